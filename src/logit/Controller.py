@@ -85,7 +85,12 @@ from ship.utils import utilfunctions as uf
 
 # Local modules
 import LogBuilder
+import Exporters
+import ingest
+import dbmaintenance
+import dbmigrations
 
+import peeweemodels as pm
 import peeweeviews as pv
 
 
@@ -163,39 +168,70 @@ def fetchAndCheckModel(open_path, run_options, errors):
              pages or False if the load failed and a dictionary containing
              the load status and messages for status bars and errors.
     """   
-    def getMissingFiles(open_path, missing_files):
-        """
-        """
-        # Check if it's because model files are missing
-        message = ' at:\n%s' % (open_path)
-        file_str = 'The following tuflow model files could not be loaded:\n' + '\n'.join(missing_files)
-        message = ' at:\n%s\n\n%s' % (open_path, file_str)
-        return message
-        
+    run_hash = LogBuilder.readRunHash(open_path, run_options)
+    if run_hash is not None and pv.runExists(run_hash):
+        _addLogExistsError(errors, run_hash, open_path)
+        return errors, False
+
+    all_logs, load_error, missing = LogBuilder.loadModelLogs(open_path, run_options)
+    return checkModel(open_path, all_logs, load_error, errors)
+
+
+def _addLogExistsError(errors, run_hash, open_path):
+    """Add a LOG_EXISTS error for a run that's already in the database."""
+    logger.warning('Log entry already exists for :\n%s' % (run_hash))
+    errors.addError(errors.LOG_EXISTS, 
+                    msg_add=(':\nRun name = %s\nfile = %s' % (run_hash, open_path)),
+                    msgbox_error=True)
+
+
+def findLoggedModels(model_paths, run_options):
+    """Find the models that are already in the database without loading them.
+    
+    The run hash for each model is found with LogBuilder.readRunHash and
+    they are all checked against the database with a few IN queries.
+    
+    Args:
+        model_paths(list): the .ief/.tcf file paths.
+        run_options(str): the run options (~s1~ etc) to load the models with.
+    
+    Return:
+        dict - {path: run_hash} for the models that are already logged.
+    """
+    hashes = {}
+    for path in model_paths:
+        run_hash = LogBuilder.readRunHash(path, run_options)
+        if run_hash is not None:
+            hashes[path] = run_hash
+    existing = pv.existingRunHashes(hashes.values())
+    return dict((p, h) for p, h in hashes.items() if h in existing)
+
+
+def checkModel(open_path, all_logs, load_error, errors):
+    """Check a model loaded by LogBuilder.loadModelLogs.
+    
+    Adds an error if the model couldn't be loaded or already exists in the
+    database. Otherwise fills in the RUN_STATUS and MB.
     
-    loader = LogBuilder.ModelLoader()
-    all_logs = loader.loadModel(open_path, run_options)
+    Args:
+        open_path(str): the .ief or .tcf file path.
+        all_logs(AllLogs): the loaded logs, or False if the load failed.
+        load_error(str): the message returned by loadModelLogs.
+        errors(ErrorHolder): updated with any errors.
     
+    Return:
+        tuple(ErrorHolder, AllLogs) - errors and all_logs.
+    """
     # Deal with any loading errors
     if all_logs == False:
         logger.warning('Unable to load file:\n%s\nDoes it exist?' % (open_path))
-        
-        if loader.missing_files:
-            msg_add = getMissingFiles(open_path, loader.missing_files)
-        else:
-            msg_add = (':\n%s\nCould not find the following files:\n%s'  % (open_path, loader.error))
-
-        # DEBUG
-        errors.addError(errors.MODEL_LOAD, msg_add=msg_add, msgbox_error=True)
+        errors.addError(errors.MODEL_LOAD, msg_add=load_error, msgbox_error=True)
         return errors, all_logs
     
     else:
         # Check that this run doesn't already exist in the database
         if pv.runExists(all_logs.run_hash):
-            logger.warning('Log entry already exists for :\n%s' % (all_logs.run_hash))
-            errors.addError(errors.LOG_EXISTS, 
-                                msg_add=(':\nRun name = %s\nfile = %s' % (all_logs.run_hash, open_path)),
-                                                    msgbox_error=True)
+            _addLogExistsError(errors, all_logs.run_hash, open_path)
             return errors, all_logs
         
         # Gets run status and MB info if run is already completed and includes tuflow
@@ -208,7 +244,390 @@ def fetchAndCheckModel(open_path, run_options, errors):
                 all_logs.run['MB'] = outputs[2]
     
         return errors, all_logs
- 
+
+
+LOG_BATCH_SIZE = ingest.DEFAULT_BATCH_SIZE
+""" Number of loaded models written to the database in each transaction. """
+
+def logMultipleModels(job, model_paths, run_options, input_vars, errors, workers=1,
+                      batch_size=LOG_BATCH_SIZE, journal=None):
+    """Load a list of models and add them to the database.
+    
+    Run as a jobs.Job. The models are streamed through an 
+    ingest.IngestPipeline: they are loaded by workers processes, checked in
+    the job thread and written on the database writer lane in batches of
+    batch_size, in the order of model_paths. Only a few models are held in
+    memory at a time however long the list is. If the job is cancelled it
+    stops after the current model and the models already checked are still
+    written, so the database is left in a clean state.
+    
+    Each batch is written in a single transaction with each model in its 
+    own savepoint. A model that can't be added is rolled back and reported
+    in errors without affecting the rest of the batch. If the write fails 
+    completely (e.g. the database is locked) the batch is rolled back by
+    SQLite and the batches already committed are kept.
+    
+    If a journal is given the models in each batch are recorded in it as
+    soon as the batch is committed. If the program stops only the batch
+    being written is lost and IngestJournal.remaining gives the models
+    that still need logging.
+    
+    Models that are already in the database are found with 
+    findLoggedModels first and are not loaded.
+    
+    Args:
+        job(jobs.Job): the job running this function.
+        model_paths(list): the .ief/.tcf file paths to load.
+        run_options(str): the run options (~s1~ etc) to load the models with.
+        input_vars(dict): the user supplied MODELLER, TUFLOW_BUILD, 
+            ISIS_BUILD and EVENT_NAME values to apply to every run.
+        errors(ErrorHolder): updated with any models that could not be 
+            loaded or already exist.
+        workers=1(int): the number of processes to load the models with.
+        batch_size=LOG_BATCH_SIZE(int): the number of models written in
+            each transaction.
+        journal=None(ingest.IngestJournal): if given the models are 
+            recorded in it as each transaction is committed.
+    
+    Return:
+        tuple(ErrorHolder, int) - errors and the number of models logged.
+    """
+    job.setProgress(0, 0, 'Checking for models already logged')
+    logged_paths = findLoggedModels(model_paths, run_options)
+    for path in model_paths:
+        if path in logged_paths:
+            _addLogExistsError(errors, logged_paths[path], path)
+            errors.has_local_errors = False
+    model_paths = [p for p in model_paths if not p in logged_paths]
+    
+    pending_paths = {}
+    def check(path, all_logs, load_error, missing):
+        checkModel(path, all_logs, load_error, errors)
+        if errors.has_local_errors:
+            errors.has_local_errors = False
+            return None
+    
+        # Not in the database yet, but an earlier model in the list has it
+        if all_logs.run_hash in pending_paths:
+            _addLogExistsError(errors, all_logs.run_hash, path)
+            errors.has_local_errors = False
+            return None
+    
+        all_logs.run['MODELLER'] = input_vars['MODELLER']
+        all_logs.run['TUFLOW_BUILD'] = input_vars['TUFLOW_BUILD'] 
+        all_logs.run['ISIS_BUILD'] = input_vars['ISIS_BUILD']
+        all_logs.run['EVENT_NAME'] = input_vars['EVENT_NAME'] 
+        pending_paths[all_logs.run_hash] = path
+        return all_logs
+    
+    # Called in the pipeline writer thread, so errors are added afterwards
+    failed = []
+    def write(batch):
+        run_ids = job.write(pv.addLogEntries, batch, True)
+        committed = {}
+        for all_logs, run_id in zip(batch, run_ids):
+            path = pending_paths[all_logs.run_hash]
+            if run_id is None:
+                failed.append(path)
+            else:
+                committed[path] = all_logs.run_hash
+        # The whole batch is committed now, so record all of it
+        if journal is not None:
+            journal.commit(committed)
+
+    total = len(model_paths)
+    job.setProgress(0, total, 'Loading model 1 of %s' % total)
+    pipeline = ingest.IngestPipeline(write, batch_size)
+    try:
+        logged = pipeline.run(model_paths, run_options, check, workers, job.isCancelled,
+                              job.setProgress)
+    finally:
+        for path in failed:
+            errors.addError(errors.DB_UPDATE, msg_add=':\n%s' % path, msgbox_error=True)
+        errors.has_local_errors = False
+    logged -= len(failed)
+    job.setProgress(total, total, 'Logged %s of %s models' % (logged, total))
+    return errors, logged
+
+
+PREFLIGHT_NEW = 'New'
+PREFLIGHT_DUPLICATE = 'Duplicate'
+PREFLIGHT_MISSING = 'Missing Files'
+PREFLIGHT_ERROR = 'Parse Error'
+""" Statuses returned by preflightModels. """
+
+
+def preflightModels(job, model_paths, run_options, workers=1):
+    """Check a list of models before logging them without changing the database.
+    
+    Run as a jobs.Job. Models that are already logged are found with 
+    findLoggedModels and the rest are loaded with LogBuilder.loadModels (so 
+    they're in the parse cache when they are logged). The run hashes, model
+    file names and dat names of the loaded models are then checked against
+    the database with a few IN queries. If the job is cancelled the models 
+    checked so far are returned.
+    
+    Args:
+        job(jobs.Job): the job running this function.
+        model_paths(list): the .ief/.tcf file paths to check.
+        run_options(str): the run options (~s1~ etc) to load the models with.
+        workers=1(int): the number of processes to load the models with.
+    
+    Return:
+        dict - {path: (status, message)} where status is one of the 
+            PREFLIGHT_* values and message gives the details.
+    """
+    results = {}
+    job.setProgress(0, 0, 'Checking for models already logged')
+    logged_paths = findLoggedModels(model_paths, run_options)
+    for path, run_hash in logged_paths.items():
+        results[path] = (PREFLIGHT_DUPLICATE, 'Already logged (run name = %s)' % run_hash)
+    model_paths = [p for p in model_paths if not p in logged_paths]
+
+    # Only keep the names needed for the database checks, not the whole logs
+    checked = []
+    total = len(model_paths)
+    job.setProgress(0, total, 'Checking model 1 of %s' % total)
+    loaded = LogBuilder.loadModels(model_paths, run_options, workers, job.isCancelled)
+    try:
+        for i, (path, all_logs, load_error, missing) in enumerate(loaded):
+            if job.isCancelled(): break
+            job.setProgress(i + 1, total, 'Checking model %s of %s' % (min(i + 2, total), total))
+            if all_logs == False:
+                if missing:
+                    results[path] = (PREFLIGHT_MISSING, 'Missing files:\n' + '\n'.join(missing))
+                else:
+                    results[path] = (PREFLIGHT_ERROR, 'Unable to load' + load_error)
+                continue
+            dat = all_logs.dat['NAME'] if all_logs.dat is not None else None
+            checked.append((path, all_logs.run_hash, [m['NAME'] for m in all_logs.models], dat))
+    finally:
+        loaded.close()
+    
+    job.setProgress(total, total, 'Checking the database')
+    existing_runs = pv.existingRunHashes([c[1] for c in checked])
+    existing_models = pv.existingNames(pm.ModelFile.name, [m for c in checked for m in c[2]])
+    existing_dats = pv.existingNames(pm.Dat.name, [c[3] for c in checked if c[3] is not None])
+    first_paths = {}
+    for path, run_hash, model_names, dat in checked:
+        if run_hash in existing_runs:
+            results[path] = (PREFLIGHT_DUPLICATE, 'Already logged (run name = %s)' % run_hash)
+        elif run_hash in first_paths:
+            results[path] = (PREFLIGHT_DUPLICATE, 'Same run as: %s' % first_paths[run_hash])
+        else:
+            first_paths[run_hash] = path
+            new_models = [m for m in model_names if not m in existing_models]
+            message = '%s of %s model files are new' % (len(new_models), len(model_names))
+            if dat is not None:
+                message += ', dat file %s is %s' % (
+                    dat, 'already logged' if dat in existing_dats else 'new')
+            results[path] = (PREFLIGHT_NEW, message)
+    return results
+
+
+def checkRunStatus(run_id, run_data):
+    """Get the latest RUN_STATUS and MB values for a Run record.
+    
+    Args:
+        run_id(int): the Run.id.
+        run_data(dict): the Run record values (see peeweeviews.getRunRow).
+    
+    Return:
+        tuple(dict, str) - {'run_status': str, 'mb': value} to update the
+            Run with, or None and an error message if it can't be updated.
+    """
+    results = getRunStatusInfo(run_data['tcf_dir'], run_data['tcf'], run_data['run_options'])
+    if not results[0] and not results[1]:
+        msg = "- Failed to update status (ID=%s).\n  Is the TCF_DIR correct and does in contain '_ TUFLOW Simulations.log' file?" % (run_id)
+        return None, msg
+    elif not results[0]:
+        msg = "- Run is not yet complete(ID=%s).\n  You can only update status for a completed run" % (run_id)
+        return None, msg
+    else:
+        return {'run_status': results[1], 'mb': results[2]}, None
+
+
+def updateRunStatus(job, run_ids):
+    """Update the RUN_STATUS and MB of a list of Run records.
+    
+    Run as a jobs.Job. The simulation logs are read in the job thread and
+    the updates are written on the database writer lane in batches. If the
+    job is cancelled the updates found so far are written before it stops.
+    
+    Args:
+        job(jobs.Job): the job running this function.
+        run_ids(list): the Run.id's to update.
+    
+    Return:
+        tuple(list, int) - error messages for the runs that could not be
+            updated and the number of runs that were updated.
+    """
+    total = len(run_ids)
+    errors = []
+    updates = {}
+    updated = 0
+    for i, run_id in enumerate(run_ids):
+        if job.isCancelled(): break
+        job.setProgress(i, total, 'Updating row %s of %s' % (i + 1, total))
+        vals, msg = checkRunStatus(run_id, pv.getRunRow(run_id))
+        if vals is None:
+            errors.append(msg)
+            continue
+        updates[run_id] = vals
+        if len(updates) >= LOG_BATCH_SIZE * 10:
+            job.write(pv.updateRunRows, updates)
+            updated += len(updates)
+            updates = {}
+    if updates:
+        job.write(pv.updateRunRows, updates)
+        updated += len(updates)
+    job.setProgress(total, total)
+    return errors, updated
+
+
+def updateRunRow(job, updates, run_id):
+    """Update the values of a Run record.
+
+    Run as a jobs.Job on the writer lane (see peeweeviews.updateRunRow).
+
+    Args:
+        job(jobs.Job): the job running this function.
+        updates(dict): {field name: value} to update.
+        run_id(int): the Run.id to update.
+    """
+    pv.updateRunRow(updates, run_id)
+
+
+def verifyNewStatus(job):
+    """Check the new_file flags against a full recalculation.
+
+    Run as a jobs.Job on the writer lane (see peeweeviews.verifyNewStatus).
+
+    Return:
+        dict - {table name: list of mismatched records}.
+    """
+    job.progressCallback(0, 0, 'Verifying file status ...')
+    return pv.verifyNewStatus()
+
+
+def recalculateNewStatus(job):
+    """Recalculate the new_file flags of all of the file records.
+
+    Run as a jobs.Job on the writer lane (see peeweeviews.updateNewStatus).
+    """
+    job.progressCallback(0, 0, 'Recalculating file status ...')
+    pv.updateNewStatus()
+
+
+def exportDatabase(job, save_path, export_type='excel'):
+    """Export the database to an Excel or JSON file.
+    
+    Run as a jobs.Job. It can be cancelled until the file is written.
+    
+    Args:
+        job(jobs.Job): the job running this function.
+        save_path(str): the file to write.
+        export_type='excel'(str): 'excel' or 'json'.
+    """
+    data = {}
+    job.progressCallback(1, 5, 'Exporting Model Files ...')
+    data['model_out'] = pv.createModelExport()
+    job.progressCallback(2, 5, 'Exporting Run Files ...')
+    data['run_out'], data['run_header'], data['dat_out'], data['dat_header'] = pv.createRunDatExport()
+    job.progressCallback(3, 5, 'Exporting Ied Files ...')
+    data['ied_out'], data['ied_header'] = pv.createIedExport()
+    if export_type == 'json':
+        job.progressCallback(4, 5, 'Writing to JSON ...')
+        Exporters.exportToJson(data, save_path)
+    else:
+        job.progressCallback(4, 5, 'Writing to Excel ...')
+        Exporters.newExportToExcel(
+            data['run_out'], data['run_header'], data['dat_out'], data['dat_header'], 
+            data['model_out'], data['ied_out'], data['ied_header'], save_path
+        )
+    job.setProgress(5, 5, 'Export Complete')
+
+
+def findOrphans(job):
+    """Find the records that cleanDatabase would remove.
+    
+    Run as a jobs.Job on the writer lane (see peeweeviews.removeOrphans).
+    
+    Return:
+        dict - {table name: list of primary keys}.
+    """
+    return pv.removeOrphans(dry_run=True, progress_callback=job.progressCallback)
+
+
+def cleanDatabase(job):
+    """Remove orphaned records and recalculate the new file status.
+    
+    Run as a jobs.Job on the writer lane. Cancelling while the orphans are
+    being removed rolls the removal back.
+    
+    Return:
+        dict - {table name: list of primary keys} of the removed records.
+    """
+    orphans = pv.removeOrphans(progress_callback=job.progressCallback)
+    job.progressCallback(0, 0, 'Recalculating file status ...')
+    pv.updateNewStatus()
+    return orphans
+
+
+def checkDatabaseHealth(job, analyze=True):
+    """Check the database and update the query planner statistics.
+    
+    Run as a jobs.Job on the writer lane (see dbmaintenance.healthReport).
+    
+    Return:
+        dict - the dbmaintenance.healthReport.
+    """
+    return dbmaintenance.healthReport(analyze, job.progressCallback)
+
+
+def repairDatabase(job, duplicates=None, vacuum=False):
+    """Fix the problems found by checkDatabaseHealth.
+    
+    Run as a jobs.Job on the writer lane.
+    
+    Args:
+        duplicates=None(dict): duplicate association records to remove, as
+            returned by dbmaintenance.findDuplicateAssociations. If None 
+            they are left in place.
+        vacuum=False(bool): if True free pages are returned to the file 
+            system with dbmaintenance.vacuum.
+    
+    Return:
+        tuple(dict, int) - {table name: duplicates removed} and the number
+            of pages freed.
+    """
+    removed = {}
+    freed = 0
+    if duplicates:
+        job.progressCallback(0, 0, 'Removing duplicate records ...')
+        removed = dbmaintenance.removeDuplicateAssociations(duplicates)
+        if removed.get('ModelFile_SubFile') or removed.get('Run_ModelFile'):
+            job.progressCallback(0, 0, 'Recalculating file status ...')
+            pv.updateNewStatus()
+    if vacuum:
+        job.progressCallback(0, 0, 'Freeing unused pages ...')
+        freed = dbmaintenance.vacuum()
+    return removed, freed
+
+
+def updateDatabase(job, db_path):
+    """Update a database to the latest version.
+    
+    Run as a jobs.Job on the writer lane (see dbmigrations.migrateDatabase).
+    Each migration step, or batch within a step, is committed as it 
+    completes, so if the job fails or is cancelled running it again 
+    carries on from where it stopped.
+    
+    Return:
+        list - the update functions that were run.
+    """
+    return dbmigrations.migrateDatabase(db_path, job.progressCallback)
+
     
 def getRunStatusInfo(tcf_dir, tcf_name, run_options):
     """Get the status and MB of a simulation.
@@ -61,6 +61,7 @@ from PyQt5 import Qt, QtCore, QtGui, QtWidgets
 
 from qtclasses import MyFileDialogs
 from qtclasses import QNumericSortTableWidgetItem
+from qtclasses import sortValue
 
 import logging
 from PyQt5.Qt import pyqtSignal
@@ -70,8 +71,361 @@ import LogClasses
 import peeweeviews as pv
 
 
-class TableWidgetDb(QtWidgets.QTableWidget):
-    """Subclass of QTableWidget with Logit Log View specific behaviour."""
+class DbTableModel(QtCore.QAbstractTableModel):
+    """Table model holding the rows loaded from the database.
+    
+    The rows are stored as the tuples returned by the peeweeviews loaders
+    and the cell text is only created when the view asks for it. The cost of
+    displaying a table therefore depends on the number of visible rows
+    rather than on the size of the table.
+    
+    Sorting reorders a list of indexes into the stored rows (self._order),
+    using a python sort, instead of comparing cells through the Qt API.
+    The typed sort keys (see qtclasses.sortValue) of a column are created
+    the first time it is sorted and kept up to date as rows are added or
+    edited, so the same column can be resorted without converting the
+    values again. Highlighting is kept against the stored rows so it 
+    follows the sort.
+    
+    mergeRows and removeKeys apply changes to individual records (see
+    changetracker.py) without resetting the model, so the sort, selection
+    and scroll position are kept.
+    """
+    
+    rowEditedSignal = Qt.pyqtSignal(int)
+    
+    HEADER_COLOUR = QtGui.QColor(187, 185, 185) # Light Grey
+    HIGHLIGHT_COLOUR = QtGui.QColor(178, 255, 102) # Light Green
+    
+    def __init__(self, parent=None):
+        super(DbTableModel, self).__init__(parent)
+        self._cols = []
+        self._rows = []
+        self._order = []
+        self._editable = set()
+        self._highlighted = set()
+        self._custom_highlight = []
+        self._pages = None
+        self._sort_keys = {}
+        self._sort_column = -1
+        self._sort_order = QtCore.Qt.AscendingOrder
+        
+    
+    def setRows(self, cols, rows, editing_allowed=[], custom_highlight=[], pages=None):
+        """Replace the contents of the model.
+        
+        Args:
+            cols(list): columns header strings.
+            rows(list): containing tuples/lists of cell data for each row.
+            editing_allowed=[](list): header strings of the columns that can
+                be edited.
+            custom_highlight=[](list): contains booleans corresponding to each
+                item in rows setting whether to highlight the cell or not. 
+                Must be the same dimensions as rows.
+            pages=None(peeweeviews.QueryPages): if given the rows will be
+                extended with the next page from pages when the view calls
+                fetchMore.
+        """
+        self.beginResetModel()
+        self._cols = [str(c) for c in cols]
+        self._rows = rows if isinstance(rows, list) else list(rows)
+        self._order = list(range(len(self._rows)))
+        self._editable = set(i for i, c in enumerate(self._cols) if c in editing_allowed)
+        self._highlighted = set()
+        self._custom_highlight = custom_highlight
+        self._pages = pages
+        self._sort_keys = {}
+        self._sort_column = -1
+        self.endResetModel()
+    
+    
+    def setPages(self, cols, pages, editing_allowed=[]):
+        """Replace the contents of the model with the rows of a paged query.
+        
+        Only the first page is read now. The others are read by fetchMore
+        when the view is scrolled to the bottom.
+        
+        Args:
+            cols(list): columns header strings.
+            pages(peeweeviews.QueryPages): the query results.
+            editing_allowed=[](list): header strings of the columns that can
+                be edited.
+        """
+        self.setRows(cols, pages.fetchPage(), editing_allowed, pages=pages)
+    
+    
+    def pages(self):
+        """Return the QueryPages being read by the model, or None."""
+        return self._pages
+    
+    
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self._pages is None: return False
+        return not self._pages.finished
+    
+    
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        """Append the next page of rows from the QueryPages.
+        
+        If the rows have been sorted the new rows are sorted in with them.
+        """
+        if not self.canFetchMore(parent): return
+        rows = self._pages.fetchPage()
+        if rows:
+            self._appendRows(rows)
+            if self._sort_column >= 0:
+                self.sort(self._sort_column, self._sort_order)
+    
+    
+    def _appendRows(self, rows):
+        """Add rows to the end of the model, with their sort keys."""
+        start = len(self._rows)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(rows) - 1)
+        self._rows.extend(rows)
+        self._order.extend(range(start, start + len(rows)))
+        for col, keys in self._sort_keys.items():
+            keys.extend(sortValue(row[col]) for row in rows)
+        if self._custom_highlight:
+            self._custom_highlight.extend([False] * len(self._cols) for row in rows)
+        self.endInsertRows()
+    
+    
+    def mergeRows(self, rows, key_col):
+        """Replace the rows with the same key as one of rows and add the rest.
+        
+        Replaced rows lose their edit highlighting. If the rows have been 
+        sorted they are sorted again.
+        
+        Args:
+            rows(list): tuples of cell data, in the same column order as the
+                rows already in the model.
+            key_col(int): the column holding the unique key of each row 
+                (e.g. the id).
+        """
+        if not rows: return
+        stored_rows = dict((row[key_col], i) for i, row in enumerate(self._rows))
+        display_rows = None
+        new_rows = []
+        for row in rows:
+            stored = stored_rows.get(row[key_col])
+            if stored is None:
+                new_rows.append(row)
+                continue
+            self._rows[stored] = row
+            self._highlighted.discard(stored)
+            for col, keys in self._sort_keys.items():
+                keys[stored] = sortValue(row[col])
+            if display_rows is None:
+                display_rows = dict((s, r) for r, s in enumerate(self._order))
+            r = display_rows[stored]
+            self.dataChanged.emit(self.index(r, 0), self.index(r, len(self._cols) - 1))
+        
+        if new_rows:
+            self._appendRows(new_rows)
+        if self._sort_column >= 0:
+            self.sort(self._sort_column, self._sort_order)
+    
+    
+    def removeKeys(self, keys, key_col):
+        """Remove the rows with one of keys in column key_col.
+        
+        Args:
+            keys(list): the keys of the rows to remove.
+            key_col(int): the column holding the unique key of each row.
+        
+        Return:
+            int - the number of rows removed.
+        """
+        keys = set(keys)
+        removed = set(i for i, row in enumerate(self._rows) if row[key_col] in keys)
+        if not removed: return 0
+        
+        # Remove them from the view in blocks of neighbouring rows, last first
+        blocks = []
+        for r in [r for r, stored in enumerate(self._order) if stored in removed]:
+            if blocks and blocks[-1][1] == r - 1:
+                blocks[-1][1] = r
+            else:
+                blocks.append([r, r])
+        for first, last in reversed(blocks):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self._order[first:last + 1]
+            self.endRemoveRows()
+        
+        # Then renumber the stored rows that are left
+        new_index = {}
+        for i in range(len(self._rows)):
+            if not i in removed: new_index[i] = len(new_index)
+        kept = lambda values: [v for i, v in enumerate(values) if not i in removed]
+        self._rows = kept(self._rows)
+        self._order = [new_index[stored] for stored in self._order]
+        self._highlighted = set(new_index[s] for s in self._highlighted if s in new_index)
+        for col in self._sort_keys.keys():
+            self._sort_keys[col] = kept(self._sort_keys[col])
+        if self._custom_highlight:
+            self._custom_highlight = kept(self._custom_highlight)
+        return len(removed)
+    
+    
+    def clearHighlights(self):
+        """Remove the edit highlighting from all of the rows."""
+        if self._highlighted:
+            self._highlighted = set()
+            self.dataChanged.emit(self.index(0, 0), 
+                                  self.index(len(self._rows) - 1, len(self._cols) - 1))
+    
+    
+    def columnHeaders(self):
+        """Return a list of the column header strings."""
+        return list(self._cols)
+    
+    
+    def value(self, row, col):
+        """Return the stored value of a cell.
+        
+        Args:
+            row(int): row in this model (not the filtered view).
+            col(int): column index.
+        """
+        return self._rows[self._order[row]][col]
+    
+    
+    def highlightRow(self, row):
+        """Set the background of all the cells in row to the edit colour."""
+        stored = self._order[row]
+        if not stored in self._highlighted:
+            self._highlighted.add(stored)
+            self.dataChanged.emit(self.index(row, 0), 
+                                  self.index(row, len(self._cols) - 1))
+    
+    
+    def sortKey(self, col):
+        """Return the function used to get the sort key of a stored row.
+        
+        The keys for the column are created on the first call and reused
+        after that.
+        
+        Args:
+            col(int): the column being sorted.
+        """
+        if not col in self._sort_keys:
+            self._sort_keys[col] = [sortValue(row[col]) for row in self._rows]
+        return self._sort_keys[col].__getitem__
+    
+    
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """Sort the rows by column.
+        
+        Args:
+            column(int): the column to sort by. If < 0 the rows are put back
+                in the order they were loaded.
+            order=AscendingOrder(Qt.SortOrder): the sort direction.
+        """
+        if column >= len(self._cols): return
+        self._sort_column = column
+        self._sort_order = order
+        self.layoutAboutToBeChanged.emit()
+        old_order = self._order
+        if column < 0:
+            self._order = list(range(len(self._rows)))
+        else:
+            self._order = sorted(old_order, key=self.sortKey(column),
+                                 reverse=(order == QtCore.Qt.DescendingOrder))
+        
+        # Keep the selection/current cell on the same records
+        new_rows = dict((stored, row) for row, stored in enumerate(self._order))
+        old_indexes = self.persistentIndexList()
+        new_indexes = [
+            self.index(new_rows[old_order[i.row()]], i.column()) for i in old_indexes
+        ]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+    
+    
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid(): return 0
+        return len(self._rows)
+    
+    
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid(): return 0
+        return len(self._cols)
+    
+    
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid(): return None
+        if role == QtCore.Qt.DisplayRole or role == QtCore.Qt.EditRole:
+            return str(self._rows[self._order[index.row()]][index.column()])
+
+        elif role == QtCore.Qt.BackgroundRole:
+            stored = self._order[index.row()]
+            if stored in self._highlighted:
+                return self.HIGHLIGHT_COLOUR
+            if self._custom_highlight and self._custom_highlight[stored][index.column()]:
+                return self.HIGHLIGHT_COLOUR
+        return None
+    
+    
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        """Store an edited cell value and emit the rowEditedSignal.
+        
+        The value is only changed in the model. It is written to the 
+        database by TableWidgetDb.saveTableEdits.
+        """
+        if not index.isValid() or not role == QtCore.Qt.EditRole:
+            return False
+        stored, col = self._order[index.row()], index.column()
+        if str(value) == str(self._rows[stored][col]):
+            return False
+        values = list(self._rows[stored])
+        values[col] = str(value)
+        self._rows[stored] = tuple(values)
+        if col in self._sort_keys:
+            self._sort_keys[col][stored] = sortValue(values[col])
+        self.dataChanged.emit(index, index)
+        self.rowEditedSignal.emit(index.row())
+        return True
+    
+    
+    def flags(self, index):
+        if not index.isValid(): return QtCore.Qt.NoItemFlags
+        if index.column() in self._editable:
+            return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsEditable
+        else:
+            return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled
+    
+    
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and section < len(self._cols):
+            if role == QtCore.Qt.DisplayRole:
+                return self._cols[section]
+            elif role == QtCore.Qt.TextAlignmentRole:
+                return QtCore.Qt.AlignCenter|QtCore.Qt.AlignVCenter
+            elif role == QtCore.Qt.BackgroundRole:
+                return self.HEADER_COLOUR
+            return None
+        return super(DbTableModel, self).headerData(section, orientation, role)
+
+
+class DbSortFilterProxyModel(QtCore.QSortFilterProxyModel):
+    """Proxy model filtering the rows of a DbTableModel.
+    
+    Sorting is passed on to the DbTableModel. The default proxy sort calls
+    lessThan, and so data(), for every comparison.
+    """
+    
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+
+class TableWidgetDb(QtWidgets.QTableView):
+    """Subclass of QTableView with Logit Log View specific behaviour.
+    
+    The data is held in a DbTableModel (self.table_model) which is shown
+    through a DbSortFilterProxyModel (self.proxy_model) for sorting and
+    filtering. Row numbers used by the view methods (currentRow, cellText,
+    etc) are the rows as displayed, i.e. in the proxy model.
+    """
     
     statusUpdateSignal = Qt.pyqtSignal(str)
     setRangeSignal = Qt.pyqtSignal(int)
@@ -82,12 +436,12 @@ class TableWidgetDb(QtWidgets.QTableWidget):
         """
         Args:
             name(str): the name of this table (RUN, MODEL, QUERY).
-            rows(int): number of rows.
-            cols(int): number of columns.
+            rows(int): not used. Kept for compatibility with QTableWidget.
+            cols(int): not used. Kept for compatibility with QTableWidget.
             subname=''(str): a subname for this table (TGC, TEF, etc).
             hidden_cols=[]: {col name: index} of columns that should be hidden.
         """
-        QtWidgets.QTableWidget.__init__(self, rows, cols, parent)
+        QtWidgets.QTableView.__init__(self, parent)
 
         self.name = name
         self.subname = str(subname)
@@ -101,6 +455,15 @@ class TableWidgetDb(QtWidgets.QTableWidget):
            'run_status', 'run_name',
         ]
         
+        self.table_model = DbTableModel(self)
+        self.proxy_model = DbSortFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.table_model)
+        self.proxy_model.setFilterKeyColumn(-1)
+        self.proxy_model.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.setModel(self.proxy_model)
+        
+        # All rows are the same height, so the view doesn't need to measure them
+        self.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
         self.horizontalHeader().setStretchLastSection(True)
         self.setHorizontalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
         self._unsaved_entries = []
@@ -109,62 +472,108 @@ class TableWidgetDb(QtWidgets.QTableWidget):
     def addRows(self, cols, rows, sort_col=None, custom_highlight=[]):
         """Add row data to this table.
         
-        Uses the TableWidgetItemDb class to create the QTableWidgetItem's.
+        Replaces the contents of the DbTableModel. No Qt items are created
+        for the cells, they are read from rows when they are displayed.
         
         Args:
             cols(list): columns header strings.
-            rows(list): containing lists of cell data to be added to rows.
+            rows(list): containing tuples/lists of cell data for each row.
             sort_col(int)=None: column used to sort the data by. If left at
                 default no sorting will be done.
             custom_highlight(list): contains booleans corresponding to each
                 item in rows setting whether to highlight or not highlight the
-                QTableWidgetItem. Must be the same dimensions as rows or an
-                IndexError will be thrown.
+                cell. Must be the same dimensions as rows or an IndexError 
+                will be thrown.
         """
         self.setSortingEnabled(False)
-        self.setColumnCount(len(cols))
-        
-        for k, c in enumerate(cols):
-            item = QtWidgets.QTableWidgetItem()
-            item.setTextAlignment(QtCore.Qt.AlignCenter|QtCore.Qt.AlignVCenter)
-            item.setBackground(QtGui.QColor(187, 185, 185)) # Light Grey
-            self.setHorizontalHeaderItem(k, item)
-            item.setText(c)
-        
-        self.setRowCount(len(rows))
-        self.blockSignals(True)
-        for i, r in enumerate(rows):
-            for j, t in enumerate(r):
-                item = TableWidgetItemDb(str(t))
-                if str(self.horizontalHeaderItem(j).text()) in self.editing_allowed:
-                    item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsEditable)
-                else:
-                    item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
-                if custom_highlight:
-                    if custom_highlight[i][j]:
-                        item.setBackground(QtGui.QColor(178, 255, 102)) # Light Green
-                    
-                self.setItem(i, j, item)
-        
-        self.blockSignals(False)
+        self.table_model.setRows(cols, rows, self.editing_allowed, custom_highlight)
         self.setSortingEnabled(True)
         if not sort_col is None:
-            self.sortItems(sort_col)
-    
-
-    @QtCore.pyqtSlot()
-    def _highlightEditRow(self):
-        """Highlightes the calling cell in the View Tables."""
-        item = self.currentItem()
-        if not item is None:
-            row = item.row()
-            id = str(self.item(item.row(), self.id_col).text())
-            # Need to do this because it keeps calling the slot twice
-            if not id in self._unsaved_entries:
-                self._unsaved_entries.append(id)
-                headercount = self.columnCount()
-                for x in range(0,headercount,1):
-                    self.item(row, x).setBackground(QtGui.QColor(178, 255, 102)) # Light Green
+            self.sortByColumn(sort_col, QtCore.Qt.AscendingOrder)
+    
+    
+    def addPages(self, cols, pages):
+        """Add the rows of a paged query to this table.
+        
+        The first page is shown straight away and the rest are read as the
+        table is scrolled down. The rows are shown in the order of the query
+        until the user sorts the table.
+        
+        Args:
+            cols(list): columns header strings.
+            pages(peeweeviews.QueryPages): the query results.
+        """
+        self.setSortingEnabled(False)
+        self.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.table_model.setPages(cols, pages, self.editing_allowed)
+        self.setSortingEnabled(True)
+    
+    
+    def patchRows(self, rows=[], removed=[]):
+        """Apply changes to individual records to this table.
+        
+        Unlike addRows the other rows, the sorting and any unsaved edits are
+        kept. Rows are matched on the id column (self.id_col).
+        
+        Args:
+            rows=[](list): tuples of cell data of the records that were added
+                or changed. A row with the same id as an existing row replaces
+                it, and any unsaved edits to it.
+            removed=[](list): the ids of records that were deleted.
+        """
+        changed = set(str(r[self.id_col]) for r in rows) | set(str(k) for k in removed)
+        self._unsaved_entries = [e for e in self._unsaved_entries if not e in changed]
+        self.table_model.removeKeys(removed, self.id_col)
+        self.table_model.mergeRows(rows, self.id_col)
+    
+    
+    def rowCount(self):
+        """Return the number of rows shown in the table."""
+        return self.proxy_model.rowCount()
+    
+    
+    def columnCount(self):
+        """Return the number of columns in the table."""
+        return self.proxy_model.columnCount()
+    
+    
+    def currentRow(self):
+        """Return the row of the current cell, or -1 if there isn't one."""
+        return self.currentIndex().row()
+    
+    
+    def headerText(self, col):
+        """Return the header string for column col."""
+        return str(self.table_model.headerData(col, QtCore.Qt.Horizontal))
+    
+    
+    def cellText(self, row, col):
+        """Return the text of the cell at row, col as shown in the table."""
+        return str(self.proxy_model.index(row, col).data())
+    
+    
+    def setFilterText(self, text, col=-1):
+        """Only show rows containing text (case insensitive).
+        
+        Args:
+            text(str): text to search for. '' shows all rows.
+            col=-1(int): column to search. If -1 all columns are searched.
+        """
+        self.proxy_model.setFilterKeyColumn(col)
+        self.proxy_model.setFilterFixedString(text)
+        
+
+    @QtCore.pyqtSlot(int)
+    def _highlightEditRow(self, row):
+        """Highlightes the edited row in the View Tables.
+        
+        Args:
+            row(int): the row in the DbTableModel that was edited.
+        """
+        id = str(self.table_model.value(row, self.id_col))
+        if not id in self._unsaved_entries:
+            self._unsaved_entries.append(id)
+        self.table_model.highlightRow(row)
                 
                 
     def saveTableEdits(self, callback): 
@@ -180,23 +589,19 @@ class TableWidgetDb(QtWidgets.QTableWidget):
         cur_prog = 1
         total_updates += len(self._unsaved_entries)
         self.setRangeSignal.emit(total_updates + 1)
-#         self.emit(QtCore.SIGNAL("setRange"), total_updates + 1)
         
         if self._unsaved_entries:
-            for row in range(self.rowCount()):
-                id = str(self.item(row, self.id_col).text())
+            headers = self.table_model.columnHeaders()
+            for row in range(self.table_model.rowCount()):
+                id = str(self.table_model.value(row, self.id_col))
                 if id in self._unsaved_entries:
                     self.statusUpdateSignal.emit('Updating edit %s of %s' % (cur_prog, total_updates))
                     self.updateProgressSignal.emit(cur_prog)
-#                     self.emit(QtCore.SIGNAL("statusUpdate"), 'Updating edit %s of %s' % (cur_prog, total_updates))
-#                     self.emit(QtCore.SIGNAL("updateProgress"), cur_prog)
 
                     keep_cells = {}
-                    headercount = self.columnCount()
-                    for x in range(0,headercount,1):
-                        headertext = str(self.horizontalHeaderItem(x).text())
+                    for x, headertext in enumerate(headers):
                         if not headertext == 'id':
-                            keep_cells[headertext] = str(self.item(row, x).text())
+                            keep_cells[headertext] = str(self.table_model.value(row, x))
                     
                     # Callback function
                     callback(keep_cells, id)
@@ -204,12 +609,10 @@ class TableWidgetDb(QtWidgets.QTableWidget):
                     cur_prog += 1
                     
         self._unsaved_entries = []
+        self.table_model.clearHighlights()
         self.updateProgressSignal.emit(0)
         self.statusUpdateSignal.emit('')
         self.dbUpdatedSignal.emit()
-#         self.emit(QtCore.SIGNAL("updateProgress"), 0)
-#         self.emit(QtCore.SIGNAL("statusUpdate"), '')
-#         self.emit(QtCore.SIGNAL("dbUpdated"))
     
     
     def _deleteRowFromDatabase(self, all_entry):
@@ -268,7 +671,7 @@ class TableWidgetDb(QtWidgets.QTableWidget):
         
         if action == hide_action:
             self.horizontalHeader().hideSection(col)
-            self.hidden_columns[str(self.horizontalHeaderItem(col).text())] = col
+            self.hidden_columns[self.headerText(col)] = col
         
             logger.debug('Hiding header: %s' % col)
                 
@@ -304,12 +707,19 @@ class TableWidgetQuery(TableWidgetDb):
         self.horizontalHeader().setStretchLastSection(True)
     
     
+    def addPages(self, cols, pages):
+        super(TableWidgetQuery, self).addPages(cols, pages)
+        self.resizeColumnsToContents()
+        self.horizontalHeader().setStretchLastSection(True)
+    
+    
     def _tablePopup(self, pos):
-        index = self.itemAt(pos)
-        if index is None: return
+        index = self.indexAt(pos)
+        if not index.isValid(): return
         menu = QtWidgets.QMenu()
         copyAction = menu.addAction("Copy")
 
+        queryFileAction = None
         if self.subname == 'EventOptions':
             queryFileAction = menu.addAction("File Summary")
         
@@ -319,24 +729,25 @@ class TableWidgetQuery(TableWidgetDb):
         if action is None: return
         if action == copyAction:
             clipboard = QtWidgets.QApplication.clipboard()
-            clipboard.setText(self.currentItem().text())
-        elif action == queryFileAction:
+            clipboard.setText(self.cellText(index.row(), index.column()))
+        elif not queryFileAction is None and action == queryFileAction:
             selected = self.selectionModel().selectedRows()
             ids = []
             for s in selected:
-                ids.append(int(self.item(s.row(), 0).text()))
-            self.queryFileSummary_signal.emit(ids)
+                ids.append(int(self.cellText(s.row(), 0)))
+            self.queryFileSummarySignal.emit(ids)
             return
             
             
 class TableWidgetModel(TableWidgetDb):
     
     dbUpdatedSignal = pyqtSignal()
+    queryModelTableSignal = pyqtSignal(str, str, str)
     
     def __init__(self, name, rows, cols, subname='', hidden_cols={}, parent=None):
         TableWidgetDb.__init__(self, name, rows, cols, subname, hidden_cols, parent)
         self.id_col = 1
-        self.cellChanged.connect(self._highlightEditRow)
+        self.table_model.rowEditedSignal.connect(self._highlightEditRow)
         self.horizontalHeader().setStretchLastSection(True)
         
 
@@ -349,7 +760,7 @@ class TableWidgetModel(TableWidgetDb):
     def saveTableEdits(self):
         if self.subname == 'DAT':
             TableWidgetDb.saveTableEdits(self, pv.updateDatRow)
-        if self.subname == 'IED':
+        elif self.subname == 'IED':
             TableWidgetDb.saveTableEdits(self, pv.updateIedRow)
         else:
             TableWidgetDb.saveTableEdits(self, pv.updateModelRow)
@@ -368,7 +779,7 @@ class TableWidgetModel(TableWidgetDb):
         
         # Get the currently active row in the table and find it's ID value
         row = self.currentRow()
-        row_id = str(self.item(row, self.id_col).text())
+        row_id = self.cellText(row, self.id_col)
         
         message = "Delete this entry?\nTable = %s, ID = %s" % (self.subname, row_id) 
         answer = self.launchQtQBox('Confirm Delete?', message)    
@@ -387,8 +798,8 @@ class TableWidgetModel(TableWidgetDb):
     
     
     def _tablePopup(self, pos):
-        index = self.itemAt(pos)
-        if index is None: return
+        index = self.indexAt(pos)
+        if not index.isValid(): return
         menu = QtWidgets.QMenu()
         copyAction = menu.addAction("Copy")
         updateRowsAction = menu.addAction("Save updates")
@@ -407,7 +818,7 @@ class TableWidgetModel(TableWidgetDb):
         if action is None: return
         if action == copyAction:
             clipboard = QtWidgets.QApplication.clipboard()
-            clipboard.setText(self.currentItem().text())
+            clipboard.setText(self.cellText(index.row(), index.column()))
             
         elif action == updateRowsAction:
             self.saveTableEdits()
@@ -417,8 +828,8 @@ class TableWidgetModel(TableWidgetDb):
             
         if is_dat_ied and (action == queryModelFilesNewAction or action == queryModelFilesAction):
             row = self.currentRow()
-            id = str(self.item(row, self.id_col).text())
-            self.emit(QtCore.SIGNAL("queryModelTable"), self.subname, str(action.text()), id)
+            id = self.cellText(row, self.id_col)
+            self.queryModelTableSignal.emit(self.subname, str(action.text()), id)
             
 
 class TableWidgetRun(TableWidgetDb):
@@ -438,13 +849,13 @@ class TableWidgetRun(TableWidgetDb):
         TableWidgetDb.__init__(self, name, rows, cols, subname, hidden_cols, parent)
         self.id_col = 0
 #         self._unsaved_entries = []
-        self.cellChanged.connect(self._highlightEditRow)
+        self.table_model.rowEditedSignal.connect(self._highlightEditRow)
         self.horizontalHeader().setStretchLastSection(True)
+        self.horizontalHeader().setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        self.horizontalHeader().customContextMenuRequested.connect(self.showHeaderMenu)
                
 
     def addRows(self, cols, rows, sort_col=None, custom_highlight=[]):
-        self.horizontalHeader().setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
-        self.horizontalHeader().customContextMenuRequested.connect(self.showHeaderMenu)
         super(TableWidgetRun, self).addRows(cols, rows, sort_col, custom_highlight)
         for k, v in self.hidden_columns.items():
             self.horizontalHeader().hideSection(v)
@@ -455,37 +866,46 @@ class TableWidgetRun(TableWidgetDb):
 
     
     def _deleteRowFromDatabase(self, all_entry):
-        """Deletes the row in the database based on the location that the mouse
-        was last clicked.
-        This is fine because this function is called from the context menu and
-        therefore relies on the user right-clicking on the correct row.
+        """Deletes the rows with selected cells in the database.
+        
+        If nothing is selected the row where the mouse was last clicked is
+        used. This is fine because this function is called from the context
+        menu and therefore relies on the user right-clicking on the correct 
+        row.
+        
+        All of the runs are deleted in a single transaction, with a single
+        unused file clean up and file status update at the end.
         
         Args:
-            table(TableWidget): to get the row data from.
             all_entry(bool): if True deletes associated entries as well.
         """
         
-        # Get the currently active row in the table and find it's ID value
-        row = self.currentRow()
-        row_id = str(self.item(row, self.id_col).text())
+        # Get the selected rows, or the currently active row, and find their ID values
+        rows = sorted(set([i.row() for i in self.selectedIndexes()]))
+        if not rows:
+            rows = [self.currentRow()]
+        row_ids = [int(self.cellText(r, self.id_col)) for r in rows]
+        if len(row_ids) == 1:
+            id_text = 'ID = %s' % row_ids[0]
+        elif len(row_ids) <= 10:
+            id_text = 'IDs = %s' % ', '.join([str(r) for r in row_ids])
+        else:
+            id_text = '%s rows selected' % len(row_ids)
         if not all_entry:
-            message = "Delete RUN entry for ID = %s" % (row_id) 
+            message = "Delete RUN entry for %s" % (id_text) 
         else:
-            message = "Delete this RUN entry AND all associated entries?\nID = %s" % (row_id)       
+            message = "Delete RUN entry AND all associated entries?\n%s" % (id_text)       
         answer = self.launchQtQBox('Confirm Delete?', message)        
         if answer == False:
             return
         
+        def progress(value, maximum, message):
+            self.setRangeSignal.emit(maximum)
+            self.updateProgressSignal.emit(value)
+            self.statusUpdateSignal.emit(message)
+        
         try:
-            self.setRangeSignal.emit(3)
-            self.updateProgressSignal.emit(1)
-            self.statusUpdateSignal.emit('Deleting Run and Model files...')
-            pv.deleteRunRow(int(row_id), delete_recursive=all_entry)
-            self.statusUpdateSignal.emit('Deleting orpaned files...')
-            pv.deleteOrphanFiles(int(row_id))
-            self.updateProgressSignal.emit(2)
-            self.statusUpdateSignal.emit('Recalculating file status...')
-            pv.updateNewStatus()
+            pv.deleteRunRows(row_ids, delete_recursive=all_entry, progress_callback=progress)
             self.statusUpdateSignal.emit('Delete complete...')
             self.updateProgressSignal.emit(0)
 
@@ -493,8 +913,7 @@ class TableWidgetRun(TableWidgetDb):
             self.statusUpdateSignal.emit('Delete failed...')
             self.updateProgressSignal.emit(0)
             msg = ('There was an issue deleting some of the components of ' +
-                   'this run.\nYou should run the Clean Database tool to ' +
-                   'make sure all orphaned files have been removed.')
+                   'these runs.\nNo changes have been made to the database.')
             self.launchQMsgBox('Database Error', msg)
             logger.exception(err)
         
@@ -503,17 +922,17 @@ class TableWidgetRun(TableWidgetDb):
 
     
     def _tablePopup(self, pos):
-        index = self.itemAt(pos)
-        if index is None: return
+        index = self.indexAt(pos)
+        if not index.isValid(): return
         
         menu = QtWidgets.QMenu()
         
         copyAction = menu.addAction("Copy")
         updateRowsAction = menu.addAction("Save updates")
-        deleteRowAction = menu.addAction("Delete row")
+        deleteRowAction = menu.addAction("Delete selected rows")
         
         # Find who called us and get the object that the name refers to.
-        deleteAllRowAction = menu.addAction("Delete associated entries")
+        deleteAllRowAction = menu.addAction("Delete selected with associated entries")
         updateStatusAction = menu.addAction("Update status")
         query_menu = menu.addMenu("Query")
         queryFileAction = query_menu.addAction("File Summary")
@@ -537,7 +956,7 @@ class TableWidgetRun(TableWidgetDb):
         
         if action == copyAction:
             clipboard = QtWidgets.QApplication.clipboard()
-            clipboard.setText(self.currentItem().text())
+            clipboard.setText(self.cellText(index.row(), index.column()))
             
         elif action == updateRowsAction:
             self.saveTableEdits()
@@ -549,7 +968,7 @@ class TableWidgetRun(TableWidgetDb):
             selected = self.selectionModel().selectedRows()
             ids = []
             for s in selected:
-                ids.append(int(self.item(s.row(), 0).text()))
+                ids.append(int(self.cellText(s.row(), 0)))
             self.queryFileSummarySignal.emit(ids)
 #             self.emit(QtCore.SIGNAL("queryFileSummary"), ids)
             
@@ -558,7 +977,7 @@ class TableWidgetRun(TableWidgetDb):
                     action == queryRunModelAction  or action == queryRunModelNewAction  or \
                     action == queryRunDatAction or action == queryRunIedAction:
             row = self.currentRow()
-            id = str(self.item(row, self.id_col).text())
+            id = self.cellText(row, self.id_col)
             self.queryRunTableSignal.emit(str(action.text()), int(id))
 #             self.emit(QtCore.SIGNAL("queryRunTable"), str(action.text()), int(id))
     
@@ -569,55 +988,33 @@ class TableWidgetRun(TableWidgetDb):
         # Send log path to RunSummary tool
         elif action == extractRowAction or action == addToRunSummaryAction:
             row = self.currentRow()
-            id = str(self.item(row, self.id_col).text())
+            id = int(self.cellText(row, self.id_col))
             self.runTableContextToolSignal.emit(str(action.text()), id)
 #             self.emit(QtCore.SIGNAL("runTableContextTool"), str(action.text()), id)
         
         # Update IEF_DIR, TCF_DIR, or LOG_DIR
         elif action == updateIefRowAction or action == updateTcfRowAction or action == updateLogRowAction:
             row = self.currentRow()
-            id = str(self.item(row, self.id_col).text())
+            id = int(self.cellText(row, self.id_col))
             self.runTableContextPathSignal.emit(str(action.text()), id)
 #             self.emit(QtCore.SIGNAL("runTableContextPathUpdate"), str(action.text()), id)
             
         # Update the MB and RUN_STATUS values
         elif action == updateStatusAction:
             row = self.currentRow()
-            id = int(self.item(row, self.id_col).text())
+            id = int(self.cellText(row, self.id_col))
             self.runTableContextStatusSignal.emit(id)
 #             self.emit(QtCore.SIGNAL("runTableContextStatusUpdate"), id)
 
 
-class TableWidgetItemDb(QtWidgets.QTableWidgetItem):
-    """Overriddes QTableWidgetItem with Logit specific behaviour."""
+class TableWidgetItemDb(QNumericSortTableWidgetItem):
+    """Overriddes QTableWidgetItem with Logit specific behaviour.
+    
+    Items are sorted using the typed keys from qtclasses.sortValue.
+    """
     
     def __init__ (self, value):
-        super(TableWidgetItemDb, self).__init__(str(value))
-
-    def __lt__ (self, other):
-        """Check order of two values.
-        
-        Tries to convert the value to a float. If successful it will return 
-        the order of those two values. 
-        
-        If value is not numeric or is not a QCustomTableWidgetItem type it
-        will return the standard string compare output.
-        
-        Args:
-            other(QTableWidgetItem): value to compare with that stored by this.
-        
-        Return:
-            Bool - True if given value is less than this.
-        """
-        if (isinstance(other, TableWidgetItemDb)):
-            try:
-                self_data_value  = float(self.data(QtCore.Qt.EditRole).toString())
-                other_data_value = float(other.data(QtCore.Qt.EditRole).toString())
-            except:
-                return QtWidgets.QTableWidgetItem.__lt__(self, other)
-            return self_data_value < other_data_value
-        else:
-            return QtWidgets.QTableWidgetItem.__lt__(self, other)
+        super(TableWidgetItemDb, self).__init__(value)
 
 
 class TableWidgetDragRows(QtWidgets.QTableWidget):
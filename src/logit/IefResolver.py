@@ -487,7 +487,7 @@ def findFile(start_location, file_to_find, search_folder_depth=3,
         return False
 
 
-def autoResolveIefs(iefs):
+def autoResolveIefs(iefs, progress_callback=None):
     """Attempt to automatically update the file paths in the given ief files.
     
     Tries to automatically update the file paths in a given ief file to work
@@ -509,6 +509,8 @@ def autoResolveIefs(iefs):
     
     Args:
         iefs(list): filepaths to the ief files to be updated.
+        progress_callback=None(func): called with (value, maximum, message)
+            before each ief is resolved.
     
     Return:
         Tuple(Bool, list): True if Successful or False otherwise. List of
@@ -516,7 +518,9 @@ def autoResolveIefs(iefs):
     """
     ief_holders = []
     ief_fail = []
-    for ief in iefs:
+    for i, ief in enumerate(iefs):
+        if progress_callback is not None:
+            progress_callback(i, len(iefs), 'Resolving ief %s of %s' % (i + 1, len(iefs)))
         success, new_holder = autoResolvePath(ief, search_folder_depth=4)
         if success:
             ief_holders.append(new_holder)
@@ -526,6 +530,47 @@ def autoResolveIefs(iefs):
     return ief_holders, ief_fail
     
     
+def resolveIefs(job, iefs):
+    """Run the ief resolver as a background job.
+    
+    Runs autoResolveIefs, then resolveUnfoundPaths for any files that were
+    not found, and writes the updated ief files. The job can be cancelled 
+    up until the files are written.
+    
+    Args:
+        job(jobs.Job): the job running this function.
+        iefs(list): filepaths to the ief files to be updated.
+    
+    Return:
+        dict - {'resolved': number of iefs with a reference file found,
+            'ief_fail': list of iefs that couldn't be resolved, 
+            'required_search': from resolveUnfoundPaths or None, 'success':
+            False if the files could not be written, 'summary': from 
+            getUpdateSummary or None}.
+    """
+    results = {'resolved': 0, 'ief_fail': [], 'required_search': None, 
+               'success': False, 'summary': None}
+    ief_holders, results['ief_fail'] = autoResolveIefs(iefs, job.progressCallback)
+    results['resolved'] = len(ief_holders)
+    if not ief_holders:
+        return results
+    
+    # check if there were any files that couldn't be found on first attempt
+    missing = any(ief_holder.getMissingFileKeys() for ief_holder in ief_holders)
+    if missing:
+        job.checkCancelled()
+        job.setProgress(0, 0, 'Attempting to find missing paths (this may take a while) ...')
+        ief_holders, results['required_search'] = resolveUnfoundPaths(ief_holders)
+    
+    job.checkCancelled()
+    job.setProgress(0, 0, 'Updating Ief files and writing to file...')
+    ief_objs = updateIefObjects(ief_holders)
+    results['success'] = writeUpdatedFiles(ief_objs)
+    if results['success']:
+        results['summary'] = getUpdateSummary(ief_objs)
+    return results
+    
+    
 def autoResolvePath(ief_path, search_folder_depth=4):
     """Change the file names in an ief to match it's new location.
     
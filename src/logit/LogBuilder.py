@@ -66,9 +66,12 @@
 
 # Import python standard modules
 import os
+import time
 import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from operator import attrgetter
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import logging
 logger = logging.getLogger(__name__)
@@ -85,14 +88,245 @@ except:
     logger.error('Cannot load ship: Is it installed?')
     
 import LogClasses
+import parsecache
 
 # Constants for identifying log type
 TYPE_TUFLOW = 0
 TYPE_ISIS = 1
 TYPE_ESTRY = 2
 
+CONTROL_FILE_EXTENSIONS = ['.tcf', '.ecf', '.tgc', '.tbc', '.tef', '.trd', '.tmf',
+                           '.toc', '.tesf', '.tscf', '.qcf', '.trfc', '.adcf']
+""" Extensions of the files that ship reads when it loads a tuflow model. """
+
 missing_files = []
 
+parse_cache = parsecache.ParseCache()
+""" Cache for loaded models and bc databases. See configureParseCache. """
+
+
+def configureParseCache(cache_dir=None, max_items=parsecache.DEFAULT_MAX_ITEMS):
+    """Replace the parse cache used when loading models.
+    
+    Args:
+        cache_dir=None(str): folder to keep the cache in between sessions.
+            If None the cache is only kept in memory.
+        max_items=parsecache.DEFAULT_MAX_ITEMS(int): number of loaded files
+            to keep in memory.
+    
+    Return:
+        ParseCache - the new cache.
+    """
+    global parse_cache
+    parse_cache = parsecache.ParseCache(max_items, cache_dir)
+    return parse_cache
+
+
+def parseWorkerCount(setting=0):
+    """Get the number of processes to load models with.
+    
+    Args:
+        setting=0(int): the user setting. If < 1 one less than the number
+            of CPU cores is used.
+    
+    Return:
+        int - the number of worker processes, at least 1.
+    """
+    if setting is None or setting < 1:
+        setting = (multiprocessing.cpu_count() or 2) - 1
+    return max(1, setting)
+
+
+def loadModelLogs(open_path, run_options):
+    """Load the logs for a model.
+    
+    Doesn't access the database or the GUI, so it can be run in a worker 
+    process (see loadModels). The returned AllLogs only holds builtin types
+    and can be pickled.
+    
+    Successfully loaded models are stored in the parse_cache and the cached
+    copy is returned until one of the model files changes.
+    
+    Args:
+        open_path(str): the .ief or .tcf file path.
+        run_options(str): the run options (~s1~ etc) to load the model with.
+    
+    Return:
+        tuple(AllLogs, str, list) - the loaded logs, '' and []. If the load 
+            fails (False, message, missing_files) where message describes 
+            why, for adding to a MODEL_LOAD error, and missing_files lists
+            any model files that don't exist.
+    """
+    key = ('model', os.path.normcase(os.path.abspath(open_path)), str(run_options))
+    all_logs = parse_cache.get(key)
+    if all_logs is not None:
+        logger.info('Loaded model from cache: ' + open_path)
+        return all_logs, '', []
+
+    loader = ModelLoader()
+    try:
+        all_logs = loader.loadModel(open_path, run_options)
+    except Exception as err:
+        logger.exception(err)
+        return False, ':\n%s\n%s' % (open_path, err), []
+    
+    if all_logs == False:
+        if loader.missing_files:
+            missing = [str(f) for f in loader.missing_files]
+            file_str = 'The following tuflow model files could not be loaded:\n' + '\n'.join(missing)
+            return False, ' at:\n%s\n\n%s' % (open_path, file_str), missing
+        else:
+            missing = [open_path] if not os.path.exists(open_path) else []
+            return False, (':\n%s\nCould not find the following files:\n%s' % (open_path, loader.error)), missing
+    
+    dependencies = loader.modelDependencies()
+    if dependencies is not None:
+        parse_cache.put(key, all_logs, dependencies)
+    return all_logs, '', []
+
+
+def readIefHeader(ief_path):
+    """Read the key=value lines from the header of an ief file.
+    
+    Only reads the [ISIS Event Header] section, so it's much quicker than
+    loading the ief with ship.
+    
+    Args:
+        ief_path(str): the .ief file path.
+    
+    Return:
+        dict - {key: value} for the header lines, or None if the file can't
+            be read.
+    """
+    header = {}
+    try:
+        with open(ief_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    if header or not line.lower() == '[isis event header]': break
+                    continue
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    header[key.strip()] = value.strip()
+    except (IOError, UnicodeDecodeError) as err:
+        logger.warning('Unable to read ief header: ' + ief_path)
+        logger.exception(err)
+        return None
+    return header
+
+
+def readRunHash(open_path, run_options):
+    """Get the run hash for a model without loading it.
+    
+    Uses the same tcf name, ief name and run options that ModelLoader uses
+    to build the RUN entry, read from the ief header for ief files, so it
+    matches AllLogs.run_hash when the model is loaded. Used to skip models
+    that are already in the database before loading them.
+    
+    Args:
+        open_path(str): the .ief or .tcf file path.
+        run_options(str): the run options (~s1~ etc) the model would be 
+            loaded with. Ignored for ief files, which have their own.
+    
+    Return:
+        str - the run hash, or None if it can't be found without loading 
+            the model (e.g. the file, or the tcf it refers to, is missing).
+    """
+    if not os.path.isfile(open_path): return None
+    ext = os.path.splitext(open_path)[1]
+    if ext in ['.tcf', '.TCF']:
+        if not run_options: run_options = ''
+        return LogClasses.runHash(os.path.basename(open_path), '', run_options)
+    elif not ext in ['.ief', '.IEF']:
+        return None
+    
+    header = readIefHeader(open_path)
+    if not header: return None
+    ief_name = os.path.basename(open_path)
+    options = header.get('2DOptions', '')
+    tcf_path = header.get('2DFile')
+    if header.get('2DScheme') == 'TUFLOW' and tcf_path is not None:
+        if not os.path.splitext(tcf_path)[1] in ['.tcf', '.TCF'] or not os.path.exists(tcf_path):
+            return None
+        return LogClasses.runHash(os.path.basename(tcf_path), ief_name, options)
+    return LogClasses.runHash('', ief_name, options)
+
+
+def loadModels(model_paths, run_options, workers=1, cancelled=None, queue_size=None,
+               stats=None):
+    """Load a list of models, using a pool of worker processes.
+    
+    The models are loaded with loadModelLogs in up to workers processes and
+    the results are yielded in the same order as model_paths. Only 
+    queue_size models are queued at a time, so that the results held in
+    memory stay bounded when the caller is slower than the workers. With
+    one worker the models are loaded in the calling thread.
+    
+    Processes are started with the 'spawn' method, as forking a process
+    that is running Qt and database threads is not safe. Each process uses
+    a parse cache with the same settings as the current parse_cache.
+    
+    Args:
+        model_paths(list): the .ief or .tcf file paths to load.
+        run_options(str): the run options (~s1~ etc) to load the models with.
+        workers=1(int): the number of worker processes to use.
+        cancelled=None(func): called before each model is queued. If it 
+            returns True no more models are loaded.
+        queue_size=None(int): the number of models queued in the worker
+            processes at a time. If None twice the number of workers.
+        stats=None(ingest.StageStats): updated with the number of models
+            loaded, the time spent loading them and the queue depth.
+    
+    Return:
+        generator - of tuple(str, AllLogs, str, list) with the path and the 
+            loadModelLogs return values for each model.
+    """
+    def isCancelled():
+        return cancelled is not None and cancelled()
+    
+    if workers <= 1 or len(model_paths) < 2:
+        for path in model_paths:
+            if isCancelled(): return
+            start = time.time()
+            result = loadModelLogs(path, run_options)
+            if stats is not None: stats.add(1, time.time() - start)
+            yield (path,) + result
+        return
+    
+    if not queue_size: queue_size = workers * 2
+    
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(min(workers, len(model_paths)), mp_context=context,
+                               initializer=configureParseCache,
+                               initargs=(parse_cache.cache_dir, parse_cache.max_items))
+    pending = deque()
+    paths = iter(model_paths)
+    try:
+        while True:
+            while len(pending) < queue_size and not isCancelled():
+                path = next(paths, None)
+                if path is None: break
+                pending.append((path, pool.submit(loadModelLogs, path, run_options)))
+            if stats is not None: stats.setDepth(len(pending))
+            if not pending: return
+            
+            path, future = pending.popleft()
+            start = time.time()
+            try:
+                result = future.result()
+            except Exception as err:
+                # e.g. the logs couldn't be pickled or the worker died
+                logger.error('Model load process failed for: %s' % path)
+                logger.exception(err)
+                result = False, ':\n%s\n%s' % (path, err), []
+            if stats is not None: stats.add(1, time.time() - start)
+            yield (path,) + result
+    finally:
+        for path, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
 
 class ModelLoader(object):
     
@@ -107,6 +341,8 @@ class ModelLoader(object):
         self.run_options = {}
         self.error = None
         self.missing_files = []
+        self.file_path = None
+        self.bc_paths = []
         
         # Get the current date
         date_now = datetime.datetime.now()
@@ -116,6 +352,7 @@ class ModelLoader(object):
     def loadModel(self, file_path, run_options={}):
         """
         """
+        self.file_path = file_path
         self.run_options = run_options
         options = ''
         
@@ -265,6 +502,34 @@ class ModelLoader(object):
         return log_pages
     
     
+    def modelDependencies(self):
+        """Get the files that the logs for the loaded model were built from.
+        
+        These are the main file, the control files and the bc databases. 
+        Other files referenced by the model are only logged by name, so 
+        changes to them don't change the logs.
+        
+        Return:
+            list - of file paths, or None if they can't be found.
+        """
+        paths = [self.file_path]
+        if self.tuflow is None: return paths
+
+        paths.append(os.path.join(self.tcf_dir, self.tcf))
+        paths.extend(self.bc_paths)
+        try:
+            for control_file in self.tuflow.control_files.values():
+                for part in control_file.files():
+                    path = part.absolutePath()
+                    if os.path.splitext(path)[1].lower() in CONTROL_FILE_EXTENSIONS:
+                        paths.append(path)
+        except Exception as err:
+            logger.warning('Unable to find the model files for: ' + self.file_path)
+            logger.exception(err)
+            return None
+        return paths
+    
+
     def createSEVals(self, options):
         """
         """
@@ -485,8 +750,14 @@ class ModelLoader(object):
         
         if len(bc) > 0:
             for b in bc:
-                bc_obj = datafileloader.loadDataFile(b)
-                files = bc_obj.getAllPaths(include_this=False, name_only=True)
+                path = b.absolutePath()
+                self.bc_paths.append(path)
+                key = ('bc', os.path.normcase(os.path.abspath(path)))
+                files = parse_cache.get(key)
+                if files is None:
+                    bc_obj = datafileloader.loadDataFile(b)
+                    files = bc_obj.getAllPaths(include_this=False, name_only=True)
+                    parse_cache.put(key, files, [path])
                 bc_list.append({'TYPE': 'BC_DBASE', 'NAME': b.filenameAndExtension(), 
                                 'FILES': files, 'COMMENTS': 'None', 'EXISTS': False})
         
@@ -54,6 +54,27 @@ EDITING_ALLOWED = ['COMMENTS', 'MODELLER', 'SETUP', 'DESCRIPTION',
                    'RUN_STATUS']
 """AllLogs keys for which value editing is permitted."""
 
+
+def runHash(tcf, ief, run_options):
+    """Create the run hash for a set of run variables.
+    
+    The hash uses a salt made up of:  
+        tcf name + ief name + run options
+    
+    Args:
+        tcf(str): the tcf file name, or '' if there isn't one.
+        ief(str): the ief file name, or '' if there isn't one.
+        run_options(str): the run options, or ''.
+    
+    Return:
+        str - the sha1 hex digest.
+    """
+    rn = [v.strip() for v in (tcf, ief, run_options) if not v.strip() == '']
+    hash = hashlib.sha1()
+    hash.update((';'.join(rn)).encode('utf-8'))
+    return hash.hexdigest()
+
+
 class AllLogs(object):
     """Holder for the log data when loaded.
     
@@ -112,19 +133,9 @@ class AllLogs(object):
             tcf name + ief name + run options
             
         This combination of variables should not exist in two different runs.
+        See runHash.
         """
-        rn = []
-        if not self.run['TCF'].strip() == '':
-            rn.append(self.run['TCF'].strip())
-        if not self.run['IEF'].strip() == '':
-            rn.append(self.run['IEF'].strip())
-        if not self.run['RUN_OPTIONS'].strip() == '':
-            rn.append(self.run['RUN_OPTIONS'].strip())
-        
-        hash = hashlib.sha1()
-        hash.update((';'.join(rn)).encode('utf-8'))
-        self.run_hash = hash.hexdigest()
-#         self.run_hash = hashlib.sha1((';'.join(rn)).encode('utf-8')).hexdigest()
+        self.run_hash = runHash(self.run['TCF'], self.run['IEF'], self.run['RUN_OPTIONS'])
     
     
     def updateLogEntry(self, entry, values, index=None):
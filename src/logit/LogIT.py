@@ -100,13 +100,13 @@
 
 # Python standard modules
 import os
-import shutil
+import copy
 import sys
+import multiprocessing
 # import pickle
 import logging
 import json
 from PyQt5 import sip
-from peewee import InterfaceError
 
 # import encodings
 # import future
@@ -141,6 +141,9 @@ except:
     logger.warning('Unable to create log file directory')
     CONSOLE_ONLY_LOG = True
 
+SNAPSHOT_CHECK_INTERVAL = 5 * 60 * 1000
+""" Milliseconds between checks for whether a database snapshot is due. """
+
 TEMP_PATH = os.path.join(cur_location, 'temp')
 try:
     if not os.path.exists(TEMP_PATH):
@@ -170,8 +173,6 @@ from LogIT_UI_qt5 import Ui_MainWindow
 logger.debug('Main Window import complete')
 import LogBuilder
 logger.debug('LogBuilder import complete')
-import Exporters
-logger.debug('Exporters import complete')
 import Controller
 logger.debug('Controller import complete')
 import GuiStore
@@ -190,6 +191,12 @@ logger.debug('New Entry import complete')
 #logger.debug('Run Summary import complete')
 import dbmigrations
 logger.debug('db migrations import complete')
+import jobs
+import ingest
+import snapshots
+import dbmaintenance
+import changetracker
+logger.debug('jobs import complete')
 
 import peeweemodels as pm
 import peeweeviews as pv
@@ -232,6 +239,23 @@ class MainGui(QtWidgets.QMainWindow):
         self.progress_bar.setMaximumSize(200, 20)
         self.ui.statusbar.addPermanentWidget(self.progress_bar)
         self.progress_bar.setValue(0)
+        
+        # Long running tasks are run as background jobs, which can be 
+        # stopped with the button next to the progress bar
+        self.jobs = jobs.JobExecutor(inline=gs.__TEST_MODE__, parent=self)
+        self.jobs.jobDoneSignal.connect(self._jobDone)
+        self._job_message = ''
+        self.stop_button = QtWidgets.QPushButton('Stop', self.ui.statusbar)
+        self.stop_button.setToolTip('Stop the running task')
+        self.stop_button.setMaximumSize(60, 20)
+        self.stop_button.clicked.connect(self.jobs.cancelAll)
+        self.ui.statusbar.addPermanentWidget(self.stop_button)
+        self.stop_button.hide()
+        
+        # Snapshots of the database are taken in the background when due
+        self.snapshot_timer = QtCore.QTimer(self)
+        self.snapshot_timer.setInterval(SNAPSHOT_CHECK_INTERVAL)
+        self.snapshot_timer.timeout.connect(self._checkSnapshot)
 
         # Connect the slots
         self.ui.actionLoad.triggered.connect(self._loadNewModelLog)
@@ -240,6 +264,11 @@ class MainGui(QtWidgets.QMainWindow):
         self.ui.actionNewModelLog.triggered.connect(self._createNewLogDatabase)
         self.ui.actionUpdateDatabaseSchema.triggered.connect(self._updateDatabaseVersion)
         self.ui.actionCleanDatabase.triggered.connect(self.cleanDatabase)
+        self.ui.actionVerifyNewStatus.triggered.connect(self._verifyNewStatus)
+        self.ui.menuTools.addAction(QtWidgets.QAction(
+            'Database Maintenance...', self, 
+            toolTip='Check the database and update its query statistics',
+            triggered=self._databaseMaintenance))
         self.ui.actionSaveSetupAs.triggered.connect(self._saveSetup)
         self.ui.actionLoadSetup.triggered.connect(self._loadSetup)
         self.ui.actionLogWarning.triggered.connect(self._updateLoggingLevel)
@@ -253,6 +282,35 @@ class MainGui(QtWidgets.QMainWindow):
         self.ui.actionExit.triggered.connect(self.close)
         self.ui.actionUpdateAllRunStatus.triggered.connect(self._updateAllRowStatus)
         self.ui.tabWidget.currentChanged.connect(self._tabChanged)
+        self._setupDbProfileMenu()
+        self.ui.menuSettings.insertAction(self.ui.menuLoggingLevel.menuAction(), 
+            QtWidgets.QAction('Model Loading Processes...', self, 
+                              triggered=self._setParseWorkers))
+        self.parse_cache_action = QtWidgets.QAction(
+            'Keep Model Cache On Disk', self, checkable=True, 
+            toolTip='Keep loaded models on disk so they load faster next session',
+            triggered=self._setParseCache)
+        self.ui.menuSettings.insertAction(self.ui.menuLoggingLevel.menuAction(), 
+                                          self.parse_cache_action)
+        self.ingest_snapshot_action = QtWidgets.QAction(
+            'Snapshot Database Before Logging', self, checkable=True, 
+            toolTip='Take a copy of the database before adding new log entries',
+            triggered=self._setIngestSnapshot)
+        self.ui.menuSettings.insertAction(self.ui.menuLoggingLevel.menuAction(), 
+                                          self.ingest_snapshot_action)
+        self.ui.menuSettings.insertAction(self.ui.menuLoggingLevel.menuAction(), 
+            QtWidgets.QAction('Database Snapshots...', self, 
+                              triggered=self._setSnapshotSettings))
+        export_action = self.ui.menuExport.menuAction()
+        self.ui.menuFile.insertAction(export_action, QtWidgets.QAction(
+            'Take Database Snapshot', self, 
+            toolTip='Take a snapshot of the log database now',
+            triggered=lambda: self._takeSnapshot(True)))
+        self.ui.menuFile.insertAction(export_action, QtWidgets.QAction(
+            'Restore Database Snapshot...', self, 
+            toolTip='Replace the log database with an earlier snapshot',
+            triggered=self._restoreSnapshot))
+        self.ui.menuFile.insertSeparator(export_action)
         
         # Keyboard shortcuts
         # Quit
@@ -290,20 +348,26 @@ class MainGui(QtWidgets.QMainWindow):
         self.query_widget = Query.Query_UI(cur_location)
         self.ui.logViewTab.insertTab(self.ui.logViewTab.count(), self.query_widget, 'Query')
         self.query_widget.queryFileSummarySignal.connect(self._queryFileSummary)
+        self.query_widget.statusUpdateSignal.connect(self._updateStatusBar)
         try:
             self.query_widget.loadSettings(self.settings.tool_settings[self.query_widget.tool_name])
         except:
             logger.info('No loadSettings() found for %s' % (self.query_widget.tool_name))
         self._addWidgets()
+        self._setParseCache(self.settings.main['parse_cache_disk'])
         logger.debug('Add Widgets complete')
         
         # Use those settings to get the file path and try and load the last log
         # database that the user had open
         self.table_info = {}
+        self.change_tracker = changetracker.ChangeTracker()
         self._setupDbTabs()
         if self.checkDbLoaded(False) and self.checkDatabaseVersion(gs.path_holder['log']):
             self._loadModelLog()
+            self._checkIngestJournal()
         logger.debug('Attempt to laod model log complete')
+        if not gs.__TEST_MODE__:
+            self.snapshot_timer.start()
         self.all_logs = None
         
         # Set default logging level if used in release
@@ -350,7 +414,7 @@ class MainGui(QtWidgets.QMainWindow):
         run_table.statusUpdateSignal.connect(self._updateStatusBar)
         run_table.setRangeSignal.connect(self._updateMaxProgress)
         run_table.updateProgressSignal.connect(self._updateCurrentProgress)
-        run_table.dbUpdatedSignal.connect(self._loadModelLog)
+        run_table.dbUpdatedSignal.connect(self._refreshModelLog)
         run_table.runTableContextToolSignal.connect(self.runTableContextTool)
         run_table.runTableContextPathSignal.connect(self.runTableContextPathUpdate)
         run_table.runTableContextStatusSignal.connect(self.runTableContextStatusUpdate)
@@ -378,57 +442,39 @@ class MainGui(QtWidgets.QMainWindow):
 
         
     def _updateAllRowStatus(self):
-        """Update the RUN_STATUS and MB of all rows in RUN table."""
+        """Update the RUN_STATUS and MB of all rows in RUN table.
+        
+        The update is run as a background job (see Controller.updateRunStatus).
+        """
         if not self.checkDbLoaded(): return
-        failures = []
-        row_count = self.table_info['RUN']['table'].rowCount()
-        self._updateMaxProgress(row_count+1)
-        errors = []
-        for row in range(0, row_count):
-            self._updateStatusBar('Updating row %s of %s' % (row, row_count))
-            self._updateCurrentProgress(row)
-            run_id = self.table_info['RUN']['table'].item(row, self.table_info['RUN']['table'].id_col).text()
-            errors = self.runTableContextStatusUpdate(run_id, errors, show_error=False)
+        table = self.table_info['RUN']['table']
+        run_ids = [int(table.cellText(row, table.id_col)) for row in range(table.rowCount())]
+        job = jobs.Job(Controller.updateRunStatus, (run_ids,), 'Update run status')
+        self._startJob(job, lambda result: self._allRowStatusUpdated(result, run_ids))
+    
+    def _allRowStatusUpdated(self, result, run_ids):
+        errors, updated = result
         if errors:
             errors.insert(0, 'The following updates failed:')
             msg = '\n'.join(errors)
             self.launchQMsgBox('Update Failure', msg)
 
-        self._loadModelLog()
-        self._updateStatusBar('')
-        self._updateCurrentProgress(0)
+        self.change_tracker.markUpdated('Run', run_ids)
+        self._refreshModelLog()
+        self.ui.statusbar.showMessage('Updated the status of %s runs' % updated)
 
     #@QtCore.pyqtSlot(int)
-    def runTableContextStatusUpdate(self, run_id, errors=[], show_error=True):
+    def runTableContextStatusUpdate(self, run_id):
         """Update the status of a Run table entry.
         
+        The update is run as a background job (see Controller.updateRunStatus)
+        and a msgbox is launched if it fails.
+        
         Args:
             run_id(int): the Run record to update.
-            errors=[](list): will be appended with any errors and returned.
-            show_error=True(bool): if True msgbox will be launched on error.
-        
-        Return:
-            list - containing any errors.
         """
-        run_data = pv.getRunRow(run_id)
-        
-        # Find the latest values and update the RUN table
-        results = Controller.getRunStatusInfo(run_data['tcf_dir'], run_data['tcf'], run_data['run_options'])
-        if not results[0] and not results[1]:
-            msg = "- Failed to update status (ID=%s).\n  Is the TCF_DIR correct and does in contain '_ TUFLOW Simulations.log' file?" % (run_id)
-            if show_error:
-                self.launchQMsgBox('Update Failed', msg)
-            errors.append(msg)
-        elif not results[0]:
-            msg = "- Run is not yet complete(ID=%s).\n  You can only update status for a completed run" % (run_id)
-            if show_error:
-                self.launchQMsgBox('Update Failed', msg)
-            errors.append(msg)
-        else:
-            vals = {'run_status': results[1], 'mb': results[2]}
-            pv.updateRunRow(vals, run_id)
-        
-        return errors
+        job = jobs.Job(Controller.updateRunStatus, ([run_id],), 'Update run status')
+        self._startJob(job, lambda result: self._allRowStatusUpdated(result, [run_id]))
 
     @QtCore.pyqtSlot(str, int)
     def runTableContextPathUpdate(self, context_text, run_id):
@@ -466,9 +512,15 @@ class MainGui(QtWidgets.QMainWindow):
             open_path = str(open_path)
             p = os.path.split(open_path)[0]
             row_dict = {lookup_name: p}
-            pv.updateRunRow(row_dict, run_id)
             gs.setPath('model', p)
             
+            def updated(result):
+                self.change_tracker.markUpdated('Run', [run_id])
+                self._refreshModelLog()
+            job = jobs.Job(Controller.updateRunRow, (row_dict, run_id), 
+                           'Update run paths', writer=True)
+            self._startJob(job, updated)
+            
         
     @QtCore.pyqtSlot(str, int)
     def runTableContextTool(self, context_text, run_id):
@@ -638,26 +690,79 @@ class MainGui(QtWidgets.QMainWindow):
             success = self.checkDatabaseVersion(open_path)
             if success:
                 self._loadModelLog()
+                self._checkIngestJournal()
             elif not success and not cur_log is None:
                 gs.setPath('log', cur_log)
             
     def _loadModelLog(self):
-        """Reload the Run and Model tables."""
+        """Reload the Run and Model tables.
+        
+        Used when a database is loaded. When records have been changed
+        _refreshModelLog is used instead.
+        """
         if not self.checkDbLoaded(): return
         
         try:
+            self.change_tracker.reset()
             self.loadModelDb()
             self.loadRunDb()
             self._updateFileSummaryQueryList()
         except Exception as err:
             logger.error("Critical error loading database")
             logger.exception(err)
-            pm.logit_db.init(None)
+            pm.closeSession()
             gs.path_holder['last_path'] = gs.path_holder['log']
             del gs.path_holder['log']
             msg = "Critical error accessing database! - please check it exists and/or contact support"
             self.launchQMsgBox('DB Load Error', msg)
     
+    def _refreshModelLog(self):
+        """Update the Run and Model tables with the changes to the database.
+        
+        Only the records that have been added, removed or marked as updated
+        since the tables were loaded are read and changed in the tables (see
+        changetracker.ChangeTracker), so logging a run doesn't reload all of
+        the runs. If the changes to a table can't be worked out it's 
+        reloaded.
+        """
+        if not self.checkDbLoaded(): return
+        
+        try:
+            changes = self.change_tracker.check()
+        except Exception as err:
+            logger.exception(err)
+            changes = None
+        if changes is None:
+            self._loadModelLog()
+            return
+        
+        try:
+            run = changes.get('Run')
+            if run is not None:
+                if run.reload:
+                    self.loadRunDb()
+                    self._updateFileSummaryQueryList()
+                else:
+                    cols, rows = pv.getRunData(run.added + run.updated)
+                    self.table_info['RUN']['table'].patchRows(rows, run.removed)
+                    self.query_widget.patchFileSummaryQueryList(run.added, run.removed)
+            
+            model_table = self.table_info['MODEL']['table']
+            if model_table is not None:
+                name = {'DAT': 'Dat', 'IED': 'Ied'}.get(model_table.subname, 'ModelFile')
+                model = changes.get(name)
+                if model is not None:
+                    if model.reload:
+                        self.loadModelDb()
+                    else:
+                        cols, rows = pv.getModelData(model_table.subname, 
+                                                     model.added + model.updated)
+                        model_table.patchRows(rows, model.removed)
+        except Exception as err:
+            logger.error("Error updating the log tables, reloading")
+            logger.exception(err)
+            self._loadModelLog()
+    
     def checkDbLoaded(self, show_dialog=True):
         """Check if there's a database filepath set.
         
@@ -672,7 +777,7 @@ class MainGui(QtWidgets.QMainWindow):
             return False
          
         else:
-            pm.logit_db.init(path)
+            pm.openSession(path)
             return True 
 
     def loadModelDb(self, index=None):
@@ -694,11 +799,11 @@ class MainGui(QtWidgets.QMainWindow):
                     self.table_info['MODEL']['table'] = None
                 
             model_table = GuiStore.TableWidgetModel('MODEL', 0, 0, subname=cur_text, parent=self)
-            self.statusUpdateSignal.connect(self._updateStatusBar)
-            self.setRangeSignal.connect(self._updateMaxProgress)
-            self.updateProgressSignal.connect(self._updateCurrentProgress)
-            self.dbUpdatedSignal.connect(self._loadModelLog)
-            self.queryModelTableSignal.connect(self.queryModelTable)
+            model_table.statusUpdateSignal.connect(self._updateStatusBar)
+            model_table.setRangeSignal.connect(self._updateMaxProgress)
+            model_table.updateProgressSignal.connect(self._updateCurrentProgress)
+            model_table.dbUpdatedSignal.connect(self._refreshModelLog)
+            model_table.queryModelTableSignal.connect(self.queryModelTable)
             
             self.table_info['MODEL'] = {'table': model_table}
             self.ui.tableModelGroupLayout.addWidget(model_table)
@@ -782,6 +887,9 @@ class MainGui(QtWidgets.QMainWindow):
         self.ui.tabWidget.insertTab(self.ui.tabWidget.count(), new_entry, new_entry.tool_name)
         self.widgets[new_entry.tool_name].addSingleLogEntryButton.clicked.connect(self._createLogEntry)
         self.widgets[new_entry.tool_name].addMultiLogEntryButton.clicked.connect(self._createMultipleLogEntry)
+        self.widgets[new_entry.tool_name].preflightMultiLogEntryButton.clicked.connect(self._preflightMultipleLogEntry)
+        self.widgets[new_entry.tool_name].preflightMultiLogEntryButton.setToolTip(
+            'Check the models in the list without adding them to the database')
         # Update all Run status information
         self.widgets[new_entry.tool_name].addSingleLogEntryButton.setToolTip('Add model details to log database (Ctrl-A)')
         self.widgets[new_entry.tool_name].addSingleLogEntryButton.setShortcut("Ctrl+A")
@@ -824,6 +932,111 @@ class MainGui(QtWidgets.QMainWindow):
             self._on_viewlog = False
     
     
+    def _setupDbProfileMenu(self):
+        """Add the Database Profile sub menu to the Settings menu.
+        
+        Contains a checkable action for each of the pragma profiles in the
+        settings and an action to show the profile that's in use.
+        """
+        self.db_profile_menu = QtWidgets.QMenu('Database Profile', self.ui.menuSettings)
+        self.ui.menuSettings.insertMenu(self.ui.menuLoggingLevel.menuAction(), 
+                                        self.db_profile_menu)
+        self.db_profile_group = QtWidgets.QActionGroup(self)
+        self.db_profile_group.setExclusive(True)
+        for name in sorted(self.settings.main['db_profiles'].keys()):
+            action = QtWidgets.QAction(name, self, checkable=True)
+            action.setToolTip('Use the %s SQLite settings for the log database' % name)
+            action.triggered.connect(lambda checked, n=name: self._setDbProfile(n))
+            self.db_profile_group.addAction(action)
+            self.db_profile_menu.addAction(action)
+        self.db_profile_menu.addSeparator()
+        self.db_profile_menu.addAction('Show Database Profile', self._showDbProfile)
+        
+    def _setDbProfile(self, name):
+        """Apply a pragma profile from the settings to the log database.
+        
+        Args:
+            name(str): the name of the profile in settings.main['db_profiles'].
+        """
+        name = pm.setPragmaProfile(name, self.settings.main['db_profiles'])
+        self.settings.main['db_profile'] = name
+        for action in self.db_profile_group.actions():
+            action.setChecked(action.text() == name)
+    
+    def _showDbProfile(self):
+        """Show the active pragma profile and the settings in use."""
+        status = pm.getProfileStatus()
+        lines = ['Active profile: %s' % status['name'], '']
+        if not status['current']:
+            lines.append('No log database loaded')
+        for key, val in sorted(status['current'].items()):
+            if key in status['pragmas']:
+                lines.append('%s = %s  (profile: %s)' % (key, val, status['pragmas'][key]))
+            else:
+                lines.append('%s = %s' % (key, val))
+        logger.info('\n'.join(lines))
+        self.launchQMsgBox('Database Profile', '\n'.join(lines), type='info')
+
+    def _setParseWorkers(self):
+        """Set the number of processes used to load models when logging.
+        
+        0 uses one less than the number of CPU cores.
+        """
+        current = self.settings.main['parse_workers']
+        value, ok = QtWidgets.QInputDialog.getInt(
+            self, 'Model Loading Processes', 
+            'Number of processes used to load models when logging multiple\n'
+            'models (0 = number of CPU cores - 1, currently %s):' % LogBuilder.parseWorkerCount(0),
+            current, 0, 64)
+        if ok:
+            self.settings.main['parse_workers'] = value
+            logger.info('Model loading processes set to: %s' % LogBuilder.parseWorkerCount(value))
+    
+    def _setSnapshotSettings(self):
+        """Set how often database snapshots are taken and how many are kept."""
+        main = self.settings.main
+        questions = [
+            ('snapshot_interval', 'Minutes between snapshots of the log database\n'
+                                  '(0 = no automatic snapshots):', 0, 100000),
+            ('snapshot_hourly', 'Number of hourly snapshots to keep:', 0, 1000),
+            ('snapshot_daily', 'Number of daily snapshots to keep:', 0, 1000),
+        ]
+        values = {}
+        for key, text, minimum, maximum in questions:
+            value, ok = QtWidgets.QInputDialog.getInt(
+                self, 'Database Snapshots', text, main[key], minimum, maximum)
+            if not ok: return
+            values[key] = value
+        main.update(values)
+        logger.info('Snapshot settings: every %(snapshot_interval)s minutes, keep '
+                    '%(snapshot_hourly)s hourly and %(snapshot_daily)s daily' % values)
+    
+    def _setParseCache(self, on_disk):
+        """Setup the cache used for loaded models.
+        
+        Models are always cached in memory. If on_disk is True they are also
+        stored in the New Entry data folder and kept between sessions.
+        
+        Args:
+            on_disk(bool): whether to keep the cache on disk.
+        """
+        self.settings.main['parse_cache_disk'] = on_disk
+        self.parse_cache_action.setChecked(on_disk)
+        cache_dir = None
+        data_dir = self.widgets['New Entry'].data_dir
+        if on_disk and data_dir is not None:
+            cache_dir = os.path.join(data_dir, 'parse_cache')
+        LogBuilder.configureParseCache(cache_dir)
+    
+    def _setIngestSnapshot(self, snapshot):
+        """Set whether to snapshot the database before adding log entries.
+        
+        Args:
+            snapshot(bool): whether to take a snapshot.
+        """
+        self.settings.main['ingest_snapshot'] = snapshot
+        self.ingest_snapshot_action.setChecked(snapshot)
+
     def _updateLoggingLevel(self):
         """Alters to logging level based on the name of the calling action
         
@@ -876,8 +1089,10 @@ class MainGui(QtWidgets.QMainWindow):
     def _createLogEntry(self):
         """Take the updated data in the provisional table and load it into the
         model log.
+        
+        The records are added in a single transaction, so if anything goes
+        wrong SQLite rolls the database back to how it was.
         """
-        temp_copy = os.path.join(TEMP_PATH, os.path.basename(gs.path_holder['log']))
         # Check that we have a database
         if not self.checkDbLoaded(): 
             return
@@ -888,47 +1103,23 @@ class MainGui(QtWidgets.QMainWindow):
         
         all_logs = self.widgets['New Entry'].getSingleLogEntry()
         if not all_logs is None:
-            
-            try:
-                shutil.copy(gs.path_holder['log'], temp_copy)
-            except IOError as err:
-                logger.warning('Cound not create temp backup')
-            
+            snapshot = self._takeIngestSnapshot()
             try:
-                if all_logs.dat is not None:
-                    dat = pv.addDat(all_logs.dat)
-                else:
-                    dat = None
-                run = pv.addRun(all_logs.run, all_logs.run_hash, all_logs.ief_dir, 
-                                all_logs.tcf_dir, dat)
-                pv.addAllIed(all_logs.ieds, run)
-                pv.addAllModel(all_logs.models, run)
-
-                # Add the new entries to the view table as well
-                self._loadModelLog()
+                pv.addLogEntries([all_logs])
             except Exception as err:
-                
                 self._updateStatusBar('')
                 msg = ("Critical Error - Oooohhh Nnnooooooooo....\nThis has " +
-                       "all gone terribly wrong. You're on your own dude.\n" +
-                       "Don't look at me...DON'T LOOK AT MMMEEEEE!!!\n" +
-                       "<-((+_+))->")
+                       "all gone terribly wrong.\n" +
+                       "The log entry could not be added and the database has " +
+                       "not been changed.\n" + "<-((+_+))->")
                 logger.error('Critical error in create log entry')
                 logger.exception(err)
                 self.launchQMsgBox('Critical Error', msg)
-                try:
-                    os.remove(gs.path_holder['log'])
-                    shutil.copy(temp_copy, gs.path_holder['log'])
-                except IOError as err:
-                    logger.warning('Could not reinstate backup!')
-                    p = os.path.normpath(TEMP_PATH)
-                    msg = "Couln't auto-reinstate the backup, but you can find\nit here and do it manually:\n" + p
-                    self.launchQMsgBox('Backup failure', msg)
                 return
-            try:
-                os.remove(temp_copy)
-            except IOError as err:
-                logger.warning('Cound not delete temp backup')
+            self._removeIngestSnapshot(snapshot)
+
+            # Add the new entries to the view table as well
+            self._refreshModelLog()
             
             # Update the status bar message
             self.ui.statusbar.showMessage("Log Database successfully updated")
@@ -937,98 +1128,218 @@ class MainGui(QtWidgets.QMainWindow):
     
     def _createMultipleLogEntry(self):
         """Takes all the files in the multiple model list, load them and add
-        them to the database.        
+        them to the database.
+        
+        The models are loaded and logged by a background job (see
+        Controller.logMultipleModels), which can be stopped part way through.
         """
         # Check that we have a database
         if not self.checkDbLoaded():
             return
-            
-        temp_copy = os.path.join(TEMP_PATH, os.path.basename(gs.path_holder['log']))
-        try:
-            shutil.copy(gs.path_holder['log'], temp_copy)
-        except IOError as err:
-            logger.warning('Cound not create temp backup')
-                
-        errors = GuiStore.ErrorHolder()
-        
         
         # Check we don't have any unsaved data in the tables first
         if not self.checkUnsavedEntries('RUN'): return
         if not self.checkUnsavedEntries('MODEL'): return
             
         # Get all of the file paths from the list
+        errors = GuiStore.ErrorHolder()
         model_paths, run_options = self.widgets['New Entry'].getMultipleModelPaths()
         if not model_paths: return errors
         
-        # Setup the progress stuff
-        total = len(model_paths)
-        prog_count = 1
-        self._updateMaxProgress(total)
-        
         # Get the global user supplied log variables
         input_vars = self.widgets['New Entry'].getInputVars()
         
-        try:
-            for path in model_paths:
-                
-                self._updateStatusBar('Loading model %s of %s' % (prog_count, total))
-                self._updateCurrentProgress(prog_count)
-                prog_count += 1
-                errors, all_logs = Controller.fetchAndCheckModel(path, run_options, errors)
-                
-                if errors.has_local_errors:
-                    errors.has_local_errors = False
-                    continue
-                
-                all_logs.run['MODELLER'] = input_vars['MODELLER']
-                all_logs.run['TUFLOW_BUILD'] = input_vars['TUFLOW_BUILD'] 
-                all_logs.run['ISIS_BUILD'] = input_vars['ISIS_BUILD']
-                all_logs.run['EVENT_NAME'] = input_vars['EVENT_NAME'] 
-                all_logs.run['RUN_OPTIONS'] = all_logs.run['RUN_OPTIONS'] 
-
-                if all_logs.dat is not None:
-                    dat = pv.addDat(all_logs.dat)
-                else:
-                    dat = None
-                run = pv.addRun(
-                    all_logs.run, all_logs.run_hash, all_logs.ief_dir, all_logs.tcf_dir, dat
-                )
-                pv.addAllIed(all_logs.ieds, run)
-                pv.addAllModel(all_logs.models, run)
-
-                if errors.has_local_errors:
-                    errors.has_local_errors = False
-                    continue
+        journal = ingest.IngestJournal(gs.path_holder['log'])
+        journal.start(model_paths, run_options, input_vars)
+        self._logModels(journal, model_paths, errors)
 
-            self._loadModelLog()
+#         if self._TEST_MODE:
+        if gs.__TEST_MODE__:
+            return errors
+    
+    def _logModels(self, journal, model_paths, errors):
+        """Start the job that logs the models in a batch.
+        
+        Args:
+            journal(ingest.IngestJournal): the journal for the batch.
+            model_paths(list): the paths in the batch still to be logged.
+            errors(ErrorHolder): for the job to add errors to.
+        """
+        snapshot = self._takeIngestSnapshot()
+        workers = LogBuilder.parseWorkerCount(self.settings.main['parse_workers'])
+        job = jobs.Job(Controller.logMultipleModels, 
+                       (model_paths, journal.run_options, journal.input_vars, errors, 
+                        workers, self.settings.main['log_batch_size'], journal), 
+                       'Log models')
+        self._startJob(
+            job, lambda result: self._multipleLogEntryDone(job, journal, snapshot, result),
+            lambda msg: self._multipleLogEntryFailed(journal, snapshot, msg)
+        )
+    
+    def _checkIngestJournal(self):
+        """Offer to resume a batch of models that didn't finish logging.
+        
+        Looks for an ingest.IngestJournal next to the loaded database, left
+        by a batch that failed or was interrupted (e.g. LogIT crashed).
+        """
+        path, exists = gs.getPath('log')
+        if not exists: return
+        journal = ingest.IngestJournal(path)
+        if not journal.exists() or self.jobs.isRunning('Log models'): return
+        if not journal.load():
+            journal.remove()
+            return
+        
+        remaining = journal.remaining()
+        if not remaining or gs.__TEST_MODE__:
+            journal.remove()
+            return
+        message = ('Logging a batch of %s models to this database did not finish.\n' +
+                   '%s models were logged and %s still need logging.\n\n' +
+                   'Do you want to log the remaining models now?') % (
+                       len(journal.model_paths), len(journal.committed), len(remaining))
+        if not self.launchQtQBox('Resume Logging Models', message):
+            journal.remove()
+            return
+        self._logModels(journal, remaining, GuiStore.ErrorHolder())
+    
+    def _takeIngestSnapshot(self):
+        """Take a snapshot of the database before logging, if configured.
+        
+        Failed writes are rolled back by SQLite, so this is only done when 
+        the ingest_snapshot setting is on, for an extra copy to go back to.
+        The snapshot is taken with the SQLite online backup API.
+        
+        Return:
+            str - the snapshot path, or None if one wasn't taken.
+        """
+        if not self.settings.main['ingest_snapshot'] or TEMP_PATH is None:
+            return None
+        snapshot = os.path.join(TEMP_PATH, os.path.basename(gs.path_holder['log']))
+        try:
+            return pm.backupDatabase(snapshot)
         except Exception as err:
-            self._updateStatusBar('')
-            self._updateCurrentProgress(0)
-            msg = ("Critical Error - Oooohhh Nnnooooooooo....\nThis has " +
-                   "all gone terribly wrong.\n" +
-                   "Don't look at me!!\n" +
-                   "<-((+_+))->")
-            logger.error('Critical error in multiple model load.')
+            logger.warning('Could not create database snapshot: %s' % snapshot)
             logger.exception(err)
-            try:
-                os.remove(gs.path_holder['log'])
-                shutil.copy(temp_copy, gs.path_holder['log'])
-            except IOError as err:
-                logger.error('Cound not reinstate backup!')
-                p = os.path.normpath(TEMP_PATH)
-                msg = "Couldn't auto-reinstate the backup, but you can find\nit here and do it manually:\n" + p
-                self.launchQMsgBox('Backup failure', msg)
-            
-#             if self._TEST_MODE:
-            if gs.__TEST_MODE__:
-                return errors
-            else:
-                self.launchQMsgBox('Critical Error', msg)
-                return
-
+            return None
+    
+    def _checkSnapshot(self):
+        """Take a snapshot of the database if one is due.
+        
+        Called by the snapshot_timer. Uses the snapshot_interval setting.
+        """
+        path, exists = gs.getPath('log')
+        if not exists or self.jobs.isRunning('Snapshot database'): return
+        manager = snapshots.SnapshotManager(path)
+        if manager.isDue(self.settings.main['snapshot_interval']):
+            self._takeSnapshot()
+    
+    def _takeSnapshot(self, show_dialog=False):
+        """Take a snapshot of the database in the background.
+        
+        Expired snapshots are removed afterwards, using the snapshot_hourly
+        and snapshot_daily settings.
+        
+        Args:
+            show_dialog=False(bool): if True tell the user if the snapshot
+                fails. Otherwise it's only logged.
+        """
+        if not self.checkDbLoaded(show_dialog): return
+        main = self.settings.main
+        job = jobs.Job(snapshots.takeSnapshot, 
+                       (gs.path_holder['log'], main['snapshot_hourly'], main['snapshot_daily']), 
+                       'Snapshot database')
+        failed = None
+        if not show_dialog:
+            failed = lambda msg: self.ui.statusbar.showMessage('Database snapshot failed')
+        self._startJob(job, lambda snapshot: self.ui.statusbar.showMessage(
+            'Database snapshot saved: %s' % os.path.normpath(snapshot)), failed)
+    
+    def _restoreSnapshot(self):
+        """Replace the database with a snapshot chosen by the user."""
+        if not self.checkDbLoaded(): return
+        if self.jobs.activeJobs():
+            self.launchQMsgBox('Task Running', 
+                               'Please wait for the running tasks to finish or stop them first.')
+            return
+        path = gs.path_holder['log']
+        found = snapshots.SnapshotManager(path).listSnapshots()
+        if not found:
+            self.launchQMsgBox('No Snapshots', 'There are no snapshots of this database.',
+                               'info')
+            return
+        labels = [when.strftime('%d/%m/%Y %H:%M:%S') for when, p in found]
+        label, ok = QtWidgets.QInputDialog.getItem(
+            self, 'Restore Database Snapshot', 'Snapshot to restore:', labels, 0, False)
+        if not ok: return
+        message = ('Replace the log database with the snapshot from %s?\n\n' +
+                   'A snapshot of the current database is taken first, so this ' +
+                   'can be undone.') % label
+        if not self.launchQtQBox('Restore Database Snapshot', message): return
+        
+        # The restore needs the database to itself
+        pm.closeSession()
+        job = jobs.Job(snapshots.restoreSnapshot, (path, found[labels.index(label)][1]),
+                       'Restore database snapshot', writer=True)
+        self._startJob(job, self._restoreSnapshotDone, self._restoreSnapshotFailed)
+    
+    def _restoreSnapshotDone(self, before):
+        self._loadModelLog()
+        logger.info('Database snapshot restored')
+        self.launchQMsgBox(
+            'Snapshot Restored', 'The snapshot has been restored.\n\n' +
+            'The database from before the restore was saved as:\n%s' % os.path.normpath(before),
+            'info')
+    
+    def _restoreSnapshotFailed(self, error):
+        self._loadModelLog()
+        self.launchQMsgBox('Restore Failed', 'The snapshot could not be restored ' +
+                           '(is the database open somewhere else?)\n\n%s' % error)
+    
+    def _removeIngestSnapshot(self, snapshot):
+        """Delete a snapshot taken by _takeIngestSnapshot."""
+        if snapshot is None: return
+        try:
+            os.remove(snapshot)
+        except OSError:
+            logger.warning('Could not delete database snapshot: %s' % snapshot)
+    
+    def _preflightMultipleLogEntry(self):
+        """Check all the files in the multiple model list without logging them.
+        
+        The models are checked by a background job (see 
+        Controller.preflightModels) and the results are shown in the 
+        Preflight Status column of the model list.
+        """
+        if not self.checkDbLoaded():
+            return
+        
+        model_paths, run_options = self.widgets['New Entry'].getMultipleModelPaths()
+        if not model_paths: return
+        
+        workers = LogBuilder.parseWorkerCount(self.settings.main['parse_workers'])
+        job = jobs.Job(Controller.preflightModels, (model_paths, run_options, workers), 
+                       'Preflight check')
+        self._startJob(job, self._preflightDone)
+    
+    def _preflightDone(self, results):
+        """Show the results of the job started by _preflightMultipleLogEntry."""
+        self.widgets['New Entry'].setPreflightResults(results)
+        counts = {}
+        for status, message in results.values():
+            counts[status] = counts.get(status, 0) + 1
+        summary = ', '.join('%s %s' % (counts[s], s.lower()) for s in sorted(counts))
+        logger.info('Preflight check complete: %s' % summary)
+        self.ui.statusbar.showMessage('Preflight check complete: %s' % summary)
+    
+    def _multipleLogEntryDone(self, job, journal, snapshot, result):
+        """Report the results of the job started by _createMultipleLogEntry."""
+        errors, logged = result
+        journal.remove()
+        self._removeIngestSnapshot(snapshot)
+        self._refreshModelLog()
         if errors.has_errors:
-            self._updateStatusBar('')
-            self._updateCurrentProgress(0)
+            self.progress_bar.setValue(0)
             text = errors.formatErrors('Some models could not be logged:')
             self.widgets['New Entry'].setMultipleErrorText(text)
             message = 'Some files could not be logged.\nSee Error Logs window for details'
@@ -1036,24 +1347,40 @@ class MainGui(QtWidgets.QMainWindow):
             if not gs.__TEST_MODE__: 
                 self.launchQMsgBox('Logging Error', message)
 
+        elif job.isCancelled():
+            logger.info('Model logging stopped after %s models' % logged)
+            self.ui.statusbar.showMessage('Logging stopped: %s models were logged' % logged)
         else:
             logger.info('Log Database updated successfully')
             self.ui.statusbar.showMessage("Log Database successfully updated")
-            self._updateCurrentProgress(0)
         
-        # Clear the list entries
-        self.widgets['New Entry'].clearMultipleModelTable()
-
-        try:
-            os.remove(temp_copy)
-        except IOError as err:
-            logger.warning('Cound not delete temp backup')
-
-#         if self._TEST_MODE:
-        if gs.__TEST_MODE__:
-            return errors
-
+        # Clear the list entries, unless the user stopped before the end
+        if not job.isCancelled():
+            self.widgets['New Entry'].clearMultipleModelTable()
     
+    def _multipleLogEntryFailed(self, journal, snapshot, error):
+        """Report a failure in the job started by _createMultipleLogEntry.
+        
+        The batch being written when it failed has been rolled back and the
+        batches before it are kept. The journal is left in place so the rest
+        of the models can be logged later.
+        """
+        self.ui.statusbar.showMessage('')
+        logger.error('Critical error in multiple model load.')
+        self._refreshModelLog()
+        journal.load()
+        msg = ("Critical Error - Oooohhh Nnnooooooooo....\nThis has " +
+               "all gone terribly wrong.\n%s\n\n" % error +
+               "%s of %s models were logged before the error. " % (
+                   len(journal.committed), len(journal.model_paths)) +
+               "You will be asked to log the rest next time the database is loaded.")
+        if snapshot is not None:
+            msg += ("\n\nA copy of the database from before logging started is here:\n" +
+                    os.path.normpath(snapshot))
+        
+        if not gs.__TEST_MODE__:
+            self.launchQMsgBox('Critical Error', msg)
+
     def _loadSettings(self):
         """Get the settings loaded from file if they exist.
         """
@@ -1070,6 +1397,11 @@ class MainGui(QtWidgets.QMainWindow):
         except:
             logger.warning('Was unable to retrieve previous settings - Has LogIT been updated?')
         
+        self._setDbProfile(self.settings.main['db_profile'])
+        self._setIngestSnapshot(self.settings.main['ingest_snapshot'])
+        if hasattr(self, 'widgets'):
+            self._setParseCache(self.settings.main['parse_cache_disk'])
+        
     
     def _writeSettings(self, save_path):
         """Need a custom close event so that we can save the user settings.
@@ -1161,6 +1493,15 @@ class MainGui(QtWidgets.QMainWindow):
         if answer == False: 
             event.ignore()
             return
+        
+        # Stop any background jobs at their next checkpoint
+        if self.jobs.activeJobs():
+            message = 'Some tasks are still running.\nStop them and close LogIT?'
+            if self.launchQtQBox('Tasks Running', message) == False:
+                event.ignore()
+                return
+            self.jobs.cancelAll()
+            self.jobs.waitForDone()
 
         save_path = self.settings.cur_settings_path
         self._writeSettings(save_path)
@@ -1177,16 +1518,7 @@ class MainGui(QtWidgets.QMainWindow):
 
         save_path = str(save_path)
         gs.setPath('export', save_path)
-        errors = GuiStore.ErrorHolder()
-        data = self.exportDatabase(errors)
-        self._updateCurrentProgress(4)
-        self._updateStatusBar('Writing to Excel ...')
-        Exporters.newExportToExcel(
-            data['run_out'], data['run_header'], data['dat_out'], data['dat_header'], 
-            data['model_out'], data['ied_out'], data['ied_header'], save_path
-        )
-        self._updateCurrentProgress(0)
-        self._updateStatusBar('Export Complete')
+        self.exportDatabase(save_path, 'excel')
 
     def _exportToJson(self, call_name):
         if not self.checkDbLoaded(): return
@@ -1200,43 +1532,24 @@ class MainGui(QtWidgets.QMainWindow):
 
         save_path = str(save_path)
         gs.setPath('export', save_path)
-        errors = GuiStore.ErrorHolder()
-        data = self.exportDatabase(errors)
-        self._updateCurrentProgress(4)
-        self._updateStatusBar('Writing to JSON ...')
-        Exporters.exportToJson(data, save_path)
-#             data['run_out'], data['run_header'], data['dat_out'], data['dat_header'], 
-#             data['model_out'], data['ied_out'], data['ied_header'], save_path
-#         )
-        self._updateCurrentProgress(0)
-        self._updateStatusBar('Export Complete')
+        self.exportDatabase(save_path, 'json')
  
-    def exportDatabase(self, error_holder):
+    def exportDatabase(self, save_path, export_type):
         """Exports the database.
         
-        Collects all of the data in the database and returns it in a dict.
-        """
-
-        try:
-            data = {}
-            # Setup the progress stuff
-            self._updateMaxProgress(5)
-            self._updateCurrentProgress(1)
-            self._updateStatusBar('Exporting Model Files ...')
-            data['model_out'] = pv.createModelExport()
-            self._updateCurrentProgress(2)
-            self._updateStatusBar('Exporting Run Files ...')
-            data['run_out'], data['run_header'], data['dat_out'], data['dat_header'] = pv.createRunDatExport()
-            self._updateCurrentProgress(3)
-            self._updateStatusBar('Exporting Ied Files ...')
-            data['ied_out'], data['ied_header'] = pv.createIedExport()
-            return data
+        The export is run as a background job (see Controller.exportDatabase).
         
-        except Exception as err:
-            self._updateCurrentProgress(0)
-            self._updateStatusBar('Export Failed')
-            logger.exception(err)
+        Args:
+            save_path(str): the file to write.
+            export_type(str): 'excel' or 'json'.
+        """
+        def failed(msg):
+            self.ui.statusbar.showMessage('Export Failed')
             QtWidgets.QMessageBox.warning(self, "Export Failed", "Export failed!")
+        
+        job = jobs.Job(Controller.exportDatabase, (save_path, export_type), 'Export')
+        self._startJob(job, lambda result: self.ui.statusbar.showMessage('Export Complete'),
+                       failed)
 
     def _getModelFileDialog(self, multi_paths=False, path=None):
         """Launches an open file dialog to get .ief or .tcf files.
@@ -1261,41 +1574,132 @@ class MainGui(QtWidgets.QMainWindow):
     
     
     def cleanDatabase(self):
-        """Removes any orphaned Many-to-many table files from database.""" 
-        try:
-            self._updateMaxProgress(3)
-            self._updateCurrentProgress(1)
-            self._updateStatusBar('Removing orphaned files ...')
-            pv.deleteOrphanFiles()
-            self._updateCurrentProgress(2)
-            self._updateStatusBar('Recalculating file status ...')
-            pv.updateNewStatus()
-            self._updateCurrentProgress(0)
-            self._updateStatusBar('Cleanup complete')
+        """Removes any orphaned records from the database.
+        
+        Does a dry run first and asks the user to confirm the records that
+        will be removed (see peeweeviews.removeOrphans). Both steps are run
+        as background jobs on the database writer lane.
+        """ 
+        if not self.checkDbLoaded(): return
+        job = jobs.Job(Controller.findOrphans, name='Find orphans', writer=True)
+        self._startJob(job, self._confirmCleanDatabase)
+    
+    def _confirmCleanDatabase(self, orphans):
+        """Ask the user to confirm the orphans to remove and remove them."""
+        counts = ['%s: %s' % (k, len(v)) for k, v in sorted(orphans.items()) if v]
+        if counts:
+            logger.info('Orphaned records:\n' + '\n'.join(
+                ['%s: %s' % (k, ', '.join([str(x) for x in v])) 
+                 for k, v in sorted(orphans.items()) if v]))
+            message = ('The following unused records will be removed:\n%s\n\n'
+                       'Continue?' % '\n'.join(counts))
+            if self.launchQtQBox('Clean Database', message) == False:
+                self.ui.statusbar.showMessage('')
+                return
+        
+        def cleaned(removed):
+            self.ui.statusbar.showMessage('Cleanup complete')
+            if not counts:
+                self.launchQMsgBox('Clean Database', 'No orphaned records found.', type='info')
+            self._refreshModelLog()
 
-        except InterfaceError:
-            logger.warning('No database setup')
-            self.launchQMsgBox('No database loaded', 'You need to load or create a database first.')
-        except Exception as err:
-            logger.warning('Cleanup database fail')
-            logger.exception(err)
+        job = jobs.Job(Controller.cleanDatabase, name='Clean Database', writer=True)
+        self._startJob(job, cleaned)
+    
+    def _databaseMaintenance(self):
+        """Check the health of the database and offer to fix any problems.
+        
+        Updates the query planner statistics, checks the database integrity
+        and foreign keys and looks for duplicate association records and 
+        free pages (see dbmaintenance.healthReport). Run as background jobs
+        on the database writer lane.
+        """
+        if not self.checkDbLoaded(): return
+        job = jobs.Job(Controller.checkDatabaseHealth, name='Database maintenance', 
+                       writer=True)
+        self._startJob(job, self._confirmDatabaseRepair)
+    
+    def _confirmDatabaseRepair(self, report):
+        """Show the health report and fix the problems if the user wants to."""
+        summary, details = dbmaintenance.formatReport(report)
+        logger.info('Database health report:\n%s\n%s' % (summary, details))
+        self.ui.statusbar.showMessage('Database check complete')
+        duplicates = report['duplicates']
+        fixable = any(duplicates.values()) or report['database']['free_pages'] > 0
+        if gs.__TEST_MODE__: return
+        
+        box = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Information, 
+                                    'Database Maintenance', summary, parent=self)
+        box.setDetailedText(details)
+        if fixable:
+            text = 'Remove the duplicate records and free the unused pages now?'
+            if report['database']['auto_vacuum'] != dbmaintenance.AUTO_VACUUM_INCREMENTAL:
+                text += ('\n\nThe first time this is done the whole database is rebuilt, '
+                         'which can take a while and needs no one else to be using it.')
+            box.setInformativeText(text)
+            box.setStandardButtons(QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+        if box.exec_() != QtWidgets.QMessageBox.Yes: return
+        
+        def repaired(result):
+            removed, freed = result
+            self.ui.statusbar.showMessage(
+                'Database maintenance complete: %s duplicates removed, %s pages freed' % (
+                    sum(removed.values()), freed))
+            self._refreshModelLog()
+        job = jobs.Job(Controller.repairDatabase, (duplicates, True), 
+                       'Database repair', writer=True)
+        self._startJob(job, repaired)
+    
+    def _verifyNewStatus(self):
+        """Check the stored new file flags against a full recalculation.
+        
+        The new_file flags are updated as runs are added and deleted. This
+        reports any that differ from what updateNewStatus would set and 
+        offers to fix them. Both steps are run as background jobs on the
+        database writer lane.
+        """
+        if not self.checkDbLoaded(): return
+        job = jobs.Job(Controller.verifyNewStatus, name='Verify file status', writer=True)
+        self._startJob(job, self._confirmNewStatus)
+    
+    def _confirmNewStatus(self, mismatches):
+        """Report the new file flag mismatches and recalculate them if asked."""
+        self.ui.statusbar.showMessage('')
+        total = sum([len(m) for m in mismatches.values()])
+        if total == 0:
+            self.launchQMsgBox('File Status OK', 'All new file flags are correct.', type='info')
+            return
+        
+        lines = ['%s: %s records (ids %s)' % (
+                 key, len(m), ', '.join([str(x[0]) for x in m[:10]]) + (' ...' if len(m) > 10 else ''))
+                 for key, m in sorted(mismatches.items()) if m]
+        logger.warning('New file status mismatches found:\n' + '\n'.join(lines))
+        message = ('Some new file flags are incorrect:\n%s\n\nRecalculate them now?' % '\n'.join(lines))
+        answer = self.launchQtQBox('File Status Errors', message)
+        if answer == False:
+            return
+        
+        def recalculated(result):
+            self.ui.statusbar.showMessage('')
+            self._refreshModelLog()
+        job = jobs.Job(Controller.recalculateNewStatus, name='Recalculate file status', 
+                       writer=True)
+        self._startJob(job, recalculated)
     
     
     def _updateDatabaseVersion(self, dbpath=None):
         """Update to the latest version of the database.
         
-        A backup copy is created at the start and restored if the upgrade fails.
-        
-        Collects a list of all of the migration functions from the dbmigrations
-        module and then loops them calling each one in order.
+        The updates are run in a background job by 
+        dbmigrations.migrateDatabase. Each step is committed as it completes,
+        so the database isn't copied first: if the update fails or is 
+        stopped it can be run again and will carry on from where it stopped.
         """
         if not dbpath:
             # Get the database to update
-            current_log = None
             p = gs.path_holder['last_path']
             path, exists = gs.getPath('log')
             if exists: 
-                current_log = path
                 p = path
             d = MyFileDialogs(parent=self)
             dbpath = d.openFileDialog(path=p, 
@@ -1304,7 +1708,7 @@ class MainGui(QtWidgets.QMainWindow):
                 return
         
         # Get the migration we need to apply
-        pm.logit_db.init(None)
+        pm.closeSession()
         update_funcs = dbmigrations.getRequiredUpdates(dbpath)
         # Check that we can update it
         if update_funcs == pm.DATABASE_VERSION_HIGH:
@@ -1320,60 +1724,30 @@ class MainGui(QtWidgets.QMainWindow):
             else:
                 return 'latest'
         
-        total_updates = len(update_funcs)
-        update_count = 1
-        pm.logit_db.init(dbpath)
-        self._updateMaxProgress(5)
-        
-        # Create a backup copy
-        self._updateCurrentProgress(1)
-        self._updateStatusBar('Creating backup copy of database')
-        path_vars = os.path.split(dbpath)
-        name_vars = os.path.splitext(path_vars[1])
-        backup_name = os.path.join(path_vars[0], name_vars[0] + 'backup' + name_vars[1])
-        try:
-            shutil.copyfile(dbpath, backup_name)
-        except Exception as err:
-            logger.exception(err)
-            msg = "Could not backup database is it open?\nUpdate Terminated."
-            if not gs.__TEST_MODE__:
-                self.launchQMsgBox('Backup Failed', msg)
-                self._updateCurrentProgress(0)
-                self._updateStatusBar('Update Failed')
-                return
-            else:
-                return 'copy failed'
-        
-        # Run the database migrations
-        try:
-            for func in update_funcs:
-                self._updateCurrentProgress(update_count + 1)
-                self._updateStatusBar('Applying update %s of %s' % (update_count, total_updates))
-                func()
-                update_count += 1
-            
-            # Update the database version number
-            pm.logit_db.init(None)
-            pm.createNewDb(dbpath)
-            pm.logit_db.init(dbpath)
-            gs.setPath('log', dbpath)
-            self._loadModelLog()
-
-            if not gs.__TEST_MODE__:
-                self.launchQMsgBox('Update Successfull', 'Your database has been updated and loaded into logit')
-            else:
-                return 'success'
-        except Exception as err:
-            logger.exception(err)
-            # Restore the backup copy if it fails
-            shutil.copyfile(backup_name, dbpath)
-            if not gs.__TEST_MODE__:
-                self.launchQMsgBox('Update Failed', "Could not complete update.\nlogdb file reset with backup.")
-            else:
-                return 'reset with backup'
-        finally:
-            self._updateCurrentProgress(0)
-            self._updateStatusBar('Update complete')
+        pm.openSession(dbpath)
+        job = jobs.Job(Controller.updateDatabase, (dbpath,), 'Update database', writer=True)
+        self._startJob(job, lambda result: self._updateDatabaseDone(dbpath),
+                       self._updateDatabaseFailed)
+        if gs.__TEST_MODE__:
+            return 'success' if job.error is None else 'update failed'
+    
+    def _updateDatabaseDone(self, dbpath):
+        """Load the database updated by _updateDatabaseVersion."""
+        pm.closeSession()
+        pm.openSession(dbpath)
+        gs.setPath('log', dbpath)
+        self._loadModelLog()
+        self.ui.statusbar.showMessage('Update complete')
+        if not gs.__TEST_MODE__:
+            self.launchQMsgBox('Update Successfull', 'Your database has been updated and loaded into logit')
+    
+    def _updateDatabaseFailed(self, error):
+        self.ui.statusbar.showMessage('Update Failed')
+        if not gs.__TEST_MODE__:
+            self.launchQMsgBox(
+                'Update Failed', "Could not complete update:\n%s\n\n" % error +
+                "The steps completed so far have been kept. Run Update Database " +
+                "Schema again to carry on from where it stopped.")
         
           
     def _resolveIefs(self):
@@ -1382,13 +1756,9 @@ class MainGui(QtWidgets.QMainWindow):
         When .ief files are moved to a new location they retain the old paths
         from the build location. This tool attempts to convert the paths from
         the old location to the new location.
-        """
-        
-        def finalize():
-            """Set status update back to default."""
-            self._updateStatusBar('')
-            self._updateCurrentProgress(0)
         
+        The files are resolved by a background job (see IefResolver.resolveIefs).
+        """
         p = cur_location
         if 'ief' in gs.path_holder.keys(): p = gs.path_holder['ief']
         elif 'model' in gs.path_holder.keys(): p = gs.path_holder['model']
@@ -1404,62 +1774,37 @@ class MainGui(QtWidgets.QMainWindow):
             file_list.append(str(i))
             gs.setPath('ief', i)
         
-        self._updateStatusBar('Attempting to automatically resolve ief file...')
-        self._updateMaxProgress(4)
-        self._updateCurrentProgress(1)
-        ief_holders, ief_fail = IefResolver.autoResolveIefs(file_list)
+        self.ui.statusbar.showMessage('Attempting to automatically resolve ief file...')
+        job = jobs.Job(IefResolver.resolveIefs, (file_list,), 'Ief resolver')
+        self._startJob(job, self._iefsResolved)
+    
+    def _iefsResolved(self, results):
+        """Show the results of the job started by _resolveIefs."""
+        self.ui.statusbar.showMessage('')
         
         # If we couldn't find the reference file
-        if not ief_holders:
+        if not results['resolved']:
             msg = ('Could not locate intial reference file(s). This means that\n' +
                    'it will not be possible to automate the update of these ' +
                    'iefs.')
             self.launchQMsgBox('Ief Update Error', msg)
-            finalize()
             return
         
-        # check if there were any files that couldn't be found on first attempt
-        missing_keys = []
-        for ief_holder in ief_holders:
-            miss = ief_holder.getMissingFileKeys()
-            if miss:
-                for m in miss:
-                    if not m in missing_keys:
-                        missing_keys.append(m)
-
-        # If there were then use the secondary method to try and get them
-        required_search = None
-        if missing_keys:
-            self._updateStatusBar('Attempting to find missing paths (this may take a while) ...')
-            self._updateCurrentProgress(2)
-            ief_holders, required_search = IefResolver.resolveUnfoundPaths(ief_holders)
-            
-            i=0
-        
-        # Write out the updated files
-        self._updateStatusBar('Updating Ief files and writing to file...')
-        self._updateCurrentProgress(3)
-        ief_objs = IefResolver.updateIefObjects(ief_holders)
-        success = IefResolver.writeUpdatedFiles(ief_objs)
-        
-        self._updateStatusBar('')
-        self._updateCurrentProgress(4)
-        if not success:
+        if not results['success']:
             msg = 'There was an error when writing the updated ief files to disk.'
             self.launchQMsgBox('Ief Write Error', msg)
-            finalize()
             return
         
         # Output a summary of any difficulties with the file update
-        summary = IefResolver.getUpdateSummary(ief_objs)
-        ief_dialog = IefResolver.IefResolverDialog(summary, ief_fail, required_search, parent=self)
+        ief_dialog = IefResolver.IefResolverDialog(
+            results['summary'], results['ief_fail'], results['required_search'], parent=self
+        )
         ief_dialog.resize(600, 400)
         ief_dialog.setWindowTitle('Ief Resolver Search Summary')
         icon = QtGui.QIcon()
         icon.addPixmap(QtGui.QPixmap(":/icons/images/Logit_Logo2_75x75.png"), QtGui.QIcon.Normal, QtGui.QIcon.Off)
         ief_dialog.setWindowIcon(icon)
         ief_dialog.exec_()
-        finalize() 
      
 
     def launchQtQBox(self, title, message):
@@ -1612,6 +1957,58 @@ class MainGui(QtWidgets.QMainWindow):
         self.progress_bar.setValue(value)
         QtWidgets.QApplication.processEvents()
     
+    
+    ''' 
+        Background jobs.
+    '''
+    def _startJob(self, job, finished=None, failed=None):
+        """Run a job in the background and show its progress.
+        
+        Progress is shown in the status and progress bars and the stop 
+        button is shown until all jobs are done.
+        
+        Args:
+            job(jobs.Job): the job to start.
+            finished=None(func): connected to the job finishedSignal.
+            failed=None(func): connected to the job failedSignal. If None a
+                message box with the error is shown.
+        
+        Return:
+            jobs.Job - the job, or None if a job with the same name is 
+                already running.
+        """
+        if self.jobs.isRunning(job.name):
+            self.launchQMsgBox('Task Running', '%s is already running.' % job.name)
+            return None
+        if failed is None:
+            failed = lambda msg: self.launchQMsgBox('%s Failed' % job.name, msg)
+        job.progressSignal.connect(self._jobProgress)
+        job.rateSignal.connect(self._jobRate)
+        job.cancelledSignal.connect(
+            lambda: self.ui.statusbar.showMessage('%s stopped' % job.name))
+        job.failedSignal.connect(failed)
+        if finished is not None:
+            job.finishedSignal.connect(finished)
+        self.stop_button.show()
+        return self.jobs.start(job)
+    
+    def _jobProgress(self, value, maximum, message):
+        self._job_message = message
+        self.progress_bar.setMaximum(maximum)
+        self.progress_bar.setValue(value)
+        self.ui.statusbar.showMessage(message)
+    
+    def _jobRate(self, rate, eta):
+        rate_text = jobs.formatRate(rate, eta)
+        if rate_text:
+            self.ui.statusbar.showMessage('%s (%s)' % (self._job_message, rate_text))
+    
+    def _jobDone(self, job):
+        if not self.jobs.activeJobs():
+            self.stop_button.hide()
+            self.progress_bar.setMaximum(1)
+            self.progress_bar.setValue(0)
+    
 
 
 class LogitSettings(object):
@@ -1650,13 +2047,23 @@ class LogitSettings(object):
         return {
             'release_notes_version': '', 'column_widths': {}, 'cur_tab': 0,
             'run_hidden_cols': {}, 'window_width': -1, 'window_height': -1,
+            'db_profile': pm.DEFAULT_PRAGMA_PROFILE, 
+            'db_profiles': copy.deepcopy(pm.PRAGMA_PROFILES),
+            'parse_workers': 0, 'parse_cache_disk': False,
+            'log_batch_size': Controller.LOG_BATCH_SIZE, 'ingest_snapshot': False,
+            'snapshot_interval': 60, 'snapshot_hourly': snapshots.DEFAULT_HOURLY,
+            'snapshot_daily': snapshots.DEFAULT_DAILY,
         }
         
     def fromJson(self, json_data):
         """"""
         self.path_holder = json_data.get('path_holder', {})
         self.tool_settings = json_data.get('tools', {})
-        self.main = json_data.get('main', self.getMainToolSettings())
+        # Fill in any main settings added since the file was written
+        self.main = self.getMainToolSettings()
+        self.main.update(json_data.get('main', {}))
+        for name, pragmas in pm.PRAGMA_PROFILES.items():
+            self.main['db_profiles'].setdefault(name, copy.deepcopy(pragmas))
         self.cur_settings_path = json_data.get('cur_settings_path', self.cur_settings_path)
         self.logging_level = json_data.get('logging_level', self.logging_level)
     
@@ -1735,6 +2142,9 @@ def main():
  
  
 if __name__ == '__main__':
+    # Model loading uses worker processes, which need this when frozen
+    multiprocessing.freeze_support()
+    
     args = sys.argv
     if len(args) > 1:
         if args[1] == '--delete-settings':
@@ -156,6 +156,8 @@ class Ui_MainWindow(object):
         self.actionSetdb.setObjectName("actionSetdb")
         self.actionCleanDatabase = QtWidgets.QAction(MainWindow)
         self.actionCleanDatabase.setObjectName("actionCleanDatabase")
+        self.actionVerifyNewStatus = QtWidgets.QAction(MainWindow)
+        self.actionVerifyNewStatus.setObjectName("actionVerifyNewStatus")
         self.actionExportToJson = QtWidgets.QAction(MainWindow)
         self.actionExportToJson.setObjectName("actionExportToJson")
         self.actionReleaseNotes = QtWidgets.QAction(MainWindow)
@@ -176,6 +178,7 @@ class Ui_MainWindow(object):
         self.menuTools.addAction(self.actionUpdateDatabaseSchema)
         self.menuTools.addAction(self.actionUpdateAllRunStatus)
         self.menuTools.addAction(self.actionCleanDatabase)
+        self.menuTools.addAction(self.actionVerifyNewStatus)
         self.menuLoggingLevel.addAction(self.actionLogWarning)
         self.menuLoggingLevel.addAction(self.actionLogInfo)
         self.menuLoggingLevel.addAction(self.actionLogDebug)
@@ -411,6 +414,8 @@ class Ui_MainWindow(object):
         self.actionNewdb.setText(_translate("MainWindow", "newdb"))
         self.actionSetdb.setText(_translate("MainWindow", "setdb"))
         self.actionCleanDatabase.setText(_translate("MainWindow", "Clean Database"))
+        self.actionVerifyNewStatus.setText(_translate("MainWindow", "Verify New File Status"))
+        self.actionVerifyNewStatus.setToolTip(_translate("MainWindow", "Check the new file flags against a full recalculation"))
         self.actionExportToJson.setText(_translate("MainWindow", "JSON"))
         self.actionExportToJson.setToolTip(_translate("MainWindow", "Export to JSON file"))
         self.actionReleaseNotes.setText(_translate("MainWindow", "Release Notes"))
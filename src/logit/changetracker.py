@@ -0,0 +1,233 @@
+"""
+###############################################################################
+
+ Name: LogIT (Logger for Isis and Tuflow)
+ Author: Duncan Runnacles
+ Copyright: (C) 2016 Duncan Runnacles
+ email: duncan.runnacles@thomasmackay.co.uk
+ License: GPL v2 - Available at: http://www.gnu.org/licenses/gpl-2.0.html
+
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 2 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License along
+ with this program; if not, write to the Free Software Foundation, Inc.,
+ 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+ Module:          changetracker.py
+ Date:            18/10/2026
+ Author:          Duncan Runnacles
+ Since-Version:   2.0.0
+
+ Summary:
+     Works out which records have changed since the log tables were loaded,
+     so the views only need to read those records instead of the whole
+     table.
+     
+     ChangeTracker.reset is called when the views are loaded. After that
+     ChangeTracker.check compares the database with the state at the last
+     reset/check. PRAGMA data_version (changed by commits from other
+     connections, e.g. the background jobs) and total_changes() (changes
+     made by this connection) are read first, so if nothing has been
+     written at all no tables are read. Otherwise the high-water mark of
+     each table (row count, max id and max timestamp) is compared. If only
+     new records have been added they are found with the id index. If
+     records have been removed the ids of the table are compared with the
+     ones stored at the last check.
+     
+     Updates to existing records can't be seen from the high-water marks.
+     Code that changes a record shown in the views adds it with
+     ChangeTracker.markUpdated.
+
+ UPDATES:
+
+
+ TODO:
+
+
+###############################################################################
+"""
+from collections import namedtuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+import peeweemodels as pm
+
+
+TableChanges = namedtuple('TableChanges', ['added', 'removed', 'updated', 'reload'])
+""" The changes to a table found by ChangeTracker.check.
+
+added - ids of the new records.
+removed - keys (see trackedTables) of the records that were deleted. The
+    records no longer exist, so these are the values shown in the views.
+updated - ids of the records marked with ChangeTracker.markUpdated.
+reload - True if the table changed in a way that couldn't be worked out
+    (e.g. the record with the highest id was deleted and its id reused) and
+    the whole table should be loaded again.
+"""
+
+
+def trackedTables():
+    """The tables shown in the views and the field used to identify a record.
+    
+    The key is the value in the id column of the views: the Run id and the
+    file name for the others.
+    
+    Return:
+        list - (model, key field) tuples.
+    """
+    return [
+        (pm.Run, pm.Run.id),
+        (pm.Dat, pm.Dat.name),
+        (pm.Ied, pm.Ied.name),
+        (pm.ModelFile, pm.ModelFile.name),
+    ]
+
+
+class ChangeTracker(object):
+    """Finds the records added to, or removed from, the tables in the views.
+    
+    See the module docs. The tracker must be used from the GUI thread, as
+    data_version and total_changes belong to that thread's connection.
+    """
+    
+    def __init__(self, tables=None):
+        """
+        Args:
+            tables=None(list): (model, key field) tuples of the tables to
+                track. If None trackedTables is used.
+        """
+        self.tables = tables if tables is not None else trackedTables()
+        self._path = None
+        self._version = None
+        self._marks = {}
+        self._keys = {}
+        self._updated = {}
+    
+    def reset(self):
+        """Take the current database contents as the starting point.
+        
+        Called when the views load all of the records.
+        """
+        pm.connectDB()
+        try:
+            self._path = pm.logit_db.database
+            self._version = self._dataVersion()
+            for model, key in self.tables:
+                name = model.__name__
+                self._marks[name] = self._highWaterMark(model)
+                self._keys[name] = self._readKeys(model, key)
+        finally:
+            pm.disconnectDB()
+        self._updated = {}
+    
+    def markUpdated(self, table, ids):
+        """Add records that have been changed, to be reported by check.
+        
+        Args:
+            table(str): the model name, e.g. 'Run'.
+            ids(list): the ids of the changed records.
+        """
+        self._updated.setdefault(table, set()).update(ids)
+    
+    def check(self):
+        """Find the changes since the last reset or check.
+        
+        Return:
+            dict - {model name: TableChanges} for the tables that changed, or
+                None if reset hasn't been called for the current database, in
+                which case everything should be loaded again.
+        """
+        if self._version is None or self._path != pm.logit_db.database:
+            return None
+        
+        changes = {}
+        pm.connectDB()
+        try:
+            version = self._dataVersion()
+            if self._sameVersion(version) and not self._updated:
+                return changes
+            self._version = version
+            for model, key in self.tables:
+                name = model.__name__
+                updated = sorted(self._updated.pop(name, []))
+                mark = self._highWaterMark(model)
+                added, removed, reload = [], [], False
+                if mark != self._marks[name]:
+                    added, removed, reload = self._tableChanges(model, key, mark)
+                    self._marks[name] = mark
+                if added or removed or updated or reload:
+                    changes[name] = TableChanges(added, removed, updated, reload)
+        finally:
+            pm.disconnectDB()
+        self._updated = {}
+        return changes
+    
+    def _tableChanges(self, model, key, mark):
+        """Find the records added to and removed from a table.
+        
+        Args:
+            model(LogitModel): the table.
+            key(Field): the key field of the table.
+            mark(tuple): the new _highWaterMark of the table.
+        
+        Return:
+            tuple(list, list, bool) - the added ids, the removed keys and
+                whether the table needs reloading.
+        """
+        name = model.__name__
+        keys = self._keys[name]
+        count, max_id, max_time = self._marks[name]
+        
+        # Records with a higher id than before are new. If that accounts for
+        # the new count and timestamp nothing else has changed
+        sql = 'SELECT id, "%s", timestamp FROM "%s" WHERE id > ?' % (
+            key.column_name, model._meta.table_name)
+        new = pm.logit_db.execute_sql(sql, (max_id or 0,)).fetchall()
+        times = [t for t in [max_time] + [r[2] for r in new] if t is not None]
+        latest = max(times) if times else None
+        if (count + len(new), latest) == (mark[0], mark[2]):
+            for id, value, time in new:
+                keys[id] = value
+            return [r[0] for r in new], [], False
+        
+        # Otherwise compare all of the ids. A reused id counts as a new record
+        # if it now has a different key
+        current = self._readKeys(model, key)
+        added = sorted(id for id, value in current.items() if keys.get(id, None) != value)
+        removed = [value for id, value in keys.items() if current.get(id, None) != value]
+        self._keys[name] = current
+        reload = not added and not removed
+        if reload:
+            logger.debug('Unable to find the changes to %s, reloading' % name)
+        return added, removed, reload
+    
+    def _sameVersion(self, version):
+        return version[0] is self._version[0] and version[1:] == self._version[1:]
+    
+    def _dataVersion(self):
+        """Return (connection, data_version, total_changes) for this thread."""
+        row = pm.logit_db.execute_sql(
+            'SELECT data_version, total_changes() FROM pragma_data_version').fetchone()
+        return (pm.logit_db.connection(), row[0], row[1])
+    
+    def _highWaterMark(self, model):
+        """Return (row count, max id, max timestamp) for a table."""
+        return tuple(pm.logit_db.execute_sql(
+            'SELECT COUNT(*), MAX(id), MAX(timestamp) FROM "%s"' % model._meta.table_name
+        ).fetchone())
+    
+    def _readKeys(self, model, key):
+        """Return {id: key} for all of the records in a table."""
+        cursor = pm.logit_db.execute_sql('SELECT id, "%s" FROM "%s"' % (
+            key.column_name, model._meta.table_name))
+        return dict(cursor.fetchall())
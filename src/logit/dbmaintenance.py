@@ -0,0 +1,345 @@
+"""
+###############################################################################
+
+ Name: LogIT (Logger for Isis and Tuflow)
+ Author: Duncan Runnacles
+ Copyright: (C) 2016 Duncan Runnacles
+ email: duncan.runnacles@thomasmackay.co.uk
+ License: GPL v2 - Available at: http://www.gnu.org/licenses/gpl-2.0.html
+
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 2 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License along
+ with this program; if not, write to the Free Software Foundation, Inc.,
+ 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+ Module:          dbmaintenance.py
+ Date:            18/10/2026
+ Author:          Duncan Runnacles
+ Since-Version:   2.0.0
+
+ Summary:
+     Health checks and maintenance for the log database.
+
+     healthReport collects everything in one go: the query planner 
+     statistics are refreshed (ANALYZE / PRAGMA optimize), the database is
+     checked with integrity_check and foreign_key_check, duplicate 
+     association records are found and the row counts, page usage and free
+     pages of each table are reported. formatReport turns it into text for
+     the user.
+     
+     removeDuplicateAssociations and vacuum fix the problems that are found.
+     vacuum uses incremental vacuuming, so after the first run free pages 
+     are returned to the file system without rebuilding the database.
+
+ UPDATES:
+
+
+ TODO:
+
+
+###############################################################################
+"""
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+from peewee import chunked, OperationalError
+
+import peeweemodels as pm
+
+
+AUTO_VACUUM_INCREMENTAL = 2
+""" PRAGMA auto_vacuum value for incremental vacuuming. """
+
+MAX_INTEGRITY_ERRORS = 100
+""" Maximum number of problems reported by integrityCheck. """
+
+DELETE_BATCH_SIZE = 500
+""" Number of duplicate records deleted in each statement. """
+
+
+def associationTables():
+    """The association tables and the pair of columns that should be unique.
+    
+    Return:
+        list - (model, (column name, column name)) tuples.
+    """
+    return [
+        (pm.ModelFile_SubFile, ('model_file_id', 'sub_file_id')),
+        (pm.Run_ModelFile, ('run_id', 'model_file_id')),
+        (pm.Run_SubFile, ('run_id', 'sub_file_id')),
+        (pm.Run_Ied, ('run_id', 'ied_id')),
+    ]
+
+
+def optimize(analyze=True):
+    """Update the statistics used by the SQLite query planner.
+    
+    Args:
+        analyze=True(bool): if True ANALYZE is run on the whole database.
+            Otherwise only PRAGMA optimize, which is quicker and only 
+            analyzes tables that look like they need it.
+    """
+    pm.connectDB()
+    try:
+        if analyze:
+            pm.logit_db.execute_sql('ANALYZE')
+        pm.logit_db.execute_sql('PRAGMA optimize')
+    finally:
+        pm.disconnectDB()
+
+
+def integrityCheck(max_errors=MAX_INTEGRITY_ERRORS):
+    """Check the database file for corruption with PRAGMA integrity_check.
+    
+    Args:
+        max_errors=MAX_INTEGRITY_ERRORS(int): the most problems to report.
+    
+    Return:
+        list - the problems found, empty if the database is ok.
+    """
+    pm.connectDB()
+    try:
+        rows = pm.logit_db.execute_sql('PRAGMA integrity_check(%d)' % max_errors).fetchall()
+    finally:
+        pm.disconnectDB()
+    problems = [r[0] for r in rows]
+    if problems == ['ok']: return []
+    return problems
+
+
+def foreignKeyCheck():
+    """Find records that reference a record that doesn't exist.
+    
+    Return:
+        list - (table, rowid, parent table, foreign key index) tuples.
+    """
+    pm.connectDB()
+    try:
+        rows = pm.logit_db.execute_sql('PRAGMA foreign_key_check').fetchall()
+    finally:
+        pm.disconnectDB()
+    return [tuple(r) for r in rows]
+
+
+def findDuplicateAssociations():
+    """Find association records that repeat an earlier record.
+    
+    A record is a duplicate if a record with a lower id has the same pair
+    of values (e.g. the same run_id and sub_file_id in Run_SubFile). The
+    lookup uses the index on the pair.
+    
+    Return:
+        dict - {table name: list of ids of the duplicate records}.
+    """
+    sql = ('SELECT x.id FROM {0} AS x WHERE EXISTS (SELECT 1 FROM {0} AS y '
+           'WHERE y.{1} = x.{1} AND y.{2} = x.{2} AND y.id < x.id) ORDER BY x.id')
+    results = {}
+    pm.connectDB()
+    try:
+        for table, (col1, col2) in associationTables():
+            cursor = pm.logit_db.execute_sql(sql.format(table._meta.table_name, col1, col2))
+            results[table.__name__] = [r[0] for r in cursor.fetchall()]
+    finally:
+        pm.disconnectDB()
+    return results
+
+
+def removeDuplicateAssociations(duplicates=None):
+    """Delete duplicate association records, keeping the first of each.
+    
+    The new_file flags are not changed, so peeweeviews.updateNewStatus 
+    should be run afterwards if any ModelFile_SubFile or Run_ModelFile
+    records are removed.
+    
+    Args:
+        duplicates=None(dict): the records to delete, as returned by 
+            findDuplicateAssociations. If None they are found first.
+    
+    Return:
+        dict - {table name: number of records deleted}.
+    """
+    removed = {}
+    with pm.batchSession():
+        if duplicates is None: duplicates = findDuplicateAssociations()
+        for table, cols in associationTables():
+            ids = duplicates.get(table.__name__, [])
+            for chunk in chunked(ids, DELETE_BATCH_SIZE):
+                table.delete().where(table.id << chunk).execute()
+            removed[table.__name__] = len(ids)
+            if ids:
+                logger.info('Removed %s duplicate %s records' % (len(ids), table.__name__))
+    return removed
+
+
+def databaseStats():
+    """Get the size and page usage of the database.
+    
+    Return:
+        dict - {'size': file size in bytes, 'page_size': bytes, 'page_count':
+            pages, 'free_pages': unused pages, 'auto_vacuum': mode}.
+    """
+    pm.connectDB()
+    try:
+        stats = {}
+        for key, pragma in [('page_size', 'page_size'), ('page_count', 'page_count'),
+                            ('free_pages', 'freelist_count'), ('auto_vacuum', 'auto_vacuum')]:
+            stats[key] = pm.logit_db.execute_sql('PRAGMA %s' % pragma).fetchone()[0]
+    finally:
+        pm.disconnectDB()
+    stats['size'] = os.path.getsize(pm.logit_db.database)
+    return stats
+
+
+def tableStats():
+    """Get the row count and pages used by each table and its indexes.
+    
+    The pages are read from the SQLite dbstat table. If SQLite was built 
+    without it the pages are None.
+    
+    Return:
+        list - {'table': name, 'rows': count, 'pages': table pages,
+            'index_pages': pages of the table's indexes} dicts.
+    """
+    pm.connectDB()
+    try:
+        pages = {}
+        try:
+            cursor = pm.logit_db.execute_sql(
+                'SELECT m.tbl_name, m.type, COUNT(*) FROM dbstat AS s '
+                'JOIN sqlite_master AS m ON m.name = s.name GROUP BY m.tbl_name, m.type')
+            for name, kind, count in cursor.fetchall():
+                pages.setdefault(name, {})[kind] = count
+        except OperationalError:
+            logger.info('SQLite dbstat is not available, table pages not reported')
+            pages = None
+        
+        stats = []
+        for table in pm.getAllTables():
+            name = table._meta.table_name
+            stat = {'table': table.__name__, 'rows': table.select().count(),
+                    'pages': None, 'index_pages': None}
+            if pages is not None:
+                stat['pages'] = pages.get(name, {}).get('table', 0)
+                stat['index_pages'] = pages.get(name, {}).get('index', 0)
+            stats.append(stat)
+    finally:
+        pm.disconnectDB()
+    return stats
+
+
+def vacuum(pages=0):
+    """Return free pages to the file system.
+    
+    If the database isn't set up for incremental vacuuming it's changed to
+    it and rebuilt with a full VACUUM. This is slow and needs the database 
+    to itself, but only has to be done once. After that PRAGMA 
+    incremental_vacuum frees pages without a rebuild.
+    
+    Args:
+        pages=0(int): the most free pages to remove. If < 1 they all are.
+    
+    Return:
+        int - the number of pages freed.
+    """
+    pm.connectDB()
+    try:
+        execute = pm.logit_db.execute_sql
+        before = execute('PRAGMA page_count').fetchone()[0]
+        if execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            logger.info('Changing database to incremental vacuum, running full VACUUM')
+            execute('PRAGMA auto_vacuum = %d' % AUTO_VACUUM_INCREMENTAL)
+            execute('VACUUM')
+        else:
+            # The pragma frees a page each step and returns no rows, so a 
+            # cursor only runs the first step. A script runs it to the end.
+            pm.logit_db.connection().executescript(
+                'PRAGMA incremental_vacuum(%d);' % max(0, pages))
+        after = execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        pm.disconnectDB()
+    logger.info('Vacuum freed %s pages' % (before - after))
+    return before - after
+
+
+def healthReport(analyze=True, progress_callback=None):
+    """Check the database and collect the results.
+    
+    Args:
+        analyze=True(bool): passed to optimize.
+        progress_callback=None(func): called with (value, maximum, message)
+            before each step.
+    
+    Return:
+        dict - {'database': databaseStats, 'tables': tableStats, 
+            'integrity': integrityCheck, 'foreign_keys': foreignKeyCheck,
+            'duplicates': findDuplicateAssociations}.
+    """
+    steps = [
+        ('optimize', 'Updating query statistics...', lambda: optimize(analyze)),
+        ('integrity', 'Checking database integrity...', integrityCheck),
+        ('foreign_keys', 'Checking foreign keys...', foreignKeyCheck),
+        ('duplicates', 'Finding duplicate records...', findDuplicateAssociations),
+        ('tables', 'Counting table rows and pages...', tableStats),
+        ('database', 'Checking free pages...', databaseStats),
+    ]
+    report = {}
+    for i, (key, message, func) in enumerate(steps):
+        if progress_callback is not None:
+            progress_callback(i, len(steps), message)
+        result = func()
+        if key != 'optimize': report[key] = result
+    return report
+
+
+def formatReport(report):
+    """Format a healthReport as text.
+    
+    Return:
+        tuple(str, str) - a summary of any problems and the full report.
+    """
+    db = report['database']
+    dup_count = sum(len(v) for v in report['duplicates'].values())
+    free_mb = db['free_pages'] * db['page_size'] / 1048576.0
+    
+    problems = []
+    if report['integrity']:
+        problems.append('Integrity check failed: %s problems' % len(report['integrity']))
+    if report['foreign_keys']:
+        problems.append('%s records with a missing foreign key (run Clean Database)' % 
+                        len(report['foreign_keys']))
+    if dup_count:
+        problems.append('%s duplicate association records' % dup_count)
+    if db['free_pages']:
+        problems.append('%s free pages (%.1f MB)' % (db['free_pages'], free_mb))
+    summary = '\n'.join(problems) if problems else 'No problems found.'
+    
+    lines = ['Database size: %.1f MB (%s pages of %s bytes, %s free)' % (
+        db['size'] / 1048576.0, db['page_count'], db['page_size'], db['free_pages'])]
+    lines.append('Incremental vacuum: %s' % (
+        'on' if db['auto_vacuum'] == AUTO_VACUUM_INCREMENTAL else 'off'))
+    lines.append('')
+    lines.append('%-20s %10s %10s %12s' % ('Table', 'Rows', 'Pages', 'Index pages'))
+    for t in report['tables']:
+        lines.append('%-20s %10s %10s %12s' % (
+            t['table'], t['rows'], '-' if t['pages'] is None else t['pages'],
+            '-' if t['index_pages'] is None else t['index_pages']))
+    lines.append('')
+    for name, ids in sorted(report['duplicates'].items()):
+        if ids: lines.append('Duplicate %s records: %s' % (name, len(ids)))
+    for r in report['foreign_keys'][:20]:
+        lines.append('Missing foreign key: %s rowid %s -> %s' % r[:3])
+    for p in report['integrity']:
+        lines.append('Integrity: %s' % p)
+    return summary, '\n'.join(lines)
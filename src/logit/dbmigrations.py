@@ -46,6 +46,8 @@ logger = logging.getLogger(__name__)
 
 import os
 import copy
+from contextlib import contextmanager
+from datetime import datetime as dt
 
 from peewee import *
 from playhouse.migrate import *
@@ -56,43 +58,628 @@ import peeweemodels as pm
 
 migrator = SqliteMigrator(pm.logit_db)
 
-def update21():
+BATCH_SIZE = 5000
+""" Number of key values covered by each batch of a BatchStep. """
+
+# The updates below use copies of the table definitions as they were in the
+# version they update to, rather than the peewee models, so that they still
+# give the same result once the models have moved on.
+
+V23_TABLES = {
+    'dat': (
+        ['name', 'amendments', 'comments', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "dat" ("name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"amendments" TEXT NOT NULL, "comments" TEXT NOT NULL, "timestamp" DATETIME NOT NULL)',
+        []),
+    'run': (
+        ['id', 'dat_id', 'run_hash', 'setup', 'comments', 'ief', 'tcf', 'initial_conditions', 
+         'isis_results', 'tuflow_results', 'estry_results', 'event_duration', 'run_status', 
+         'mb', 'modeller', 'isis_version', 'tuflow_version', 'event_name', 'ief_dir', 
+         'tcf_dir', 'log_dir', 'run_options', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "run" ("id" INTEGER NOT NULL PRIMARY KEY, "dat_id" VARCHAR(255), '
+        '"run_hash" VARCHAR(255) NOT NULL, "setup" TEXT NOT NULL, "comments" TEXT NOT NULL, '
+        '"ief" VARCHAR(255) NOT NULL, "tcf" VARCHAR(255) NOT NULL, '
+        '"initial_conditions" VARCHAR(255) NOT NULL, "isis_results" VARCHAR(255) NOT NULL, '
+        '"tuflow_results" VARCHAR(255) NOT NULL, "estry_results" VARCHAR(255) NOT NULL, '
+        '"event_duration" REAL NOT NULL, "run_status" VARCHAR(255) NOT NULL, "mb" REAL NOT NULL, '
+        '"modeller" VARCHAR(255) NOT NULL, "isis_version" VARCHAR(255) NOT NULL, '
+        '"tuflow_version" VARCHAR(255) NOT NULL, "event_name" VARCHAR(255) NOT NULL, '
+        '"ief_dir" VARCHAR(255) NOT NULL, "tcf_dir" VARCHAR(255) NOT NULL, '
+        '"log_dir" VARCHAR(255) NOT NULL, "run_options" VARCHAR(255) NOT NULL, '
+        '"timestamp" DATETIME NOT NULL, FOREIGN KEY ("dat_id") REFERENCES "dat" ("name"))',
+        ['CREATE INDEX IF NOT EXISTS "run_dat_id" ON "run" ("dat_id")',
+         'CREATE UNIQUE INDEX IF NOT EXISTS "run_run_hash" ON "run" ("run_hash")']),
+    'subfile': (
+        ['name', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "subfile" ("name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"timestamp" DATETIME NOT NULL)',
+        []),
+    'ied': (
+        ['name', 'ref', 'amendments', 'comments', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "ied" ("name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"ref" VARCHAR(255) NOT NULL, "amendments" TEXT NOT NULL, "comments" TEXT NOT NULL, '
+        '"timestamp" DATETIME NOT NULL)',
+        []),
+    'modelfile': (
+        ['name', 'model_type', 'comments', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "modelfile" ("name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"model_type" VARCHAR(255) NOT NULL, "comments" TEXT NOT NULL, "timestamp" DATETIME NOT NULL)',
+        ['CREATE INDEX IF NOT EXISTS "modelfile_model_type_name" ON "modelfile" ("model_type", "name")']),
+    'modelfile_subfile': (
+        ['id', 'model_file_id', 'sub_file_id', 'new_file', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "modelfile_subfile" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"model_file_id" VARCHAR(255) NOT NULL, "sub_file_id" VARCHAR(255) NOT NULL, '
+        '"new_file" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("model_file_id") REFERENCES "modelfile" ("name") ON DELETE CASCADE, '
+        'FOREIGN KEY ("sub_file_id") REFERENCES "subfile" ("name") ON DELETE CASCADE)',
+        ['CREATE INDEX IF NOT EXISTS "modelfile_subfile_model_file_id" ON "modelfile_subfile" ("model_file_id")',
+         'CREATE INDEX IF NOT EXISTS "modelfile_subfile_sub_file_id" ON "modelfile_subfile" ("sub_file_id")',
+         'CREATE INDEX IF NOT EXISTS "modelfile_subfile_model_file_id_sub_file_id" ON "modelfile_subfile" ("model_file_id", "sub_file_id")',
+         'CREATE INDEX IF NOT EXISTS "modelfile_subfile_sub_file_id_timestamp" ON "modelfile_subfile" ("sub_file_id", "timestamp")']),
+    'run_modelfile': (
+        ['id', 'run_id', 'model_file_id', 'new_file', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "run_modelfile" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"run_id" INTEGER NOT NULL, "model_file_id" VARCHAR(255) NOT NULL, '
+        '"new_file" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("run_id") REFERENCES "run" ("id") ON DELETE CASCADE, '
+        'FOREIGN KEY ("model_file_id") REFERENCES "modelfile" ("name") ON DELETE CASCADE)',
+        ['CREATE INDEX IF NOT EXISTS "run_modelfile_run_id" ON "run_modelfile" ("run_id")',
+         'CREATE INDEX IF NOT EXISTS "run_modelfile_model_file_id" ON "run_modelfile" ("model_file_id")',
+         'CREATE INDEX IF NOT EXISTS "run_modelfile_run_id_model_file_id" ON "run_modelfile" ("run_id", "model_file_id")',
+         'CREATE INDEX IF NOT EXISTS "run_modelfile_model_file_id_timestamp" ON "run_modelfile" ("model_file_id", "timestamp")']),
+    'run_subfile': (
+        ['id', 'run_id', 'sub_file_id', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "run_subfile" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"run_id" INTEGER NOT NULL, "sub_file_id" VARCHAR(255) NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("run_id") REFERENCES "run" ("id") ON DELETE CASCADE, '
+        'FOREIGN KEY ("sub_file_id") REFERENCES "subfile" ("name") ON DELETE CASCADE)',
+        ['CREATE INDEX IF NOT EXISTS "run_subfile_run_id" ON "run_subfile" ("run_id")',
+         'CREATE INDEX IF NOT EXISTS "run_subfile_sub_file_id" ON "run_subfile" ("sub_file_id")',
+         'CREATE INDEX IF NOT EXISTS "run_subfile_run_id_sub_file_id" ON "run_subfile" ("run_id", "sub_file_id")']),
+    'run_ied': (
+        ['id', 'run_id', 'ied_id', 'timestamp'],
+        'CREATE TABLE IF NOT EXISTS "run_ied" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"run_id" INTEGER NOT NULL, "ied_id" VARCHAR(255) NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("run_id") REFERENCES "run" ("id") ON DELETE CASCADE, '
+        'FOREIGN KEY ("ied_id") REFERENCES "ied" ("name") ON DELETE CASCADE)',
+        ['CREATE INDEX IF NOT EXISTS "run_ied_run_id" ON "run_ied" ("run_id")',
+         'CREATE INDEX IF NOT EXISTS "run_ied_ied_id" ON "run_ied" ("ied_id")',
+         'CREATE INDEX IF NOT EXISTS "run_ied_run_id_ied_id" ON "run_ied" ("run_id", "ied_id")']),
+}
+""" {table name: (columns, create table sql, create index sql's)} of all the
+tables as they are in version 23.
+"""
+
+V24_FILE_TABLES = {
+    'dat': (
+        ['amendments', 'comments', 'timestamp'],
+        'CREATE TABLE "dat_new" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, '
+        '"name_key" VARCHAR(255) NOT NULL, "amendments" TEXT NOT NULL, "comments" TEXT NOT NULL, '
+        '"timestamp" DATETIME NOT NULL)',
+        ['CREATE UNIQUE INDEX "dat_name" ON "dat" ("name")',
+         'CREATE INDEX "dat_name_key" ON "dat" ("name_key")']),
+    'ied': (
+        ['ref', 'amendments', 'comments', 'timestamp'],
+        'CREATE TABLE "ied_new" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, '
+        '"name_key" VARCHAR(255) NOT NULL, "ref" VARCHAR(255) NOT NULL, "amendments" TEXT NOT NULL, '
+        '"comments" TEXT NOT NULL, "timestamp" DATETIME NOT NULL)',
+        ['CREATE UNIQUE INDEX "ied_name" ON "ied" ("name")',
+         'CREATE INDEX "ied_name_key" ON "ied" ("name_key")']),
+    'modelfile': (
+        ['model_type', 'comments', 'timestamp'],
+        'CREATE TABLE "modelfile_new" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, '
+        '"name_key" VARCHAR(255) NOT NULL, "model_type" VARCHAR(255) NOT NULL, '
+        '"comments" TEXT NOT NULL, "timestamp" DATETIME NOT NULL)',
+        ['CREATE UNIQUE INDEX "modelfile_name" ON "modelfile" ("name")',
+         'CREATE INDEX "modelfile_name_key" ON "modelfile" ("name_key")',
+         'CREATE INDEX "modelfile_model_type_name" ON "modelfile" ("model_type", "name")']),
+    'subfile': (
+        ['timestamp'],
+        'CREATE TABLE "subfile_new" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, '
+        '"name_key" VARCHAR(255) NOT NULL, "timestamp" DATETIME NOT NULL)',
+        ['CREATE UNIQUE INDEX "subfile_name" ON "subfile" ("name")',
+         'CREATE INDEX "subfile_name_key" ON "subfile" ("name_key")']),
+}
+""" {table name: (columns other than id/name/name_key, create table sql, 
+create index sql's)} of the file tables in version 24. The table is created 
+as <name>_new and renamed once the rows have been copied.
+"""
+
+V24_LINK_TABLES = {
+    'modelfile_subfile': (
+        ['new_file', 'timestamp'],
+        [('model_file_id', 'modelfile'), ('sub_file_id', 'subfile')],
+        'CREATE TABLE "modelfile_subfile_link" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"model_file_id" INTEGER NOT NULL, "sub_file_id" INTEGER NOT NULL, '
+        '"new_file" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("model_file_id") REFERENCES "modelfile" ("id") ON DELETE CASCADE, '
+        'FOREIGN KEY ("sub_file_id") REFERENCES "subfile" ("id") ON DELETE CASCADE)',
+        ['CREATE INDEX "modelfile_subfile_model_file_id" ON "modelfile_subfile_link" ("model_file_id")',
+         'CREATE INDEX "modelfile_subfile_sub_file_id" ON "modelfile_subfile_link" ("sub_file_id")',
+         'CREATE INDEX "modelfile_subfile_model_file_id_sub_file_id" ON "modelfile_subfile_link" ("model_file_id", "sub_file_id")',
+         'CREATE INDEX "modelfile_subfile_sub_file_id_timestamp" ON "modelfile_subfile_link" ("sub_file_id", "timestamp")']),
+    'run_modelfile': (
+        ['run_id', 'new_file', 'timestamp'],
+        [('model_file_id', 'modelfile')],
+        'CREATE TABLE "run_modelfile_link" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"run_id" INTEGER NOT NULL, "model_file_id" INTEGER NOT NULL, '
+        '"new_file" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("run_id") REFERENCES "run" ("id") ON DELETE CASCADE, '
+        'FOREIGN KEY ("model_file_id") REFERENCES "modelfile" ("id") ON DELETE CASCADE)',
+        ['CREATE INDEX "run_modelfile_run_id" ON "run_modelfile_link" ("run_id")',
+         'CREATE INDEX "run_modelfile_model_file_id" ON "run_modelfile_link" ("model_file_id")',
+         'CREATE INDEX "run_modelfile_run_id_model_file_id" ON "run_modelfile_link" ("run_id", "model_file_id")',
+         'CREATE INDEX "run_modelfile_model_file_id_timestamp" ON "run_modelfile_link" ("model_file_id", "timestamp")']),
+    'run_subfile': (
+        ['run_id', 'timestamp'],
+        [('sub_file_id', 'subfile')],
+        'CREATE TABLE "run_subfile_link" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"run_id" INTEGER NOT NULL, "sub_file_id" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("run_id") REFERENCES "run" ("id") ON DELETE CASCADE, '
+        'FOREIGN KEY ("sub_file_id") REFERENCES "subfile" ("id") ON DELETE CASCADE)',
+        ['CREATE INDEX "run_subfile_run_id" ON "run_subfile_link" ("run_id")',
+         'CREATE INDEX "run_subfile_sub_file_id" ON "run_subfile_link" ("sub_file_id")',
+         'CREATE INDEX "run_subfile_run_id_sub_file_id" ON "run_subfile_link" ("run_id", "sub_file_id")']),
+    'run_ied': (
+        ['run_id', 'timestamp'],
+        [('ied_id', 'ied')],
+        'CREATE TABLE "run_ied_link" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"run_id" INTEGER NOT NULL, "ied_id" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, '
+        'FOREIGN KEY ("run_id") REFERENCES "run" ("id") ON DELETE CASCADE, '
+        'FOREIGN KEY ("ied_id") REFERENCES "ied" ("id") ON DELETE CASCADE)',
+        ['CREATE INDEX "run_ied_run_id" ON "run_ied_link" ("run_id")',
+         'CREATE INDEX "run_ied_ied_id" ON "run_ied_link" ("ied_id")',
+         'CREATE INDEX "run_ied_run_id_ied_id" ON "run_ied_link" ("run_id", "ied_id")']),
+}
+""" {table name: (copied columns, [(file column, file table)], create table
+sql, create index sql's)} of the association tables in version 24. The 
+tables are renamed to <name>_link and the old names used for the 
+peeweemodels.COMPAT_VIEWS.
+"""
+
+
+class MigrationStep(pm.LogitModel):
+    """Record of a migration step that has been started.
+    
+    last_key is the high-water mark of a BatchStep: every key up to and
+    including it has been migrated.
+    """
+    name = CharField(primary_key=True)
+    last_key = IntegerField(null=True)
+    completed = BooleanField(default=False)
+    timestamp = DateTimeField(default=dt.now)
+    
+    class Meta:
+        table_name = 'logit_migration'
+
+
+@contextmanager
+def _stepTransaction(foreign_keys=True):
+    """A transaction for part of a migration step.
+    
+    Args:
+        foreign_keys=True(bool): if False foreign key checks are turned off
+            for the transaction. SQLite ignores the pragma inside a 
+            transaction, so it's set before the transaction starts.
+    """
+    pm.connectDB()
+    if not foreign_keys:
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = OFF')
+    try:
+        with pm.batchSession():
+            yield
+    finally:
+        if not foreign_keys and not pm.logit_db.is_closed():
+            pm.logit_db.execute_sql('PRAGMA foreign_keys = ON')
+        pm.disconnectDB()
+
+
+class Step(object):
+    """A single step of a migration.
+    
+    Each step records its progress in the MigrationStep table in the same 
+    transaction as the changes it makes, so a migration that is 
+    interrupted can be run again and will carry on from where it stopped.
+    """
+    
+    def __init__(self, name, foreign_keys=True):
+        """
+        Args:
+            name(str): name of the step, unique within the migration.
+            foreign_keys=True(bool): if False foreign key checks are turned
+                off while the step runs.
+        """
+        self.name = name
+        self.foreign_keys = foreign_keys
+    
+    def run(self, record, progress_callback=None):
+        """Make the changes and set record.completed.
+        
+        Args:
+            record(MigrationStep): the record for the step.
+            progress_callback=None(func): called with (value, maximum, 
+                message) as the step progresses.
+        """
+        raise NotImplementedError
+    
+    def _complete(self, record):
+        record.completed = True
+        record.timestamp = dt.now()
+        record.save()
+
+
+class FuncStep(Step):
+    """Calls a function in a single transaction.
+    
+    For schema changes (creating tables and indexes, adding columns) and 
+    other steps that are quick or can't be split up.
+    """
+    
+    def __init__(self, name, func, foreign_keys=True):
+        """
+        Args:
+            func(func): called with no arguments to make the changes.
+        """
+        super(FuncStep, self).__init__(name, foreign_keys)
+        self.func = func
+    
+    def run(self, record, progress_callback=None):
+        with _stepTransaction(self.foreign_keys):
+            self.func()
+            self._complete(record)
+
+
+class BatchStep(Step):
+    """Runs a set-based SQL statement over ranges of an integer key.
+    
+    The sql has two parameters, the start (exclusive) and end (inclusive) 
+    of the key range to migrate. E.g.
+        INSERT INTO run_subfile (run_id, sub_file_id, timestamp) 
+        SELECT ... FROM run_modelfile AS rm ... 
+        WHERE rm.run_id > ? AND rm.run_id <= ?
+    
+    The keys from 0 to the value returned by max_key_sql are covered in 
+    ranges of batch_size, each in its own transaction along with the new
+    high-water mark, so the memory used and the time the database is locked
+    for are bounded and an interrupted step restarts after the last batch
+    that was committed.
+    """
+    
+    def __init__(self, name, sql, max_key_sql, batch_size=None, foreign_keys=True):
+        """
+        Args:
+            sql(str): the statement to run for each batch.
+            max_key_sql(str): query returning the largest key to migrate.
+            batch_size=None(int): the range of keys in each batch. If None
+                BATCH_SIZE is used.
+        """
+        super(BatchStep, self).__init__(name, foreign_keys)
+        self.sql = sql
+        self.max_key_sql = max_key_sql
+        self.batch_size = batch_size
+    
+    def run(self, record, progress_callback=None):
+        batch_size = self.batch_size or BATCH_SIZE
+        pm.connectDB()
+        try:
+            max_key = pm.logit_db.execute_sql(self.max_key_sql).fetchone()[0] or 0
+        finally:
+            pm.disconnectDB()
+        
+        last = record.last_key or 0
+        while last < max_key:
+            if progress_callback is not None:
+                progress_callback(last, max_key, '%s: %s of %s' % (self.name, last, max_key))
+            end = min(last + batch_size, max_key)
+            with _stepTransaction(self.foreign_keys):
+                pm.logit_db.execute_sql(self.sql, (last, end))
+                record.last_key = end
+                record.save()
+            last = end
+        with _stepTransaction(self.foreign_keys):
+            self._complete(record)
+
+
+def runSteps(migration, steps, progress_callback=None):
+    """Run the steps of a migration that haven't been completed yet.
+    
+    Args:
+        migration(str): name of the migration, e.g. 'update21'. Used with 
+            the step names to record progress in the MigrationStep table.
+        steps(list): the Step's to run, in order.
+        progress_callback=None(func): called with (value, maximum, message)
+            before each step and by the steps as they progress.
+    """
+    pm.createTable(MigrationStep)
+    for i, step in enumerate(steps):
+        name = '%s.%s' % (migration, step.name)
+        pm.connectDB()
+        try:
+            record, created = MigrationStep.get_or_create(name=name)
+        finally:
+            pm.disconnectDB()
+        if record.completed:
+            logger.info('Migration step already completed: %s' % name)
+            continue
+        if progress_callback is not None:
+            progress_callback(i, len(steps), 'Running %s' % name)
+        logger.info('Running migration step: %s' % name)
+        step.run(record, progress_callback)
+
+
+def update21(progress_callback=None):
     """Run the updates for database version 21.
     
     - Adds the Ied, Run_Ied and Run_SubFile tables.
     - Adds the initial_conditions field to the Run table.
-    - Populates the Run_Subfile table with values.
+    - Populates the Run_Subfile table with a record for each SubFile used
+      by the ModelFile's of each Run.
     """
     logger.info("\n*** Running migration 'update21' ***\n")
+    
+    def addInitialConditions():
+        icfield = CharField(default='')
+        migrate(migrator.add_column("Run", "initial_conditions", icfield))
+    
+    def createTables():
+        for name in ['ied', 'run_ied', 'run_subfile']:
+            columns, table_sql, index_sql = V23_TABLES[name]
+            for sql in [table_sql] + index_sql:
+                pm.logit_db.execute_sql(sql)
+    
+    # Only the SubFile's that exist are added and the records get the current
+    # local time, like the Run_SubFile timestamp default
+    populate = (
+        'INSERT INTO "run_subfile" (run_id, sub_file_id, timestamp) '
+        "SELECT rm.run_id, ms.sub_file_id, strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') "
+        'FROM "run_modelfile" AS rm '
+        'JOIN "modelfile" AS m ON m.name = rm.model_file_id '
+        'JOIN "modelfile_subfile" AS ms ON ms.model_file_id = m.name '
+        'JOIN "subfile" AS s ON s.name = ms.sub_file_id '
+        'WHERE rm.run_id > ? AND rm.run_id <= ? ORDER BY rm.run_id'
+    )
+    runSteps('update21', [
+        FuncStep('create_tables', createTables),
+        # The column is added by rebuilding the Run table, so foreign key
+        # checks are off or dropping the old table would delete the runs'
+        # association records
+        FuncStep('add_initial_conditions', addInitialConditions, False),
+        BatchStep('populate_run_subfile', populate, 
+                  'SELECT MAX(run_id) FROM "run_modelfile"'),
+    ], progress_callback)
 
-    logger.info("Creating Ied, Run_Ied and Run_SubFile tables...")
-    pm.createTable(pm.Ied)
-    pm.createTable(pm.Run_Ied)
-    pm.createTable(pm.Run_SubFile)
-    
-    logger.info("Adding initial_conditions field to Run table...")
-    icfield = CharField(default='')
-    migrate(migrator.add_column("Run", "initial_conditions", icfield))
-    
-    logger.info("Creating entries for Run_Subfile table...")
-    
-    saved_data = []
-    for r in pm.Run.select():
-        query = (pm.ModelFile_SubFile
-                 .select(pm.ModelFile_SubFile, pm.ModelFile, pm.SubFile, pm.Run_ModelFile)
-                 .join(pm.SubFile)
-                 .switch(pm.ModelFile_SubFile)
-                 .join(pm.ModelFile)
-                 .join(pm.Run_ModelFile)
-                 )
-        query = query.where(pm.Run_ModelFile.run_id == r.id)
-        
-        for q in query:
-            saved_data.append({'run_id': r.id, 'sub_file_id': q.sub_file.name})
+
+def update22(progress_callback=None):
+    """Run the updates for database version 22.
+    
+    - Adds composite indexes to the ModelFile and association tables:
+        ModelFile(model_type, name)
+        ModelFile_SubFile(model_file, sub_file) and (sub_file, timestamp)
+        Run_ModelFile(run, model_file) and (model_file, timestamp)
+        Run_SubFile(run, sub_file)
+        Run_Ied(run, ied)
+    
+    Any of the indexes that don't exist yet are created.
+    """
+    logger.info("\n*** Running migration 'update22' ***\n")
+    
+    def createIndexes(name):
+        for sql in V23_TABLES[name][2]:
+            pm.logit_db.execute_sql(sql)
     
-    with pm.logit_db.atomic():
-        for data_dict in saved_data:
-            pm.Run_SubFile.create(**data_dict)
+    tables = ['modelfile', 'modelfile_subfile', 'run_modelfile', 'run_subfile', 'run_ied']
+    runSteps('update22', [
+        FuncStep('indexes_%s' % name, lambda name=name: createIndexes(name))
+        for name in tables
+    ], progress_callback)
+
+
+def update23(progress_callback=None):
+    """Run the updates for database version 23.
+    
+    - Rebuilds the ModelFile_SubFile, Run_ModelFile, Run_SubFile and Run_Ied
+      tables so that their foreign keys are declared ON DELETE CASCADE.
+    
+    SQLite can't alter a foreign key constraint so each table is renamed,
+    created again and the rows copied across (see rebuildTableSteps). 
+    Foreign key checks are turned off while this happens so that any 
+    existing records with broken references are kept.
+    """
+    logger.info("\n*** Running migration 'update23' ***\n")
+    
+    steps = []
+    for name in ['modelfile_subfile', 'run_modelfile', 'run_subfile', 'run_ied']:
+        steps.extend(rebuildTableSteps(name, *V23_TABLES[name]))
+    runSteps('update23', steps, progress_callback)
+
+
+def update24(progress_callback=None):
+    """Run the updates for database version 24.
+    
+    - Gives the Dat, Ied, ModelFile and SubFile tables an integer id primary
+      key, a unique index on the name and a name_key field holding the 
+      case-normalised name (see peeweemodels.nameKey).
+    - Moves the association tables to <name>_link tables that reference 
+      the files by id instead of name.
+    - Replaces the old association tables with the 
+      peeweemodels.COMPAT_VIEWS, so existing query scripts still work.
+    
+    The file tables are rebuilt first, keeping the rowid of each record as
+    its new id. The association rows are then copied across with the names
+    looked up in the rebuilt file tables. Association records that point to
+    a file that doesn't exist can't be given an id and are dropped. Run.dat
+    still references the Dat.name, so the Run table isn't changed.
+    
+    All of the copying is done with set based statements in batches of the
+    key (see BatchStep), with foreign key checks turned off.
+    """
+    logger.info("\n*** Running migration 'update24' ***\n")
+    
+    steps = []
+    for name in ['dat', 'ied', 'modelfile', 'subfile']:
+        steps.extend(fileTableSteps(name, *V24_FILE_TABLES[name]))
+    for name in ['modelfile_subfile', 'run_modelfile', 'run_subfile', 'run_ied']:
+        steps.extend(linkTableSteps(name, *V24_LINK_TABLES[name]))
+    runSteps('update24', steps, progress_callback)
+
+
+def _executeAll(sqls):
+    for sql in sqls:
+        pm.logit_db.execute_sql(sql)
+
+
+def fileTableSteps(name, columns, table_sql, index_sql, batch_size=None):
+    """Get the steps to give one of the file tables an integer id (update24).
+    
+    The rows are copied to a new table in batches of the old rowid, which 
+    becomes the id, and name_key is filled in with logit_name_key (see 
+    peeweemodels.nameKey). The old table is then dropped, the new one 
+    renamed and its indexes created.
+    
+    Args:
+        name(str): the table name.
+        columns(list): the columns to copy, other than the name.
+        table_sql(str): creates the new table, called <name>_new.
+        index_sql(list): creates the indexes on the renamed table.
+        batch_size=None(int): passed to the BatchStep that copies the rows.
+    
+    Return:
+        list - the Step's for runSteps.
+    """
+    new_name = name + '_new'
+    columns = ', '.join(['"%s"' % c for c in columns])
+    
+    def finish():
+        pm.logit_db.execute_sql('DROP TABLE "%s"' % name)
+        pm.logit_db.execute_sql('ALTER TABLE "%s" RENAME TO "%s"' % (new_name, name))
+        _executeAll(index_sql)
+    
+    copy_sql = ('INSERT INTO "{new}" (id, name, name_key, {cols}) '
+                'SELECT rowid, name, logit_name_key(name), {cols} FROM "{old}" '
+                'WHERE rowid > ? AND rowid <= ?').format(new=new_name, old=name, cols=columns)
+    return [
+        FuncStep('%s_start' % name, lambda: _executeAll([table_sql]), False),
+        BatchStep('%s_copy' % name, copy_sql, 
+                  'SELECT MAX(rowid) FROM "%s"' % name, batch_size, False),
+        FuncStep('%s_finish' % name, finish, False),
+    ]
+
+
+def linkTableSteps(name, columns, files, table_sql, index_sql, batch_size=None):
+    """Get the steps to move an association table to file ids (update24).
+    
+    The rows are copied to the <name>_link table in batches of the id, 
+    joining each file column to the (already rebuilt) file table to get the
+    file id. The old table is then dropped, the indexes of the new table 
+    created and the compatibility view created with the old name.
+    
+    Args:
+        name(str): the old table name.
+        columns(list): the columns copied as they are, other than the id.
+        files(list): (column, file table) tuples for the columns that 
+            change from the file name to the file id.
+        table_sql(str): creates the <name>_link table.
+        index_sql(list): creates the indexes on the <name>_link table.
+        batch_size=None(int): passed to the BatchStep that copies the rows.
+    
+    Return:
+        list - the Step's for runSteps.
+    """
+    link_name = name + '_link'
+    
+    def finish():
+        pm.logit_db.execute_sql('DROP TABLE "%s"' % name)
+        _executeAll(index_sql)
+        pm.logit_db.execute_sql('CREATE VIEW "%s" AS %s' % (name, pm.COMPAT_VIEWS[name]))
+    
+    to_columns = ['id'] + columns + [f[0] for f in files]
+    from_columns = ['x.id'] + ['x.%s' % c for c in columns] + ['f%s.id' % i for i in range(len(files))]
+    joins = ' '.join(['INNER JOIN "{1}" AS f{0} ON f{0}.name = x.{2}'.format(i, f[1], f[0]) 
+                      for i, f in enumerate(files)])
+    copy_sql = ('INSERT INTO "{new}" ({to}) SELECT {frm} FROM "{old}" AS x {joins} '
+                'WHERE x.id > ? AND x.id <= ?').format(
+        new=link_name, old=name, to=', '.join(to_columns), frm=', '.join(from_columns), 
+        joins=joins)
+    return [
+        FuncStep('%s_start' % link_name, lambda: _executeAll([table_sql]), False),
+        BatchStep('%s_copy' % link_name, copy_sql, 
+                  'SELECT MAX(id) FROM "%s"' % name, batch_size, False),
+        FuncStep('%s_finish' % link_name, finish, False),
+    ]
+
+
+def rebuildTableSteps(name, columns, table_sql, index_sql, batch_size=None):
+    """Get the steps to recreate a table, keeping all the rows.
+    
+    The table is renamed and created again without its indexes, the rows 
+    are copied across in batches of the integer primary key and then the 
+    indexes are created and the old table dropped. Foreign key checks are
+    off throughout.
+    
+    Args:
+        name(str): the table to rebuild. Must have an integer id primary 
+            key.
+        columns(list): the columns to copy.
+        table_sql(str): creates the table.
+        index_sql(list): creates the indexes on the table.
+        batch_size=None(int): passed to the BatchStep that copies the rows.
+    
+    Return:
+        list - the Step's for runSteps.
+    """
+    old_name = name + '_old'
+    key = 'id'
+    columns = ', '.join(['"%s"' % c for c in columns])
+    
+    def start():
+        cursor = pm.logit_db.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+            "AND sql IS NOT NULL", (name,)
+        )
+        for index in [r[0] for r in cursor.fetchall()]:
+            pm.logit_db.execute_sql('DROP INDEX "%s"' % index)
+        pm.logit_db.execute_sql('ALTER TABLE "%s" RENAME TO "%s"' % (name, old_name))
+        pm.logit_db.execute_sql(table_sql)
+    
+    def finish():
+        _executeAll(index_sql)
+        pm.logit_db.execute_sql('DROP TABLE "%s"' % old_name)
+    
+    copy_sql = 'INSERT INTO "%s" (%s) SELECT %s FROM "%s" WHERE "%s" > ? AND "%s" <= ?' % (
+        name, columns, columns, old_name, key, key)
+    return [
+        FuncStep('rebuild_%s_start' % name, start, False),
+        BatchStep('rebuild_%s_copy' % name, copy_sql, 
+                  'SELECT MAX("%s") FROM "%s"' % (key, old_name), batch_size, False),
+        FuncStep('rebuild_%s_finish' % name, finish, False),
+    ]
+
+
+def migrateDatabase(db_path, progress_callback=None):
+    """Update a database to the latest version.
+    
+    Runs the updates returned by getRequiredUpdates and sets the database
+    version number. The database must already be loaded (pm.openSession).
+    If an update fails or is stopped part way through the database keeps
+    its old version number and the completed steps, so running this again
+    carries on from the last step (or batch) that was committed.
+    
+    Args:
+        db_path(str): path of the database to update.
+        progress_callback=None(func): called with (value, maximum, message)
+            as the updates progress.
+    
+    Return:
+        list - the update functions that were run, or the 
+            pm.DATABASE_VERSION_* status if the database can't be updated.
+    """
+    updates = getRequiredUpdates(db_path)
+    if not isinstance(updates, list):
+        return updates
+    for func in updates:
+        func(progress_callback)
+    pm.createNewDb(db_path)
+    return updates
 
     
 def getRequiredUpdates(db_path):
@@ -116,6 +703,12 @@ def getRequiredUpdates(db_path):
     required = []
     if db_version < 21:
         required.append(update21)
+    if db_version < 22:
+        required.append(update22)
+    if db_version < 23:
+        required.append(update23)
+    if db_version < 24:
+        required.append(update24)
     
     return required
     
@@ -0,0 +1,380 @@
+"""
+###############################################################################
+
+ Name: LogIT (Logger for Isis and Tuflow)
+ Author: Duncan Runnacles
+ Copyright: (C) 2016 Duncan Runnacles
+ email: duncan.runnacles@thomasmackay.co.uk
+ License: GPL v2 - Available at: http://www.gnu.org/licenses/gpl-2.0.html
+
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 2 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License along
+ with this program; if not, write to the Free Software Foundation, Inc.,
+ 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+ Module:          ingest.py
+ Date:            18/10/2026
+ Author:          Duncan Runnacles
+ Since-Version:   2.0.0
+
+ Summary:
+     Streaming pipeline for loading models and adding them to the database.
+
+     The pipeline has three stages:
+         parse - the models are loaded in worker processes by
+             LogBuilder.loadModels, with a limited number queued at a time.
+         check - each loaded model is checked (e.g. that it's not already in
+             the database) in the calling thread.
+         write - models that pass the checks are put on a bounded write
+             queue and a single writer thread adds them to the database in
+             batches, one transaction per batch.
+
+     Each queue is bounded, so a stage that gets ahead waits for the next
+     one and only a few models are held in memory however long the list of
+     models is. The writer runs alongside the other stages, so models are
+     loaded while the previous batch is being written.
+
+     Each stage keeps a StageStats with the number of items it has done,
+     the time spent working and the depth of its queue, for tuning the
+     queue and batch sizes.
+
+     An IngestJournal kept next to the database records the models in a
+     batch and the ones that have been committed, so that a batch that was
+     interrupted can be resumed without logging them again.
+
+ UPDATES:
+
+
+ TODO:
+
+
+###############################################################################
+"""
+import os
+import json
+import queue
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+import LogBuilder
+import peeweemodels as pm
+
+
+DEFAULT_BATCH_SIZE = 20
+""" Number of models added to the database in each transaction. """
+
+JOURNAL_SUFFIX = '.ingest'
+""" Added to the database path to get the IngestJournal path. """
+
+JOURNAL_VERSION = 1
+
+_END = object()
+""" Put on the write queue to stop the writer thread. """
+
+
+class StageStats(object):
+    """Counters for one stage of an IngestPipeline."""
+
+    def __init__(self, name, max_depth=0):
+        """
+        Args:
+            name(str): the name of the stage.
+            max_depth=0(int): the size of the queue feeding the stage.
+        """
+        self.name = name
+        self.max_depth = max_depth
+        self.count = 0
+        self.busy = 0.0
+        self.depth = 0
+        self.peak_depth = 0
+        self._start = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, count=1, busy=0.0):
+        """Record items completed by the stage.
+
+        Args:
+            count=1(int): the number of items completed.
+            busy=0.0(float): seconds spent working on them.
+        """
+        with self._lock:
+            self.count += count
+            self.busy += busy
+
+    def setDepth(self, depth):
+        """Record the number of items waiting in the queue for the stage."""
+        self.depth = depth
+        self.peak_depth = max(self.peak_depth, depth)
+
+    def rate(self):
+        """Return the number of items completed per second."""
+        elapsed = time.time() - self._start
+        if elapsed <= 0: return 0.0
+        return self.count / elapsed
+
+    def summary(self):
+        """Return the counters as text, e.g. 'write: 40 (2.1/s, queue 3/40)'."""
+        return '%s: %s (%.1f/s, queue %s/%s)' % (
+            self.name, self.count, self.rate(), self.depth, self.max_depth)
+
+
+class IngestPipeline(object):
+    """Loads models, checks them and writes them to the database.
+
+    Example:
+        pipeline = ingest.IngestPipeline(
+            lambda batch: job.write(pv.addLogEntries, batch), batch_size=20)
+        logged = pipeline.run(model_paths, run_options, checkFunc, workers=4)
+    """
+
+    def __init__(self, write_func, batch_size=DEFAULT_BATCH_SIZE,
+                 parse_queue_size=None, write_queue_size=None):
+        """
+        Args:
+            write_func(func): called with a list of the models to write in
+                a single transaction (e.g. peeweeviews.addLogEntries).
+            batch_size=DEFAULT_BATCH_SIZE(int): the number of models in each
+                call to write_func.
+            parse_queue_size=None(int): the number of models queued in the
+                worker processes. If None twice the number of workers.
+            write_queue_size=None(int): the number of checked models that
+                can wait to be written. If None twice batch_size.
+        """
+        self.write_func = write_func
+        self.batch_size = max(1, batch_size)
+        self.parse_queue_size = parse_queue_size
+        if write_queue_size is None: write_queue_size = self.batch_size * 2
+        self.write_queue_size = max(1, write_queue_size)
+        self.parse_stats = StageStats('parse')
+        self.check_stats = StageStats('check')
+        self.write_stats = StageStats('write', self.write_queue_size)
+        self.written = 0
+        self.write_error = None
+        self._write_queue = None
+
+    def stats(self):
+        """Return the StageStats for the parse, check and write stages."""
+        return [self.parse_stats, self.check_stats, self.write_stats]
+
+    def summary(self):
+        """Return the stage counters as a single line of text."""
+        return ', '.join(s.summary() for s in self.stats())
+
+    def run(self, model_paths, run_options, check_func, workers=1, cancelled=None,
+            progress_callback=None):
+        """Load, check and write a list of models.
+
+        Models are checked and written in the order of model_paths. If
+        cancelled returns True no more models are loaded, but those already
+        checked are still written.
+
+        Args:
+            model_paths(list): the .ief/.tcf file paths to load.
+            run_options(str): the run options (~s1~ etc) to load them with.
+            check_func(func): called with the values yielded by
+                LogBuilder.loadModels (path, all_logs, error, missing).
+                Returns the AllLogs to write, or None to skip the model.
+            workers=1(int): the number of processes to load the models with.
+            cancelled=None(func): returns True if the pipeline should stop.
+            progress_callback=None(func): called with (value, maximum,
+                message) after each model is checked.
+
+        Return:
+            int - the number of models written.
+
+        Raises:
+            any exception raised by write_func, after the models already
+                checked have been handled.
+        """
+        def isCancelled():
+            return cancelled is not None and cancelled()
+
+        total = len(model_paths)
+        self._write_queue = queue.Queue(self.write_queue_size)
+        parse_queue_size = self.parse_queue_size or max(1, workers) * 2
+        self.parse_stats.max_depth = parse_queue_size
+        writer = threading.Thread(target=self._writeLoop, name='logit-ingest-writer')
+        writer.daemon = True
+        writer.start()
+
+        loaded = LogBuilder.loadModels(model_paths, run_options, workers, isCancelled,
+                                       parse_queue_size, self.parse_stats)
+        try:
+            for i, result in enumerate(loaded):
+                if isCancelled() or self.write_error is not None: break
+                start = time.time()
+                all_logs = check_func(*result)
+                self.check_stats.add(1, time.time() - start)
+                if all_logs is not None:
+                    # Blocks while the writer is behind
+                    self._write_queue.put(all_logs)
+                    self.write_stats.setDepth(self._write_queue.qsize())
+                if (i + 1) % self.batch_size == 0:
+                    logger.debug('Ingest pipeline: ' + self.summary())
+                if progress_callback is not None:
+                    progress_callback(i + 1, total, 'Logging model %s of %s' % (
+                        min(i + 2, total), total))
+        finally:
+            # Stops any models still queued in the worker processes
+            loaded.close()
+            self._write_queue.put(_END)
+            writer.join()
+            logger.info('Ingest pipeline: ' + self.summary())
+
+        if self.write_error is not None:
+            raise self.write_error
+        return self.written
+
+    def _writeLoop(self):
+        """Take models from the write queue and write them in batches.
+
+        Runs in the writer thread until _END is taken from the queue. After
+        a failed write the queue is still emptied, so the other stages
+        don't block, but nothing else is written.
+        """
+        batch = []
+        try:
+            while True:
+                item = self._write_queue.get()
+                self.write_stats.setDepth(self._write_queue.qsize())
+                if item is not _END:
+                    batch.append(item)
+                if batch and (item is _END or len(batch) >= self.batch_size):
+                    self._writeBatch(batch)
+                    batch = []
+                if item is _END: break
+        finally:
+            pm.closeThreadConnection()
+
+    def _writeBatch(self, batch):
+        if self.write_error is not None: return
+        start = time.time()
+        try:
+            self.write_func(batch)
+        except Exception as err:
+            logger.error('Failed to write models to the database')
+            logger.exception(err)
+            self.write_error = err
+            return
+        self.written += len(batch)
+        self.write_stats.add(len(batch), time.time() - start)
+
+
+class IngestJournal(object):
+    """Record of a batch of models being added to a database.
+
+    The journal is a file of json lines next to the database. The first 
+    line has the model paths, run options and input variables for the 
+    batch and a line with the {path: run_hash} of the models is added 
+    after each transaction is committed. Each line is flushed to disk 
+    before the next write, so after a crash the journal lists every model 
+    that was committed.
+
+    Example:
+        journal = ingest.IngestJournal(db_path)
+        if journal.load():
+            model_paths = journal.remaining()
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path(str): path of the database the batch is added to.
+        """
+        self.path = db_path + JOURNAL_SUFFIX
+        self.model_paths = []
+        self.run_options = ''
+        self.input_vars = {}
+        self.committed = {}
+
+    def exists(self):
+        """Return True if there's a journal for the database."""
+        return os.path.exists(self.path)
+
+    def start(self, model_paths, run_options, input_vars):
+        """Start a new journal, replacing any existing one.
+
+        Args:
+            model_paths(list): the .ief/.tcf file paths in the batch.
+            run_options(str): the run options the models are loaded with.
+            input_vars(dict): the user supplied values applied to each run.
+        """
+        self.model_paths = list(model_paths)
+        self.run_options = run_options
+        self.input_vars = dict(input_vars)
+        self.committed = {}
+        header = {'version': JOURNAL_VERSION, 'model_paths': self.model_paths,
+                  'run_options': self.run_options, 'input_vars': self.input_vars}
+        with open(self.path, 'w') as f:
+            self._writeLine(f, header)
+
+    def commit(self, committed):
+        """Record models that have been committed to the database.
+
+        Args:
+            committed(dict): {path: run_hash} of the committed models.
+        """
+        if not committed: return
+        self.committed.update(committed)
+        with open(self.path, 'a') as f:
+            self._writeLine(f, {'committed': committed})
+
+    def load(self):
+        """Read the journal for the database.
+
+        A partly written last line (e.g. if the computer was turned off
+        while it was being written) is ignored.
+
+        Return:
+            bool - True if a journal was loaded.
+        """
+        if not self.exists(): return False
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.read().splitlines()
+            header = json.loads(lines[0])
+            if not header.get('version') == JOURNAL_VERSION: return False
+        except (IOError, ValueError, IndexError) as err:
+            logger.warning('Unable to read ingest journal: %s' % self.path)
+            logger.exception(err)
+            return False
+        self.model_paths = header['model_paths']
+        self.run_options = header['run_options']
+        self.input_vars = header['input_vars']
+        self.committed = {}
+        for line in lines[1:]:
+            try:
+                self.committed.update(json.loads(line)['committed'])
+            except (ValueError, KeyError):
+                logger.warning('Skipping incomplete line in ingest journal')
+        return True
+
+    def remaining(self):
+        """Return the model paths in the batch that haven't been committed."""
+        return [p for p in self.model_paths if not p in self.committed]
+
+    def remove(self):
+        """Delete the journal file."""
+        try:
+            if self.exists(): os.remove(self.path)
+        except OSError as err:
+            logger.warning('Unable to remove ingest journal: %s' % self.path)
+            logger.exception(err)
+
+    def _writeLine(self, f, data):
+        f.write(json.dumps(data) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,424 @@
+"""
+###############################################################################
+
+ Name: LogIT (Logger for Isis and Tuflow)
+ Author: Duncan Runnacles
+ Copyright: (C) 2016 Duncan Runnacles
+ email: duncan.runnacles@thomasmackay.co.uk
+ License: GPL v2 - Available at: http://www.gnu.org/licenses/gpl-2.0.html
+
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 2 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License along
+ with this program; if not, write to the Free Software Foundation, Inc.,
+ 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+ Module:          jobs.py
+ Date:            18/10/2026
+ Author:          Duncan Runnacles
+ Since-Version:   2.0.0
+
+ Summary:
+     Background jobs for long running operations (logging lots of models,
+     updating the run status, exports, etc).
+
+     A Job wraps a function that is run in a worker thread so that the GUI
+     stays responsive. The function is given the Job as its first argument
+     and uses it to report progress and to check whether the user has
+     cancelled it (see Job.checkCancelled). Results, errors and progress are
+     sent back to the GUI thread with Qt signals, so job functions must not
+     touch any widgets.
+
+     The JobExecutor runs jobs in a pool of worker threads and has a single
+     database writer lane. Jobs that write to the database are either run
+     on the writer lane or pass their writes to it with Job.write, so only
+     one thread writes to the database at a time.
+
+ UPDATES:
+
+
+ TODO:
+
+
+###############################################################################
+"""
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+from PyQt5 import QtCore
+
+import peeweemodels as pm
+
+
+_lane = threading.local()
+""" Set to True in the writer lane thread while it runs a job or write. """
+
+
+class JobCancelled(Exception):
+    """Raised by Job.checkCancelled when the user has cancelled the job."""
+    pass
+
+
+class Job(QtCore.QObject):
+    """A function run in the background by a JobExecutor.
+
+    The function is called as func(job, *args) and its return value is sent
+    with the finishedSignal. If it raises JobCancelled the cancelledSignal
+    is emitted instead and if it raises any other exception the error is
+    logged and the failedSignal is emitted. The doneSignal is emitted after
+    any of these.
+
+    A job can return normally after it has been cancelled (e.g. to report
+    the work completed before it stopped). Use isCancelled to check.
+    
+    The database connection opened by the job thread is closed before any
+    of the signals are emitted, so the database file can be replaced or 
+    removed by the signal handlers.
+    """
+
+    progressSignal = QtCore.pyqtSignal(int, int, str)
+    rateSignal = QtCore.pyqtSignal(float, float)
+    finishedSignal = QtCore.pyqtSignal(object)
+    failedSignal = QtCore.pyqtSignal(str)
+    cancelledSignal = QtCore.pyqtSignal()
+    doneSignal = QtCore.pyqtSignal()
+
+    PROGRESS_INTERVAL = 0.1
+    """Minimum time in seconds between progress signals."""
+
+    def __init__(self, func, args=(), name='', writer=False, parent=None):
+        """
+        Args:
+            func(callable): function to run. Called with func(job, *args).
+            args=()(tuple): arguments to pass to func after the job.
+            name=''(str): name of the job used in logs and status messages.
+            writer=False(bool): if True the job is run on the database writer
+                lane rather than in the worker pool.
+        """
+        super(Job, self).__init__(parent)
+        self.func = func
+        self.args = args
+        self.name = name
+        self.writer = writer
+        self.executor = None
+        self.result = None
+        self.error = None
+        self.value = 0
+        self.maximum = 0
+        self.message = ''
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._start_time = None
+        self._start_value = 0
+        self._last_emit = 0
+
+    def cancel(self):
+        """Ask the job to stop at its next cancellation checkpoint."""
+        if not self._cancel.is_set():
+            logger.info('Cancelling job: %s' % self.name)
+            self._cancel.set()
+
+    def isCancelled(self):
+        """Return True if the job has been cancelled."""
+        return self._cancel.is_set()
+
+    def checkCancelled(self):
+        """Cancellation checkpoint.
+
+        Job functions should call this at points where it is safe to stop,
+        i.e. not part way through a write.
+
+        Raises:
+            JobCancelled - if the job has been cancelled.
+        """
+        if self._cancel.is_set():
+            raise JobCancelled(self.name)
+
+    def isDone(self):
+        """Return True if the job has finished running."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job is done or timeout seconds have passed.
+
+        Return:
+            bool - True if the job is done.
+        """
+        return self._done.wait(timeout)
+
+    def setProgress(self, value, maximum=None, message=None):
+        """Report the progress of the job.
+
+        Emits the progressSignal and the rateSignal, with the number of items
+        completed per second and the estimated seconds remaining (-1 if not
+        known). Signals are limited to one every PROGRESS_INTERVAL seconds,
+        except when the maximum changes or the job is complete.
+
+        Args:
+            value(int): number of items completed.
+            maximum=None(int): total number of items. If None the last
+                maximum given is used.
+            message=None(str): status message. If None the last message given
+                is used.
+        """
+        now = time.time()
+        changed = False
+        if maximum is not None and not maximum == self.maximum:
+            self.maximum = maximum
+            self._start_time = now
+            self._start_value = value
+            changed = True
+        if message is not None:
+            self.message = message
+        self.value = value
+        if self._start_time is None:
+            self._start_time = now
+            self._start_value = value
+
+        if not changed and value < self.maximum and now - self._last_emit < self.PROGRESS_INTERVAL:
+            return
+        self._last_emit = now
+        self.progressSignal.emit(self.value, self.maximum, self.message)
+        rate, eta = self.rate(now)
+        self.rateSignal.emit(rate, eta)
+
+    def progressCallback(self, value, maximum, message):
+        """Progress callback with a cancellation checkpoint.
+
+        For passing as the progress_callback(value, maximum, message)
+        argument of functions that take one (e.g. peeweeviews.removeOrphans).
+        Each call is treated as a safe point to stop at.
+
+        Raises:
+            JobCancelled - if the job has been cancelled.
+        """
+        self.checkCancelled()
+        self.setProgress(value, maximum, message)
+
+    def rate(self, now=None):
+        """Get the throughput and estimated time remaining for the job.
+
+        Return:
+            tuple(float, float) - items per second and seconds remaining. The
+                remaining time is -1 if it can't be estimated yet.
+        """
+        if now is None: now = time.time()
+        if self._start_time is None: return 0.0, -1.0
+        elapsed = now - self._start_time
+        done = self.value - self._start_value
+        if elapsed <= 0 or done <= 0:
+            return 0.0, -1.0
+        rate = done / elapsed
+        return rate, max(self.maximum - self.value, 0) / rate
+
+    def write(self, func, *args):
+        """Run func(*args) on the executors database writer lane.
+
+        Blocks until the write is complete and returns its result. Any
+        exception raised by func is raised here. If the job is already
+        running on the writer lane func is called directly.
+        """
+        if self.executor is None or getattr(_lane, 'writer', False):
+            return func(*args)
+        return self.executor.write(func, *args)
+
+    def run(self):
+        """Call the job function and emit the result signals.
+
+        Called by the JobExecutor in the thread that the job is run in.
+        """
+        logger.debug('Starting job: %s' % self.name)
+        try:
+            if self.isCancelled():
+                raise JobCancelled(self.name)
+            try:
+                self.result = self.func(self, *self.args)
+            finally:
+                if not self.executor is None and not self.executor.inline:
+                    pm.closeThreadConnection()
+        except JobCancelled:
+            logger.info('Job cancelled: %s' % self.name)
+            self.cancelledSignal.emit()
+        except Exception as err:
+            logger.error('Job failed: %s' % self.name)
+            logger.exception(err)
+            self.error = err
+            self.failedSignal.emit(str(err))
+        else:
+            self.finishedSignal.emit(self.result)
+        finally:
+            self._done.set()
+            self.doneSignal.emit()
+
+
+class _JobRunnable(QtCore.QRunnable):
+    """Runs a Job, or a single write, in a QThreadPool thread."""
+
+    def __init__(self, func, writer=False):
+        super(_JobRunnable, self).__init__()
+        self.func = func
+        self.writer = writer
+
+    def run(self):
+        _lane.writer = self.writer
+        try:
+            self.func()
+        finally:
+            _lane.writer = False
+
+
+class _WriteCall(object):
+    """A write passed to the writer lane by Job.write."""
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def __call__(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as err:
+            self.error = err
+        finally:
+            pm.closeThreadConnection()
+            self.done.set()
+
+
+class JobExecutor(QtCore.QObject):
+    """Runs Jobs in a worker thread pool with a single database writer lane.
+
+    Keeps a reference to each job until it is done so that the signals
+    connected by the caller are delivered.
+
+    Example:
+        job = jobs.Job(Controller.updateRunStatus, (run_ids,), 'Update status')
+        job.finishedSignal.connect(self._statusUpdated)
+        self.jobs.start(job)
+    """
+
+    jobStartedSignal = QtCore.pyqtSignal(object)
+    jobDoneSignal = QtCore.pyqtSignal(object)
+
+    def __init__(self, max_workers=None, inline=False, parent=None):
+        """
+        Args:
+            max_workers=None(int): the number of worker threads. If None
+                QThreadPool's default (the number of CPU cores) is used.
+            inline=False(bool): if True jobs are run straight away in the
+                calling thread. Used in test mode where the results are
+                needed before start returns.
+        """
+        super(JobExecutor, self).__init__(parent)
+        self.inline = inline
+        self.worker_pool = QtCore.QThreadPool(self)
+        if max_workers:
+            self.worker_pool.setMaxThreadCount(max_workers)
+        self.writer_pool = QtCore.QThreadPool(self)
+        self.writer_pool.setMaxThreadCount(1)
+        self._jobs = []
+
+    def start(self, job):
+        """Start a job.
+
+        Connect to the job signals before calling this.
+
+        Args:
+            job(Job): the job to run.
+
+        Return:
+            Job - the job that was started.
+        """
+        job.executor = self
+        self._jobs.append(job)
+        job.doneSignal.connect(lambda: self._jobDone(job))
+        self.jobStartedSignal.emit(job)
+        if self.inline:
+            _lane.writer = job.writer
+            try:
+                job.run()
+            finally:
+                _lane.writer = False
+        elif job.writer:
+            self.writer_pool.start(_JobRunnable(job.run, True))
+        else:
+            self.worker_pool.start(_JobRunnable(job.run, False))
+        return job
+
+    def write(self, func, *args):
+        """Run func(*args) on the writer lane and wait for the result.
+
+        Any exception raised by func is raised in the calling thread.
+        """
+        if self.inline or getattr(_lane, 'writer', False):
+            return func(*args)
+        call = _WriteCall(func, args)
+        self.writer_pool.start(_JobRunnable(call, True))
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def activeJobs(self):
+        """Return a list of the jobs that have not finished yet."""
+        return list(self._jobs)
+
+    def isRunning(self, name):
+        """Return True if a job called name has not finished yet."""
+        return any(j.name == name for j in self._jobs)
+
+    def cancelAll(self):
+        """Cancel all of the jobs that have not finished yet."""
+        for job in self._jobs:
+            job.cancel()
+
+    def waitForDone(self, timeout=-1):
+        """Wait for all the threads in both pools to finish.
+
+        Args:
+            timeout=-1(int): milliseconds to wait. -1 waits until done.
+
+        Return:
+            bool - True if all the threads finished.
+        """
+        workers = self.worker_pool.waitForDone(timeout)
+        writer = self.writer_pool.waitForDone(timeout)
+        return workers and writer
+
+    def _jobDone(self, job):
+        if job in self._jobs:
+            self._jobs.remove(job)
+            self.jobDoneSignal.emit(job)
+
+
+def formatRate(rate, eta):
+    """Format the values from a Job rateSignal for the status bar.
+
+    Args:
+        rate(float): items completed per second.
+        eta(float): seconds remaining, or < 0 if not known.
+
+    Return:
+        str - e.g. '12.5/s, 0:01:20 left', or '' if rate is 0.
+    """
+    if rate <= 0:
+        return ''
+    text = '%.1f/s' % rate if rate < 100 else '%d/s' % rate
+    if eta >= 0:
+        eta = int(round(eta))
+        text += ', %d:%02d:%02d left' % (eta // 3600, eta % 3600 // 60, eta % 60)
+    return text
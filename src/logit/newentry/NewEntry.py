@@ -70,11 +70,19 @@ logger.debug('NewEntry_Widget import complete')
 # from app_metrics import utils as applog
 import globalsettings as gs
 
+import peeweemodels as pm
 import peeweeviews as pv
 
 
 class NewEntry_UI(newentrywidget.Ui_NewEntryWidget, AWidget):
     
+    PREFLIGHT_COLOURS = {
+        Controller.PREFLIGHT_NEW: (204, 255, 153), 
+        Controller.PREFLIGHT_DUPLICATE: (255, 229, 153),
+        Controller.PREFLIGHT_MISSING: (255, 204, 204),
+        Controller.PREFLIGHT_ERROR: (255, 204, 204),
+    }
+    """Background colours (RGB) for each preflight status."""
 
     def __init__(self, cwd, parent=None, f=QtCore.Qt.WindowFlags()):
         
@@ -89,7 +97,7 @@ class NewEntry_UI(newentrywidget.Ui_NewEntryWidget, AWidget):
         # Setup a custom QTableWidget for multiple model choice table so that
         # It can be drag and dropped into order
         self.multipleModelLayoutH.removeItem(self.multipleModelLayoutV)
-        self.loadMultiModelTable = GuiStore.TableWidgetDragRows(0, 3, self)
+        self.loadMultiModelTable = GuiStore.TableWidgetDragRows(0, 4, self)
         item = QtWidgets.QTableWidgetItem()
         item.setTextAlignment(QtCore.Qt.AlignLeft|QtCore.Qt.AlignVCenter)
         self.loadMultiModelTable.setHorizontalHeaderItem(0, item)
@@ -105,6 +113,11 @@ class NewEntry_UI(newentrywidget.Ui_NewEntryWidget, AWidget):
         self.loadMultiModelTable.setHorizontalHeaderItem(2, item)
         item.setText("Absolute Path")
         
+        item = QtWidgets.QTableWidgetItem()
+        item.setTextAlignment(QtCore.Qt.AlignLeft|QtCore.Qt.AlignVCenter)
+        self.loadMultiModelTable.setHorizontalHeaderItem(3, item)
+        item.setText("Preflight Status")
+        
         self.loadMultiModelTable.horizontalHeader().setDefaultSectionSize(300)
         self.loadMultiModelTable.horizontalHeader().setMinimumSectionSize(300)
         self.loadMultiModelTable.horizontalHeader().setStretchLastSection(True)
@@ -113,6 +126,12 @@ class NewEntry_UI(newentrywidget.Ui_NewEntryWidget, AWidget):
         self.loadMultiModelTable.setSortingEnabled(True)
         self.multipleModelLayoutH.addWidget(self.loadMultiModelTable)
         self.multipleModelLayoutH.addItem(self.multipleModelLayoutV)
+        
+        # Checks the models in the table without logging them
+        self.preflightMultiLogEntryButton = QtWidgets.QPushButton(
+            'Preflight Check', self.submitMultiModelGroup)
+        self.preflightMultiLogEntryButton.setObjectName('preflightMultiLogEntryButton')
+        self.gridLayout_3.addWidget(self.preflightMultiLogEntryButton, 2, 0, 1, 1)
         '''
             End of Multiple model load table setup.
         '''
@@ -436,6 +455,8 @@ class NewEntry_UI(newentrywidget.Ui_NewEntryWidget, AWidget):
                                         Controller.createQtTableItem(fname, drag_enabled=True))
                 self.loadMultiModelTable.setItem(row_count, 2, 
                                         Controller.createQtTableItem(p, drag_enabled=True))
+                self.loadMultiModelTable.setItem(row_count, 3, 
+                                        Controller.createQtTableItem('', drag_enabled=True))
                 
             # Set the sumbit button to enabled
             self.submitMultiModelGroup.setEnabled(True)
@@ -474,9 +495,28 @@ class NewEntry_UI(newentrywidget.Ui_NewEntryWidget, AWidget):
             return False
          
         else:
+            pm.openSession(path)
             return True 
     
     
+    def setPreflightResults(self, results):
+        """Show the results of a preflight check in the multiple model table.
+        
+        Args:
+            results(dict): {path: (status, message)} as returned by
+                Controller.preflightModels. Rows for paths that aren't in
+                results have their status cleared.
+        """
+        for row in range(self.loadMultiModelTable.rowCount()):
+            path = str(self.loadMultiModelTable.item(row, 2).text())
+            status, message = results.get(path, ('', ''))
+            item = Controller.createQtTableItem(status, drag_enabled=True)
+            item.setToolTip(message)
+            if status in self.PREFLIGHT_COLOURS:
+                item.setBackground(QtGui.QColor(*self.PREFLIGHT_COLOURS[status]))
+            self.loadMultiModelTable.setItem(row, 3, item)
+    
+    
     def _clearMultiErrorText(self):
         """Clears the error outputs in multi model load error textbox.
         """
@@ -0,0 +1,265 @@
+"""
+###############################################################################
+
+ Name: LogIT (Logger for Isis and Tuflow)
+ Author: Duncan Runnacles
+ Copyright: (C) 2016 Duncan Runnacles
+ email: duncan.runnacles@thomasmackay.co.uk
+ License: GPL v2 - Available at: http://www.gnu.org/licenses/gpl-2.0.html
+
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 2 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License along
+ with this program; if not, write to the Free Software Foundation, Inc.,
+ 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+ Module:          parsecache.py
+ Date:            18/10/2026
+ Author:          Duncan Runnacles
+ Since-Version:   2.0.0
+
+ Summary:
+     Cache for the results of parsing model files.
+
+     Each entry is stored with the modified time and size of the files it
+     was created from and is only returned while all of those files are
+     unchanged. Entries are kept in memory, with the least recently used
+     removed once there are more than max_items, and optionally written to
+     a cache folder so that they are shared with other processes and kept
+     between sessions.
+
+ UPDATES:
+
+
+ TODO:
+
+
+###############################################################################
+"""
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+CACHE_VERSION = 1
+""" Stored with each entry. Increase it when the cached values change. """
+
+DEFAULT_MAX_ITEMS = 256
+""" Number of entries kept in memory. """
+
+DEFAULT_MAX_DISK_ITEMS = 5000
+""" Number of entries kept in the cache folder. """
+
+
+def fileStat(path):
+    """Get the values used to check whether a file has changed.
+
+    Args:
+        path(str): the file path.
+
+    Return:
+        tuple(str, int, int) - the normalised absolute path, modified time
+            in nanoseconds and size, or (path, None, None) if the file
+            doesn't exist.
+    """
+    path = os.path.normcase(os.path.abspath(path))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, None, None
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+class ParseCache(object):
+    """LRU cache of parse results validated against the files they came from.
+
+    Values are pickled when they are added, so every get returns a new copy
+    that the caller is free to change, and anything stored must be
+    picklable.
+
+    Example:
+        value = cache.get(('bc', path))
+        if value is None:
+            value = parse(path)
+            cache.put(('bc', path), value, [path])
+    """
+
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS, cache_dir=None,
+                 max_disk_items=DEFAULT_MAX_DISK_ITEMS):
+        """
+        Args:
+            max_items=DEFAULT_MAX_ITEMS(int): number of entries kept in
+                memory. If < 1 nothing is kept in memory.
+            cache_dir=None(str): folder to store the entries in as well. If
+                None they are only kept in memory.
+            max_disk_items=DEFAULT_MAX_DISK_ITEMS(int): number of entries
+                kept in cache_dir. The oldest are removed when the cache is
+                created.
+        """
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_items = max_disk_items
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            try:
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                self.prune()
+            except OSError as err:
+                logger.warning('Could not setup parse cache folder: %s' % cache_dir)
+                logger.exception(err)
+                self.cache_dir = None
+
+    def get(self, key):
+        """Get the value stored for key.
+
+        Args:
+            key(tuple): of str's identifying the value.
+
+        Return:
+            the stored value, or None if there isn't one or any of the files
+                it was created from have changed.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            entry = self._items.get(digest)
+            if entry is not None:
+                self._items.move_to_end(digest)
+        if entry is None:
+            entry = self._readEntry(digest, key)
+
+        if entry is None or not self._isValid(entry[0]):
+            if entry is not None:
+                self._remove(digest)
+            self.misses += 1
+            return None
+
+        self._remember(digest, entry)
+        self.hits += 1
+        return pickle.loads(entry[1])
+
+    def put(self, key, value, paths=()):
+        """Store a value.
+
+        Args:
+            key(tuple): of str's identifying the value.
+            value: the value to store. Must be picklable.
+            paths=()(list): the files the value was created from.
+        """
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            logger.warning('Parse result could not be cached: %s' % (key,))
+            logger.exception(err)
+            return
+        entry = (tuple(fileStat(p) for p in paths), data)
+        digest = self._digest(key)
+        self._remember(digest, entry)
+        self._writeEntry(digest, key, entry)
+
+    def clear(self):
+        """Remove all entries, including those in cache_dir."""
+        with self._lock:
+            self._items.clear()
+        for path in self._diskFiles():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def prune(self):
+        """Remove the least recently used files from cache_dir.
+
+        Only the newest max_disk_items are kept.
+        """
+        files = self._diskFiles()
+        if len(files) <= self.max_disk_items: return
+        files.sort(key=lambda p: os.path.getmtime(p), reverse=True)
+        for path in files[self.max_disk_items:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _isValid(self, stats):
+        return all(fileStat(s[0]) == s for s in stats)
+
+    def _digest(self, key):
+        text = repr((CACHE_VERSION,) + tuple(key))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _remember(self, digest, entry):
+        if self.max_items < 1: return
+        with self._lock:
+            self._items[digest] = entry
+            self._items.move_to_end(digest)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def _remove(self, digest):
+        with self._lock:
+            self._items.pop(digest, None)
+        if self.cache_dir is not None:
+            try:
+                os.remove(self._diskPath(digest))
+            except OSError:
+                pass
+
+    def _diskPath(self, digest):
+        return os.path.join(self.cache_dir, digest + '.pkl')
+
+    def _diskFiles(self):
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return []
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir)
+                if f.endswith('.pkl')]
+
+    def _readEntry(self, digest, key):
+        if self.cache_dir is None: return None
+        path = self._diskPath(digest)
+        if not os.path.exists(path): return None
+        try:
+            with open(path, 'rb') as f:
+                version, stored_key, stats, data = pickle.load(f)
+            # Keep the most recently used files when pruning
+            os.utime(path, None)
+        except Exception:
+            logger.debug('Unreadable parse cache file: %s' % path)
+            return None
+        if not version == CACHE_VERSION or not tuple(stored_key) == tuple(key):
+            return None
+        return stats, data
+
+    def _writeEntry(self, digest, key, entry):
+        if self.cache_dir is None: return
+        path = self._diskPath(digest)
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump((CACHE_VERSION, tuple(key), entry[0], entry[1]), f,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception as err:
+            logger.warning('Could not write parse cache file: %s' % path)
+            logger.exception(err)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
@@ -38,8 +38,11 @@
 
 ###############################################################################
 """
+import os
 import  sqlite3
+import threading
 import traceback
+from contextlib import contextmanager
 
 import logging
 logger = logging.getLogger(__name__)
@@ -48,10 +51,73 @@ from peewee import *
 from datetime import date as d
 from datetime import datetime as dt
 
-logit_db = SqliteDatabase(None)
+_session = threading.local()
+""" Per-thread session state.
+
+path - the database path the thread's connection was opened with.
+depth - the number of batchSession's currently open in the thread.
+"""
+
+_keep_open = False
+""" Set by openSession: connections stay open between view calls. """
+
+
+DEFAULT_PRAGMA_PROFILE = 'default'
+""" Name of the pragma profile used when no other is configured. """
+
+PRAGMA_PROFILES = {
+    'default': {},
+    'local-fast': {
+        'journal_mode': 'wal', 'synchronous': 'normal', 'cache_size': -65536,
+        'mmap_size': 268435456, 'temp_store': 'memory',
+    },
+    'network-share-safe': {
+        'journal_mode': 'delete', 'synchronous': 'full', 'cache_size': -16384,
+        'mmap_size': 0, 'temp_store': 'memory',
+    },
+}
+""" Built-in SQLite pragma profiles.
+
+default - SQLite defaults, the database is used as it is.
+local-fast - for databases on a local disk. Write-ahead logging with 
+    synchronous=NORMAL, a 64MB page cache and 256MB memory mapped I/O.
+network-share-safe - for databases on shared drives, where WAL and memory
+    mapping are not safe. Rollback journal with full syncing and a 16MB cache.
+
+The profiles are copied into the user settings, where they can be edited or
+added to. Negative cache_size values are in KiB, mmap_size is in bytes.
+"""
+
+_active_profile = {'name': DEFAULT_PRAGMA_PROFILE, 'pragmas': {}}
+""" The pragma profile applied to new connections (see setPragmaProfile). """
+
+
+class LogitDatabase(SqliteDatabase):
+    """SqliteDatabase that records which setup each thread's connection is for.
+    
+    logit_db.init() only closes the connection in the calling thread, so
+    connectDB uses the recorded path and pragmas to spot connections in 
+    other threads that still point at a previously loaded database or were
+    opened with a different pragma profile.
+    """
+    
+    def _connect(self):
+        conn = super(LogitDatabase, self)._connect()
+        _session.path = self.database
+        _session.pragmas = tuple(self._pragmas)
+        return conn
+    
+    def _add_conn_hooks(self, conn):
+        # The association tables rely on ON DELETE CASCADE, which SQLite 
+        # only applies when foreign key support is turned on.
+        conn.execute('PRAGMA foreign_keys = ON')
+        super(LogitDatabase, self)._add_conn_hooks(conn)
+
+
+logit_db = LogitDatabase(None)
 """ Database object """
 
-DATABASE_VERSION_NO = 21
+DATABASE_VERSION_NO = 24
 """ Database version number """
 
 NEW_DB_START = 20
@@ -77,15 +143,51 @@ class LogitModel(Model):
         database = logit_db
         
 
-class Dat(LogitModel):
-    name = CharField(primary_key=True, index=True)
+def nameKey(name):
+    """Return the case-normalised form of a file name.
+    
+    Names are compared as Windows compares paths: ignoring case and treating
+    '/' and '\\' as the same separator. The key is stored in the name_key
+    field of the NamedModel tables, so lookups on it can use an index. It is
+    also available in SQL as logit_name_key(name).
+    
+    Args:
+        name(str): the name to normalise.
+    
+    Return:
+        str - the normalised name.
+    """
+    if name is None: return None
+    return name.replace('/', '\\').lower()
+
+logit_db.register_function(nameKey, 'logit_name_key', 1)
+
+
+class NamedModel(LogitModel):
+    """Base for the file tables (Dat, ModelFile, SubFile and Ied).
+    
+    Records have a compact integer id, used by the association tables, and
+    are looked up by their unique name. name_key is kept up to date with 
+    the name when a record is saved. Code that writes the tables in bulk 
+    (e.g. insert_many) must set it with nameKey.
+    """
+    name = CharField(unique=True)
+    name_key = CharField(index=True)
+    
+    def save(self, *args, **kwargs):
+        self.name_key = nameKey(self.name)
+        return super(NamedModel, self).save(*args, **kwargs)
+    
+
+class Dat(NamedModel):
     amendments = TextField(default='')
     comments = TextField(default='')
     timestamp = DateTimeField(default=dt.now)
     
 
 class Run(LogitModel):
-    dat = ForeignKeyField(Dat, null=True)
+    # Still references the name, so run.dat_id is the Dat.name as before
+    dat = ForeignKeyField(Dat, field='name', null=True)
     run_hash = CharField(unique=True, index=True)
     setup = TextField(default='')
     comments = TextField(default='')
@@ -109,20 +211,22 @@ class Run(LogitModel):
     timestamp = DateTimeField(default=dt.now)
     
 
-class ModelFile(LogitModel):
-    name = CharField(primary_key=True, index=True)
+class ModelFile(NamedModel):
     model_type = CharField()
     comments = TextField(default='')
     timestamp = DateTimeField(default=dt.now)
+    
+    class Meta:
+        indexes = (
+            (('model_type', 'name'), False),
+        )
 
 
-class SubFile(LogitModel):
-    name = CharField(primary_key=True, index=True)
+class SubFile(NamedModel):
     timestamp = DateTimeField(default=dt.now)
     
     
-class Ied(LogitModel):
-    name = CharField(primary_key=True, index=True)
+class Ied(NamedModel):
     ref = CharField(default='')
     amendments = TextField(default='')
     comments = TextField(default='')
@@ -130,29 +234,87 @@ class Ied(LogitModel):
 
     
 class ModelFile_SubFile(LogitModel):
-    model_file = ForeignKeyField(ModelFile, index=True)
-    sub_file = ForeignKeyField(SubFile, index=True)
+    model_file = ForeignKeyField(ModelFile, index=True, on_delete='CASCADE')
+    sub_file = ForeignKeyField(SubFile, index=True, on_delete='CASCADE')
     new_file = BooleanField(default=False)
     timestamp = DateTimeField(default=dt.now)
+    
+    class Meta:
+        table_name = 'modelfile_subfile_link'
+        indexes = (
+            (('model_file', 'sub_file'), False),
+            (('sub_file', 'timestamp'), False),
+        )
 
         
 class Run_ModelFile(LogitModel):
-    run = ForeignKeyField(Run, index=True)
-    model_file = ForeignKeyField(ModelFile, index=True)
+    run = ForeignKeyField(Run, index=True, on_delete='CASCADE')
+    model_file = ForeignKeyField(ModelFile, index=True, on_delete='CASCADE')
     new_file = BooleanField(default=False)
     timestamp = DateTimeField(default=dt.now)
+    
+    class Meta:
+        table_name = 'run_modelfile_link'
+        indexes = (
+            (('run', 'model_file'), False),
+            (('model_file', 'timestamp'), False),
+        )
 
 
 class Run_SubFile(LogitModel):
-    run = ForeignKeyField(Run, index=True)
-    sub_file = ForeignKeyField(SubFile, index=True)
+    run = ForeignKeyField(Run, index=True, on_delete='CASCADE')
+    sub_file = ForeignKeyField(SubFile, index=True, on_delete='CASCADE')
     timestamp = DateTimeField(default=dt.now)
+    
+    class Meta:
+        table_name = 'run_subfile_link'
+        indexes = (
+            (('run', 'sub_file'), False),
+        )
 
 
 class Run_Ied(LogitModel):
-    run = ForeignKeyField(Run, index=True)
-    ied = ForeignKeyField(Ied, index=True)
+    run = ForeignKeyField(Run, index=True, on_delete='CASCADE')
+    ied = ForeignKeyField(Ied, index=True, on_delete='CASCADE')
     timestamp = DateTimeField(default=dt.now)
+    
+    class Meta:
+        table_name = 'run_ied_link'
+        indexes = (
+            (('run', 'ied'), False),
+        )
+
+
+COMPAT_VIEWS = {
+    'modelfile_subfile': (
+        'SELECT l.id AS id, mf.name AS model_file_id, sf.name AS sub_file_id, '
+        'l.new_file AS new_file, l.timestamp AS timestamp '
+        'FROM modelfile_subfile_link AS l '
+        'INNER JOIN modelfile AS mf ON mf.id = l.model_file_id '
+        'INNER JOIN subfile AS sf ON sf.id = l.sub_file_id'),
+    'run_modelfile': (
+        'SELECT l.id AS id, l.run_id AS run_id, mf.name AS model_file_id, '
+        'l.new_file AS new_file, l.timestamp AS timestamp '
+        'FROM run_modelfile_link AS l '
+        'INNER JOIN modelfile AS mf ON mf.id = l.model_file_id'),
+    'run_subfile': (
+        'SELECT l.id AS id, l.run_id AS run_id, sf.name AS sub_file_id, '
+        'l.timestamp AS timestamp '
+        'FROM run_subfile_link AS l '
+        'INNER JOIN subfile AS sf ON sf.id = l.sub_file_id'),
+    'run_ied': (
+        'SELECT l.id AS id, l.run_id AS run_id, i.name AS ied_id, '
+        'l.timestamp AS timestamp '
+        'FROM run_ied_link AS l '
+        'INNER JOIN ied AS i ON i.id = l.ied_id'),
+}
+""" Read-only views of the association tables as they were before version 24.
+
+The association tables reference the files by their integer id. These views
+have the old table names and show the file names in the *_id columns, so 
+query scripts written for the old tables (e.g. joining 
+run_modelfile.model_file_id to modelfile.name) still work.
+"""
 
 
 
@@ -164,16 +326,35 @@ def getAllTables():
 
 def createTable(table, connect_db=True):
     """Create a single table."""
-    logit_db.connect()
-    logit_db.create_tables([table])
-    logit_db.close()
+    createTableList([table], connect_db)
 
 
 def createTableList(tables, connect_db=True):
-    """Create all tables."""
-    logit_db.connect()
-    logit_db.create_tables(tables)
-    logit_db.close()
+    """Create all tables.
+    
+    The COMPAT_VIEWS of any association tables in tables are created too.
+    """
+    connectDB()
+    try:
+        logit_db.create_tables(tables)
+        createCompatViews(tables)
+    finally:
+        disconnectDB()
+
+
+def createCompatViews(tables=None):
+    """Create the COMPAT_VIEWS, if they don't already exist.
+    
+    Args:
+        tables=None(list): only create the views of these tables. If None
+            all of the views are created.
+    """
+    names = None
+    if tables is not None:
+        names = [t._meta.table_name for t in tables]
+    for view, sql in COMPAT_VIEWS.items():
+        if names is None or view + '_link' in names:
+            logit_db.execute_sql('CREATE VIEW IF NOT EXISTS "%s" AS %s' % (view, sql))
     
 
 # def updatePragmaUserVersion(db_path):
@@ -189,6 +370,15 @@ def createTableList(tables, connect_db=True):
 
 
 def connectDB():
+    """Make sure this thread has an open connection to the current database.
+    
+    An existing connection is reused unless it was opened for a different 
+    database file than the one that is currently loaded.
+    """
+    if not logit_db.is_closed() and (
+            getattr(_session, 'path', None) != logit_db.database or 
+            getattr(_session, 'pragmas', ()) != tuple(logit_db._pragmas)):
+        logit_db.close()
     try:
         logit_db.connect(reuse_if_open=True)
     except InterfaceError:
@@ -196,9 +386,193 @@ def connectDB():
         raise
     
 def disconnectDB():
+    """Close this thread's connection.
+    
+    Does nothing while a session is open (see openSession) or when called
+    from inside a batchSession or transaction, so that the connection and 
+    SQLite page cache are kept between view calls and view functions can be
+    called from inside each other.
+    """
+    if _keep_open or getattr(_session, 'depth', 0) > 0 or logit_db.in_transaction():
+        return
     logit_db.close()
 
 
+def closeThreadConnection():
+    """Close this thread's connection, even if a session is open.
+    
+    Used by background threads (see jobs.py) when they finish with the 
+    database so that no connection is left open on the file by a thread 
+    that may not use it again. Does nothing inside a batchSession or 
+    transaction.
+    """
+    if getattr(_session, 'depth', 0) > 0 or logit_db.deferred:
+        return
+    if not logit_db.is_closed() and not logit_db.in_transaction():
+        logit_db.close()
+
+
+def _samePath(path1, path2):
+    if path1 is None or path2 is None:
+        return path1 is path2
+    return os.path.normcase(os.path.abspath(path1)) == os.path.normcase(os.path.abspath(path2))
+
+
+def openSession(db_path):
+    """Load a database and keep its connections open.
+    
+    Connections are opened as needed (one per thread) and left open until
+    the database path changes or closeSession is called. Calling this with
+    the path that is already loaded does nothing, so it is safe to call 
+    every time the database is accessed.
+    
+    Args:
+        db_path(str): path to the .logdb file.
+    """
+    global _keep_open
+    _keep_open = True
+    if _samePath(logit_db.database, db_path):
+        return
+    logit_db.init(db_path)
+
+
+def setPragmaProfile(name, profiles=None):
+    """Set the SQLite pragma profile used by all database connections.
+    
+    The pragmas are applied whenever a connection is opened. This thread's
+    connection is reopened straight away, those in other threads are 
+    reopened the next time they call connectDB.
+    
+    Args:
+        name(str): the name of the profile to use.
+        profiles=None(dict): {name: {pragma: value}} profiles to look the 
+            name up in, usually the ones stored in the user settings. If
+            None or name isn't in it PRAGMA_PROFILES is used.
+    
+    Return:
+        str - the name of the profile that was applied. This will be 
+            DEFAULT_PRAGMA_PROFILE if name could not be found.
+    """
+    if profiles is not None and name in profiles:
+        pragmas = profiles[name]
+    elif name in PRAGMA_PROFILES:
+        pragmas = PRAGMA_PROFILES[name]
+    else:
+        logger.warning('Database profile %s not found, using %s' % (name, DEFAULT_PRAGMA_PROFILE))
+        name = DEFAULT_PRAGMA_PROFILE
+        pragmas = PRAGMA_PROFILES[name]
+    
+    _active_profile['name'] = name
+    _active_profile['pragmas'] = dict(pragmas)
+    logit_db._pragmas = list(pragmas.items())
+    if not logit_db.deferred and getattr(_session, 'depth', 0) == 0:
+        logit_db.close()
+    logger.info('Database profile set to: %s' % name)
+    return name
+
+
+def getProfileStatus():
+    """Report the active pragma profile and the values SQLite is using.
+    
+    The values are read back from a connection to the loaded database, so
+    any pragma that SQLite refused to change (e.g. journal_mode=wal on a 
+    drive that doesn't support it) will show the value actually in use.
+    
+    Return:
+        dict - {'name': profile name, 'pragmas': {pragma: value} configured
+            for the profile, 'current': {pragma: value} in use on the
+            database or empty if no database is loaded}.
+    """
+    status = {
+        'name': _active_profile['name'], 
+        'pragmas': dict(_active_profile['pragmas']), 'current': {}
+    }
+    if logit_db.database is None:
+        return status
+    
+    names = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'foreign_keys']
+    for n in _active_profile['pragmas'].keys():
+        if not n in names: names.append(n)
+    connectDB()
+    try:
+        for n in names:
+            row = logit_db.execute_sql('PRAGMA %s' % n).fetchone()
+            status['current'][n] = row[0] if row is not None else None
+    finally:
+        disconnectDB()
+    return status
+
+
+def closeSession():
+    """Close the current thread's connection and unload the database.
+    
+    Connections in any other threads are closed the next time they call
+    connectDB.
+    """
+    global _keep_open
+    _keep_open = False
+    if getattr(_session, 'depth', 0) > 0:
+        raise OperationalError('Cannot close the session inside a batchSession')
+    if not logit_db.deferred:
+        logit_db.close()
+    logit_db.init(None)
+
+
+@contextmanager
+def batchSession():
+    """Hold a single connection and transaction across many view calls.
+    
+    All of the connectDB/disconnectDB calls made by the view functions 
+    inside the block reuse the same connection and everything is committed
+    at the end of the block, or rolled back if an exception is raised.
+    Nested batchSession's become savepoints of the outer transaction.
+    
+    Example:
+        with pm.batchSession():
+            run = pv.addRun(...)
+            pv.addAllModel(models, run)
+    """
+    connectDB()
+    _session.depth = getattr(_session, 'depth', 0) + 1
+    try:
+        with logit_db.atomic():
+            yield logit_db
+    finally:
+        _session.depth -= 1
+        disconnectDB()
+
+
+def backupDatabase(dest_path, db_path=None, pages=-1, sleep=0.25, progress=None):
+    """Copy a database with the SQLite online backup API.
+    
+    Unlike a file copy this gives a consistent snapshot while other 
+    connections are using the database and doesn't need them to be closed.
+    
+    Args:
+        dest_path(str): the file to write to. Its contents are replaced.
+        db_path=None(str): the database to copy. If None the loaded 
+            database is copied.
+        pages=-1(int): the number of pages copied in each step. If < 1 the 
+            whole database is copied in one step. Smaller steps let other 
+            connections write to the database in between.
+        sleep=0.25(float): seconds to wait between steps.
+        progress=None(func): called after each step with (status, 
+            remaining, total) pages, as for sqlite3.Connection.backup.
+    
+    Return:
+        str - dest_path.
+    """
+    if db_path is None: db_path = logit_db.database
+    src = sqlite3.connect(db_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest, pages=pages, progress=progress, sleep=sleep)
+    finally:
+        dest.close()
+        src.close()
+    return dest_path
+
+
 def createNewDb(db_path):
     """Create a new sqlite database and setup version number."""
     
@@ -207,6 +581,8 @@ def createNewDb(db_path):
     try:
         conn = sqlite3.connect(db_path)
         cur = conn.cursor()
+        # Only applies to a new database, before any tables are created
+        cur.execute("pragma auto_vacuum = incremental")
         cur.execute("pragma user_version = %s" % DATABASE_VERSION_NO)
         logger.info('Database successfully Updated - Current DB version = %s' % str(DATABASE_VERSION_NO))
 
@@ -229,7 +605,7 @@ def createNewDb(db_path):
         return False
     
     try:
-        logit_db.init(db_path)
+        openSession(db_path)
     except Exception as err:
         logger.exception(err)
         return False
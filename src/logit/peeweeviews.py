@@ -48,7 +48,6 @@ import traceback
 import sqlite3
 
 from peewee import *
-from playhouse import shortcuts
 import peeweemodels as pm
 
 
@@ -58,6 +57,27 @@ DAT_FIELDS = {'name': pm.Dat.name, 'amendments': pm.Dat.amendments, 'comments':
 MODEL_FIELDS = {'name': pm.ModelFile.name, 'model_type': pm.ModelFile.model_type, 'comments': pm.ModelFile.comments, 'files': None}
 FILE_FIELDS = ['name']
 
+INSERT_CHUNK_SIZE = 100
+"""Number of rows written by each insert_many call in bulkInsert."""
+
+IN_QUERY_CHUNK_SIZE = 500
+"""Maximum number of values used in a single IN (...) lookup query.
+
+SQLite builds before 3.32 limit a statement to 999 bound variables.
+"""
+
+DELETE_CHUNK_SIZE = 25
+"""Number of Run records deleted at a time by deleteRunRows."""
+
+ORPHAN_BATCH_SIZE = 500
+"""Number of orphaned records found and deleted at a time by removeOrphans."""
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+"""Format used for timestamps in the rows returned to the tables."""
+
+QUERY_PAGE_SIZE = 500
+"""Number of rows read at a time by the QueryPages classes."""
+
 '''
  Getters for the different table fields.
  These are here to try and keep referenced to fields etc in one place.
@@ -142,7 +162,8 @@ def addAllIed(ieds, run):
     Updates the Ied entries and Run_Ied many to many entries.
     
     Will only add a new entry to the Ied table if the name doesn't already
-    exist.
+    exist. The existing names are looked up in a single pass (see 
+    existingIds) rather than querying for each Ied in turn.
     
     Args:
         ieds(list): containing dictionaries with values to update with.
@@ -150,23 +171,19 @@ def addAllIed(ieds, run):
     """
     ied_datasource = []
     ri_datasource = []
-    found_ieds = []
+    ied_ids = existingIds(pm.Ied, [i['NAME'] for i in ieds])
+    found_ieds = set(ied_ids)
     
     for i in ieds:
-        if not i['NAME'] in found_ieds and not iedExists(i['NAME']):
+        if not i['NAME'] in found_ieds:
             ied_datasource.append({'name': i['NAME'], 'ref': i['REF'], 'amendments': i['AMENDMENTS'], 'comments': i['COMMENTS']})
-            found_ieds.append(i['NAME'])
-            ri_datasource.append({'run': run, 'ied': i['NAME'], 'new_file': True})
-        else:
-            ri_datasource.append({'run': run, 'ied': i['NAME'], 'new_file': False})
+            found_ieds.add(i['NAME'])
+        ri_datasource.append({'run': run, 'ied': i['NAME']})
     
-    # Use atomic for create calls - MASSIVE write speed increase.
     if ied_datasource or ri_datasource:
         with pm.logit_db.atomic():
-            for data_dict in ied_datasource:
-                pm.Ied.create(**data_dict)
-            for data_dict in ri_datasource:
-                pm.Run_Ied.create(**data_dict)
+            ied_ids.update(bulkInsertNamed(pm.Ied, ied_datasource))
+            bulkInsert(pm.Run_Ied, namesToIds(ri_datasource, {'ied': ied_ids}))
         
 
 def addAllModel(mfiles, run):
@@ -181,15 +198,21 @@ def addAllModel(mfiles, run):
     SubFile table is only updated when the filename is not in SubFile.name,
     but the ModelFile_SubFile table will be.
     
-    The checking of existing records is done in a first pass and a set of lists
-    if populated with the record data to update. Once this is completed these
-    lists are looped seperately 'with atomic' to try and speed things up.
+    All of the records that already exist for the names in mfiles are loaded
+    up front with a few IN queries (chunked to stay within the SQLite variable
+    limit). The new/existing status of every record and the new_file flags are
+    then worked out in memory with sets before each table is written with 
+    chunked insert_many calls inside a single transaction.
+    
+    The new_file flags are set to the values that updateNewStatus would give
+    them: only the first ModelFile_SubFile record for each model_type and 
+    SubFile, and the first Run_ModelFile record for each ModelFile, are new.
+    New records are always later than those already in the database, so 
+    only the existing records need checking.
     
-    TODO:
-        A bit slow and probably not very efficient. I don't think this will
-            scale well when the database gets even slightly big. Maybe consider
-            whether just adding it all on and then deleting any duplicates might
-            be quicker than check files exist on loop?
+    The association records are built with the file names, which are 
+    swapped for the ModelFile.id and SubFile.id once the new files have 
+    been written (see namesToIds).
     
     Args:
         mfiles(list): containing dictionaries with values to update with.
@@ -201,52 +224,241 @@ def addAllModel(mfiles, run):
     rm_datasource = []      # Run_ModelFile
     rs_datasource = []      # Run_SubFile
     
-    found_models = []
-    found_files = []
-    found_modelfiles = []
+    model_names = set([m['NAME'] for m in mfiles])
+    file_names = set([f for m in mfiles for f in m['FILES']])
+    model_ids = existingIds(pm.ModelFile, model_names)
+    file_ids = existingIds(pm.SubFile, file_names)
+    found_models = set(model_ids)
+    found_files = set(file_ids)
+    found_modelfiles = existingModelSubfiles(found_models)
+    found_typefiles = existingTypeSubfiles(file_names)
     
     # Loop all of the model files
     for m in mfiles:
-        if not m['NAME'] in found_models and not modelExists(m['NAME']): 
+        if not m['NAME'] in found_models: 
             model_datasource.append({'name': m['NAME'], 'model_type': m['TYPE'], 'comments': m['COMMENTS']})
-            found_models.append(m['NAME'])
+            found_models.add(m['NAME'])
             rm_datasource.append({'run': run, 'model_file': m['NAME'], 'new_file': True})
         else:
             rm_datasource.append({'run': run, 'model_file': m['NAME'], 'new_file': False})
         
         # Loop all of the subfiles
         for f in m['FILES']:
-            first_time = False
             
-            # Add to Run_SubFile list and check new status
+            # Add to Run_SubFile list
             rs_datasource.append({'run': run, 'sub_file': f})
-            if subFileIsNew(m['TYPE'], f):
-                first_time = True
             
             # Add to SubFile list
-            if not f in found_files and not subfileExists(f):
+            if not f in found_files:
                 files_datasource.append({'name': f})
-                found_files.append(f)
+                found_files.add(f)
             
-            # Add to ModelFile_Subfile list
-            if not ((m['NAME'] + f) in found_modelfiles) and  not modelSubfileExists(m['NAME'], f):
+            # Add to ModelFile_Subfile list and check new status
+            if not (m['NAME'], f) in found_modelfiles:
+                first_time = not (m['TYPE'], f) in found_typefiles
                 mf_datasource.append({'model_file': m['NAME'], 'sub_file': f, 'new_file': first_time})
-                found_modelfiles.append(m['NAME'] + f)
+                found_modelfiles.add((m['NAME'], f))
+                found_typefiles.add((m['TYPE'], f))
             
-    # Use atomic for create calls - MASSIVE write speed increase.
     with pm.logit_db.atomic():
-        for data_dict in model_datasource:
-            pm.ModelFile.create(**data_dict)
-        for data_dict in files_datasource:
-            pm.SubFile.create(**data_dict)
-        for data_dict in mf_datasource:
-            pm.ModelFile_SubFile.create(**data_dict)
-        for data_dict in rm_datasource:
-            pm.Run_ModelFile.create(**data_dict)
-        for data_dict in rs_datasource:
-            pm.Run_SubFile.create(**data_dict)
+        model_ids.update(bulkInsertNamed(pm.ModelFile, model_datasource))
+        file_ids.update(bulkInsertNamed(pm.SubFile, files_datasource))
+        ids = {'model_file': model_ids, 'sub_file': file_ids}
+        bulkInsert(pm.ModelFile_SubFile, namesToIds(mf_datasource, ids))
+        bulkInsert(pm.Run_ModelFile, namesToIds(rm_datasource, ids))
+        bulkInsert(pm.Run_SubFile, namesToIds(rs_datasource, ids))
             
 
+ENTRY_ERRORS = (IntegrityError, DataError, KeyError, TypeError, ValueError)
+""" Errors caused by the contents of a single log, see addLogEntries. """
+
+def addLogEntries(logs, skip_failed=False):
+    """Add the records for a list of loaded models to the database.
+    
+    All of the logs are added in a single transaction, with each log in its
+    own savepoint. By default either all or none of them are added. If 
+    skip_failed is True a log that fails with one of the ENTRY_ERRORS is 
+    rolled back to its savepoint and the others are still added. Any other
+    error (e.g. the database is locked) rolls back the whole transaction.
+    
+    Args:
+        logs(list): the LogBuilder.AllLogs to add.
+        skip_failed=False(bool): whether to skip logs that can't be added.
+    
+    Return:
+        list - the Run.id of each new Run record, in the order of logs, or
+            None for logs that were skipped.
+    """
+    run_ids = []
+    with pm.batchSession():
+        for all_logs in logs:
+            try:
+                with pm.batchSession():
+                    if all_logs.dat is not None:
+                        dat = addDat(all_logs.dat)
+                    else:
+                        dat = None
+                    run = addRun(all_logs.run, all_logs.run_hash, all_logs.ief_dir, 
+                                 all_logs.tcf_dir, dat)
+                    addAllIed(all_logs.ieds, run)
+                    addAllModel(all_logs.models, run)
+            except ENTRY_ERRORS as err:
+                if not skip_failed: raise
+                logger.error('Unable to add log entry for: %s' % all_logs.run_hash)
+                logger.exception(err)
+                run_ids.append(None)
+            else:
+                run_ids.append(run.id)
+    return run_ids
+
+
+def bulkInsert(model, rows):
+    """Write rows to a table with chunked insert_many calls.
+    
+    Each chunk is INSERT_CHUNK_SIZE rows, which keeps the number of bound 
+    variables well below the SQLite limit for all of the tables. Fields not
+    included in the row dicts get their default values per row.
+    
+    Args:
+        model(peewee.Model): the table to insert into.
+        rows(list): dicts of {field name: value}. All dicts must have the
+            same keys.
+    """
+    for chunk in chunked(rows, INSERT_CHUNK_SIZE):
+        model.insert_many(chunk).execute()
+
+
+def bulkInsertNamed(model, rows):
+    """Write new records to one of the pm.NamedModel tables.
+    
+    Sets the name_key of each row before writing them with bulkInsert.
+    
+    Args:
+        model(peewee.Model): one of Dat, ModelFile, SubFile or Ied.
+        rows(list): dicts of {field name: value}, including the name.
+    
+    Return:
+        dict - {name: id} of the new records.
+    """
+    if not rows: return {}
+    for row in rows:
+        row['name_key'] = pm.nameKey(row['name'])
+    bulkInsert(model, rows)
+    return existingIds(model, [row['name'] for row in rows])
+
+
+def namesToIds(rows, ids):
+    """Swap the file names in association rows for the file ids.
+    
+    Args:
+        rows(list): dicts of {field name: value} for one of the association
+            tables, with the file names as the foreign key values.
+        ids(dict): {field name: {name: id}} for the foreign key fields.
+    
+    Return:
+        list - rows, updated in place.
+    """
+    for row in rows:
+        for field, lookup in ids.items():
+            if field in row:
+                row[field] = lookup[row[field]]
+    return rows
+
+
+def existingNames(field, names):
+    """Return the names that already exist in a table.
+    
+    Args:
+        field(peewee.Field): the field to check against (e.g. SubFile.name).
+        names(iterable): the values to look for.
+    
+    Return:
+        set - containing the values in names that were found in field.
+    """
+    found = set()
+    for chunk in chunked(set(names), IN_QUERY_CHUNK_SIZE):
+        query = field.model.select(field).where(field << chunk).tuples()
+        found.update([q[0] for q in query])
+    return found
+
+
+def existingIds(model, names):
+    """Return the ids of the records in a table with the given names.
+    
+    Args:
+        model(peewee.Model): one of Dat, ModelFile, SubFile or Ied.
+        names(iterable): the name values to look for.
+    
+    Return:
+        dict - {name: id} for the names that were found.
+    """
+    found = {}
+    for chunk in chunked(set(names), IN_QUERY_CHUNK_SIZE):
+        query = model.select(model.name, model.id).where(model.name << chunk).tuples()
+        found.update(query)
+    return found
+
+
+def existingRunHashes(run_hashes):
+    """Return the run hashes that are already in the Run table.
+    
+    Args:
+        run_hashes(iterable): Run.run_hash values to look for.
+    
+    Return:
+        set - containing the hashes in run_hashes that were found.
+    """
+    return existingNames(pm.Run.run_hash, run_hashes)
+
+
+def existingModelSubfiles(model_names):
+    """Return the ModelFile_SubFile records referenced by the given ModelFile's.
+    
+    Args:
+        model_names(iterable): ModelFile.name values to query.
+    
+    Return:
+        set - containing (ModelFile.name, SubFile.name) tuples.
+    """
+    found = set()
+    for chunk in chunked(set(model_names), IN_QUERY_CHUNK_SIZE):
+        query = (pm.ModelFile_SubFile
+                 .select(pm.ModelFile.name, pm.SubFile.name)
+                 .join(pm.SubFile)
+                 .switch(pm.ModelFile_SubFile)
+                 .join(pm.ModelFile)
+                 .where(pm.ModelFile.name << chunk)
+                 .tuples())
+        found.update(query)
+    return found
+
+
+def existingTypeSubfiles(file_names):
+    """Return the ModelFile.model_type's that the given SubFile's are used by.
+    
+    This is the set based equivalent of subFileIsNew: a SubFile is new for a
+    model_type if (model_type, name) is not in the returned set.
+    
+    Args:
+        file_names(iterable): SubFile.name values to query.
+    
+    Return:
+        set - containing (ModelFile.model_type, SubFile.name) tuples.
+    """
+    found = set()
+    for chunk in chunked(set(file_names), IN_QUERY_CHUNK_SIZE):
+        query = (pm.ModelFile_SubFile
+                 .select(pm.ModelFile.model_type, pm.SubFile.name)
+                 .join(pm.SubFile)
+                 .switch(pm.ModelFile_SubFile)
+                 .join(pm.ModelFile)
+                 .where(pm.SubFile.name << chunk)
+                 .distinct()
+                 .tuples())
+        found.update(query)
+    return found
+
+
 def subFileIsNew(mtype, fname):
     """Test if a SubFile is new.
     
@@ -322,21 +534,27 @@ def subfileExists(name):
         return False
 
 def runModelFileExists(r, m):
-    query = pm.Run_ModelFile.select().where((pm.Run_ModelFile.run_file_id == r) & (pm.Run_ModelFile.model_file_id == m))
+    query = (pm.Run_ModelFile.select().join(pm.ModelFile)
+             .where((pm.Run_ModelFile.run == r) & (pm.ModelFile.name == m)))
     if query.exists():
         return True
     else:
         return False
 
 def modelSubfileExists(m, s):
-    query = pm.ModelFile_SubFile.select().where((pm.ModelFile_SubFile.model_file_id == m) & (pm.ModelFile_SubFile.sub_file_id == s))
+    query = (pm.ModelFile_SubFile.select()
+             .join(pm.ModelFile)
+             .switch(pm.ModelFile_SubFile)
+             .join(pm.SubFile)
+             .where((pm.ModelFile.name == m) & (pm.SubFile.name == s)))
     if query.exists():
         return True
     else:
         return False
 
 def RunSubfileExists(r, s):
-    query = pm.Run_SubFile.select().where((pm.Run_SubFile.run_file_id == r) & (pm.Run_SubFile.sub_file_id == s))
+    query = (pm.Run_SubFile.select().join(pm.SubFile)
+             .where((pm.Run_SubFile.run == r) & (pm.SubFile.name == s)))
     if query.exists():
         return True
     else:
@@ -357,8 +575,7 @@ def getRunRow(run_id):
     """    
     pm.connectDB()
     try:
-        query = pm.Run.get(pm.Run.id == run_id)
-        run = shortcuts.model_to_dict(query, recurse=False)
+        run = pm.Run.select().where(pm.Run.id == run_id).dicts().get()
     finally:
         pm.disconnectDB()
     return run
@@ -367,86 +584,188 @@ def getRunRow(run_id):
 def deleteRunRow(run_id, delete_recursive=False):
     """Delete a record in the Run table.
     
-    Delete's a Run record. If delete_recursive it will delete any associated
-    records in the other tables. This is done in a (semi)intelligent way:
-    All ModelFile records associated with this run_id in the Run_ModelFile
-    table will be deleted IF they are not refernced by another Run.id in the
-    Run_ModelFile table. This is also True of the Dat reference.
+    Delete's a Run record. The Run_ModelFile, Run_SubFile and Run_Ied records
+    for the run are removed by the ON DELETE CASCADE foreign keys.
     
-    TODO:
-        I don't think this is very well written at the moment and is definitely
-            quite slow.
+    If delete_recursive any ModelFile, Ied and Dat records used by the run
+    will be deleted IF they are not referenced by another Run. Only the 
+    references to the records used by this run are counted, using indexed 
+    NOT EXISTS lookups, so the time taken depends on the size of the run 
+    rather than the size of the database. Deleting the ModelFile's cascades
+    to their ModelFile_SubFile records.
+    
+    Any SubFile records used by the run that are no longer referenced by
+    either ModelFile_SubFile or Run_SubFile are deleted and the new_file 
+    flags of the ModelFile's and SubFile's used by the run are updated (see
+    updateNewStatus).
     
     Args:
         run_id(int): the Run.id value to query against.
-        delete_recursive=False(bool): if True will delete any foreign key
-            associations and remove any associated Dat and ModelFile records.
+        delete_recursive=False(bool): if True will remove any associated Dat,
+            ModelFile and Ied records that are not used by another run.
     """
     pm.connectDB()
-    
     try:
-        model_del = []
-        ied_del = []
-        dat = None
-        r = None
-        try:
-            r = pm.Run.get(pm.Run.id == run_id)
-        except Exception as err:
+        if not pm.Run.select().where(pm.Run.id == run_id).exists():
             logger.warning('Could not find entry for run_id = %s' % run_id)
-            logger.exception(err)
+            return
+        deleteRunRows([run_id], delete_recursive)
+    finally:
+        pm.disconnectDB()
 
-        if delete_recursive:
-            
-            # If we have a dat in this run
-            if r.dat is not None:
-                run_d = pm.Dat.get(name=r.dat)
-                
-                # If that dat isn't referenced in any other runs
-                if pm.Run.select().filter(dat=run_d.name).count() < 2:
-                    dat = run_d.name
+
+def deleteRunRows(run_ids, delete_recursive=False, progress_callback=None):
+    """Delete many records in the Run table.
+    
+    Works in the same way as deleteRunRow, but all of the runs are deleted
+    in a single transaction and the unused SubFile removal and new_file 
+    flag update are done once at the end. Files are only deleted with
+    delete_recursive if they are not used by a Run outside of run_ids.
+    
+    Args:
+        run_ids(list): the Run.id values to delete.
+        delete_recursive=False(bool): if True will remove any associated Dat,
+            ModelFile and Ied records that are not used by another run.
+        progress_callback=None(func): called with (value, maximum, message)
+            as the delete progresses.
+    
+    Return:
+        int - the number of Run records deleted.
+    """
+    def progress(value, message):
+        if progress_callback is not None:
+            progress_callback(value, total_steps, message)
+    
+    run_ids = list(set(run_ids))
+    run_chunks = list(chunked(run_ids, DELETE_CHUNK_SIZE))
+    total_steps = len(run_chunks) + 3
+    count = 0
+
+    pm.connectDB()
+    try:
+        with pm.logit_db.atomic():
+            progress(1, 'Finding files used by runs...')
+            status_models, status_files = newStatusGroups(run_ids)
+            model_del, ied_del, dat_del = [], [], []
+            if delete_recursive:
+                model_del, ied_del, dat_del = unsharedRunFiles(run_ids)
             
-    #         # Get all the run_subfile's referenced
-    #         sq = pm.Run_SubFile.select().where(pm.Run_SubFile.run_id == run_id)
-
-            # Get all modelfile's and a count of how many times there are referenced
-            mq = (pm.Run_ModelFile
-                    .select(pm.Run_ModelFile.run_id, pm.Run_ModelFile.model_file_id, fn.Count(pm.Run_ModelFile.model_file_id).alias('count'))
-                    .group_by(pm.Run_ModelFile.model_file_id)
-                 )
-            # If they are only referenced by this run add to the delete list
-            # TODO: VERY slow. Must try harder
-            for m in mq:
-                if m.count < 2 and m.run_id == run_id:
-                    model_del.append(m.model_file_id)
+            # The SubFile's that might be orphaned by the delete
+            sub_files = set(status_files)
+            for chunk in chunked(run_ids, IN_QUERY_CHUNK_SIZE):
+                query = (pm.Run_SubFile.select(pm.Run_SubFile.sub_file_id)
+                         .where(pm.Run_SubFile.run_id << chunk).distinct().tuples())
+                sub_files.update([q[0] for q in query])
             
-            # Do the same for ied files
-            iq = (pm.Run_Ied
-                    .select(pm.Run_Ied.run_id, pm.Run_Ied.ied_id, fn.Count(pm.Run_Ied.ied_id).alias('count'))
-                    .group_by(pm.Run_Ied.ied_id)
-                 )
-            for i in iq:
-                if i.count < 2 and i.run_id == run_id:
-                    ied_del.append(i.ied_id)
+            for i, chunk in enumerate(run_chunks):
+                progress(i + 2, 'Deleting runs %s of %s...' % (
+                    min((i + 1) * DELETE_CHUNK_SIZE, len(run_ids)), len(run_ids)))
+                count += pm.Run.delete().where(pm.Run.id << chunk).execute()
             
-
-        r.delete_instance(recursive=delete_recursive)
-        
-        with pm.logit_db.atomic():
-            if dat is not None: 
-                deleteDatRow(dat, connect_db=False)
-            for m in model_del:
-                deleteModelRow(m, remove_orphans=False, connect_db=False)
-            for i in ied_del:
-                deleteIedRow(i, remove_orphans=False, connect_db=False)
-
+            progress(total_steps - 1, 'Deleting unused files...')
+            deleteByIds(pm.ModelFile, model_del)
+            deleteByIds(pm.Ied, ied_del)
+            deleteByName(pm.Dat, dat_del)
+            deleteUnusedSubFiles(sub_files)
+            progress(total_steps, 'Recalculating file status...')
+            updateNewStatus(model_files=status_models, sub_files=status_files)
     finally:
         pm.disconnectDB()
+    return count
+
+
+def unsharedRunFiles(run_ids):
+    """Find the ModelFile, Ied and Dat records only used by the given Run's.
+    
+    The run_ids are written to a temporary table so that any number of 
+    them can be checked in one query.
+    
+    Args:
+        run_ids(list): the Run.id's to check.
+    
+    Return:
+        tuple(list, list, list) - the ModelFile.id, Ied.id and Dat.name 
+            values that are not referenced by any Run outside of run_ids.
+    """
+    tables = {
+        'run': pm.Run._meta.table_name, 'rm': pm.Run_ModelFile._meta.table_name,
+        'ri': pm.Run_Ied._meta.table_name, 'ids': 'SELECT id FROM temp.logit_run_ids',
+    }
+    checks = [
+        ('SELECT DISTINCT rm.model_file_id FROM {rm} AS rm WHERE rm.run_id IN ({ids}) '
+         'AND NOT EXISTS (SELECT 1 FROM {rm} AS other WHERE other.model_file_id = rm.model_file_id '
+         'AND other.run_id NOT IN ({ids}))'),
+        ('SELECT DISTINCT ri.ied_id FROM {ri} AS ri WHERE ri.run_id IN ({ids}) '
+         'AND NOT EXISTS (SELECT 1 FROM {ri} AS other WHERE other.ied_id = ri.ied_id '
+         'AND other.run_id NOT IN ({ids}))'),
+        ('SELECT DISTINCT run.dat_id FROM {run} AS run WHERE run.id IN ({ids}) '
+         'AND run.dat_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {run} AS other '
+         'WHERE other.dat_id = run.dat_id AND other.id NOT IN ({ids}))'),
+    ]
+    pm.logit_db.execute_sql('CREATE TEMP TABLE IF NOT EXISTS logit_run_ids (id INTEGER PRIMARY KEY)')
+    pm.logit_db.execute_sql('DELETE FROM temp.logit_run_ids')
+    for chunk in chunked(set(run_ids), IN_QUERY_CHUNK_SIZE):
+        pm.logit_db.execute_sql(
+            'INSERT INTO temp.logit_run_ids (id) VALUES %s' % ', '.join(['(?)'] * len(chunk)), 
+            chunk)
+    
+    results = []
+    for sql in checks:
+        cursor = pm.logit_db.execute_sql(sql.format(**tables))
+        results.append([row[0] for row in cursor.fetchall()])
+    pm.logit_db.execute_sql('DELETE FROM temp.logit_run_ids')
+    return tuple(results)
+
+
+def deleteByName(table, names):
+    """Delete the records in a table by their unique name.
+    
+    Args:
+        table(peewee.Model): one of ModelFile, SubFile, Ied or Dat.
+        names(list): the names to delete.
+    """
+    for chunk in chunked(set(names), IN_QUERY_CHUNK_SIZE):
+        table.delete().where(table.name << chunk).execute()
+
+
+def deleteByIds(table, ids):
+    """Delete the records in a table by their id primary key.
+    
+    Args:
+        table(peewee.Model): the table to delete from.
+        ids(list): the ids to delete.
+    """
+    for chunk in chunked(set(ids), IN_QUERY_CHUNK_SIZE):
+        table.delete().where(table.id << chunk).execute()
+
+
+def deleteUnusedSubFiles(sub_files):
+    """Delete any of the given SubFile's that are no longer referenced.
+    
+    A SubFile is unused when it isn't in either the ModelFile_SubFile or
+    the Run_SubFile table. Both are checked with indexed NOT EXISTS lookups.
+    
+    Args:
+        sub_files(list): the SubFile.id's to check.
+    
+    Return:
+        int - the number of SubFile records deleted.
+    """
+    count = 0
+    for chunk in chunked(set(sub_files), IN_QUERY_CHUNK_SIZE):
+        mf_refs = pm.ModelFile_SubFile.select().where(pm.ModelFile_SubFile.sub_file_id == pm.SubFile.id)
+        run_refs = pm.Run_SubFile.select().where(pm.Run_SubFile.sub_file_id == pm.SubFile.id)
+        count += (pm.SubFile.delete()
+                  .where((pm.SubFile.id << chunk) & ~fn.EXISTS(mf_refs) & ~fn.EXISTS(run_refs))
+                  .execute())
+    return count
     
 
 def deleteDatRow(dat_name, connect_db=True):
     """Delete a record in the Dat table.
     
-    Deletes the specified Dat record.
+    Deletes the specified Dat record and clears the Run.dat reference of 
+    any Run's that use it.
     
     Args:
         dat_name(str): the Dat.name to query against.
@@ -455,7 +774,9 @@ def deleteDatRow(dat_name, connect_db=True):
         pm.connectDB()
     try:
         d = pm.Dat.get(pm.Dat.name == dat_name)
-        d.delete_instance()
+        with pm.logit_db.atomic():
+            pm.Run.update(dat=None).where(pm.Run.dat == dat_name).execute()
+            d.delete_instance()
     finally:
         if connect_db:
             pm.disconnectDB()
@@ -479,24 +800,31 @@ def deleteIedRow(ied_name, remove_orphans=True, connect_db=True):
             pm.disconnectDB()
     
 
-def deleteModelRow(model_name, remove_orphans=True, connect_db=True):
+def deleteModelRow(model_name, remove_orphans=True, connect_db=True, update_status=True):
     """Delete a record in the ModelFile table.
     
     Deletes the specified ModelFile record and any foreign key associations.
     
     Args:
         model_name(str): the ModelFile.name to query against.
-        remove_orphans=True(bool): if True will call deleteOrphanFiles after.
+        remove_orphans=True(bool): if True will delete any of the ModelFile's
+            SubFile's that are no longer used.
+        update_status=True(bool): if True will update the new_file flags of
+            the SubFile's used by the ModelFile.
     """
     if connect_db:
         pm.connectDB()
     try:
         m = pm.ModelFile.get(pm.ModelFile.name == model_name)
-        m.delete_instance(recursive=True)
-        
-        # Delete any orphaned subfiles
-        if remove_orphans:
-            deleteOrphanFiles(execute=True)
+        sub_files = newStatusGroups([], [m.id])[1]
+        with pm.logit_db.atomic():
+            m.delete_instance(recursive=True)
+            if update_status and sub_files:
+                updateNewStatus(sub_files=sub_files)
+            
+            # Delete any orphaned subfiles
+            if remove_orphans:
+                deleteUnusedSubFiles(sub_files)
         
     finally:
         if connect_db:
@@ -506,114 +834,324 @@ def deleteModelRow(model_name, remove_orphans=True, connect_db=True):
 def deleteOrphanFiles(run_id=-1, execute=True, connect_db=True):
     """Find any orphaned file references and delete them from the database.
     
-    Checks the SubFile table for and SubFile.name values that aren't in the
-    ModelFile_SubFile table and deletes them.
+    See removeOrphans.
     
     Args:
-        execute=True(bool): I don't think this does anything? Should probably
-            always leave as default until further notice. DEBUG.
+        run_id=-1(int): if given the Run_SubFile and Run_Ied records for 
+            this Run.id are deleted first.
+        execute=True(bool): if False nothing is deleted (a dry run).
+    
+    Return:
+        dict - the removeOrphans results.
     """    
     if connect_db:
         pm.connectDB()
     try:
-        # Delete any orphaned subfiles
-        subs = pm.ModelFile_SubFile.select(pm.ModelFile_SubFile.sub_file_id)
-        q = pm.SubFile.delete().where(~(pm.SubFile.name << subs))
-        if execute:
-            q.execute()
-        # Need to clean up the subfile entries as well
-        subs = pm.Run_SubFile.select(pm.Run_SubFile.sub_file_id)
-        q = pm.SubFile.delete().where(~(pm.SubFile.name << subs))
-        if execute:
-            q.execute()
-        
-        if not run_id == -1:
-            # Delete all of the run references subfile (Run_SubFile)
-            rsquery = pm.Run_SubFile.delete().where(pm.Run_SubFile.run_id == run_id)
-            if execute:
-                rsquery.execute()
-        
-            # Delete all of the run referencd ied files (Run_Ied)
-            iquery = pm.Run_Ied.delete().where(pm.Run_Ied.run_id == run_id)
-            if execute:
-                iquery.execute()
-    
+        if not run_id == -1 and execute:
+            with pm.logit_db.atomic():
+                pm.Run_SubFile.delete().where(pm.Run_SubFile.run_id == run_id).execute()
+                pm.Run_Ied.delete().where(pm.Run_Ied.run_id == run_id).execute()
+        return removeOrphans(dry_run=not execute)
     finally:
         if connect_db:
             pm.disconnectDB()
+
+
+def _orphanChecks():
+    """The anti-join conditions used by removeOrphans, in the order they run.
     
+    Return:
+        list - containing (table, sql condition) tuples. The condition is
+            true for a record in table (aliased as 'x') that is an orphan.
+    """
+    t = dict((m.__name__, m._meta.table_name) for m in pm.getAllTables())
+    missing = 'NOT EXISTS (SELECT 1 FROM {0} AS p WHERE p.{1} = x.{2})'
+    return [
+        # Association records that point to a record that doesn't exist
+        (pm.ModelFile_SubFile, missing.format(t['ModelFile'], 'id', 'model_file_id') + 
+            ' OR ' + missing.format(t['SubFile'], 'id', 'sub_file_id')),
+        (pm.Run_ModelFile, missing.format(t['Run'], 'id', 'run_id') + 
+            ' OR ' + missing.format(t['ModelFile'], 'id', 'model_file_id')),
+        (pm.Run_SubFile, missing.format(t['Run'], 'id', 'run_id') + 
+            ' OR ' + missing.format(t['SubFile'], 'id', 'sub_file_id')),
+        (pm.Run_Ied, missing.format(t['Run'], 'id', 'run_id') + 
+            ' OR ' + missing.format(t['Ied'], 'id', 'ied_id')),
+        # Files that aren't used by any Run
+        (pm.ModelFile, missing.format(t['Run_ModelFile'], 'model_file_id', 'id')),
+        (pm.Ied, missing.format(t['Run_Ied'], 'ied_id', 'id')),
+        (pm.Dat, missing.format(t['Run'], 'dat_id', 'name')),
+        (pm.SubFile, missing.format(t['ModelFile_SubFile'], 'sub_file_id', 'id') + 
+            ' AND ' + missing.format(t['Run_SubFile'], 'sub_file_id', 'id')),
+    ]
 
-def updateNewStatus():
-    """Updates the Run_ModelFile.new_file and ModelFile_SubFile.new_file status flags.
+
+def removeOrphans(dry_run=False, batch_size=None, progress_callback=None):
+    """Delete records that are no longer used by any Run.
     
-    Updated the new_file status flag to True for all ModelFile and SubFile
-    records that come first when ordering by name and timestamp.
+    Removes, in order:
+        - ModelFile_SubFile, Run_ModelFile, Run_SubFile and Run_Ied records
+          that reference a record that doesn't exist.
+        - ModelFile, Ied and Dat records not referenced by any Run.
+        - SubFile records not referenced by ModelFile_SubFile or Run_SubFile.
     
-    For Run_ModelFile the tables are ordered by ModelFile.name, 
-    Run_ModelFile.timestamp and the first one updated to True.
+    Orphans are found with indexed NOT EXISTS anti-joins and deleted in 
+    batches of batch_size, walking the primary key so that each batch only
+    scans the rows after the last one. Everything is done in a single 
+    transaction. With dry_run the deletes are rolled back at the end, so the
+    results show exactly what would be removed (including SubFile's that 
+    are only orphaned once their ModelFile is deleted).
+    
+    Args:
+        dry_run=False(bool): if True nothing is changed in the database.
+        batch_size=None(int): number of records found and deleted at a time.
+            Defaults to ORPHAN_BATCH_SIZE.
+        progress_callback=None(func): called with (value, maximum, message)
+            before each table is checked.
+    
+    Return:
+        dict - {table name: list} for each table, where the list contains 
+            the primary keys of the records that were (or would be) deleted.
+    """
+    if batch_size is None: batch_size = ORPHAN_BATCH_SIZE
+    checks = _orphanChecks()
+    results = {}
     
-    For ModelFile_SubFile the tables are ordered by ModelFile.model_type, 
-    ModelFile_SubFile.sub_file_id, ModelFile_SubFile.timestamp and the first 
-    one updated to True.
-    """    
     pm.connectDB()
     try:
-        query = (pm.ModelFile_SubFile
-                    .select(pm.ModelFile_SubFile, pm.ModelFile, pm.SubFile)
-                    #.distinct(pm.ModelFile_SubFile.sub_file_id)
-                    .join(pm.SubFile)
-                    .switch()#pm.ModelFile_SubFile)
-                    .join(pm.ModelFile)
-                    .order_by(
-                            pm.ModelFile.model_type, 
-                            pm.ModelFile_SubFile.sub_file_id, 
-                            pm.ModelFile_SubFile.timestamp)
-                    )
-        
-        query.execute()
-    except:
+        with pm.logit_db.atomic() as txn:
+            for i, (table, condition) in enumerate(checks):
+                if progress_callback is not None:
+                    progress_callback(i + 1, len(checks), 'Checking %s for orphans...' % table.__name__)
+                key = table._meta.primary_key.column_name
+                sql = 'SELECT x.{0} FROM {1} AS x WHERE ({2}){3} ORDER BY x.{0} LIMIT ?'
+                found = []
+                last = None
+                while True:
+                    if last is None:
+                        cursor = pm.logit_db.execute_sql(
+                            sql.format(key, table._meta.table_name, condition, ''), (batch_size,))
+                    else:
+                        cursor = pm.logit_db.execute_sql(
+                            sql.format(key, table._meta.table_name, condition, ' AND x.%s > ?' % key),
+                            (last, batch_size))
+                    batch = [row[0] for row in cursor.fetchall()]
+                    if not batch: break
+                    table.delete().where(table._meta.primary_key << batch).execute()
+                    found.extend(batch)
+                    last = batch[-1]
+                    if len(batch) < batch_size: break
+                results[table.__name__] = found
+                if found:
+                    logger.info('%s orphaned %s records' % (len(found), table.__name__))
+            if dry_run:
+                txn.rollback()
+    finally:
         pm.disconnectDB()
-        raise
+    return results
+
+
+def updateNewStatus(run_ids=None, model_files=None, sub_files=None):
+    """Updates the Run_ModelFile.new_file and ModelFile_SubFile.new_file status flags.
+    
+    Sets the new_file flag to True for the first record, by timestamp, of 
+    each ModelFile and SubFile and to False for all the others:
+    
+    For Run_ModelFile the records are grouped by ModelFile and ordered by
+    Run_ModelFile.timestamp.
     
+    For ModelFile_SubFile the records are grouped by ModelFile.model_type and
+    ModelFile_SubFile.sub_file_id and ordered by ModelFile_SubFile.timestamp.
+    This is the same test used by subFileIsNew when the records are added.
     
+    Records with the same timestamp are ordered by id. The flags are worked 
+    out with a couple of set based UPDATE statements using ROW_NUMBER()
+    (or correlated sub queries on SQLite versions without window functions)
+    and only the records whose flag changes are written.
+    
+    By default all records are updated. If any of run_ids, model_files or 
+    sub_files are given only the groups containing them are updated.
+    
+    Args:
+        run_ids=None(list): Run.id's to update the groups of. Must be called
+            before the Run's are deleted.
+        model_files=None(list): ModelFile.id's to update the Run_ModelFile
+            groups for.
+        sub_files=None(list): SubFile.id's to update the ModelFile_SubFile
+            groups for.
+    """
+    full_update = run_ids is None and model_files is None and sub_files is None
+    pm.connectDB()
     try:
-        query2 = (pm.Run_ModelFile
-                    .select(pm.Run_ModelFile, pm.Run, pm.ModelFile)
-                    #.distinct(pm.Run_ModelFile.model_file_id)
-                    .join(pm.ModelFile)
-                    .switch(pm.Run_ModelFile)
-                    .join(pm.Run)
-                    .order_by(
-                            pm.ModelFile.name, 
-                            pm.Run_ModelFile.timestamp)
-                    )
-        
-        query2.execute()
-    except:
+        with pm.logit_db.atomic():
+            if full_update:
+                _updateModelNewStatus()
+                _updateSubFileNewStatus()
+            else:
+                model_files = set(model_files) if model_files is not None else set()
+                sub_files = set(sub_files) if sub_files is not None else set()
+                if run_ids:
+                    run_models, run_files = newStatusGroups(run_ids)
+                    model_files.update(run_models)
+                    sub_files.update(run_files)
+                for chunk in chunked(model_files, IN_QUERY_CHUNK_SIZE):
+                    _updateModelNewStatus(chunk)
+                for chunk in chunked(sub_files, IN_QUERY_CHUNK_SIZE):
+                    _updateSubFileNewStatus(chunk)
+    finally:
         pm.disconnectDB()
-        raise
+
+
+def newStatusGroups(run_ids, model_files=None):
+    """Get the new_file groups that a set of Run's are part of.
+    
+    Args:
+        run_ids(list): the Run.id's to find the groups for.
+        model_files=None(list): ModelFile.id's to include as well.
+    
+    Return:
+        tuple(set, set) - the ModelFile.id's used by the Run's (the 
+            Run_ModelFile groups) and the SubFile.id's used by those
+            ModelFile's (the ModelFile_SubFile groups).
+    """
+    model_files = set(model_files) if model_files is not None else set()
+    for chunk in chunked(set(run_ids), IN_QUERY_CHUNK_SIZE):
+        query = (pm.Run_ModelFile
+                 .select(pm.Run_ModelFile.model_file_id)
+                 .where(pm.Run_ModelFile.run_id << chunk)
+                 .distinct()
+                 .tuples())
+        model_files.update([q[0] for q in query])
+
+    sub_files = set()
+    for chunk in chunked(model_files, IN_QUERY_CHUNK_SIZE):
+        query = (pm.ModelFile_SubFile
+                 .select(pm.ModelFile_SubFile.sub_file_id)
+                 .where(pm.ModelFile_SubFile.model_file_id << chunk)
+                 .distinct()
+                 .tuples())
+        sub_files.update([q[0] for q in query])
+    return model_files, sub_files
+
+
+def _useWindowFunctions():
+    return pm.logit_db.server_version >= (3, 25, 0)
+
+
+def _inClause(column, values):
+    """Return an 'AND column IN (?, ...)' sql clause and its parameters."""
+    if values is None:
+        return '', []
+    values = list(values)
+    return ' AND %s IN (%s)' % (column, ', '.join(['?'] * len(values))), values
+
+
+def _rankedModelSql(model_files=None, window=None):
+    """Return a 'ranked' CTE of Run_ModelFile (id, new_file, is_first) rows.
+    
+    is_first is what the new_file flag should be for the record. See
+    updateNewStatus.
+    
+    Args:
+        model_files=None(list): restrict to these ModelFile.id groups.
+        window=None(bool): use window functions. If None they are used when
+            the SQLite version supports them.
+    
+    Return:
+        tuple(str, list) - the sql and its parameters.
+    """
+    if window is None: window = _useWindowFunctions()
+    tables = {'rm': pm.Run_ModelFile._meta.table_name, 'run': pm.Run._meta.table_name}
+    where, params = _inClause('rm.model_file_id', model_files)
+
+    if window:
+        first = ('ROW_NUMBER() OVER (PARTITION BY rm.model_file_id '
+                 'ORDER BY rm.timestamp, rm.id) = 1')
+    else:
+        first = ('NOT EXISTS (SELECT 1 FROM {rm} AS prev INNER JOIN {run} AS prev_run ON prev_run.id = prev.run_id '
+                 'WHERE prev.model_file_id = rm.model_file_id AND (prev.timestamp < rm.timestamp OR '
+                 '(prev.timestamp = rm.timestamp AND prev.id < rm.id)))').format(**tables)
+    sql = ('WITH ranked AS ('
+           'SELECT rm.id AS id, rm.new_file AS new_file, {first} AS is_first '
+           'FROM {rm} AS rm INNER JOIN {run} AS run ON run.id = rm.run_id '
+           'WHERE 1{where}) '
+           ).format(first=first, where=where, **tables)
+    return sql, params
+
+
+def _rankedSubFileSql(sub_files=None, window=None):
+    """Return a 'ranked' CTE of ModelFile_SubFile (id, new_file, is_first) rows.
+    
+    is_first is what the new_file flag should be for the record. See
+    updateNewStatus.
+    
+    Args:
+        sub_files=None(list): restrict to the groups of these SubFile.id's.
+        window=None(bool): use window functions. If None they are used when
+            the SQLite version supports them.
     
+    Return:
+        tuple(str, list) - the sql and its parameters.
+    """
+    if window is None: window = _useWindowFunctions()
+    tables = {'msf': pm.ModelFile_SubFile._meta.table_name, 'mf': pm.ModelFile._meta.table_name}
+    where, params = _inClause('msf.sub_file_id', sub_files)
+
+    if window:
+        first = ('ROW_NUMBER() OVER (PARTITION BY mf.model_type, msf.sub_file_id '
+                 'ORDER BY msf.timestamp, msf.id) = 1')
+    else:
+        first = ('NOT EXISTS (SELECT 1 FROM {msf} AS prev INNER JOIN {mf} AS prev_mf ON prev_mf.id = prev.model_file_id '
+                 'WHERE prev.sub_file_id = msf.sub_file_id AND prev_mf.model_type = mf.model_type AND '
+                 '(prev.timestamp < msf.timestamp OR (prev.timestamp = msf.timestamp AND prev.id < msf.id)))'
+                 ).format(**tables)
+    sql = ('WITH ranked AS ('
+           'SELECT msf.id AS id, msf.new_file AS new_file, {first} AS is_first '
+           'FROM {msf} AS msf INNER JOIN {mf} AS mf ON mf.id = msf.model_file_id '
+           'WHERE 1{where}) '
+           ).format(first=first, where=where, **tables)
+    return sql, params
+
+
+def _updateModelNewStatus(model_files=None, window=None):
+    """Set Run_ModelFile.new_file for the given ModelFile's (or all of them)."""
+    sql, params = _rankedModelSql(model_files, window)
+    sql += ('UPDATE %s SET new_file = NOT new_file WHERE id IN '
+            '(SELECT id FROM ranked WHERE is_first != new_file)' % pm.Run_ModelFile._meta.table_name)
+    pm.logit_db.execute_sql(sql, params)
+
+
+def _updateSubFileNewStatus(sub_files=None, window=None):
+    """Set ModelFile_SubFile.new_file for the given SubFile's (or all of them)."""
+    sql, params = _rankedSubFileSql(sub_files, window)
+    sql += ('UPDATE %s SET new_file = NOT new_file WHERE id IN '
+            '(SELECT id FROM ranked WHERE is_first != new_file)' % pm.ModelFile_SubFile._meta.table_name)
+    pm.logit_db.execute_sql(sql, params)
+
+
+def verifyNewStatus():
+    """Check the stored new_file flags against a full updateNewStatus.
+    
+    The flags are kept up to date when records are added and deleted. This
+    works out what updateNewStatus would set them to, without changing 
+    anything, and reports any that are different.
+    
+    Return:
+        dict - {'ModelFile_SubFile': list, 'Run_ModelFile': list} where the 
+            lists contain an (id, stored value, expected value) tuple for 
+            each record that has the wrong new_file flag.
+    """
+    mismatches = {}
+    pm.connectDB()
     try:
-        found_names = []
-        with pm.logit_db.atomic():
-            for q in query:
-                i = q.id
-                n = q.sub_file_id
-                if not n in found_names:
-                    found_names.append(n)
-                    q = pm.ModelFile_SubFile.update(new_file=True).where(pm.ModelFile_SubFile.id == i)
-                    q.execute()
-            
-            run_found_names = []
-            for q in query2:
-                ri = q.id
-                rn = q.model_file_id
-                if not rn in run_found_names:
-                    run_found_names.append(rn)
-                    q = pm.Run_ModelFile.update(new_file=True).where(pm.Run_ModelFile.id == ri)
-                    q.execute()
+        for key, sql_func in [('ModelFile_SubFile', _rankedSubFileSql), 
+                              ('Run_ModelFile', _rankedModelSql)]:
+            sql, params = sql_func()
+            sql += 'SELECT id, new_file, is_first FROM ranked WHERE is_first != new_file ORDER BY id'
+            cursor = pm.logit_db.execute_sql(sql, params)
+            mismatches[key] = [(r[0], bool(r[1]), bool(r[2])) for r in cursor.fetchall()]
     finally:
         pm.disconnectDB()
+    return mismatches
 
 
 def updateRunRow(updateDict, run_id):
@@ -631,6 +1169,17 @@ def updateRunRow(updateDict, run_id):
         pm.disconnectDB()
     
 
+def updateRunRows(updates):
+    """Update values in many Run records in a single transaction.
+    
+    Args:
+        updates(dict): {Run.id: {fieldname: value}} of the updates to make.
+    """
+    with pm.batchSession():
+        for run_id, updateDict in updates.items():
+            pm.Run.update(**updateDict).where(pm.Run.id == run_id).execute()
+    
+
 def updateDatRow(updateDict, dat_name):
     """Update values in the Dat table.
     
@@ -640,7 +1189,7 @@ def updateDatRow(updateDict, dat_name):
     """
     pm.connectDB()
     try:
-        query = pm.Dat.update(**updateDict).where(pm.Dat.name == dat_name)
+        query = pm.Dat.update(**_withNameKey(updateDict)).where(pm.Dat.name == dat_name)
         query.execute()
     finally:
         pm.disconnectDB()
@@ -655,7 +1204,7 @@ def updateIedRow(updateDict, ied_name):
     """
     pm.connectDB()
     try:
-        query = pm.Ied.update(**updateDict).where(pm.Ied.name == ied_name)
+        query = pm.Ied.update(**_withNameKey(updateDict)).where(pm.Ied.name == ied_name)
         query.execute()
     finally:
         pm.disconnectDB()
@@ -670,17 +1219,212 @@ def updateModelRow(updateDict, model_name):
     """
     pm.connectDB()
     try:
-        query = pm.ModelFile.update(**updateDict).where(pm.ModelFile.name == model_name)
+        query = pm.ModelFile.update(**_withNameKey(updateDict)).where(pm.ModelFile.name == model_name)
         query.execute()
     finally:
         pm.disconnectDB()
 
 
-def getRunData():
+def _withNameKey(updateDict):
+    """Add the name_key to an update that changes the name of a file record."""
+    if 'name' in updateDict:
+        updateDict = dict(updateDict, name_key=pm.nameKey(updateDict['name']))
+    return updateDict
+
+
+def formatDate(field, date_format=DATE_FORMAT):
+    """Return an SQL expression formatting a timestamp field as a string.
+    
+    Formatting the dates in the query avoids building a datetime object for
+    every row that is only going to be converted to a string for the tables.
+    
+    Args:
+        field(DateTimeField): the timestamp field to format.
+        date_format=DATE_FORMAT(str): SQLite strftime format string.
+    
+    Return:
+        peewee.Function - strftime(date_format, field).
+    """
+    return fn.strftime(date_format, field).coerce(False)
+
+
+def queryRows(query, convert=True):
+    """Return the rows of a select query as a list of tuples.
+    
+    Args:
+        query(SelectQuery): query selecting the columns wanted in each row.
+        convert=True(bool): if False the rows are taken straight from the 
+            sqlite cursor, skipping the peewee field conversions. Only use
+            it when none of the selected columns need converting (booleans
+            would be returned as 1/0).
+    
+    Return:
+        list - of tuples containing the selected column values.
+    """
+    if convert:
+        return list(query.tuples())
+    else:
+        return pm.logit_db.execute(query).fetchall()
+
+
+class QueryPages(object):
+    """Base class for reading the rows of a query a page at a time.
+    
+    fetchPage() returns the next page of rows and sets finished once the
+    last page has been read. Subclasses implement _readPage and _countRows.
+    """
+    
+    def __init__(self, page_size=None):
+        """
+        Args:
+            page_size=None(int): number of rows in each page. If None 
+                QUERY_PAGE_SIZE is used.
+        """
+        self.page_size = page_size if page_size else QUERY_PAGE_SIZE
+        self.finished = False
+        self.fetched = 0
+        self._count = None
+    
+    def fetchPage(self):
+        """Return the next page of rows.
+        
+        Return:
+            list - of row tuples. Empty if all rows have been read.
+        """
+        if self.finished: return []
+        rows = self._readPage()
+        if len(rows) < self.page_size:
+            self.finished = True
+        self.fetched += len(rows)
+        return rows
+    
+    def count(self):
+        """Return the total number of rows returned by the query.
+        
+        The rows are only counted the first time this is called. If all of 
+        the pages have already been read no query is needed.
+        """
+        if self._count is None:
+            if self.finished:
+                self._count = self.fetched
+            else:
+                self._count = self._countRows()
+        return self._count
+    
+    def _readPage(self):
+        raise NotImplementedError
+    
+    def _countRows(self):
+        raise NotImplementedError
+    
+
+class KeysetPages(QueryPages):
+    """Reads the rows of a peewee query a page at a time.
+    
+    Uses keyset pagination. The query is ordered by key and each page starts
+    after the last key read, so every page is a range scan on the key 
+    index, however far through the results it is. Nothing is held open 
+    between pages.
+    """
+    
+    def __init__(self, query, key, convert=True, page_size=None):
+        """
+        Args:
+            query(SelectQuery): the query to page through.
+            key(list): fields that uniquely identify each row of query.
+            convert=True(bool): see queryRows.
+            page_size=None(int): number of rows in each page. If None 
+                QUERY_PAGE_SIZE is used.
+        """
+        super(KeysetPages, self).__init__(page_size)
+        self.query = query
+        self.key = key
+        self.convert = convert
+        self._last = None
+        
+    def _readPage(self):
+        n_keys = len(self.key)
+        query = self.query.select_extend(*self.key).order_by(*self.key)
+        if not self._last is None:
+            if n_keys == 1:
+                query = query.where(self.key[0] > self._last[0])
+            else:
+                query = query.where(Tuple(*self.key) > Tuple(*self._last))
+        
+        pm.connectDB()
+        try:
+            rows = queryRows(query.limit(self.page_size), self.convert)
+        finally:
+            pm.disconnectDB()
+
+        if rows:
+            self._last = rows[-1][-n_keys:]
+        return [r[:-n_keys] for r in rows]
+    
+    def _countRows(self):
+        pm.connectDB()
+        try:
+            return self.query.count()
+        finally:
+            pm.disconnectDB()
+    
+
+class SqlPages(QueryPages):
+    """Reads the rows of an SQL select statement a page at a time.
+    
+    There is no known key to page on, so the statement is wrapped in a 
+    LIMIT/OFFSET query. Each page uses a separate connection, as 
+    complexQuery does.
+    """
+    
+    def __init__(self, db_path, sql, page_size=None):
+        """
+        Args:
+            db_path(str): path to the database.
+            sql(str): the select statement.
+            page_size=None(int): number of rows in each page. If None 
+                QUERY_PAGE_SIZE is used.
+        """
+        super(SqlPages, self).__init__(page_size)
+        self.db_path = db_path
+        self.sql = sql
+    
+    def columns(self):
+        """Return the column names of the statement, without reading any rows.
+        
+        Raises any sqlite3 error in the statement.
+        """
+        description, rows = self._execute('SELECT * FROM (%s) LIMIT 0' % self.sql)
+        return [i[0] for i in description]
+    
+    def _readPage(self):
+        description, rows = self._execute('SELECT * FROM (%s) LIMIT ? OFFSET ?' % self.sql,
+                                          (self.page_size, self.fetched))
+        return rows
+    
+    def _countRows(self):
+        description, rows = self._execute('SELECT COUNT(*) FROM (%s)' % self.sql)
+        return rows[0][0]
+    
+    def _execute(self, sql, params=()):
+        """Return the cursor description and rows for sql."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cur = conn.execute(sql, params)
+            return cur.description, cur.fetchall()
+        finally:
+            conn.close()
+
+
+def getRunData(ids=None):
     """Return records for the Run table.
     
+    Args:
+        ids=None(list): only return the records with these ids. If None all
+            of the records are returned.
+    
     Return:
-        tuple(cols:header strings, rows: list of record data).
+        tuple(cols:header strings, rows: list of record data tuples).
     """
     pm.connectDB()
     cols = [
@@ -692,61 +1436,76 @@ def getRunData():
     ]
     rows = []
     try:
-        rquery = pm.Run.select()
-        rows = []
-        for r in rquery:
-            rows.append(
-                [
-                 r.id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.run_hash,
-                 r.run_options, r.event_name, r.setup, r.comments, r.ief, r.tcf, 
-                 r.initial_conditions, r.isis_results, r.tuflow_results, r.estry_results, 
-                 r.event_duration, r.modeller, 
-                 r.isis_version, r.tuflow_version, r.ief_dir,
-                 r.tcf_dir, r.log_dir, r.run_status, r.mb
-                ]
-            )
+        fields = [getattr(pm.Run, c) for c in cols]
+        fields[1] = formatDate(pm.Run.timestamp)
+        rows = idRows(pm.Run.select(*fields), pm.Run, ids)
     finally:
         pm.disconnectDB()
     
     return cols, rows
 
 
-def getModelData(model):
+def getModelData(model, ids=None):
     """Return records for the ModelFile or Dat tables.
     
     Args:
         model(str): either 'DAT' or 'MODEL'. If anything else will return 'MODEL'.
+        ids=None(list): only return the records with these ids. If None all
+            of the records are returned.
     
     Return:
-        tuple(cols:header strings, rows: list of record data).
+        tuple(cols:header strings, rows: list of record data tuples).
     """
     pm.connectDB()
     cols = []
     rows = []
     try:
         if model == 'DAT':
-            mquery = pm.Dat.select()
             cols = ['timestamp', 'name', 'amendments', 'comments']
-            for r in mquery:
-                rows.append([r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.name, r.amendments, r.comments])
+            query = pm.Dat.select(formatDate(pm.Dat.timestamp), pm.Dat.name, 
+                                  pm.Dat.amendments, pm.Dat.comments)
         
         elif model == 'IED':
-            mquery = pm.Ied.select()
             cols = ['timestamp', 'name', 'ref', 'amendments', 'comments']
-            for r in mquery:
-                rows.append([r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.name, r.ref, r.amendments, r.comments])
+            query = pm.Ied.select(formatDate(pm.Ied.timestamp), pm.Ied.name, 
+                                  pm.Ied.ref, pm.Ied.amendments, pm.Ied.comments)
         
         else:
-            mquery = pm.ModelFile.select().where(pm.ModelFile.model_type == model)
             cols = ['timestamp', 'name', 'comments']
-            for r in mquery:
-                rows.append([r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.name, r.comments])
+            query = (pm.ModelFile
+                     .select(formatDate(pm.ModelFile.timestamp), 
+                             pm.ModelFile.name, pm.ModelFile.comments)
+                     .where(pm.ModelFile.model_type == model))
+
+        rows = idRows(query, query.model, ids)
     finally:
         pm.disconnectDB()
     
     return cols, rows
 
 
+def idRows(query, table, ids=None):
+    """Return the rows of a query, limited to the records with the given ids.
+    
+    Used to read only the records that have changed (see 
+    changetracker.ChangeTracker) rather than the whole table.
+    
+    Args:
+        query(SelectQuery): the query, read with queryRows(convert=False).
+        table(LogitModel): the table with the ids.
+        ids=None(list): the record ids. If None all of the rows are returned.
+    
+    Return:
+        list - of tuples containing the selected column values.
+    """
+    if ids is None:
+        return queryRows(query, convert=False)
+    rows = []
+    for chunk in chunked(set(ids), IN_QUERY_CHUNK_SIZE):
+        rows.extend(queryRows(query.where(table.id << chunk), convert=False))
+    return rows
+
+
 def getFileSummaryQuery(ids):
     """
     """
@@ -802,12 +1561,51 @@ def getFileSummaryQuery(ids):
 def getSimpleQuery(table, value1, with_files, new_sub_only, new_model_only, run_id, value2=''):
     """Get the results of a query from the database.
     
+    See simpleQuery for the arguments.
+    
+    Return:
+        tuple(cols: header strings, rows: list of record data tuples).
+    """
+    cols, query, key, convert = simpleQuery(
+        table, value1, with_files, new_sub_only, new_model_only, run_id, value2
+    )
+    pm.connectDB()
+    try:
+        rows = queryRows(query, convert)
+    finally: 
+        pm.disconnectDB()
+    
+    return cols, rows
+
+
+def getSimpleQueryPages(table, value1, with_files, new_sub_only, new_model_only, 
+                        run_id, value2='', page_size=None):
+    """Get the results of a query from the database a page at a time.
+    
+    See simpleQuery for the arguments.
+    
+    Args:
+        page_size=None(int): number of rows in each page. If None 
+            QUERY_PAGE_SIZE is used.
+    
+    Return:
+        tuple(cols: header strings, pages: KeysetPages for the rows).
+    """
+    cols, query, key, convert = simpleQuery(
+        table, value1, with_files, new_sub_only, new_model_only, run_id, value2
+    )
+    return cols, KeysetPages(query, key, convert, page_size)
+
+
+def simpleQuery(table, value1, with_files, new_sub_only, new_model_only, run_id, value2=''):
+    """Build a query on the database.
+    
     This is a bit of a beast of a function, but it seems hard to break it down 
     until I find a better/neater way of running the queryies.
     
-    Basically returns header columns, row data list, tuple for using. It is a 
-    bit of a black box at the moment. It is not possible to state which fields
-    will be used, only the values to test them against.
+    Basically returns header columns and the query for getting the row data.
+    It is a bit of a black box at the moment. It is not possible to state 
+    which fields will be used, only the values to test them against.
     
     Args:
         table (str): table name in the db.
@@ -819,157 +1617,149 @@ def getSimpleQuery(table, value1, with_files, new_sub_only, new_model_only, run_
         new_model_only(bool): Same as new_sub_only, but for ModelFile.
         run_id(int): the Run.id value to compare. If -1 it will not be used.
         value2=''(str): optional second field value to check.
-    """
     
-    pm.connectDB()
-    cols = []
-    rows = []
-    try:
-        if table == 'DAT':
-            
+    Return:
+        tuple(cols: header strings, query: SelectQuery for the rows,
+              key: list of fields that uniquely identify each row,
+              convert: whether the rows need converting - see queryRows).
+    """
+    convert = False
+    if table == 'DAT':
+        
+        # If run_id given - select all with that id
+        if run_id != -1:
+            query = (pm.Run
+                        .select(pm.Run.id, formatDate(pm.Run.timestamp), 
+                                pm.Dat.name, pm.Dat.amendments, pm.Dat.comments)
+                        .join(pm.Dat)
+                        .where(pm.Run.id == run_id)
+                     )
+            cols = ['Run ID', 'Date', 'Name', 'Amendments', 'Comments']
+            key = [pm.Run.id]
+        else:
+            query = pm.Dat.select(formatDate(pm.Dat.timestamp), pm.Dat.name, 
+                                  pm.Dat.amendments, pm.Dat.comments)
+            query = checkName(query, pm.Dat, value1)
             cols = ['Date', 'Name', 'Amendments', 'Comments']
-            rows = []
-            
-            # If run_id given - select all with that id
+            key = [pm.Dat.name]
+    
+    elif table == 'IED':
+        
+        # If using a run_id we need to join the Run_Ied table too
+        if run_id != -1:
+            query = (pm.Run_Ied
+                    .select(pm.Run_Ied.run, formatDate(pm.Run_Ied.timestamp), 
+                            pm.Ied.name, pm.Ied.ref, pm.Ied.amendments, 
+                            pm.Ied.comments)
+                    .join(pm.Ied)
+                    .where(pm.Run_Ied.run_id == run_id)
+                    )
+            cols = ['Run ID', 'Date', 'Name', 'Ref', 'Amendments', 'Comments']
+            key = [pm.Run_Ied.id]
+        else:
+            query = pm.Ied.select(formatDate(pm.Ied.timestamp), pm.Ied.name, 
+                                  pm.Ied.ref, pm.Ied.amendments, pm.Ied.comments)
+            cols = ['Date', 'Name', 'Ref', 'Amendments', 'Comments']
+            key = [pm.Ied.name]
+    
+    elif table == 'RUN Options' or table == 'RUN Event':
+
+        query = pm.Run.select(pm.Run.id.cast('TEXT'), formatDate(pm.Run.timestamp), 
+                              pm.Run.event_name, pm.Run.run_options, 
+                              pm.Run.comments, pm.Run.run_status, pm.Run.mb)
+        if table == 'RUN Event':
+            query = checkWildcard(query, pm.Run.event_name, value1)
+        else:
+            query = checkWildcard(query, pm.Run.run_options, value1)
+   
+        cols = ['Run ID', 'Date', 'Event Name', 'Run Options', 'Comments', 'Status', 'MB']
+        key = [pm.Run.id]
+    
+    else:
+        # new_file columns need converting to booleans
+        convert = True
+
+        # Returning associated SubFile's as well so extra queries for the
+        # value2 param will be needed
+        if with_files:
+           
+            # If using a run_id we need to join the Run_ModelFile and Run_Subfile 
+            # tables too
             if run_id != -1:
-                query = (pm.Run
-                            .select(pm.Run, pm.Dat)
-                            .join(pm.Dat)
-                            .where(pm.Run.id == run_id)
-                         )
-                cols = ['Run ID', 'Date', 'Name', 'Amendments', 'Comments']
-                for r in query:
-                    rows.append([r.id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.dat.name, r.dat.amendments, r.dat.comments])
+                cols = ['Run ID', 'Modelfile Timestamp', 'Model Type', 'Modelfile', 'Modelfile New', 'Comments', 'Subfile', 'Subfile Timestamp', 'Subfile New']
+                query = (pm.ModelFile_SubFile
+                        .select(pm.Run_ModelFile.run, formatDate(pm.ModelFile_SubFile.timestamp),
+                                pm.ModelFile.model_type, pm.ModelFile.name, 
+                                pm.Run_ModelFile.new_file, pm.ModelFile.comments, 
+                                pm.SubFile.name, formatDate(pm.SubFile.timestamp), 
+                                pm.ModelFile_SubFile.new_file)
+                        .join(pm.SubFile)
+                        .switch(pm.ModelFile_SubFile)
+                        .join(pm.ModelFile)
+                        .join(pm.Run_ModelFile)
+                        .switch(pm.SubFile)
+                        .join(pm.Run_SubFile)
+                        )
+                # A subfile can be listed more than once for a run
+                key = [pm.ModelFile_SubFile.id, pm.Run_ModelFile.id, pm.Run_SubFile.id]
             else:
-                query = pm.Dat.select()
-                query = checkWildcard(query, pm.Dat.name, value1)
+                cols = ['Modelfile Timestamp', 'Model Type', 'Modelfile', 'Comments', 'Subfile', 'Subfile Timestamp', 'Subfile New']
+                query = (pm.ModelFile_SubFile
+                        .select(formatDate(pm.ModelFile_SubFile.timestamp),
+                                pm.ModelFile.model_type, pm.ModelFile.name, 
+                                pm.ModelFile.comments, pm.SubFile.name, 
+                                formatDate(pm.SubFile.timestamp), 
+                                pm.ModelFile_SubFile.new_file)
+                        .join(pm.SubFile)
+                        .switch(pm.ModelFile_SubFile)
+                        .join(pm.ModelFile)
+                        )
+                key = [pm.ModelFile_SubFile.id]
             
-                cols = ['Date', 'Name', 'Amendments', 'Comments']
-                for r in query:
-                    rows.append([r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.name, r.amendments, r.comments])
-        
-        elif table == 'IED':
-            rows = []
+            if not table == 'All Modelfiles':
+                    query = query.where(pm.ModelFile.model_type == table)
+            
+            query = checkName(query, pm.ModelFile, value1)
+            query = checkName(query, pm.SubFile, value2)
+            
+            if new_sub_only:
+                query = query.where(pm.ModelFile_SubFile.new_file == True)
             
-            # If using a run_id we need to join the Run_ModelFile table too
             if run_id != -1:
-                query = (pm.Run_Ied
-                        .select(pm.Run_Ied, pm.Ied)
-                        .join(pm.Ied)
-                        .switch(pm.Run_Ied)
-                        .where(pm.Run_Ied.run_id == run_id)
-                        )
-                cols = ['Run ID', 'Date', 'Name', 'Ref', 'Amendments', 'Comments']
-                for r in query:
-                    rows.append([r.run_id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.ied.name, r.ied.ref, r.ied.amendments, r.ied.comments])
-            else:
-                query = pm.Ied.select()
-                cols = ['Date', 'Name', 'Ref', 'Amendments', 'Comments']
-                for r in query:
-                    rows.append([r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.name, r.ref, r.amendments, r.comments])
-        
-        elif table == 'RUN Options' or table == 'RUN Event':
-
-            query = pm.Run.select()
-            if table == 'RUN Event':
-                query = checkWildcard(query, pm.Run.event_name, value1)
-            else:
-                query = checkWildcard(query, pm.Run.run_options, value1)
-       
-            cols = ['Run ID', 'Date', 'Event Name', 'Run Options', 'Comments', 'Status', 'MB']
-            rows = []
-            for r in query:
-                rows.append([str(r.id), r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.event_name, r.run_options, r.comments, r.run_status, r.mb])
 
+                if new_model_only:
+                    query = query.where(pm.Run_ModelFile.new_file == True)
+                
+                # Filter model files by run id
+                query = query.where(pm.Run_ModelFile.run_id == run_id)
+                # Filter subfiles by run id
+                query = query .where(pm.Run_SubFile.run_id == run_id)
         
+        # If not with_files then we don't need to join the SubFile and 
+        # ModelFile_SubFile tables
         else:
-            # Returning associated SubFile's as well so extra queries for the
-            # value2 param will be needed
-            if with_files:
-               
-                # If using a run_id we need to join the Run_ModelFile and Run_Subfile 
-                # tables too
-                if run_id != -1:
-                    query = (pm.ModelFile_SubFile
-                            .select(pm.ModelFile_SubFile, pm.ModelFile, pm.SubFile, pm.Run_ModelFile, pm.Run_SubFile)
-                            .join(pm.SubFile)
-                            .switch(pm.ModelFile_SubFile)
-                            .join(pm.ModelFile)
-                            .join(pm.Run_ModelFile)
-                            .switch(pm.SubFile)
-                            .join(pm.Run_SubFile)
-                            )
-                else:
-                    query = (pm.ModelFile_SubFile
-                            .select(pm.ModelFile_SubFile, pm.ModelFile, pm.SubFile)
-                            .join(pm.SubFile)
-                            .switch(pm.ModelFile_SubFile)
-                            .join(pm.ModelFile)
-                            )
-                
-                if not table == 'All Modelfiles':
-                        query = query.where(pm.ModelFile.model_type == table)
-                
-                query = checkWildcard(query, pm.ModelFile.name, value1)
-                query = checkWildcard(query, pm.SubFile.name, value2)
-                
-                if new_sub_only:
-                    query = query.where(pm.ModelFile_SubFile.new_file == True)
-                
-
-                rows = []
-                if run_id != -1:
-
-                    if new_model_only:
-                        query = query.where(pm.Run_ModelFile.new_file == True)
-                    
-                    # Filter model files by run id
-                    query = query.where(pm.Run_ModelFile.run_id == run_id)
-                    # Filter subfiles by run id
-                    query = query .where(pm.Run_SubFile.run_id == run_id)
-                    cols = ['Run ID', 'Modelfile Timestamp', 'Model Type', 'Modelfile', 'Modelfile New', 'Comments', 'Subfile', 'Subfile Timestamp', 'Subfile New']
-                    for r in query:
-                        rows.append([r.model_file.run_modelfile.run_id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.model_file.model_type, r.model_file.name, r.model_file.run_modelfile.new_file, r.model_file.comments, r.sub_file.name, r.sub_file.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.new_file])
-                
-                else:
-                    cols = ['Modelfile Timestamp', 'Model Type', 'Modelfile', 'Comments', 'Subfile', 'Subfile Timestamp', 'Subfile New']
-                    for r in query:
-                        rows.append([r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.model_file.model_type, r.model_file.name, r.model_file.comments, r.sub_file.name, r.sub_file.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.new_file])
+            cols = ['Run ID', 'Modelfile Timestamp', 'Modelfile New', 'Model Type', 'Modelfile', 'Comments']
+            query = (pm.Run_ModelFile
+                        .select(pm.Run_ModelFile.run, formatDate(pm.Run_ModelFile.timestamp),
+                                pm.Run_ModelFile.new_file, pm.ModelFile.model_type, 
+                                pm.ModelFile.name, pm.ModelFile.comments)
+                        .join(pm.ModelFile)
+                        .switch(pm.Run_ModelFile)
+                        .join(pm.Run))
+            key = [pm.Run_ModelFile.id]
+
+            if not table == 'All Modelfiles':
+                query = query.where(pm.ModelFile.model_type == table)
             
-            # If not with_files then we don't need to join the SubFile and 
-            # ModelFile_SubFile tables
-            else:
-                query = (pm.Run_ModelFile
-                            .select(pm.Run_ModelFile, pm.Run, pm.ModelFile)
-                            .join(pm.ModelFile)
-                            .switch(pm.Run_ModelFile)
-                            .join(pm.Run))
+            query = checkName(query, pm.ModelFile, value1)
+            
+            if new_model_only:
+                query = query.where(pm.Run_ModelFile.new_file == True)
+            
+            if run_id != -1:
+                query = query.where(pm.Run.id == run_id)
 
-                if not table == 'All Modelfiles':
-                    query = query.where(pm.ModelFile.model_type == table)
-                
-                query = checkWildcard(query, pm.ModelFile.name, value1)
-                
-                if new_model_only:
-                    query = query.where(pm.Run_ModelFile.new_file == True)
-                
-                if run_id != -1:
-                    query = query.where(pm.Run.id == run_id)
-                
-                    cols = ['Run ID', 'Modelfile Timestamp', 'Modelfile New', 'Model Type', 'Modelfile', 'Comments']
-                    rows = []
-                    for r in query:
-                        rows.append([r.run_id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.new_file, r.model_file.model_type, r.model_file.name, r.model_file.comments])
-                else:
-                    cols = ['Run ID', 'Modelfile Timestamp', 'Modelfile New', 'Model Type', 'Modelfile', 'Comments']
-                    rows = []
-                    for r in query:
-                        rows.append([r.run_id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.new_file, r.model_file.model_type, r.model_file.name, r.model_file.comments])
-                    
-    finally: 
-        pm.disconnectDB()
-    
-    return cols, rows
+    return cols, query, key, convert
 
 
 def checkWildcard(query, tableField, value):
@@ -993,6 +1783,24 @@ def checkWildcard(query, tableField, value):
             query = query.where(tableField == value)
     
     return query
+
+
+def checkName(query, table, value):
+    """Return query with a where clause on the name of a file table.
+    
+    The same as checkWildcard, but the value is compared to the name_key 
+    so that, as for Windows paths, case and the direction of the slashes 
+    don't matter.
+    
+    Args:
+        query(SelectQuery): an existing query to amend.
+        table(peewee.Model): one of Dat, ModelFile, SubFile or Ied.
+        value(str): the name to check, which may contain wildcards.
+    
+    Return:
+        SelectQuery - 'and-ed' with exactly equal or wildcard equal clause.
+    """
+    return checkWildcard(query, table.name_key, pm.nameKey(value))
     
 
 
@@ -1110,8 +1918,16 @@ def createIedExport():
     return ied_out, ied_header
         
  
-def complexQuery(db_path, raw_query):
+def isReadOnlyQuery(raw_query):
+    """Check that a user SQL query doesn't contain any updating keywords.
+    
+    Args:
+        raw_query(str): the SQL entered by the user.
     
+    Return:
+        bool - False if the query contains a keyword that could change the
+            database.
+    """
     upper_raw = raw_query.upper()
     if 'DELETE' in upper_raw or 'DROP' in upper_raw or 'INSERT' in upper_raw or \
                         'TRUNCATE' in upper_raw or 'UPDATE' in upper_raw or \
@@ -1122,6 +1938,43 @@ def complexQuery(db_path, raw_query):
                         'RESTORE' in upper_raw or 'ROLLBACK' in upper_raw or \
                         'SAVE' in upper_raw or 'WRITE' in upper_raw or \
                         'CREATE' in upper_raw or 'CLONE' in upper_raw:
+        return False
+    return True
+
+
+def complexQueryPages(db_path, raw_query, page_size=None):
+    """Run a user SQL select query, reading the rows a page at a time.
+    
+    Args:
+        db_path(str): path to the database.
+        raw_query(str): the SQL entered by the user.
+        page_size=None(int): number of rows in each page. If None 
+            QUERY_PAGE_SIZE is used.
+    
+    Return:
+        tuple(cols: header strings, pages: SqlPages, error: str). If the query
+            fails cols and pages are None and error contains the message.
+    """
+    if not isReadOnlyQuery(raw_query):
+        return None, None, 'Queries to update tables are not allowed.'
+    
+    # The query is used as a sub-query so it can't end with a ;
+    query = ' '.join(raw_query.split()).rstrip('; ')
+    pages = SqlPages(db_path, query, page_size)
+    try:
+        cols = pages.columns()
+    except sqlite3.OperationalError as err:
+        return None, None, str(err)
+    except Exception as err:
+        logger.exception(err)
+        return None, None, str(err)
+    
+    return cols, pages, ''
+
+
+def complexQuery(db_path, raw_query):
+    
+    if not isReadOnlyQuery(raw_query):
         return None, None, 'Queries to update tables are not allowed.'
     
     query = ' '.join(raw_query.split())
@@ -36,13 +36,16 @@
 
 """
 
+import math
+from datetime import datetime
+
 import logging
 logger = logging.getLogger(__name__)
 """logging references with a __name__ set to this module."""
 
 
 try:
-    from PyQt5 import QtGui, QtCore, QtWidgets
+    from PyQt5 import QtGui, QtWidgets
     HAS_QT = True
 
 except Exception:
@@ -142,24 +145,74 @@ class MyFileDialogs(QtWidgets.QFileDialog):
             return False
 
 
+def sortValue(value):
+    """Get the key used to sort a table cell value.
+    
+    Values are ordered as empty cells, then numbers, then dates and then
+    text. Numeric strings are compared as numbers, ISO format date strings
+    as datetimes and other text is compared case insensitively.
+    
+    The key is a tuple of (rank, value) so that the keys of a column holding
+    a mix of these types can always be compared with each other.
+    
+    Args:
+        value: the cell value, or the cell text.
+    
+    Return:
+        tuple - (int, value) the sort key for value.
+    """
+    if value is None or value == '':
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, float(value))
+    if isinstance(value, datetime):
+        return (2, value)
+    text = str(value)
+    try:
+        number = float(text)
+        if not math.isnan(number):
+            return (1, number)
+    except ValueError:
+        pass
+    if len(text) >= 10 and text[4] == '-' and text[7] == '-':
+        try:
+            return (2, datetime.fromisoformat(text))
+        except ValueError:
+            pass
+    return (3, text.casefold())
+
+
 class QNumericSortTableWidgetItem (QtWidgets.QTableWidgetItem):
     """Custom implementation of the QTableWidgetItem class.
 
     Allows sorting of numerical values by overridding the default __lt__
     operator to do a numerical comparision.
+    
+    The sort key is taken from sortValue and kept until the item text 
+    changes.
     """
 
     def __init__(self, value):
         super(QNumericSortTableWidgetItem, self).__init__(str(value))
+        self._sort_text = None
+        self._sort_value = None
+    
+    def sortValue(self):
+        """Get the sort key for the text of this item."""
+        text = self.text()
+        if not text == self._sort_text:
+            self._sort_text = text
+            self._sort_value = sortValue(text)
+        return self._sort_value
 
     def __lt__(self, other):
         """Check order of two values.
 
-        Tries to convert the value to a float. If successful it will return 
-        the order of those two values. 
+        Numeric values are compared as numbers, dates as dates and other
+        text case insensitively (see sortValue).
 
-        If value is not numeric or is not a QCustomTableWidgetItem type it
-        will return the standard string compare output.
+        If other is not a QNumericSortTableWidgetItem type it will return 
+        the standard string compare output.
 
         Args:
             other(QTableWidgetItem): value to compare with that stored by this.
@@ -168,11 +221,6 @@ class QNumericSortTableWidgetItem (QtWidgets.QTableWidgetItem):
             Bool - True if given value is less than this.
         """
         if (isinstance(other, QNumericSortTableWidgetItem)):
-            try:
-                self_data_value = float(self.data(QtCore.Qt.EditRole).toString())
-                other_data_value = float(other.data(QtCore.Qt.EditRole).toString())
-            except:
-                return QtWidgets.QTableWidgetItem.__lt__(self, other)
-            return self_data_value < other_data_value
+            return self.sortValue() < other.sortValue()
         else:
             return QtWidgets.QTableWidgetItem.__lt__(self, other)
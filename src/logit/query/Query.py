@@ -121,9 +121,36 @@ class Query_UI(querywidget.Ui_QueryWidget, AWidget):
         query_table = GuiStore.TableWidgetQuery('QUERY', 0, 0)
         self.query_table = query_table
         self.query_table.queryFileSummarySignal.connect(self._queryFileSummary)
+        self.query_table.table_model.rowsInserted.connect(self._updateQueryStatus)
         self.tableQueryGroup.layout().addWidget(self.query_table)
     
     
+    def addQueryPages(self, cols, pages):
+        """Show the results of a paged query in the query table.
+        
+        The first page is shown straight away. The total row count is run 
+        afterwards, so it doesn't hold up the first rows.
+        
+        Args:
+            cols(list): columns header strings.
+            pages(peeweeviews.QueryPages): the query results.
+        """
+        self.query_table.addPages(cols, pages)
+        QtCore.QTimer.singleShot(0, self._updateQueryStatus)
+    
+    
+    def _updateQueryStatus(self):
+        """Show the number of query rows loaded in the status bar."""
+        pages = self.query_table.table_model.pages()
+        if pages is None: return
+        try:
+            total = pages.count()
+        except Exception as err:
+            logger.exception(err)
+            return
+        self.statusUpdateSignal.emit('Query rows loaded: %s of %s' % (pages.fetched, total))
+    
+    
 
     '''
     ######################
@@ -379,17 +406,13 @@ class Query_UI(querywidget.Ui_QueryWidget, AWidget):
         raw_query = str(self.complexScriptText.toPlainText())
         
         if not self.checkDbLoaded(): return
-        if 'ORDER BY' in raw_query.upper():
-            self.query_table.setSortingEnabled(False)
-        cols, rows, error = pv.complexQuery(gs.path_holder['log'], raw_query)
+        cols, pages, error = pv.complexQueryPages(gs.path_holder['log'], raw_query)
         
+        # Paged results are shown in query order, so any ORDER BY is kept
         if cols is None:
             self.launchQMsgBox('Query Error', error)
         else:
-            self.query_table.addRows(cols, rows)
-        
-        if 'ORDER BY' in raw_query.upper():
-            self.query_table.setSortingEnabled(True)
+            self.addQueryPages(cols, pages)
             
         
 
@@ -444,16 +467,16 @@ class Query_UI(querywidget.Ui_QueryWidget, AWidget):
         if self.queryFileTextbox.isEnabled() and table != 'DAT' and \
                                 table != 'IED' and \
                                 table != 'Run Options' and table != 'Run Event':
-            cols, rows = pv.getSimpleQuery(table, q1_vtext, with_files, new_sub_only, new_model_only, run_id, q2_vtext)
+            cols, pages = pv.getSimpleQueryPages(table, q1_vtext, with_files, new_sub_only, new_model_only, run_id, q2_vtext)
         else:
-            cols, rows = pv.getSimpleQuery(table, q1_vtext, with_files, new_sub_only, new_model_only, run_id)
+            cols, pages = pv.getSimpleQueryPages(table, q1_vtext, with_files, new_sub_only, new_model_only, run_id)
         
         if table == 'RUN Options' or table == 'RUN Event':
             self.query_table.subname = 'EventOptions'
         else:
             self.query_table.subname = ''
             
-        self.query_table.addRows(cols, rows)
+        self.addQueryPages(cols, pages)
 
     
     def queryModelTable(self, table_type, query_type, id):
@@ -486,8 +509,8 @@ class Query_UI(querywidget.Ui_QueryWidget, AWidget):
             new_sub_only = True
         
         # Run the simple query and add the returned rows to the QUERY table
-        cols, rows = pv.getSimpleQuery(table_type, id, with_files, new_sub_only, new_model_only, -1)
-        self.query_table.addRows(cols, rows)
+        cols, pages = pv.getSimpleQueryPages(table_type, id, with_files, new_sub_only, new_model_only, -1)
+        self.addQueryPages(cols, pages)
         
     
     def queryRunTable(self, query_type, id):
@@ -549,8 +572,8 @@ class Query_UI(querywidget.Ui_QueryWidget, AWidget):
             with_files = True
 
         # Run the simple query and add the returned rows to the QUERY table
-        cols, rows = pv.getSimpleQuery(table, '', with_files, new_sub_only, new_model_only, id)
-        self.query_table.addRows(cols, rows)
+        cols, pages = pv.getSimpleQueryPages(table, '', with_files, new_sub_only, new_model_only, id)
+        self.addQueryPages(cols, pages)
     '''
     ######################
     END SIMPLE QUERY
@@ -579,8 +602,27 @@ class Query_UI(querywidget.Ui_QueryWidget, AWidget):
             for r in rows:
                 id = str(r[0])
                 self.fileQueryAvailableList.addItem(id)
-                
-                
+
+    def patchFileSummaryQueryList(self, added=[], removed=[]):
+        """Add and remove run ids in the file summary lists.
+        
+        New ids are added to the available list and removed ids are taken
+        out of both lists. The rest of the lists, including the ids the
+        user has selected, are left as they are.
+        
+        Args:
+            added=[](list): the ids of new runs.
+            removed=[](list): the ids of deleted runs.
+        """
+        removed = set(str(id) for id in removed)
+        for widget in [self.fileQueryAvailableList, self.fileQuerySelectedList]:
+            for row in reversed(range(widget.count())):
+                if widget.item(row).text() in removed:
+                    widget.takeItem(row)
+        for id in added:
+            self.fileQueryAvailableList.addItem(str(id))
+
+
     def _updateRunIdLists(self):
         """"""
         caller = self.sender()
@@ -653,7 +695,7 @@ class Query_UI(querywidget.Ui_QueryWidget, AWidget):
             return False
          
         else:
-            pm.logit_db.init(path)
+            pm.openSession(path)
             return True 
     
     
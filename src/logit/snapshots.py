@@ -0,0 +1,293 @@
+"""
+###############################################################################
+
+ Name: LogIT (Logger for Isis and Tuflow)
+ Author: Duncan Runnacles
+ Copyright: (C) 2016 Duncan Runnacles
+ email: duncan.runnacles@thomasmackay.co.uk
+ License: GPL v2 - Available at: http://www.gnu.org/licenses/gpl-2.0.html
+
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 2 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License along
+ with this program; if not, write to the Free Software Foundation, Inc.,
+ 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+ Module:          snapshots.py
+ Date:            18/10/2026
+ Author:          Duncan Runnacles
+ Since-Version:   2.0.0
+
+ Summary:
+     Point in time snapshots of a log database.
+
+     Snapshots are taken with the SQLite online backup API, copying a few
+     pages at a time with a pause in between, so other connections can
+     keep reading and writing the database while it's copied. The copy is
+     then compacted with VACUUM, which only touches the snapshot file.
+     
+     Snapshots are kept in a folder next to the database and old ones are
+     removed with a retention policy that keeps the latest snapshot from
+     each of the last N hours and M days that have one.
+
+ UPDATES:
+
+
+ TODO:
+
+
+###############################################################################
+"""
+import os
+import sqlite3
+from datetime import datetime
+
+import logging
+logger = logging.getLogger(__name__)
+
+import peeweemodels as pm
+
+
+SNAPSHOT_FOLDER_SUFFIX = '_snapshots'
+""" Added to the database name to get the snapshot folder name. """
+
+TIME_FORMAT = '%Y%m%d_%H%M%S'
+""" Added to the database name to get the snapshot file name. """
+
+DEFAULT_PAGES = 256
+""" Number of pages copied in each step of a snapshot. """
+
+DEFAULT_SLEEP = 0.05
+""" Seconds to wait between each step of a snapshot. """
+
+DEFAULT_HOURLY = 24
+DEFAULT_DAILY = 7
+
+
+class SnapshotManager(object):
+    """Takes, lists, prunes and restores snapshots of a database.
+    
+    Example:
+        manager = snapshots.SnapshotManager(db_path, hourly=24, daily=7)
+        if manager.isDue(60):
+            manager.takeSnapshot()
+            manager.prune()
+    """
+    
+    def __init__(self, db_path, hourly=DEFAULT_HOURLY, daily=DEFAULT_DAILY):
+        """
+        Args:
+            db_path(str): path of the database.
+            hourly=DEFAULT_HOURLY(int): the number of hourly snapshots kept.
+            daily=DEFAULT_DAILY(int): the number of daily snapshots kept.
+        """
+        self.db_path = db_path
+        self.hourly = hourly
+        self.daily = daily
+        folder, name = os.path.split(os.path.abspath(db_path))
+        self.name, self.ext = os.path.splitext(name)
+        self.folder = os.path.join(folder, self.name + SNAPSHOT_FOLDER_SUFFIX)
+    
+    def snapshotPath(self, when):
+        """Get the path of the snapshot taken at when(datetime)."""
+        return os.path.join(self.folder, '%s_%s%s' % (
+            self.name, when.strftime(TIME_FORMAT), self.ext))
+    
+    def listSnapshots(self):
+        """Get the snapshots of the database.
+        
+        Return:
+            list - (datetime, path) of the snapshots, newest first.
+        """
+        if not os.path.isdir(self.folder): return []
+        found = []
+        prefix = self.name + '_'
+        for f in os.listdir(self.folder):
+            stem, ext = os.path.splitext(f)
+            if not ext == self.ext or not stem.startswith(prefix): continue
+            try:
+                when = datetime.strptime(stem[len(prefix):], TIME_FORMAT)
+            except ValueError:
+                continue
+            found.append((when, os.path.join(self.folder, f)))
+        found.sort(reverse=True)
+        return found
+    
+    def isDue(self, interval, now=None):
+        """Check whether it's time for another snapshot.
+        
+        Args:
+            interval(int): minutes between snapshots. If < 1 snapshots are
+                never due.
+            now=None(datetime): the current time. If None datetime.now().
+        
+        Return:
+            bool - True if there are no snapshots from the last interval 
+                minutes.
+        """
+        if interval < 1: return False
+        if now is None: now = datetime.now()
+        snapshots = self.listSnapshots()
+        if not snapshots: return True
+        return (now - snapshots[0][0]).total_seconds() >= interval * 60
+    
+    def takeSnapshot(self, job=None, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP):
+        """Take a compacted snapshot of the database.
+        
+        The database is copied pages at a time with the SQLite online 
+        backup API and the copy is compacted with VACUUM. If pages < 1 it's
+        copied in a single step with VACUUM INTO instead, which is quicker
+        but holds a read transaction for the whole copy (blocking writers 
+        in rollback journal mode).
+        
+        The snapshot is written to a temporary file and renamed when it's
+        complete, so a snapshot that's listed is always a whole database.
+        
+        Args:
+            job=None(jobs.Job): if given, progress is reported to it and
+                the copy stops if it's cancelled.
+            pages=DEFAULT_PAGES(int): the number of pages copied in each step.
+            sleep=DEFAULT_SLEEP(float): seconds to wait between steps.
+        
+        Return:
+            str - the path of the snapshot.
+        
+        Raises:
+            jobs.JobCancelled - if the job is cancelled.
+        """
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        snapshot = self.snapshotPath(datetime.now())
+        temp_path = snapshot + '.tmp'
+        if os.path.exists(temp_path): os.remove(temp_path)
+        
+        def progress(status, remaining, total):
+            if job is None: return
+            job.setProgress(total - remaining, total, 'Copying database page %s of %s' % (
+                total - remaining, total))
+            job.checkCancelled()
+        
+        try:
+            if pages < 1:
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    conn.execute('VACUUM INTO ?', (temp_path,))
+                finally:
+                    conn.close()
+            else:
+                pm.backupDatabase(temp_path, self.db_path, pages, sleep, progress)
+                if job is not None:
+                    job.setProgress(0, 0, 'Compacting database snapshot')
+                # Make the snapshot a single file, even if the database uses WAL
+                conn = sqlite3.connect(temp_path, isolation_level=None)
+                try:
+                    conn.execute('PRAGMA journal_mode=DELETE')
+                    conn.execute('VACUUM')
+                finally:
+                    conn.close()
+            os.replace(temp_path, snapshot)
+        except:
+            if os.path.exists(temp_path): os.remove(temp_path)
+            raise
+        logger.info('Database snapshot created: %s' % snapshot)
+        return snapshot
+    
+    def expiredSnapshots(self):
+        """Get the snapshots that are not kept by the retention policy.
+        
+        The latest snapshot from each of the last hourly hours and the last
+        daily days (that have a snapshot) are kept. The latest snapshot is
+        always kept.
+        
+        Return:
+            list - (datetime, path) of the expired snapshots.
+        """
+        snapshots = self.listSnapshots()
+        hours = set()
+        days = set()
+        expired = []
+        for i, snapshot in enumerate(snapshots):
+            when = snapshot[0]
+            hour = when.replace(minute=0, second=0, microsecond=0)
+            keep = i == 0
+            if not hour in hours and len(hours) < self.hourly:
+                hours.add(hour)
+                keep = True
+            if not when.date() in days and len(days) < self.daily:
+                days.add(when.date())
+                keep = True
+            if not keep:
+                expired.append(snapshot)
+        return expired
+    
+    def prune(self):
+        """Delete the snapshots that are not kept by the retention policy.
+        
+        Return:
+            list - paths of the deleted snapshots.
+        """
+        removed = []
+        for when, path in self.expiredSnapshots():
+            try:
+                os.remove(path)
+                removed.append(path)
+            except OSError as err:
+                logger.warning('Unable to remove database snapshot: %s' % path)
+                logger.exception(err)
+        return removed
+    
+    def restoreSnapshot(self, snapshot, job=None):
+        """Replace the contents of the database with a snapshot.
+        
+        A snapshot of the database is taken first, so the restore can be
+        undone. The snapshot is copied back with the SQLite backup API, so
+        the database must not be in use by other connections (the current
+        session should be closed first).
+        
+        Args:
+            snapshot(str): path of the snapshot to restore.
+            job=None(jobs.Job): if given, progress is reported to it.
+        
+        Return:
+            str - the path of the snapshot taken before restoring.
+        """
+        before = self.takeSnapshot(job, pages=-1)
+        if job is not None:
+            job.setProgress(0, 0, 'Restoring database snapshot')
+        pm.backupDatabase(self.db_path, snapshot)
+        logger.info('Database restored from snapshot: %s' % snapshot)
+        return before
+
+
+def takeSnapshot(job, db_path, hourly=DEFAULT_HOURLY, daily=DEFAULT_DAILY):
+    """Take a snapshot and remove expired ones.
+    
+    Run as a jobs.Job.
+    
+    Return:
+        str - the path of the snapshot.
+    """
+    manager = SnapshotManager(db_path, hourly, daily)
+    snapshot = manager.takeSnapshot(job)
+    manager.prune()
+    return snapshot
+
+
+def restoreSnapshot(job, db_path, snapshot):
+    """Restore a snapshot of a database.
+    
+    Run as a jobs.Job on the writer lane.
+    
+    Return:
+        str - the path of the snapshot taken before restoring.
+    """
+    return SnapshotManager(db_path).restoreSnapshot(snapshot, job)
@@ -0,0 +1,542 @@
+"""
+ Summary:
+    Timing benchmarks for the database code paths.
+    
+    Not part of the unittest suite (the file name doesn't match test*.py).
+    Run from the src folder with the logit package on the path:
+    
+        PYTHONPATH=logit python tests/benchmarks.py [name ...]
+    
+    Each benchmark builds a synthetic database in a temp folder, so no 
+    regression data is needed. Where a code path has been rewritten the
+    original implementation is kept here so that the timings and the rows
+    written can be compared directly.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import datetime
+import random
+import shutil
+import tempfile
+
+import peeweemodels as pm
+import peeweeviews as pv
+
+
+def timeit(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def setupDb(folder, name='bench.logdb'):
+    db_path = os.path.join(folder, name)
+    pm.createNewDb(db_path)
+    pm.createTableList(pm.getAllTables())
+    pm.connectDB()
+    return db_path
+
+
+def tableRows(table, exclude=('id', 'timestamp')):
+    """Return the contents of a table in insert order, without ids/timestamps."""
+    fields = [f for f in table._meta.sorted_field_names if not f in exclude]
+    cols = [getattr(table, f) for f in fields]
+    return list(table.select(*cols).order_by(table._meta.primary_key).tuples())
+
+
+def syntheticModels(n_runs, models_per_run=6, files_per_model=40, 
+                    n_models=300, n_files=5000, seed=1):
+    """Build a list of (mfiles, ieds) inputs that share files between runs."""
+    rand = random.Random(seed)
+    types = ['TCF', 'TGC', 'TBC', 'ECF', 'TEF', 'BC_DBASE']
+    runs = []
+    for r in range(n_runs):
+        mfiles = []
+        for m in rand.sample(range(n_models), models_per_run):
+            files = ['file_%s.shp' % rand.randrange(n_files) for _ in range(files_per_model)]
+            mfiles.append({'NAME': 'model_%s.%s' % (m, types[m % len(types)].lower()),
+                           'TYPE': types[m % len(types)], 'COMMENTS': '', 
+                           'FILES': files})
+        ieds = [{'NAME': 'ied_%s.ied' % rand.randrange(50), 'REF': '', 
+                 'AMENDMENTS': '', 'COMMENTS': ''} for _ in range(3)]
+        runs.append((mfiles, ieds))
+    return runs
+
+
+'''
+Original implementations, kept for comparison.
+'''
+def legacyAddAllIed(ieds, run):
+    ied_datasource = []
+    ri_datasource = []
+    found_ieds = []
+    for i in ieds:
+        if not i['NAME'] in found_ieds and not pv.iedExists(i['NAME']):
+            ied_datasource.append({'name': i['NAME'], 'ref': i['REF'], 'amendments': i['AMENDMENTS'], 'comments': i['COMMENTS']})
+            found_ieds.append(i['NAME'])
+            ri_datasource.append({'run': run, 'ied': i['NAME'], 'new_file': True})
+        else:
+            ri_datasource.append({'run': run, 'ied': i['NAME'], 'new_file': False})
+    if ied_datasource or ri_datasource:
+        with pm.logit_db.atomic():
+            for data_dict in ied_datasource:
+                pm.Ied.create(**data_dict)
+            for data_dict in ri_datasource:
+                pm.Run_Ied.create(**data_dict)
+
+
+def legacyAddAllModel(mfiles, run):
+    model_datasource = []
+    files_datasource = []
+    mf_datasource = []
+    rm_datasource = []
+    rs_datasource = []
+    found_models = []
+    found_files = []
+    found_modelfiles = []
+    for m in mfiles:
+        if not m['NAME'] in found_models and not pv.modelExists(m['NAME']): 
+            model_datasource.append({'name': m['NAME'], 'model_type': m['TYPE'], 'comments': m['COMMENTS']})
+            found_models.append(m['NAME'])
+            rm_datasource.append({'run': run, 'model_file': m['NAME'], 'new_file': True})
+        else:
+            rm_datasource.append({'run': run, 'model_file': m['NAME'], 'new_file': False})
+        for f in m['FILES']:
+            first_time = False
+            rs_datasource.append({'run': run, 'sub_file': f})
+            if pv.subFileIsNew(m['TYPE'], f):
+                first_time = True
+            if not f in found_files and not pv.subfileExists(f):
+                files_datasource.append({'name': f})
+                found_files.append(f)
+            if not ((m['NAME'] + f) in found_modelfiles) and  not pv.modelSubfileExists(m['NAME'], f):
+                mf_datasource.append({'model_file': m['NAME'], 'sub_file': f, 'new_file': first_time})
+                found_modelfiles.append(m['NAME'] + f)
+    with pm.logit_db.atomic():
+        for data_dict in model_datasource:
+            pm.ModelFile.create(**data_dict)
+        for data_dict in files_datasource:
+            pm.SubFile.create(**data_dict)
+        for data_dict in mf_datasource:
+            pm.ModelFile_SubFile.create(**data_dict)
+        for data_dict in rm_datasource:
+            pm.Run_ModelFile.create(**data_dict)
+        for data_dict in rs_datasource:
+            pm.Run_SubFile.create(**data_dict)
+
+
+def legacyUpdateNewStatus():
+    query = (pm.ModelFile_SubFile
+                .select(pm.ModelFile_SubFile, pm.ModelFile, pm.SubFile)
+                .join(pm.SubFile)
+                .switch()
+                .join(pm.ModelFile)
+                .order_by(
+                        pm.ModelFile.model_type, 
+                        pm.ModelFile_SubFile.sub_file_id, 
+                        pm.ModelFile_SubFile.timestamp)
+                )
+    query2 = (pm.Run_ModelFile
+                .select(pm.Run_ModelFile, pm.Run, pm.ModelFile)
+                .join(pm.ModelFile)
+                .switch(pm.Run_ModelFile)
+                .join(pm.Run)
+                .order_by(
+                        pm.ModelFile.name, 
+                        pm.Run_ModelFile.timestamp)
+                )
+    found_names = []
+    with pm.logit_db.atomic():
+        for q in query:
+            i = q.id
+            n = q.sub_file_id
+            if not n in found_names:
+                found_names.append(n)
+                q = pm.ModelFile_SubFile.update(new_file=True).where(pm.ModelFile_SubFile.id == i)
+                q.execute()
+        run_found_names = []
+        for q in query2:
+            ri = q.id
+            rn = q.model_file_id
+            if not rn in run_found_names:
+                run_found_names.append(rn)
+                q = pm.Run_ModelFile.update(new_file=True).where(pm.Run_ModelFile.id == ri)
+                q.execute()
+
+
+def legacyDeleteOrphanFiles():
+    subs = pm.ModelFile_SubFile.select(pm.ModelFile_SubFile.sub_file_id)
+    pm.SubFile.delete().where(~(pm.SubFile.name << subs)).execute()
+    subs = pm.Run_SubFile.select(pm.Run_SubFile.sub_file_id)
+    pm.SubFile.delete().where(~(pm.SubFile.name << subs)).execute()
+
+
+def legacyGetRunData():
+    """Original getRunData, building a Run instance for every row."""
+    cols = [
+        'id', 'timestamp', 'run_hash', 'run_options', 'event_name', 
+        'setup', 'comments', 'ief', 'tcf', 'initial_conditions', 'isis_results', 
+        'tuflow_results', 'estry_results', 'event_duration', 'modeller', 
+        'isis_version', 'tuflow_version', 'ief_dir', 'tcf_dir', 'log_dir', 
+        'run_status', 'mb'
+    ]
+    rows = []
+    for r in pm.Run.select():
+        rows.append(
+            [
+             r.id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.run_hash,
+             r.run_options, r.event_name, r.setup, r.comments, r.ief, r.tcf, 
+             r.initial_conditions, r.isis_results, r.tuflow_results, r.estry_results, 
+             r.event_duration, r.modeller, 
+             r.isis_version, r.tuflow_version, r.ief_dir,
+             r.tcf_dir, r.log_dir, r.run_status, r.mb
+            ]
+        )
+    return cols, rows
+
+
+def legacyGetModelData(model):
+    """Original getModelData for the ModelFile table."""
+    cols = ['timestamp', 'name', 'comments']
+    rows = []
+    for r in pm.ModelFile.select().where(pm.ModelFile.model_type == model):
+        rows.append([r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.name, r.comments])
+    return cols, rows
+
+
+def legacyModelQuery():
+    """Original getSimpleQuery('All Modelfiles', ...) without files."""
+    query = (pm.Run_ModelFile
+                .select(pm.Run_ModelFile, pm.Run, pm.ModelFile)
+                .join(pm.ModelFile)
+                .switch(pm.Run_ModelFile)
+                .join(pm.Run))
+    cols = ['Run ID', 'Modelfile Timestamp', 'Modelfile New', 'Model Type', 'Modelfile', 'Comments']
+    rows = []
+    for r in query:
+        rows.append([r.run_id, r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.new_file, r.model_file.model_type, r.model_file.name, r.model_file.comments])
+    return cols, rows
+
+
+def legacyRunQuery():
+    """Original getSimpleQuery('RUN Options', ...)."""
+    cols = ['Run ID', 'Date', 'Event Name', 'Run Options', 'Comments', 'Status', 'MB']
+    rows = []
+    for r in pm.Run.select():
+        rows.append([str(r.id), r.timestamp.strftime("%Y-%m-%d %H:%M:%S"), r.event_name, r.run_options, r.comments, r.run_status, r.mb])
+    return cols, rows
+
+
+def populate(n_runs, **kwargs):
+    """Fill the current database with synthetic runs."""
+    for i, (mfiles, ieds) in enumerate(syntheticModels(n_runs, **kwargs)):
+        run = pm.Run.create(run_hash=str(i), run_options='', event_name='').id
+        pv.addAllModel(mfiles, run)
+        pv.addAllIed(ieds, run)
+
+
+def legacyItemClass():
+    """Return the original TableWidgetItemDb, with its toString comparison."""
+    from PyQt5 import QtCore, QtWidgets
+    
+    class LegacyTableWidgetItemDb(QtWidgets.QTableWidgetItem):
+        def __init__ (self, value):
+            super(LegacyTableWidgetItemDb, self).__init__(str(value))
+    
+        def __lt__ (self, other):
+            if (isinstance(other, LegacyTableWidgetItemDb)):
+                try:
+                    self_data_value  = float(self.data(QtCore.Qt.EditRole).toString())
+                    other_data_value = float(other.data(QtCore.Qt.EditRole).toString())
+                except:
+                    return QtWidgets.QTableWidgetItem.__lt__(self, other)
+                return self_data_value < other_data_value
+            else:
+                return QtWidgets.QTableWidgetItem.__lt__(self, other)
+    return LegacyTableWidgetItemDb
+
+
+def legacyAddRows(table, cols, rows, sort_col=None):
+    """Original TableWidgetDb.addRows, creating an item for every cell."""
+    from PyQt5 import QtCore, QtGui, QtWidgets
+    editing_allowed = ['comments', 'modeller', 'setup', 'event_name', 
+                       'event_duration', 'isis_version', 'tuflow_version', 
+                       'amendments', 'run_options', 'mb', 'run_status', 'run_name']
+    table.setSortingEnabled(False)
+    table.setColumnCount(len(cols))
+    for k, c in enumerate(cols):
+        item = QtWidgets.QTableWidgetItem()
+        item.setTextAlignment(QtCore.Qt.AlignCenter|QtCore.Qt.AlignVCenter)
+        item.setBackground(QtGui.QColor(187, 185, 185))
+        table.setHorizontalHeaderItem(k, item)
+        item.setText(c)
+    table.setRowCount(len(rows))
+    table.blockSignals(True)
+    item_class = legacyItemClass()
+    for i, r in enumerate(rows):
+        for j, t in enumerate(r):
+            item = item_class(str(t))
+            if str(table.horizontalHeaderItem(j).text()) in editing_allowed:
+                item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsEditable)
+            else:
+                item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+            table.setItem(i, j, item)
+    table.blockSignals(False)
+    table.setSortingEnabled(True)
+    if not sort_col is None:
+        table.sortItems(sort_col)
+
+
+def qtApp():
+    """Return a QApplication, using the offscreen platform if not set."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+
+
+'''
+Benchmarks.
+'''
+def benchIngest(n_runs=150):
+    """Compare addAllModel/addAllIed against the original implementation."""
+    inputs = syntheticModels(n_runs)
+    results = {}
+    tables = [pm.ModelFile, pm.SubFile, pm.Ied, pm.ModelFile_SubFile,
+              pm.Run_ModelFile, pm.Run_SubFile, pm.Run_Ied]
+    for label, add_model, add_ied in [('legacy', legacyAddAllModel, legacyAddAllIed),
+                                      ('bulk', pv.addAllModel, pv.addAllIed)]:
+        folder = tempfile.mkdtemp()
+        try:
+            setupDb(folder)
+            total = 0
+            for i, (mfiles, ieds) in enumerate(inputs):
+                run = pm.Run.create(run_hash=str(i), run_options='', event_name='').id
+                t, _ = timeit(add_model, mfiles, run)
+                total += t
+                t, _ = timeit(add_ied, ieds, run)
+                total += t
+            # The original set ModelFile_SubFile.new_file on every new model
+            # of the same type in a batch, now it is only the first one.
+            rows = dict((t.__name__, tableRows(t, ('id', 'timestamp', 'new_file'))) for t in tables)
+            rows['Run_ModelFile_new_file'] = tableRows(pm.Run_ModelFile)
+            results[label] = (total, rows, pv.verifyNewStatus())
+        finally:
+            pm.closeSession()
+            shutil.rmtree(folder)
+    
+    same = results['legacy'][1] == results['bulk'][1]
+    flags_ok = not any(results['bulk'][2].values())
+    print('ingest (%s runs): legacy %.2fs, bulk %.2fs, identical rows: %s, '
+          'new_file flags match updateNewStatus: %s' % (
+          n_runs, results['legacy'][0], results['bulk'][0], same, flags_ok))
+    return same and flags_ok
+
+
+def benchNewStatus(n_runs=2000):
+    """Compare the set based updateNewStatus against the original loop."""
+    folder = tempfile.mkdtemp()
+    try:
+        setupDb(folder)
+        populate(n_runs, n_models=2000, n_files=100000)
+        reset = lambda: (pm.ModelFile_SubFile.update(new_file=False).execute(),
+                         pm.Run_ModelFile.update(new_file=False).execute())
+        reset()
+        legacy, _ = timeit(legacyUpdateNewStatus)
+        reset()
+        full, _ = timeit(pv.updateNewStatus)
+        runs, _ = timeit(pv.updateNewStatus, run_ids=[1, 2, 3])
+        print('updateNewStatus (%s runs, %s model/subfile rows): legacy %.2fs, '
+              'set based %.2fs, 3 runs only %.3fs' % (
+              n_runs, pm.ModelFile_SubFile.select().count(), legacy, full, runs))
+    finally:
+        pm.closeSession()
+        shutil.rmtree(folder)
+
+
+def benchDelete(n_runs=2000, n_delete=20):
+    """Time deleteRunRow on a populated database."""
+    folder = tempfile.mkdtemp()
+    try:
+        setupDb(folder)
+        populate(n_runs, n_models=2000, n_files=100000)
+        ids = random.Random(4).sample(range(1, n_runs + 1), n_delete)
+        total = 0
+        for i in ids:
+            t, _ = timeit(pv.deleteRunRow, i, delete_recursive=True)
+            total += t
+        print('deleteRunRow (%s runs): %.3fs per run' % (n_runs, total / n_delete))
+    finally:
+        pm.closeSession()
+        shutil.rmtree(folder)
+
+
+def benchOrphans(n_runs=2000, n_orphans=5000):
+    """Compare removeOrphans with the original NOT IN deleteOrphanFiles."""
+    folder = tempfile.mkdtemp()
+    try:
+        db_path = setupDb(folder)
+        populate(n_runs, n_models=2000, n_files=100000)
+        pv.bulkInsert(pm.SubFile, [{'name': 'orphan_%s' % i} for i in range(n_orphans)])
+        pm.closeSession()
+        copy_path = os.path.join(folder, 'copy.logdb')
+        shutil.copyfile(db_path, copy_path)
+        
+        pm.openSession(db_path)
+        legacy, _ = timeit(legacyDeleteOrphanFiles)
+        pm.openSession(copy_path)
+        dry, _ = timeit(pv.removeOrphans, dry_run=True)
+        full, result = timeit(pv.removeOrphans)
+        print('orphans (%s runs, %s subfiles): legacy %.2fs, dry run %.2fs, '
+              'removeOrphans %.2fs (%s SubFile removed)' % (
+              n_runs, pm.SubFile.select().count() + n_orphans, legacy, dry, full, 
+              len(result['SubFile'])))
+    finally:
+        pm.closeSession()
+        shutil.rmtree(folder)
+
+
+def benchRead(n_runs=50000, models_per_run=3, n_models=2000):
+    """Compare the tuple based table loaders with the original ones."""
+    folder = tempfile.mkdtemp()
+    try:
+        setupDb(folder)
+        rand = random.Random(1)
+        types = ['TCF', 'TGC', 'TBC', 'ECF', 'TEF', 'BC_DBASE']
+        pv.bulkInsert(pm.ModelFile, [{'name': 'model_%s' % i, 'model_type': types[i % len(types)], 
+                                      'comments': ''} for i in range(n_models)])
+        pv.bulkInsert(pm.Run, [{'run_hash': str(i), 'run_options': 'opt_%s' % (i % 50), 
+                                'event_name': 'event_%s' % i, 'tcf': 'run.tcf', 
+                                'modeller': 'me'} for i in range(n_runs)])
+        pv.bulkInsert(pm.Run_ModelFile, [{'run': r + 1, 'model_file': 'model_%s' % m, 'new_file': m % 2 == 0}
+                                         for r in range(n_runs) 
+                                         for m in rand.sample(range(n_models), models_per_run)])
+        
+        # Compare as the tables display them, addRows calls str() on each cell
+        as_text = lambda rows: [[str(c) for c in r] for r in rows]
+        cases = [
+            ('getRunData', legacyGetRunData, (), pv.getRunData, ()),
+            ('getModelData', legacyGetModelData, ('TCF',), pv.getModelData, ('TCF',)),
+            ('getSimpleQuery RUN', legacyRunQuery, (), pv.getSimpleQuery, 
+                ('RUN Options', '', False, False, False, -1)),
+            ('getSimpleQuery MODEL', legacyModelQuery, (), pv.getSimpleQuery, 
+                ('All Modelfiles', '', False, False, False, -1)),
+        ]
+        same = True
+        for name, legacy_func, legacy_args, new_func, new_args in cases:
+            legacy, (lcols, lrows) = timeit(legacy_func, *legacy_args)
+            new, (cols, rows) = timeit(new_func, *new_args)
+            match = lcols == cols and as_text(lrows) == as_text(rows)
+            same = same and match
+            print('%s (%s rows): legacy %.2fs, tuples %.2fs, identical rows: %s' % (
+                  name, len(rows), legacy, new, match))
+        t, _ = timeit(lambda: [pv.getRunRow(i) for i in range(1, 1001)])
+        print('getRunRow: %.2fms per call' % t)
+    finally:
+        pm.closeSession()
+        shutil.rmtree(folder)
+    return same
+
+
+def benchTable(n_runs=40000):
+    """Compare loading the Run table into the item and model based tables."""
+    app = qtApp()
+    from PyQt5 import QtWidgets
+    import GuiStore
+    folder = tempfile.mkdtemp()
+    try:
+        setupDb(folder)
+        pv.bulkInsert(pm.Run, [{'run_hash': str(i), 'run_options': 'opt_%s' % (i % 50), 
+                                'event_name': 'event_%s' % i, 'tcf': 'run.tcf', 
+                                'mb': i % 7 * 0.5} for i in range(n_runs)])
+        cols, rows = pv.getRunData()
+    finally:
+        pm.closeSession()
+        shutil.rmtree(folder)
+    
+    def show(table, add_rows):
+        table.resize(1200, 800)
+        table.show()
+        add_rows()
+        app.processEvents()
+        table.close()
+    
+    legacy_table = QtWidgets.QTableWidget(0, 0)
+    legacy, _ = timeit(show, legacy_table, lambda: legacyAddRows(legacy_table, cols, rows, 0))
+    table = GuiStore.TableWidgetRun('RUN', 0, 0)
+    model, _ = timeit(show, table, lambda: table.addRows(cols, rows, sort_col=0))
+    print('table (%s rows x %s cols): QTableWidget items %.2fs, DbTableModel %.2fs' % (
+          len(rows), len(cols), legacy, model))
+
+
+def benchSort(n_rows=100000):
+    """Compare sorting the id, timestamp and mb columns of a large table."""
+    qtApp()
+    from PyQt5 import QtWidgets
+    import GuiStore
+    rand = random.Random(1)
+    start = datetime.datetime(2015, 1, 1)
+    cols = ['id', 'timestamp', 'mb']
+    rows = [(i + 1, (start + datetime.timedelta(minutes=rand.randint(0, 10**6))).strftime(
+             '%Y-%m-%d %H:%M:%S'), rand.choice([-9999.0, rand.uniform(-5, 5)]))
+            for i in range(n_rows)]
+    rand.shuffle(rows)
+    
+    legacy_table = QtWidgets.QTableWidget(0, 0)
+    legacyAddRows(legacy_table, cols, rows)
+    model = GuiStore.DbTableModel()
+    model.setRows(cols, rows)
+    for col, name in enumerate(cols):
+        legacy, _ = timeit(legacy_table.sortItems, col)
+        first, _ = timeit(model.sort, col)
+        model.sort(-1)
+        again, _ = timeit(model.sort, col)
+        print('sort %s (%s rows): QTableWidget items %.2fs, DbTableModel %.2fs '
+              '(resort %.2fs)' % (name, n_rows, legacy, first, again))
+
+
+def benchPages(n_runs=50000, models_per_run=3, n_models=2000):
+    """Compare time to first rows for full and paged query results."""
+    folder = tempfile.mkdtemp()
+    try:
+        setupDb(folder)
+        rand = random.Random(1)
+        pv.bulkInsert(pm.ModelFile, [{'name': 'model_%s' % i, 'model_type': 'TCF', 
+                                      'comments': ''} for i in range(n_models)])
+        pv.bulkInsert(pm.Run, [{'run_hash': str(i), 'run_options': '', 'event_name': ''} 
+                               for i in range(n_runs)])
+        pv.bulkInsert(pm.Run_ModelFile, [{'run': r + 1, 'model_file': 'model_%s' % m}
+                                         for r in range(n_runs) 
+                                         for m in rand.sample(range(n_models), models_per_run)])
+        args = ('All Modelfiles', 'model_%', False, False, False, -1)
+        full, (cols, rows) = timeit(pv.getSimpleQuery, *args)
+        cols, pages = pv.getSimpleQueryPages(*args)
+        first, _ = timeit(pages.fetchPage)
+        count, total = timeit(pages.count)
+        while not pages.finished:
+            last, _ = timeit(pages.fetchPage)
+        print('pages (%s rows): full query %.2fs, first page %.3fs, last page %.3fs, '
+              'count %.2fs' % (total, full, first, last, count))
+    finally:
+        pm.closeSession()
+        shutil.rmtree(folder)
+
+
+BENCHMARKS = {
+    'sort': benchSort,
+    'pages': benchPages,
+    'table': benchTable,
+    'read': benchRead,
+    'orphans': benchOrphans,
+    'ingest': benchIngest,
+    'newstatus': benchNewStatus,
+    'delete': benchDelete,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    for n in names:
+        BENCHMARKS[n]()
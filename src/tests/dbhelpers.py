@@ -0,0 +1,53 @@
+"""
+ Summary:
+    Helpers shared by the tests that need a log database.
+
+    TempDbTestCase creates an empty database in a temp file for each test
+    and removes it afterwards. tempDbPath and createTempDb are for tests
+    that need to manage the database themselves.
+"""
+import unittest
+import os
+import tempfile
+
+import peeweemodels as pm
+
+
+def modelDict(name, mtype, files):
+    """Return a model in the format used by peeweeviews.addAllModel."""
+    return {'NAME': name, 'TYPE': mtype, 'COMMENTS': '', 'FILES': files}
+
+
+def tempDbPath():
+    """Return the path of a new .logdb file in the temp folder.
+
+    The file doesn't exist yet, it's up to the caller to create and remove it.
+    """
+    fd, db_path = tempfile.mkstemp(suffix='.logdb')
+    os.close(fd)
+    os.remove(db_path)
+    return db_path
+
+
+def createTempDb():
+    """Create an empty log database with all of the tables in a temp file.
+
+    Return:
+        str - the database path.
+    """
+    db_path = tempDbPath()
+    pm.createNewDb(db_path)
+    pm.createTableList(pm.getAllTables())
+    return db_path
+
+
+class TempDbTestCase(unittest.TestCase):
+    """Creates an empty database in a temp file for each test."""
+
+    def setUp(self):
+        self.db_path = createTempDb()
+        pm.connectDB()
+
+    def tearDown(self):
+        pm.closeSession()
+        os.remove(self.db_path)
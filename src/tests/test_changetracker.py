@@ -0,0 +1,105 @@
+import unittest
+import os
+import sqlite3
+
+import peeweemodels as pm
+import peeweeviews as pv
+import changetracker
+from tests.dbhelpers import modelDict, createTempDb, TempDbTestCase
+
+
+class ChangeTrackerTest(TempDbTestCase):
+
+    def setUp(self):
+        super(ChangeTrackerTest, self).setUp()
+        pm.openSession(self.db_path)
+        for r in range(3):
+            self.addRun(str(r), ['m%s.tcf' % r])
+        self.tracker = changetracker.ChangeTracker()
+        self.tracker.reset()
+
+    def addRun(self, run_hash, models):
+        run = pm.Run.create(run_hash=run_hash, run_options='', event_name='')
+        pv.addAllModel([modelDict(m, 'TCF', ['a.shp']) for m in models], run.id)
+        return run.id
+
+    def test_noChanges(self):
+        self.assertEqual(self.tracker.check(), {})
+        # Reading doesn't count as a change
+        pv.getRunData()
+        self.assertEqual(self.tracker.check(), {})
+
+    def test_added(self):
+        run_id = self.addRun('3', ['m3.tcf', 'm0.tcf'])
+        changes = self.tracker.check()
+        self.assertEqual(sorted(changes.keys()), ['ModelFile', 'Run'])
+        self.assertEqual(changes['Run'], changetracker.TableChanges([run_id], [], [], False))
+        self.assertEqual(changes['ModelFile'].added, [4])
+        self.assertEqual(self.tracker.check(), {})
+
+        cols, rows = pv.getRunData(changes['Run'].added)
+        self.assertEqual([r[0] for r in rows], [run_id])
+        cols, rows = pv.getModelData('TCF', changes['ModelFile'].added)
+        self.assertEqual([r[1] for r in rows], ['m3.tcf'])
+
+    def test_removed(self):
+        pv.deleteRunRows([1], delete_recursive=True)
+        self.addRun('3', ['m3.tcf'])
+        changes = self.tracker.check()
+        self.assertEqual(changes['Run'].added, [4])
+        self.assertEqual(changes['Run'].removed, [1])
+        # Files are reported by name, as the records have gone
+        self.assertEqual(changes['ModelFile'].removed, ['m0.tcf'])
+        self.assertEqual(changes['ModelFile'].added, [4])
+
+    def test_reusedId(self):
+        """The last record is deleted and its id is used for a new one."""
+        pm.Run.delete().where(pm.Run.id == 3).execute()
+        pm.Run.create(run_hash='new', run_options='', event_name='',
+                      timestamp='2100-01-01 00:00:00')
+        changes = self.tracker.check()
+        self.assertEqual(changes['Run'], changetracker.TableChanges([], [], [], True))
+
+        pm.ModelFile.delete().where(pm.ModelFile.id == 3).execute()
+        pm.ModelFile.create(name='new.tcf', model_type='TCF')
+        changes = self.tracker.check()
+        self.assertEqual(changes['ModelFile'],
+                         changetracker.TableChanges([3], ['m2.tcf'], [], False))
+
+    def test_markUpdated(self):
+        pv.updateRunRow({'comments': 'changed'}, 2)
+        self.assertEqual(self.tracker.check(), {})
+        self.tracker.markUpdated('Run', [2])
+        self.assertEqual(self.tracker.check()['Run'].updated, [2])
+        self.assertEqual(self.tracker.check(), {})
+
+    def test_otherConnection(self):
+        """Changes committed by another connection are found."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("INSERT INTO run (run_hash, setup, comments, ief, tcf, "
+                         "initial_conditions, isis_results, tuflow_results, estry_results, "
+                         "event_duration, modeller, isis_version, tuflow_version, "
+                         "event_name, ief_dir, tcf_dir, log_dir, run_options, run_status, "
+                         "mb, timestamp) VALUES ('other', '', '', '', '', '', '', '', '', "
+                         "'', '', '', '', '', '', '', '', '', '', -9999.0, "
+                         "'2100-01-01 00:00:00')")
+            conn.commit()
+        finally:
+            conn.close()
+        self.assertEqual(self.tracker.check()['Run'].added, [4])
+
+    def test_notReset(self):
+        self.assertIsNone(changetracker.ChangeTracker().check())
+        pm.closeSession()
+        path = createTempDb()
+        try:
+            pm.openSession(path)
+            self.assertIsNone(self.tracker.check())
+            pm.closeSession()
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import os
+
+import peeweemodels as pm
+import peeweeviews as pv
+import dbmaintenance
+from tests.dbhelpers import modelDict, TempDbTestCase
+
+
+class DbMaintenanceTest(TempDbTestCase):
+    
+    def setUp(self):
+        """Create a database with a run that uses the same file twice."""
+        super(DbMaintenanceTest, self).setUp()
+        self.run_id = pm.Run.create(run_hash='one', run_options='', event_name='').id
+        pv.addAllModel([
+            modelDict('m1.tcf', 'TCF', ['a.shp', 'b.shp']),
+            modelDict('m1.tgc', 'TGC', ['a.shp', 'c.csv']),
+        ], self.run_id)
+    
+    def test_duplicates(self):
+        duplicates = dbmaintenance.findDuplicateAssociations()
+        self.assertEqual(len(duplicates['Run_SubFile']), 1)
+        self.assertEqual(duplicates['ModelFile_SubFile'], [])
+        
+        removed = dbmaintenance.removeDuplicateAssociations()
+        self.assertEqual(removed['Run_SubFile'], 1)
+        self.assertEqual(pm.Run_SubFile.select().count(), 3)
+        self.assertFalse(any(dbmaintenance.findDuplicateAssociations().values()))
+    
+    def test_healthReport(self):
+        progress = []
+        report = dbmaintenance.healthReport(
+            progress_callback=lambda v, m, msg: progress.append(v))
+        self.assertEqual(progress, list(range(6)))
+        self.assertEqual(report['integrity'], [])
+        self.assertEqual(report['foreign_keys'], [])
+        tables = dict((t['table'], t) for t in report['tables'])
+        self.assertEqual(tables['Run_SubFile']['rows'], 4)
+        self.assertEqual(tables['SubFile']['rows'], 3)
+        self.assertTrue(tables['Run']['pages'] >= 1)
+        self.assertEqual(report['database']['auto_vacuum'], 
+                         dbmaintenance.AUTO_VACUUM_INCREMENTAL)
+        
+        summary, details = dbmaintenance.formatReport(report)
+        self.assertIn('1 duplicate association records', summary)
+        self.assertIn('Duplicate Run_SubFile records: 1', details)
+        
+        # ANALYZE has collected statistics for the query planner
+        stats = pm.logit_db.execute_sql('SELECT COUNT(*) FROM sqlite_stat1').fetchone()[0]
+        self.assertTrue(stats > 0)
+    
+    def test_vacuum(self):
+        files = ['f%s.csv' % i for i in range(2000)]
+        pv.addAllModel([modelDict('big.tgc', 'TGC', files)], self.run_id)
+        pm.Run.delete().execute()
+        pv.removeOrphans()
+        free_pages = dbmaintenance.databaseStats()['free_pages']
+        self.assertTrue(free_pages > 0)
+        self.assertEqual(dbmaintenance.vacuum(), free_pages)
+        self.assertEqual(dbmaintenance.databaseStats()['free_pages'], 0)
+    
+    def test_vacuumOldDatabase(self):
+        """A database made before incremental vacuum is changed over."""
+        pm.closeSession()
+        os.remove(self.db_path)
+        pm.openSession(self.db_path)
+        pm.createTableList(pm.getAllTables())
+        self.assertEqual(dbmaintenance.databaseStats()['auto_vacuum'], 0)
+        dbmaintenance.vacuum()
+        self.assertEqual(dbmaintenance.databaseStats()['auto_vacuum'], 
+                         dbmaintenance.AUTO_VACUUM_INCREMENTAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
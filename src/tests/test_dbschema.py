@@ -0,0 +1,389 @@
+import unittest
+import os
+import shutil
+import tempfile
+from datetime import datetime as dt
+
+import peeweemodels as pm
+import peeweeviews as pv
+import dbmigrations as migrations
+
+
+def queryPlan(sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail text for a query."""
+    cursor = pm.logit_db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)
+    return ' | '.join(row[-1] for row in cursor.fetchall())
+
+
+def createV23Database(db_path, version):
+    """Create a database with the tables as they were in version 23.
+    
+    The older versions are set up from this by the tests.
+    """
+    pm.createNewDb(db_path)
+    pm.connectDB()
+    for columns, table_sql, index_sql in migrations.V23_TABLES.values():
+        for sql in [table_sql] + index_sql:
+            pm.logit_db.execute_sql(sql)
+    pm.logit_db.execute_sql('PRAGMA user_version = %s' % version)
+
+
+def insertRows(table, columns, rows):
+    """Insert rows into a table with plain sql."""
+    sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (
+        table, ', '.join(columns), ', '.join(['?'] * len(columns)))
+    for row in rows:
+        pm.logit_db.execute_sql(sql, row)
+
+
+def addV23Run(run_hash, dat=None):
+    """Add a record to the version 23 run table and return its id."""
+    insertRows('run', migrations.V23_TABLES['run'][0][1:], [
+        [dat, run_hash, '', '', '', '', '', '', '', '', -9999.0, '', -9999.0, '', '', '', 
+         '', '', '', '', '', '2026-01-01 00:00:00']])
+    return pm.logit_db.execute_sql('SELECT MAX(id) FROM run').fetchone()[0]
+
+
+def addV23Model(run_id, name, model_type, files):
+    """Add a model and its files to the version 23 tables, as addAllModel did."""
+    time = '2026-01-01 00:00:%02d' % run_id
+    if not pm.logit_db.execute_sql('SELECT 1 FROM modelfile WHERE name = ?', (name,)).fetchone():
+        insertRows('modelfile', ['name', 'model_type', 'comments', 'timestamp'], 
+                   [(name, model_type, '', time)])
+    insertRows('run_modelfile', ['run_id', 'model_file_id', 'new_file', 'timestamp'], 
+               [(run_id, name, 1, time)])
+    for f in files:
+        if not pm.logit_db.execute_sql('SELECT 1 FROM subfile WHERE name = ?', (f,)).fetchone():
+            insertRows('subfile', ['name', 'timestamp'], [(f, time)])
+        if not pm.logit_db.execute_sql(
+                'SELECT 1 FROM modelfile_subfile WHERE model_file_id = ? AND sub_file_id = ?', 
+                (name, f)).fetchone():
+            insertRows('modelfile_subfile', ['model_file_id', 'sub_file_id', 'new_file', 'timestamp'], 
+                       [(name, f, 1, time)])
+        insertRows('run_subfile', ['run_id', 'sub_file_id', 'timestamp'], [(run_id, f, time)])
+
+
+def addV23Ied(run_id, name):
+    if not pm.logit_db.execute_sql('SELECT 1 FROM ied WHERE name = ?', (name,)).fetchone():
+        insertRows('ied', ['name', 'ref', 'amendments', 'comments', 'timestamp'], 
+                   [(name, '', '', '', '2026-01-01 00:00:00')])
+    insertRows('run_ied', ['run_id', 'ied_id', 'timestamp'], [(run_id, name, '2026-01-01 00:00:00')])
+
+
+def countRows(table):
+    return pm.logit_db.execute_sql('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0]
+
+
+class Update22Test(unittest.TestCase):
+    
+    QUERIES = {
+        'model_type': (
+            "SELECT name FROM modelfile WHERE model_type = ? ORDER BY name", ('TGC',),
+            'modelfile_model_type_name'),
+        'model_subfile': (
+            "SELECT 1 FROM modelfile_subfile WHERE model_file_id = ? AND sub_file_id = ?", 
+            ('a.tgc', 'a.shp'), 'modelfile_subfile_model_file_id_sub_file_id'),
+        'subfile_order': (
+            "SELECT id FROM modelfile_subfile WHERE sub_file_id = ? ORDER BY timestamp", 
+            ('a.shp',), 'modelfile_subfile_sub_file_id_timestamp'),
+        'run_model_order': (
+            "SELECT id FROM run_modelfile WHERE model_file_id = ? ORDER BY timestamp", 
+            ('a.tgc',), 'run_modelfile_model_file_id_timestamp'),
+        'run_subfile': (
+            "SELECT 1 FROM run_subfile WHERE run_id = ? AND sub_file_id = ?", 
+            (1, 'a.shp'), 'run_subfile_run_id_sub_file_id'),
+        'run_ied': (
+            "SELECT 1 FROM run_ied WHERE run_id = ? AND ied_id = ?", 
+            (1, 'a.ied'), 'run_ied_run_id_ied_id'),
+    }
+    
+    def setUp(self):
+        """Create a database without the version 22 indexes."""
+        self.folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.folder, 'v21.logdb')
+        createV23Database(self.db_path, 21)
+        for table in migrations.V23_TABLES.keys():
+            for index in pm.logit_db.get_indexes(table):
+                if len(index.columns) > 1:
+                    pm.logit_db.execute_sql('DROP INDEX %s' % index.name)
+    
+    def tearDown(self):
+        pm.closeSession()
+        shutil.rmtree(self.folder)
+    
+    def test_requiredUpdates(self):
+        updates = migrations.getRequiredUpdates(self.db_path)
+        self.assertEqual(updates, [migrations.update22, migrations.update23, migrations.update24])
+        
+    def test_update22(self):
+        for key, (sql, params, index) in self.QUERIES.items():
+            plan = queryPlan(sql, params)
+            self.assertNotIn(index, plan, key)
+            
+        migrations.update22()
+        for key, (sql, params, index) in self.QUERIES.items():
+            plan = queryPlan(sql, params)
+            self.assertIn(index, plan, key)
+            self.assertNotIn('TEMP B-TREE', plan, key)
+        
+        # Safe to run on a database that already has the indexes
+        migrations.update22()
+    
+    def test_newDatabaseHasIndexes(self):
+        pm.closeSession()
+        path = os.path.join(self.folder, 'new.logdb')
+        pm.createNewDb(path)
+        pm.createTableList(pm.getAllTables())
+        pm.connectDB()
+        # The association tables are now the *_link tables, using the file ids
+        for key, (sql, params, index) in self.QUERIES.items():
+            for name in migrations.V24_LINK_TABLES.keys():
+                sql = sql.replace('FROM %s ' % name, 'FROM %s_link ' % name)
+            self.assertIn(index, queryPlan(sql, [1] * len(params)), key)
+        self.assertEqual(pv.checkDatabaseVersion(path), pm.DATABASE_VERSION_SAME)
+        
+
+class Update23Test(unittest.TestCase):
+    
+    ASSOCIATIONS = ['modelfile_subfile', 'run_modelfile', 'run_subfile', 'run_ied']
+    
+    def setUp(self):
+        """Create a database with the association tables as they were in v22."""
+        self.folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.folder, 'v22.logdb')
+        createV23Database(self.db_path, 22)
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = OFF')
+        for name in self.ASSOCIATIONS:
+            columns, table_sql, index_sql = migrations.V23_TABLES[name]
+            pm.logit_db.execute_sql('DROP TABLE "%s"' % name)
+            pm.logit_db.execute_sql(table_sql.replace(' ON DELETE CASCADE', ''))
+            for sql in index_sql:
+                pm.logit_db.execute_sql(sql)
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = ON')
+        
+        insertRows('dat', ['name', 'amendments', 'comments', 'timestamp'], 
+                   [('a.dat', '', '', '2026-01-01 00:00:00')])
+        run = addV23Run('one', 'a.dat')
+        addV23Model(run, 'a.tgc', 'TGC', ['a.shp', 'b.shp'])
+        addV23Ied(run, 'a.ied')
+        # A reference to a run that has been deleted
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = OFF')
+        insertRows('run_subfile', ['run_id', 'sub_file_id', 'timestamp'], 
+                   [(99, 'a.shp', '2026-01-01 00:00:00')])
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = ON')
+    
+    def tearDown(self):
+        pm.closeSession()
+        shutil.rmtree(self.folder)
+        
+    def onDelete(self, table):
+        cursor = pm.logit_db.execute_sql('PRAGMA foreign_key_list("%s")' % table)
+        return set(row[6] for row in cursor.fetchall())
+        
+    def test_update23(self):
+        counts = dict((t, countRows(t)) for t in self.ASSOCIATIONS)
+        self.assertEqual(migrations.getRequiredUpdates(self.db_path), 
+                         [migrations.update23, migrations.update24])
+        for table in self.ASSOCIATIONS:
+            self.assertEqual(self.onDelete(table), set(['NO ACTION']))
+        
+        migrations.update23()
+        for table in self.ASSOCIATIONS:
+            self.assertEqual(self.onDelete(table), set(['CASCADE']))
+            self.assertEqual(countRows(table), counts[table])
+        
+        # Indexes are recreated
+        plan = queryPlan(*Update22Test.QUERIES['run_subfile'][:2])
+        self.assertIn(Update22Test.QUERIES['run_subfile'][2], plan)
+        
+        pm.logit_db.execute_sql('DELETE FROM run WHERE id = 1')
+        self.assertEqual(countRows('run_modelfile'), 0)
+        self.assertEqual(countRows('run_ied'), 0)
+        self.assertEqual(countRows('run_subfile'), 1)
+        
+    def test_update23Resume(self):
+        """A rebuild that is stopped part way carries on where it stopped."""
+        counts = dict((t, countRows(t)) for t in self.ASSOCIATIONS)
+        calls = []
+        def stop(value, maximum, message):
+            calls.append(message)
+            if 'run_subfile_copy: 1 of' in message:
+                raise KeyboardInterrupt
+        
+        batch_size = migrations.BATCH_SIZE
+        migrations.BATCH_SIZE = 1
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                migrations.update23(stop)
+            record = migrations.MigrationStep.get(
+                name='update23.rebuild_run_subfile_copy')
+            self.assertEqual((record.last_key, record.completed), (1, False))
+            self.assertEqual(countRows('run_subfile'), 1)
+            
+            calls = []
+            migrations.update23(lambda *args: calls.append(args[2]))
+        finally:
+            migrations.BATCH_SIZE = batch_size
+        self.assertNotIn('Running update23.rebuild_run_modelfile_copy', calls)
+        self.assertIn('rebuild_run_subfile_copy: 1 of 3', calls)
+        for table in self.ASSOCIATIONS:
+            self.assertEqual(self.onDelete(table), set(['CASCADE']))
+            self.assertEqual(countRows(table), counts[table])
+        self.assertNotIn('run_subfile_old', pm.logit_db.get_tables())
+
+
+class Update21Test(unittest.TestCase):
+    
+    def setUp(self):
+        """Create a database as it was in v20."""
+        self.folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.folder, 'v20.logdb')
+        createV23Database(self.db_path, 20)
+        for r in range(3):
+            run = addV23Run(str(r))
+            addV23Model(run, 'a.tgc', 'TGC', ['a.shp', 'b.shp'])
+            addV23Model(run, 'm%s.tbc' % r, 'TBC', ['c.shp'])
+        # A ModelFile_SubFile left behind after its SubFile was deleted
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = OFF')
+        insertRows('modelfile_subfile', ['model_file_id', 'sub_file_id', 'new_file', 'timestamp'], 
+                   [('a.tgc', 'gone.shp', 1, '2026-01-01 00:00:00')])
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = ON')
+        for table in ['run_subfile', 'run_ied', 'ied']:
+            pm.logit_db.execute_sql('DROP TABLE "%s"' % table)
+        pm.logit_db.execute_sql('ALTER TABLE run DROP COLUMN initial_conditions')
+    
+    def tearDown(self):
+        pm.closeSession()
+        shutil.rmtree(self.folder)
+    
+    def test_migrateDatabase(self):
+        self.assertEqual(migrations.getRequiredUpdates(self.db_path), 
+                         [migrations.update21, migrations.update22, migrations.update23,
+                          migrations.update24])
+        progress = []
+        start = dt.now().replace(microsecond=0)
+        updates = migrations.migrateDatabase(
+            self.db_path, lambda v, m, msg: progress.append(msg))
+        self.assertEqual(len(updates), 4)
+        self.assertIn('Running update21.populate_run_subfile', progress)
+        self.assertEqual(pv.checkDatabaseVersion(self.db_path), pm.DATABASE_VERSION_SAME)
+        self.assertEqual(migrations.migrateDatabase(self.db_path), pm.DATABASE_VERSION_SAME)
+        
+        pm.connectDB()
+        self.assertEqual(pm.Run_SubFile.select().count(), 9)
+        files = [(r.run_id, r.sub_file.name) for r in 
+                 pm.Run_SubFile.select().order_by(pm.Run_SubFile.run, pm.Run_SubFile.sub_file)]
+        self.assertEqual(files[:3], [(1, 'a.shp'), (1, 'b.shp'), (1, 'c.shp')])
+        # The new records get the current time rather than the Run_ModelFile's
+        for r in pm.Run_SubFile.select():
+            self.assertGreaterEqual(r.timestamp, start)
+        self.assertEqual(pm.Run.get(pm.Run.id == 1).initial_conditions, '')
+        done = migrations.MigrationStep.select().where(migrations.MigrationStep.completed)
+        self.assertEqual(done.count(), migrations.MigrationStep.select().count())
+
+
+class Update24Test(unittest.TestCase):
+    
+    def setUp(self):
+        """Create a version 23 database, using the file names as keys."""
+        self.folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.folder, 'v23.logdb')
+        createV23Database(self.db_path, 23)
+        insertRows('dat', ['name', 'amendments', 'comments', 'timestamp'], 
+                   [('a.dat', '', '', '2026-01-01 00:00:00')])
+        for r in range(3):
+            run = addV23Run(str(r), 'a.dat')
+            addV23Model(run, 'Model/A.TGC', 'TGC', ['a.shp', 'B.shp'])
+            addV23Model(run, 'm%s.tbc' % r, 'TBC', ['c.shp'])
+            addV23Ied(run, 'a.ied')
+        # A file that was deleted without its association records
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = OFF')
+        pm.logit_db.execute_sql("DELETE FROM subfile WHERE name = 'c.shp'")
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = ON')
+    
+    def tearDown(self):
+        pm.closeSession()
+        shutil.rmtree(self.folder)
+        
+    def schema(self):
+        cursor = pm.logit_db.execute_sql(
+            "SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' "
+            "AND tbl_name != 'logit_migration' ORDER BY name")
+        return cursor.fetchall()
+        
+    def test_update24(self):
+        self.assertEqual(migrations.getRequiredUpdates(self.db_path), [migrations.update24])
+        old_ids = dict(pm.logit_db.execute_sql('SELECT name, rowid FROM modelfile').fetchall())
+        migrations.update24()
+        
+        # The records keep the rowid as their id
+        for m in pm.ModelFile.select():
+            self.assertEqual(m.id, old_ids[m.name])
+        self.assertEqual(pm.ModelFile.get(pm.ModelFile.name == 'Model/A.TGC').name_key, 
+                         'model\\a.tgc')
+        self.assertEqual(pm.Run.get(pm.Run.id == 1).dat.name, 'a.dat')
+        
+        # Records that referenced the deleted file are dropped
+        self.assertEqual(pm.ModelFile_SubFile.select().count(), 2)
+        self.assertEqual(pm.Run_SubFile.select().count(), 6)
+        self.assertEqual(pm.Run_ModelFile.select().count(), 6)
+        self.assertEqual(pm.Run_Ied.select().count(), 3)
+        self.assertEqual(pm.logit_db.execute_sql('PRAGMA foreign_key_check').fetchall(), [])
+        
+        # The old association tables are views that still use the names
+        rows = pm.logit_db.execute_sql(
+            'SELECT r.run_hash, msf.sub_file_id FROM run AS r '
+            'JOIN run_modelfile AS rm ON rm.run_id = r.id '
+            'JOIN modelfile_subfile AS msf ON msf.model_file_id = rm.model_file_id '
+            "WHERE r.id = 2 ORDER BY msf.sub_file_id").fetchall()
+        self.assertEqual(rows, [('1', 'B.shp'), ('1', 'a.shp')])
+        
+        # Same schema as a new database
+        migrated = self.schema()
+        pm.closeSession()
+        path = os.path.join(self.folder, 'new.logdb')
+        pm.createNewDb(path)
+        pm.createTableList(pm.getAllTables())
+        pm.connectDB()
+        self.assertEqual(self.schema(), migrated)
+        pm.closeSession()
+        
+        # And it can still be logged to
+        pm.openSession(self.db_path)
+        run = pm.Run.create(run_hash='3', run_options='', event_name='', dat='a.dat')
+        pv.addAllModel([{'NAME': 'Model/A.TGC', 'TYPE': 'TGC', 'COMMENTS': '', 
+                         'FILES': ['a.shp', 'd.shp']}], run.id)
+        files = [r.sub_file.name for r in pm.Run_SubFile.select().where(pm.Run_SubFile.run == run.id)]
+        self.assertEqual(sorted(files), ['a.shp', 'd.shp'])
+        self.assertEqual(pm.SubFile.get(pm.SubFile.name == 'd.shp').id, 3)
+        
+    def test_update24Resume(self):
+        """A migration that is stopped part way carries on where it stopped."""
+        def stop(value, maximum, message):
+            if 'run_subfile_link_copy: 1 of' in message:
+                raise KeyboardInterrupt
+        
+        batch_size = migrations.BATCH_SIZE
+        migrations.BATCH_SIZE = 1
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                migrations.update24(stop)
+            record = migrations.MigrationStep.get(
+                name='update24.run_subfile_link_copy')
+            self.assertEqual((record.last_key, record.completed), (1, False))
+            self.assertEqual(countRows('run_subfile_link'), 1)
+            
+            calls = []
+            migrations.update24(lambda *args: calls.append(args[2]))
+        finally:
+            migrations.BATCH_SIZE = batch_size
+        self.assertNotIn('Running update24.dat_copy', calls)
+        self.assertIn('run_subfile_link_copy: 2 of 9', calls)
+        self.assertEqual(pm.Run_SubFile.select().count(), 6)
+        self.assertEqual(countRows('run_subfile'), 6)
+        self.assertNotIn('subfile_new', pm.logit_db.get_tables())
+        self.assertEqual(pm.logit_db.execute_sql('PRAGMA foreign_key_check').fetchall(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+import os
+import sys
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5 import QtCore, QtWidgets
+
+import GuiStore
+import peeweeviews as pv
+
+app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+
+
+class ListPages(pv.QueryPages):
+    """QueryPages over a list of rows."""
+
+    def __init__(self, rows, page_size):
+        super(ListPages, self).__init__(page_size)
+        self.rows = rows
+
+    def _readPage(self):
+        return self.rows[self.fetched:self.fetched + self.page_size]
+
+    def _countRows(self):
+        return len(self.rows)
+
+
+class TableWidgetDbTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cols = ['id', 'timestamp', 'comments', 'mb']
+        self.rows = [
+            (3, '2017-01-03 10:00:00', 'three', 1.5),
+            (1, '2017-01-01 10:00:00', 'one', -9999.0),
+            (2, '2017-01-02 10:00:00', 'two', 20.0),
+        ]
+        self.table = GuiStore.TableWidgetRun('RUN', 0, 0, hidden_cols={'mb': 3})
+        self.table.addRows(self.cols, list(self.rows), sort_col=0)
+
+    def test_addRows(self):
+        self.assertEqual(self.table.rowCount(), 3)
+        self.assertEqual(self.table.columnCount(), 4)
+        self.assertEqual(self.table.headerText(2), 'comments')
+        self.assertEqual([self.table.cellText(r, 0) for r in range(3)], ['1', '2', '3'])
+        self.assertEqual(self.table.cellText(0, 3), '-9999.0')
+        self.assertTrue(self.table.horizontalHeader().isSectionHidden(3))
+
+    def test_editFlags(self):
+        model = self.table.table_model
+        self.assertFalse(model.flags(model.index(0, 0)) & QtCore.Qt.ItemIsEditable)
+        self.assertTrue(model.flags(model.index(0, 2)) & QtCore.Qt.ItemIsEditable)
+
+    def test_editTracking(self):
+        saved = []
+        index = self.table.proxy_model.index(1, 2)
+        self.assertTrue(self.table.proxy_model.setData(index, 'edited'))
+        self.assertEqual(self.table._unsaved_entries, ['2'])
+        self.assertEqual(self.table.cellText(1, 2), 'edited')
+        self.assertEqual(index.data(QtCore.Qt.BackgroundRole),
+                         GuiStore.DbTableModel.HIGHLIGHT_COLOUR)
+
+        GuiStore.TableWidgetDb.saveTableEdits(
+            self.table, lambda cells, id: saved.append((id, cells)))
+        self.assertEqual(saved, [('2', {'timestamp': '2017-01-02 10:00:00',
+                                        'comments': 'edited', 'mb': '20.0'})])
+        self.assertEqual(self.table._unsaved_entries, [])
+
+    def test_customHighlight(self):
+        highlight = [[False, True], [False, False]]
+        table = GuiStore.TableWidgetQuery('QUERY', 0, 0)
+        table.addRows(['a', 'b'], [(1, 'x'), (2, 'y')], sort_col=0, 
+                      custom_highlight=highlight)
+        self.assertEqual(table.proxy_model.index(0, 1).data(QtCore.Qt.BackgroundRole),
+                         GuiStore.DbTableModel.HIGHLIGHT_COLOUR)
+        self.assertIsNone(table.proxy_model.index(1, 1).data(QtCore.Qt.BackgroundRole))
+
+    def test_sortKeepsHighlight(self):
+        self.table.proxy_model.setData(self.table.proxy_model.index(0, 2), 'edited')
+        self.table.setCurrentIndex(self.table.proxy_model.index(0, 2))
+        self.table.sortByColumn(0, QtCore.Qt.DescendingOrder)
+        self.assertEqual([self.table.cellText(r, 0) for r in range(3)], ['3', '2', '1'])
+        self.assertEqual(self.table.currentRow(), 2)
+        self.assertEqual(self.table.cellText(2, 2), 'edited')
+        colour = GuiStore.DbTableModel.HIGHLIGHT_COLOUR
+        backgrounds = [self.table.proxy_model.index(r, 1).data(QtCore.Qt.BackgroundRole)
+                       for r in range(3)]
+        self.assertEqual(backgrounds, [None, None, colour])
+
+    def test_sortTypes(self):
+        table = GuiStore.TableWidgetQuery('QUERY', 0, 0)
+        rows = [
+            (10, '2017-01-10 09:00:00', 'b', '1.5'),
+            (9, '2017-01-09 10:00:00', 'C', '-9999.0'),
+            (100, '2016-12-31 23:00:00', 'a', ''),
+        ]
+        table.addRows(['id', 'timestamp', 'name', 'mb'], rows, sort_col=0)
+        column = lambda c: [table.cellText(r, c) for r in range(3)]
+        self.assertEqual(column(0), ['9', '10', '100'])
+        table.sortByColumn(1, QtCore.Qt.AscendingOrder)
+        self.assertEqual(column(0), ['100', '9', '10'])
+        table.sortByColumn(2, QtCore.Qt.AscendingOrder)
+        self.assertEqual(column(2), ['a', 'b', 'C'])
+        table.sortByColumn(3, QtCore.Qt.AscendingOrder)
+        self.assertEqual(column(3), ['', '-9999.0', '1.5'])
+
+        # Edited values are sorted by their new value
+        table.proxy_model.setData(table.proxy_model.index(0, 3), '2')
+        table.sortByColumn(3, QtCore.Qt.DescendingOrder)
+        self.assertEqual(column(3), ['2', '1.5', '-9999.0'])
+
+    def test_sortValue(self):
+        values = ['abc', 'ABD', '', '2017-01-01 00:00:00', '10', 2.5, None, 'nan', 3]
+        self.assertEqual(sorted(values, key=GuiStore.sortValue),
+                         ['', None, 2.5, 3, '10', '2017-01-01 00:00:00', 'abc', 'ABD', 'nan'])
+        item = GuiStore.TableWidgetItemDb(10)
+        self.assertTrue(GuiStore.TableWidgetItemDb(9) < item)
+        item.setText('8')
+        self.assertFalse(GuiStore.TableWidgetItemDb(9) < item)
+
+    def test_filter(self):
+        self.table.setFilterText('TWO')
+        self.assertEqual(self.table.rowCount(), 1)
+        self.assertEqual(self.table.cellText(0, 0), '2')
+        self.table.setFilterText('')
+        self.assertEqual(self.table.rowCount(), 3)
+
+    def test_fetchMore(self):
+        table = GuiStore.TableWidgetQuery('QUERY', 0, 0)
+        rows = [(i, 'name_%s' % i) for i in range(10)]
+        table.addPages(['id', 'name'], ListPages(rows, 4))
+        self.assertEqual(table.rowCount(), 4)
+        self.assertEqual([table.cellText(r, 0) for r in range(4)], ['0', '1', '2', '3'])
+        self.assertTrue(table.proxy_model.canFetchMore(QtCore.QModelIndex()))
+
+        # Sorted rows stay sorted as new pages arrive
+        table.sortByColumn(0, QtCore.Qt.DescendingOrder)
+        table.proxy_model.fetchMore(QtCore.QModelIndex())
+        self.assertEqual(table.rowCount(), 8)
+        self.assertEqual(table.cellText(0, 0), '7')
+        table.proxy_model.fetchMore(QtCore.QModelIndex())
+        self.assertEqual(table.rowCount(), 10)
+        self.assertFalse(table.proxy_model.canFetchMore(QtCore.QModelIndex()))
+        self.assertEqual(table.table_model.pages().count(), 10)
+
+
+    def test_patchRows(self):
+        # Edit row 2, which is later removed, and row 3, which is replaced
+        self.table.proxy_model.setData(self.table.proxy_model.index(1, 2), 'edited')
+        self.table.proxy_model.setData(self.table.proxy_model.index(2, 2), 'edited')
+        self.table.sortByColumn(0, QtCore.Qt.DescendingOrder)
+        self.table.patchRows([(4, '2017-01-04 10:00:00', 'four', 0.0),
+                              (3, '2017-01-03 10:00:00', 'new three', 1.5)], removed=[2])
+        self.assertEqual([self.table.cellText(r, 0) for r in range(3)], ['4', '3', '1'])
+        self.assertEqual(self.table.cellText(1, 2), 'new three')
+        self.assertEqual(self.table._unsaved_entries, [])
+        self.assertIsNone(self.table.proxy_model.index(1, 2).data(QtCore.Qt.BackgroundRole))
+
+        # The kept rows keep their highlighting and sort keys
+        self.table.proxy_model.setData(self.table.proxy_model.index(2, 2), 'edited')
+        self.table.patchRows(removed=[4])
+        self.assertEqual([self.table.cellText(r, 0) for r in range(2)], ['3', '1'])
+        self.assertEqual(self.table.proxy_model.index(1, 2).data(QtCore.Qt.BackgroundRole),
+                         GuiStore.DbTableModel.HIGHLIGHT_COLOUR)
+        self.table.sortByColumn(2, QtCore.Qt.AscendingOrder)
+        self.assertEqual([self.table.cellText(r, 2) for r in range(2)], ['edited', 'new three'])
+
+        self.table.table_model.clearHighlights()
+        self.assertIsNone(self.table.proxy_model.index(0, 2).data(QtCore.Qt.BackgroundRole))
+        self.assertEqual(self.table.table_model.removeKeys([99], 0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
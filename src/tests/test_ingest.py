@@ -0,0 +1,112 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+import ingest
+
+
+class IngestPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.folder, 'model_%s.tcf' % i) for i in range(25)]
+        self.batches = []
+
+    def tearDown(self):
+        os.rmdir(self.folder)
+
+    def write(self, batch):
+        self.batches.append(list(batch))
+
+    def check(self, path, all_logs, error, missing):
+        # The models don't exist, so log the paths of every other one
+        self.assertFalse(all_logs)
+        index = self.paths.index(path)
+        return path if index % 2 == 0 else None
+
+    def test_run(self):
+        progress = []
+        pipeline = ingest.IngestPipeline(self.write, batch_size=5)
+        logged = pipeline.run(self.paths, '', self.check,
+                              progress_callback=lambda v, m, msg: progress.append((v, m)))
+        expected = self.paths[::2]
+        self.assertEqual(logged, len(expected))
+        self.assertEqual([len(b) for b in self.batches], [5, 5, 3])
+        self.assertEqual([p for b in self.batches for p in b], expected)
+        self.assertEqual(progress[-1], (25, 25))
+        self.assertEqual([s.count for s in pipeline.stats()], [25, 25, 13])
+
+    def test_backpressure(self):
+        release = threading.Event()
+        def write(batch):
+            release.wait(5)
+            self.write(batch)
+        pipeline = ingest.IngestPipeline(write, batch_size=2, write_queue_size=3)
+        result = []
+        runner = threading.Thread(
+            target=lambda: result.append(pipeline.run(self.paths, '', lambda *args: args[0])))
+        runner.start()
+
+        # The writer holds the first batch, the queue is full and the check
+        # stage is blocked on the next model
+        threading.Event().wait(0.5)
+        self.assertEqual(pipeline.check_stats.count, 6)
+        self.assertEqual(pipeline.write_stats.peak_depth, 3)
+        release.set()
+        runner.join(5)
+        self.assertEqual(result, [25])
+        self.assertEqual([p for b in self.batches for p in b], self.paths)
+
+    def test_cancelled(self):
+        checked = []
+        def check(path, all_logs, error, missing):
+            checked.append(path)
+            return path
+        pipeline = ingest.IngestPipeline(self.write, batch_size=4)
+        logged = pipeline.run(self.paths, '', check, cancelled=lambda: len(checked) >= 6)
+        self.assertEqual(logged, 6)
+        self.assertEqual([p for b in self.batches for p in b], self.paths[:6])
+
+    def test_writeError(self):
+        def write(batch):
+            raise ValueError('database is locked')
+        pipeline = ingest.IngestPipeline(write, batch_size=2, write_queue_size=1)
+        with self.assertRaises(ValueError):
+            pipeline.run(self.paths, '', lambda *args: args[0])
+        self.assertEqual(pipeline.written, 0)
+
+
+class IngestJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.folder, 'models.logdb')
+        self.paths = ['model_%s.tcf' % i for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_resume(self):
+        journal = ingest.IngestJournal(self.db_path)
+        self.assertFalse(journal.load())
+        journal.start(self.paths, '~s1~ BAS', {'MODELLER': 'DR'})
+        journal.commit({self.paths[0]: 'hash0', self.paths[1]: 'hash1'})
+        journal.commit({self.paths[3]: 'hash3'})
+
+        # A write that was cut off part way through is ignored
+        with open(journal.path, 'a') as f:
+            f.write('{"committed": {"model_4.t')
+
+        other = ingest.IngestJournal(self.db_path)
+        self.assertTrue(other.load())
+        self.assertEqual(other.run_options, '~s1~ BAS')
+        self.assertEqual(other.input_vars, {'MODELLER': 'DR'})
+        self.assertEqual(other.remaining(), [self.paths[2], self.paths[4]])
+        other.remove()
+        self.assertFalse(journal.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
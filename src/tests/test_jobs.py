@@ -0,0 +1,136 @@
+import unittest
+import os
+import sys
+import threading
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5 import QtCore, QtWidgets
+
+import jobs
+import peeweemodels as pm
+import peeweeviews as pv
+from tests.dbhelpers import createTempDb
+
+app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+
+
+class JobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = jobs.JobExecutor(max_workers=4)
+        self.events = []
+
+    def tearDown(self):
+        self.executor.cancelAll()
+        self.executor.waitForDone()
+
+    def runJobs(self, *job_list):
+        """Start the jobs and process events until they are all done."""
+        loop = QtCore.QEventLoop()
+        self.executor.jobDoneSignal.connect(
+            lambda job: loop.quit() if not self.executor.activeJobs() else None)
+        for job in job_list:
+            job.finishedSignal.connect(lambda result: self.events.append(('finished', result)))
+            job.failedSignal.connect(lambda msg: self.events.append(('failed', msg)))
+            job.cancelledSignal.connect(lambda: self.events.append(('cancelled',)))
+            self.executor.start(job)
+        QtCore.QTimer.singleShot(5000, loop.quit)
+        if self.executor.activeJobs():
+            loop.exec_()
+        self.assertEqual(self.executor.activeJobs(), [])
+
+    def test_result(self):
+        main_thread = threading.current_thread()
+        job = jobs.Job(lambda job, a, b: (a + b, threading.current_thread() is main_thread),
+                       (1, 2), 'add')
+        self.runJobs(job)
+        self.assertEqual(self.events, [('finished', (3, False))])
+
+    def test_failed(self):
+        def fail(job):
+            raise ValueError('bad value')
+        self.runJobs(jobs.Job(fail, name='fail'))
+        self.assertEqual(self.events, [('failed', 'bad value')])
+
+    def test_cancel(self):
+        started = threading.Event()
+        def loop(job):
+            started.set()
+            while True:
+                job.checkCancelled()
+                job.wait(0.01)
+        job = jobs.Job(loop, name='loop')
+        self.executor.start(job)
+        started.wait(5)
+        self.assertTrue(self.executor.isRunning('loop'))
+        self.executor.cancelAll()
+        self.assertTrue(job.wait(5))
+        self.runJobs()
+        self.assertFalse(self.executor.isRunning('loop'))
+
+    def test_progress(self):
+        progress = []
+        def count(job):
+            for i in range(1000):
+                job.setProgress(i, 1000, 'Counting')
+            job.setProgress(1000)
+        job = jobs.Job(count, name='count')
+        job.progressSignal.connect(lambda v, m, msg: progress.append((v, m, msg)))
+        self.runJobs(job)
+        # Throttled, but the first and last are always sent
+        self.assertTrue(len(progress) < 100)
+        self.assertEqual(progress[0], (0, 1000, 'Counting'))
+        self.assertEqual(progress[-1], (1000, 1000, 'Counting'))
+
+    def test_writerLane(self):
+        active = []
+        overlaps = []
+        lock = threading.Lock()
+        def write(value):
+            with lock:
+                active.append(value)
+                if len(active) > 1: overlaps.append(value)
+            threading.Event().wait(0.01)
+            with lock:
+                active.remove(value)
+            return value * 2
+        def worker(job, values):
+            return [job.write(write, v) for v in values]
+        job_list = [jobs.Job(worker, (range(i * 5, i * 5 + 5),), 'worker %s' % i)
+                    for i in range(4)]
+        self.runJobs(*job_list)
+        self.assertEqual(overlaps, [])
+        results = sorted(r for e in self.events for r in e[1])
+        self.assertEqual(results, [i * 2 for i in range(20)])
+
+    def test_inline(self):
+        executor = jobs.JobExecutor(inline=True)
+        job = jobs.Job(lambda job: job.write(lambda: threading.current_thread()), name='inline')
+        executor.start(job)
+        self.assertTrue(job.isDone())
+        self.assertIs(job.result, threading.current_thread())
+
+    def test_databaseWrites(self):
+        db_path = createTempDb()
+        try:
+            pm.openSession(db_path)
+            ids = [pm.Run.create(run_hash=str(i), run_options='', event_name='').id
+                   for i in range(10)]
+            def update(job, run_ids):
+                job.write(pv.updateRunRows, dict((i, {'mb': i * 1.5}) for i in run_ids))
+            self.runJobs(jobs.Job(update, (ids[:5],), 'first'),
+                         jobs.Job(update, (ids[5:],), 'second'))
+            self.assertEqual([r.mb for r in pm.Run.select().order_by(pm.Run.id)],
+                             [i * 1.5 for i in ids])
+        finally:
+            pm.closeSession()
+            os.remove(db_path)
+
+    def test_formatRate(self):
+        self.assertEqual(jobs.formatRate(0, -1), '')
+        self.assertEqual(jobs.formatRate(2.5, -1), '2.5/s')
+        self.assertEqual(jobs.formatRate(250, 3725), '250/s, 1:02:05 left')
+
+
+if __name__ == '__main__':
+    unittest.main()
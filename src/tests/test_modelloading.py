@@ -0,0 +1,97 @@
+import unittest
+import os
+import pickle
+import tempfile
+
+import LogBuilder
+import LogClasses
+
+
+class ModelLoadingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.folder, 'model_%s.tcf' % i) for i in range(7)]
+
+    def tearDown(self):
+        os.rmdir(self.folder)
+
+    def test_loadModelLogs(self):
+        all_logs, error, missing = LogBuilder.loadModelLogs(self.paths[0], '')
+        self.assertFalse(all_logs)
+        self.assertIn(self.paths[0], error)
+        self.assertIn('File does not exist', error)
+        self.assertEqual(missing, [self.paths[0]])
+
+    def test_loadModels(self):
+        for workers in [1, 3]:
+            results = list(LogBuilder.loadModels(self.paths, '', workers))
+            self.assertEqual([r[0] for r in results], self.paths)
+            for path, all_logs, error, missing in results:
+                self.assertFalse(all_logs)
+                self.assertIn(path, error)
+
+    def test_loadModelsCancelled(self):
+        calls = []
+        def cancelled():
+            calls.append(1)
+            return len(calls) > 3
+        results = list(LogBuilder.loadModels(self.paths, '', 2, cancelled))
+        self.assertEqual([r[0] for r in results], self.paths[:3])
+
+    def test_cachedModel(self):
+        cache = LogBuilder.configureParseCache()
+        try:
+            cached = LogClasses.AllLogs('model_0.tcf', self.folder, '')
+            key = ('model', os.path.normcase(os.path.abspath(self.paths[0])), 's1 DEV')
+            cache.put(key, cached)
+            all_logs, error, missing = LogBuilder.loadModelLogs(self.paths[0], 's1 DEV')
+            self.assertEqual((all_logs.run_hash, error), (cached.run_hash, ''))
+            all_logs, error, missing = LogBuilder.loadModelLogs(self.paths[0], 's2 DEV')
+            self.assertFalse(all_logs)
+        finally:
+            LogBuilder.configureParseCache()
+
+    def test_readRunHash(self):
+        tcf_path = os.path.join(self.folder, 'model_1.tcf')
+        ief_path = os.path.join(self.folder, 'model_1.ief')
+        with open(tcf_path, 'w') as f:
+            f.write('Geometry Control File == model.tgc\n')
+        with open(ief_path, 'w') as f:
+            f.write('[ISIS Event Header]\nTitle=model\n2DFile=%s\n2DScheme=TUFLOW\n'
+                    '2DOptions= s1 DEV \n[ISIS Event Details]\n2DOptions=s2\n' % tcf_path)
+        try:
+            self.assertEqual(LogBuilder.readIefHeader(ief_path)['2DOptions'], 's1 DEV')
+            
+            # Matches the hash made when the model is loaded
+            all_logs = LogClasses.AllLogs('model_1.ief', self.folder, self.folder)
+            all_logs.addLogEntry([{'TYPE': 'RUN', 'TCF': 'model_1.tcf', 'IEF': 'model_1.ief',
+                                   'RUN_OPTIONS': 's1 DEV'}])
+            self.assertEqual(LogBuilder.readRunHash(ief_path, 'e1'), all_logs.run_hash)
+            self.assertEqual(LogBuilder.readRunHash(tcf_path, 'e1'),
+                             LogClasses.runHash('model_1.tcf', '', 'e1'))
+            self.assertIsNone(LogBuilder.readRunHash(self.paths[0], ''))
+
+            # The tcf referenced by the ief has to exist
+            os.remove(tcf_path)
+            self.assertIsNone(LogBuilder.readRunHash(ief_path, ''))
+        finally:
+            for path in [tcf_path, ief_path]:
+                if os.path.exists(path): os.remove(path)
+
+    def test_parseWorkerCount(self):
+        self.assertEqual(LogBuilder.parseWorkerCount(4), 4)
+        self.assertTrue(LogBuilder.parseWorkerCount(0) >= 1)
+
+    def test_pickleLogs(self):
+        all_logs = LogClasses.AllLogs('model.tcf', 'c:/model', '')
+        all_logs.addLogEntry([{'TYPE': 'RUN', 'TCF': 'model.tcf', 'IEF': '',
+                               'RUN_OPTIONS': 's1 DEV'}])
+        all_logs.addLogEntry([{'TYPE': 'TGC', 'NAME': 'model.tgc', 'FILES': ['a.shp']}])
+        loaded = pickle.loads(pickle.dumps(all_logs))
+        self.assertEqual(loaded.run_hash, all_logs.run_hash)
+        self.assertEqual(loaded.models, all_logs.models)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import parsecache
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'bc_dbase.csv')
+        self.writeFile(self.path, 'name,source\nbc1,bc1.csv\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def writeFile(self, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_getPut(self):
+        cache = parsecache.ParseCache()
+        key = ('bc', self.path)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, ['bc1.csv'], [self.path])
+        value = cache.get(key)
+        self.assertEqual(value, ['bc1.csv'])
+
+        # Every get returns a new copy
+        value.append('changed')
+        self.assertEqual(cache.get(key), ['bc1.csv'])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_fileChanged(self):
+        cache = parsecache.ParseCache()
+        other = os.path.join(self.folder, 'model.tgc')
+        cache.put(('bc', self.path), ['bc1.csv'], [self.path, other])
+        self.assertEqual(cache.get(('bc', self.path)), ['bc1.csv'])
+
+        # A dependency that didn't exist being created invalidates the entry
+        self.writeFile(other, 'Read GIS Z Shape == a.shp\n')
+        self.assertIsNone(cache.get(('bc', self.path)))
+
+        cache.put(('bc', self.path), ['bc1.csv'], [self.path, other])
+        self.writeFile(self.path, 'name,source\nbc1,bc1.csv\nbc2,bc2.csv\n')
+        self.assertIsNone(cache.get(('bc', self.path)))
+
+    def test_lru(self):
+        cache = parsecache.ParseCache(max_items=2)
+        for i in range(3):
+            cache.put(('item', str(i)), i)
+            cache.get(('item', '0'))
+        self.assertEqual(cache.get(('item', '0')), 0)
+        self.assertIsNone(cache.get(('item', '1')))
+        self.assertEqual(cache.get(('item', '2')), 2)
+
+    def test_disk(self):
+        cache_dir = os.path.join(self.folder, 'cache')
+        cache = parsecache.ParseCache(cache_dir=cache_dir, max_disk_items=2)
+        for i in range(3):
+            cache.put(('item', str(i)), {'value': i}, [self.path])
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+        # Another cache, e.g. in a new session or process, reads the files
+        # and removes the oldest when it's created
+        os.utime(os.path.join(cache_dir, cache._digest(('item', '0')) + '.pkl'), (0, 0))
+        other = parsecache.ParseCache(cache_dir=cache_dir, max_disk_items=2)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        self.assertIsNone(other.get(('item', '0')))
+        self.assertEqual(other.get(('item', '2')), {'value': 2})
+
+        self.writeFile(self.path, 'changed')
+        self.assertIsNone(other.get(('item', '1')))
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        other.clear()
+        self.assertEqual(os.listdir(cache_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+import peeweemodels as pm
+import peeweeviews as pv
+
+
+class DbSessionTest(unittest.TestCase):
+    
+    def setUp(self):
+        """Create two empty databases in a temp folder."""
+        self.folder = tempfile.mkdtemp()
+        self.db1 = os.path.join(self.folder, 'one.logdb')
+        self.db2 = os.path.join(self.folder, 'two.logdb')
+        for p in [self.db2, self.db1]:
+            pm.createNewDb(p)
+            pm.createTableList(pm.getAllTables())
+    
+    def tearDown(self):
+        pm.closeSession()
+        shutil.rmtree(self.folder)
+    
+    def test_sessionKeepsConnection(self):
+        pm.openSession(self.db1)
+        pm.connectDB()
+        conn = pm.logit_db.connection()
+        self.assertFalse(pv.runExists('nothing'))
+        pv.getRunData()
+        pm.openSession(self.db1)
+        self.assertFalse(pm.logit_db.is_closed())
+        self.assertIs(pm.logit_db.connection(), conn)
+        
+    def test_sessionReopensOnPathChange(self):
+        pm.openSession(self.db1)
+        pm.Run.create(run_hash='one', run_options='', event_name='')
+        pm.openSession(self.db2)
+        self.assertFalse(pv.runExists('one'))
+        pm.openSession(self.db1)
+        self.assertTrue(pv.runExists('one'))
+    
+    def test_otherThreadReopensOnPathChange(self):
+        pm.openSession(self.db1)
+        pm.Run.create(run_hash='one', run_options='', event_name='')
+        found = []
+        go = threading.Event()
+        
+        def worker():
+            pm.connectDB()
+            found.append(pv.runExists('one'))
+            go.wait()
+            pm.connectDB()
+            found.append(pv.runExists('one'))
+            pm.logit_db.close()
+        
+        t = threading.Thread(target=worker)
+        t.start()
+        pm.openSession(self.db2)
+        go.set()
+        t.join()
+        self.assertEqual(found, [True, False])
+    
+    def test_batchSession(self):
+        pm.openSession(self.db1)
+        with pm.batchSession():
+            pm.Run.create(run_hash='one', run_options='', event_name='')
+            pm.connectDB()
+            pm.disconnectDB()
+            self.assertTrue(pm.logit_db.in_transaction())
+        self.assertTrue(pv.runExists('one'))
+        
+        try:
+            with pm.batchSession():
+                pm.Run.create(run_hash='two', run_options='', event_name='')
+                raise ValueError('Fail')
+        except ValueError:
+            pass
+        self.assertFalse(pv.runExists('two'))
+    
+    def test_batchSessionWithoutOpenSession(self):
+        pm.closeSession()
+        pm.logit_db.init(self.db1)
+        with pm.batchSession():
+            pm.Run.create(run_hash='one', run_options='', event_name='')
+            pm.disconnectDB()
+            self.assertFalse(pm.logit_db.is_closed())
+        self.assertTrue(pm.logit_db.is_closed())
+        pm.connectDB()
+        self.assertTrue(pv.runExists('one'))
+        pm.disconnectDB()
+    
+    def test_backupDatabase(self):
+        pm.openSession(self.db1)
+        pm.Run.create(run_hash='one', run_options='', event_name='')
+        copy = os.path.join(self.folder, 'copy.logdb')
+        steps = []
+        pm.backupDatabase(copy, pages=1, sleep=0, 
+                          progress=lambda status, remaining, total: steps.append(remaining))
+        self.assertTrue(len(steps) > 1)
+        self.assertEqual(steps[-1], 0)
+        pm.openSession(copy)
+        self.assertTrue(pv.runExists('one'))
+        
+
+class PragmaProfileTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db1 = os.path.join(self.folder, 'one.logdb')
+        pm.createNewDb(self.db1)
+        pm.createTableList(pm.getAllTables())
+    
+    def tearDown(self):
+        pm.setPragmaProfile(pm.DEFAULT_PRAGMA_PROFILE)
+        pm.closeSession()
+        shutil.rmtree(self.folder)
+    
+    def test_localFast(self):
+        self.assertEqual(pm.setPragmaProfile('local-fast'), 'local-fast')
+        status = pm.getProfileStatus()
+        self.assertEqual(status['name'], 'local-fast')
+        self.assertEqual(status['current']['journal_mode'], 'wal')
+        self.assertEqual(status['current']['synchronous'], 1)
+        self.assertEqual(status['current']['cache_size'], -65536)
+        self.assertEqual(status['current']['temp_store'], 2)
+        
+        pm.setPragmaProfile('network-share-safe')
+        status = pm.getProfileStatus()
+        self.assertEqual(status['current']['journal_mode'], 'delete')
+        self.assertEqual(status['current']['synchronous'], 2)
+        self.assertEqual(status['current']['mmap_size'], 0)
+    
+    def test_settingsProfiles(self):
+        profiles = {'custom': {'cache_size': -1000}}
+        self.assertEqual(pm.setPragmaProfile('custom', profiles), 'custom')
+        self.assertEqual(pm.getProfileStatus()['current']['cache_size'], -1000)
+        self.assertEqual(pm.setPragmaProfile('missing', profiles), pm.DEFAULT_PRAGMA_PROFILE)
+        
+    def test_noDatabase(self):
+        pm.closeSession()
+        status = pm.getProfileStatus()
+        self.assertEqual(status['name'], pm.DEFAULT_PRAGMA_PROFILE)
+        self.assertEqual(status['current'], {})
+    
+ 
+if __name__ == '__main__':
+    unittest.main()
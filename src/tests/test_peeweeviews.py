@@ -0,0 +1,400 @@
+import unittest
+import random
+
+import peeweemodels as pm
+import peeweeviews as pv
+from tests.dbhelpers import modelDict, TempDbTestCase
+
+
+def iedDict(name):
+    return {'NAME': name, 'REF': '', 'AMENDMENTS': '', 'COMMENTS': ''}
+
+def runDict(**kwargs):
+    run = dict((k, '') for k in [
+        'SETUP', 'MODELLER', 'IEF', 'TCF', 'INITIAL_CONDITIONS', 'ISIS_RESULTS', 
+        'TUFLOW_RESULTS', 'ESTRY_RESULTS', 'EVENT_DURATION', 'COMMENTS', 'ISIS_BUILD', 
+        'TUFLOW_BUILD', 'EVENT_NAME', 'LOG_DIR', 'RUN_OPTIONS', 'RUN_STATUS'])
+    run['MB'] = -9999.0
+    run.update(kwargs)
+    return run
+
+
+class LogsStub(object):
+    """The parts of LogBuilder.AllLogs used when adding a log entry."""
+    
+    def __init__(self, run_hash, models, ieds=[], dat=None):
+        self.run_hash = run_hash
+        self.run = runDict()
+        self.models = models
+        self.ieds = ieds
+        self.dat = dat
+        self.ief_dir = ''
+        self.tcf_dir = ''
+
+
+class PeeweeViewsTest(TempDbTestCase):
+        
+    def addRun(self, run_hash):
+        return pm.Run.create(run_hash=run_hash, run_options='', event_name='').id
+    
+    def test_addAllModel(self):
+        r1 = self.addRun('one')
+        pv.addAllModel([
+            modelDict('m1.tcf', 'TCF', ['a.shp', 'b.shp', 'a.shp']),
+            modelDict('m1.tgc', 'TGC', ['a.shp', 'c.csv']),
+        ], r1)
+        self.assertEqual(pm.ModelFile.select().count(), 2)
+        self.assertEqual(pm.SubFile.select().count(), 3)
+        # Duplicate subfile in the same model only gets one ModelFile_SubFile
+        self.assertEqual(pm.ModelFile_SubFile.select().count(), 4)
+        # ...but every occurrence gets a Run_SubFile
+        self.assertEqual(pm.Run_SubFile.select().count(), 5)
+        self.assertTrue(all(rm.new_file for rm in pm.Run_ModelFile.select()))
+        
+        r2 = self.addRun('two')
+        pv.addAllModel([
+            modelDict('m1.tcf', 'TCF', ['a.shp']),
+            modelDict('m2.tcf', 'TCF', ['a.shp', 'd.shp']),
+        ], r2)
+        self.assertEqual(pm.ModelFile.select().count(), 3)
+        self.assertEqual(pm.SubFile.select().count(), 4)
+        query = (pm.ModelFile_SubFile.select(pm.ModelFile_SubFile, pm.ModelFile, pm.SubFile)
+                 .join(pm.ModelFile).switch(pm.ModelFile_SubFile).join(pm.SubFile))
+        flags = dict(((q.model_file.name, q.sub_file.name), q.new_file) for q in query)
+        self.assertTrue(flags[('m1.tcf', 'a.shp')])
+        self.assertFalse(flags[('m2.tcf', 'a.shp')])
+        self.assertTrue(flags[('m2.tcf', 'd.shp')])
+        rm_flags = dict(
+            (q.model_file.name, q.new_file) for q in 
+            pm.Run_ModelFile.select().where(pm.Run_ModelFile.run == r2)
+        )
+        self.assertEqual(rm_flags, {'m1.tcf': False, 'm2.tcf': True})
+    
+    def test_addAllModel_chunked(self):
+        """Check inserts and lookups bigger than a single chunk."""
+        files = ['f%s.csv' % i for i in range(pv.IN_QUERY_CHUNK_SIZE * 2 + 7)]
+        pv.addAllModel([modelDict('big.tgc', 'TGC', files)], self.addRun('one'))
+        pv.addAllModel([modelDict('big2.tgc', 'TGC', files)], self.addRun('two'))
+        self.assertEqual(pm.SubFile.select().count(), len(files))
+        self.assertEqual(pm.ModelFile_SubFile.select().count(), len(files) * 2)
+        self.assertEqual(pm.Run_SubFile.select().count(), len(files) * 2)
+        
+    def test_addAllIed(self):
+        r1 = self.addRun('one')
+        pv.addAllIed([iedDict('a.ied'), iedDict('b.ied'), iedDict('a.ied')], r1)
+        r2 = self.addRun('two')
+        pv.addAllIed([iedDict('a.ied'), iedDict('c.ied')], r2)
+        self.assertEqual(pm.Ied.select().count(), 3)
+        self.assertEqual(pm.Run_Ied.select().count(), 5)
+    
+    def test_addLogEntries(self):
+        dat = {'NAME': 'river.dat', 'AMENDMENTS': '', 'COMMENTS': ''}
+        run_ids = pv.addLogEntries([
+            LogsStub('one', [modelDict('m1.tcf', 'TCF', ['a.shp'])], [iedDict('a.ied')], dat),
+            LogsStub('two', [modelDict('m1.tcf', 'TCF', ['a.shp', 'b.shp'])]),
+        ])
+        runs = list(pm.Run.select().order_by(pm.Run.id))
+        self.assertEqual(run_ids, [r.id for r in runs])
+        self.assertEqual([r.run_hash for r in runs], ['one', 'two'])
+        self.assertEqual(runs[0].dat_id, 'river.dat')
+        self.assertEqual(pm.Run_ModelFile.select().count(), 2)
+        self.assertEqual(pm.Run_Ied.select().count(), 1)
+        
+        # Nothing is added if any of the entries fail
+        with self.assertRaises(Exception):
+            pv.addLogEntries([LogsStub('three', []), LogsStub('one', [])])
+        self.assertEqual(pm.Run.select().count(), 2)
+        
+        # Or only the failed ones if skip_failed
+        run_ids = pv.addLogEntries([LogsStub('three', []), LogsStub('one', []),
+                                    LogsStub('four', [])], True)
+        self.assertIsNone(run_ids[1])
+        self.assertEqual([r.run_hash for r in pm.Run.select().order_by(pm.Run.id)],
+                         ['one', 'two', 'three', 'four'])
+    
+    def test_existingRunHashes(self):
+        for i in range(3):
+            self.addRun('hash_%s' % i)
+        hashes = ['hash_%s' % i for i in range(1200)]
+        self.assertEqual(pv.existingRunHashes(hashes), set(hashes[:3]))
+        self.assertEqual(pv.existingRunHashes([]), set())
+    
+    def addTestRuns(self):
+        """Add some runs that share model files and sub files."""
+        rand = random.Random(2)
+        for r in range(20):
+            models = []
+            for m in rand.sample(range(8), 3):
+                files = ['f%s.shp' % rand.randrange(15) for _ in range(5)]
+                models.append(modelDict('m%s.tgc' % m, ['TGC', 'TBC'][m % 2], files))
+            pv.addAllModel(models, self.addRun(str(r)))
+    
+    def expectedNewStatus(self):
+        """Work out the new_file flags in python."""
+        found = set()
+        sub_flags = {}
+        query = (pm.ModelFile_SubFile.select(pm.ModelFile_SubFile, pm.ModelFile)
+                 .join(pm.ModelFile)
+                 .order_by(pm.ModelFile_SubFile.timestamp, pm.ModelFile_SubFile.id))
+        for q in query:
+            key = (q.model_file.model_type, q.sub_file_id)
+            sub_flags[q.id] = not key in found
+            found.add(key)
+        found = set()
+        model_flags = {}
+        query = pm.Run_ModelFile.select().order_by(pm.Run_ModelFile.timestamp, pm.Run_ModelFile.id)
+        for q in query:
+            model_flags[q.id] = not q.model_file_id in found
+            found.add(q.model_file_id)
+        return sub_flags, model_flags
+    
+    def currentNewStatus(self):
+        sub_flags = dict((q.id, q.new_file) for q in pm.ModelFile_SubFile.select())
+        model_flags = dict((q.id, q.new_file) for q in pm.Run_ModelFile.select())
+        return sub_flags, model_flags
+    
+    def scrambleNewStatus(self, seed=3):
+        rand = random.Random(seed)
+        for table in [pm.ModelFile_SubFile, pm.Run_ModelFile]:
+            for q in table.select():
+                table.update(new_file=rand.random() > 0.5).where(table.id == q.id).execute()
+    
+    def test_updateNewStatus(self):
+        self.addTestRuns()
+        expected = self.expectedNewStatus()
+        self.scrambleNewStatus()
+        self.assertNotEqual(self.currentNewStatus(), expected)
+        pv.updateNewStatus()
+        self.assertEqual(self.currentNewStatus(), expected)
+        
+    def test_updateNewStatus_noWindow(self):
+        self.addTestRuns()
+        expected = self.expectedNewStatus()
+        self.scrambleNewStatus()
+        pv._updateModelNewStatus(window=False)
+        pv._updateSubFileNewStatus(window=False)
+        self.assertEqual(self.currentNewStatus(), expected)
+    
+    def test_newStatusMaintained(self):
+        """Check the flags set on add and delete match a full update."""
+        self.addTestRuns()
+        pv.addAllModel([
+            modelDict('x1.tgc', 'TGC', ['x.shp', 'f1.shp']),
+            modelDict('x2.tgc', 'TGC', ['x.shp', 'f1.shp']),
+            modelDict('x1.tgc', 'TGC', ['x.shp']),
+        ], self.addRun('dup'))
+        self.assertEqual(pv.verifyNewStatus(), {'ModelFile_SubFile': [], 'Run_ModelFile': []})
+        
+        pv.deleteRunRow(1, delete_recursive=True)
+        pv.deleteRunRow(5, delete_recursive=False)
+        pv.deleteRunRow(6, delete_recursive=True)
+        self.assertEqual(pv.verifyNewStatus(), {'ModelFile_SubFile': [], 'Run_ModelFile': []})
+        
+        pv.deleteModelRow('x1.tgc')
+        self.assertEqual(pv.verifyNewStatus(), {'ModelFile_SubFile': [], 'Run_ModelFile': []})
+        
+        self.scrambleNewStatus()
+        mismatches = pv.verifyNewStatus()
+        self.assertTrue(mismatches['ModelFile_SubFile'])
+        self.assertTrue(mismatches['Run_ModelFile'])
+        expected = self.expectedNewStatus()
+        for i, stored, flag in mismatches['ModelFile_SubFile']:
+            self.assertEqual(flag, expected[0][i])
+            self.assertNotEqual(stored, flag)
+    
+    def test_deleteRunRow(self):
+        pv.addDat({'NAME': 'shared.dat', 'AMENDMENTS': '', 'COMMENTS': ''})
+        pv.addDat({'NAME': 'own.dat', 'AMENDMENTS': '', 'COMMENTS': ''})
+        r1 = pm.Run.create(run_hash='one', run_options='', event_name='', dat='shared.dat').id
+        r2 = pm.Run.create(run_hash='two', run_options='', event_name='', dat='shared.dat').id
+        r3 = pm.Run.create(run_hash='three', run_options='', event_name='', dat='own.dat').id
+        pv.addAllModel([modelDict('shared.tcf', 'TCF', ['a.shp', 'b.shp'])], r1)
+        pv.addAllModel([modelDict('shared.tcf', 'TCF', ['a.shp', 'b.shp']),
+                        modelDict('own.tgc', 'TGC', ['b.shp', 'c.shp'])], r2)
+        pv.addAllModel([modelDict('own3.tgc', 'TGC', ['d.shp'])], r3)
+        pv.addAllIed([iedDict('shared.ied'), iedDict('own.ied')], r2)
+        pv.addAllIed([iedDict('shared.ied')], r3)
+        
+        pv.deleteRunRow(r2, delete_recursive=True)
+        names = lambda table: sorted([q.name for q in table.select()])
+        self.assertEqual(names(pm.ModelFile), ['own3.tgc', 'shared.tcf'])
+        self.assertEqual(names(pm.SubFile), ['a.shp', 'b.shp', 'd.shp'])
+        self.assertEqual(names(pm.Ied), ['shared.ied'])
+        self.assertEqual(names(pm.Dat), ['own.dat', 'shared.dat'])
+        self.assertEqual(pm.Run_ModelFile.select().where(pm.Run_ModelFile.run == r2).count(), 0)
+        self.assertEqual(pm.Run_SubFile.select().where(pm.Run_SubFile.run == r2).count(), 0)
+        self.assertEqual(pm.Run_Ied.select().where(pm.Run_Ied.run == r2).count(), 0)
+        self.assertEqual(pm.ModelFile_SubFile.select().count(), 3)
+        
+        # Not recursive, the files are kept but the association records go
+        pv.deleteRunRow(r3, delete_recursive=False)
+        self.assertEqual(names(pm.ModelFile), ['own3.tgc', 'shared.tcf'])
+        self.assertEqual(names(pm.Dat), ['own.dat', 'shared.dat'])
+        self.assertEqual(pm.Run_Ied.select().count(), 0)
+        self.assertEqual(names(pm.SubFile), ['a.shp', 'b.shp', 'd.shp'])
+        
+        pv.deleteRunRow(r1, delete_recursive=True)
+        self.assertEqual(names(pm.ModelFile), ['own3.tgc'])
+        self.assertEqual(names(pm.SubFile), ['d.shp'])
+        self.assertEqual(names(pm.Dat), ['own.dat'])
+        self.assertEqual(pv.verifyNewStatus(), {'ModelFile_SubFile': [], 'Run_ModelFile': []})
+        
+        # Missing runs are ignored
+        pv.deleteRunRow(r1, delete_recursive=True)
+    
+    def test_deleteRunRows(self):
+        self.addTestRuns()
+        pv.addAllModel([modelDict('only1.tgc', 'TGC', ['only.shp'])], 1)
+        pv.addAllModel([modelDict('only2.tgc', 'TGC', ['only.shp'])], 2)
+        progress = []
+        count = pv.deleteRunRows([1, 2, 3, 99], delete_recursive=True,
+                                 progress_callback=lambda v, m, t: progress.append((v, m)))
+        self.assertEqual(count, 3)
+        self.assertEqual(pm.Run.select().count(), 17)
+        self.assertEqual(progress[-1][0], progress[-1][1])
+        self.assertFalse(pm.ModelFile.select().where(pm.ModelFile.name << ['only1.tgc', 'only2.tgc']).exists())
+        self.assertFalse(pm.SubFile.select().where(pm.SubFile.name == 'only.shp').exists())
+        
+        # Every remaining model file is still used by a run
+        for m in pm.ModelFile.select():
+            self.assertTrue(pm.Run_ModelFile.select().where(pm.Run_ModelFile.model_file == m.id).exists())
+        self.assertEqual(pv.verifyNewStatus(), {'ModelFile_SubFile': [], 'Run_ModelFile': []})
+        
+        # Delete the rest, including the shared files
+        pv.deleteRunRows(range(4, 21), delete_recursive=True)
+        for table in pm.getAllTables():
+            self.assertEqual(table.select().count(), 0, table.__name__)
+    
+    def test_removeOrphans(self):
+        r1 = self.addRun('one')
+        r2 = self.addRun('two')
+        pv.addDat({'NAME': 'orphan.dat', 'AMENDMENTS': '', 'COMMENTS': ''})
+        pv.addAllModel([modelDict('a.tgc', 'TGC', ['a.shp', 'b.shp'])], r1)
+        pv.addAllModel([modelDict('b.tgc', 'TGC', ['b.shp', 'c.shp'])], r2)
+        pv.addAllIed([iedDict('a.ied')], r1)
+        pv.addAllIed([iedDict('b.ied')], r2)
+        pm.SubFile.create(name='orphan.shp')
+        run_only = pm.SubFile.create(name='run_only.shp')
+        pm.Run_SubFile.create(run=r1, sub_file=run_only)
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = OFF')
+        pm.Run.delete().where(pm.Run.id == r2).execute()
+        pm.logit_db.execute_sql('PRAGMA foreign_keys = ON')
+        
+        expected = {
+            'ModelFile_SubFile': [], 'Run_ModelFile': [2], 'Run_SubFile': [3, 4],
+            'Run_Ied': [2], 'ModelFile': [2], 'Ied': [2], 
+            'Dat': [1], 'SubFile': [3, 4],
+        }
+        counts = dict((t, t.select().count()) for t in pm.getAllTables())
+        self.assertEqual(pv.removeOrphans(dry_run=True), expected)
+        self.assertEqual(dict((t, t.select().count()) for t in pm.getAllTables()), counts)
+        
+        self.assertEqual(pv.removeOrphans(batch_size=1), expected)
+        names = lambda table: sorted([q.name for q in table.select()])
+        self.assertEqual(names(pm.SubFile), ['a.shp', 'b.shp', 'run_only.shp'])
+        self.assertEqual(names(pm.ModelFile), ['a.tgc'])
+        self.assertEqual(names(pm.Ied), ['a.ied'])
+        self.assertEqual(names(pm.Dat), [])
+        self.assertEqual(pm.ModelFile_SubFile.select().count(), 2)
+        self.assertFalse(any(pv.removeOrphans().values()))
+    
+    def test_deleteDatRow(self):
+        pv.addDat({'NAME': 'a.dat', 'AMENDMENTS': '', 'COMMENTS': ''})
+        r1 = pm.Run.create(run_hash='one', run_options='', event_name='', dat='a.dat').id
+        pv.deleteDatRow('a.dat')
+        self.assertEqual(pm.Dat.select().count(), 0)
+        self.assertIsNone(pm.Run.get_by_id(r1).dat_id)
+    
+    def test_updateNewStatus_runs(self):
+        self.addTestRuns()
+        expected = self.expectedNewStatus()
+        self.scrambleNewStatus()
+        run_ids = [1, 2]
+        model_files, sub_files = pv.newStatusGroups(run_ids)
+        before = self.currentNewStatus()
+        pv.updateNewStatus(run_ids=run_ids)
+        after = self.currentNewStatus()
+        
+        in_groups = dict(
+            (q.id, q.sub_file_id in sub_files) for q in pm.ModelFile_SubFile.select())
+        for i, flag in after[0].items():
+            if in_groups[i]:
+                self.assertEqual(flag, expected[0][i])
+            else:
+                self.assertEqual(flag, before[0][i])
+        in_groups = dict(
+            (q.id, q.model_file_id in model_files) for q in pm.Run_ModelFile.select())
+        for i, flag in after[1].items():
+            if in_groups[i]:
+                self.assertEqual(flag, expected[1][i])
+            else:
+                self.assertEqual(flag, before[1][i])
+    
+    def test_tableLoaders(self):
+        """Check the loaders return formatted tuples without model instances."""
+        pv.addDat({'NAME': 'a.dat', 'AMENDMENTS': '', 'COMMENTS': 'dat'})
+        r1 = pm.Run.create(run_hash='one', run_options='opt', event_name='', dat='a.dat').id
+        pv.addAllModel([modelDict('m1.tcf', 'TCF', ['a.shp', 'b.shp'])], r1)
+        date = pm.Run.get_by_id(r1).timestamp.strftime(pv.DATE_FORMAT)
+        
+        cols, rows = pv.getRunData()
+        self.assertEqual(len(rows[0]), len(cols))
+        self.assertEqual(rows[0][:4], (r1, date, 'one', 'opt'))
+        
+        cols, rows = pv.getSimpleQuery('DAT', '', False, False, False, r1)
+        self.assertEqual(rows, [(r1, date, 'a.dat', '', 'dat')])
+        cols, rows = pv.getSimpleQuery('RUN Options', 'opt', False, False, False, -1)
+        self.assertEqual(rows[0][0], str(r1))
+
+        cols, rows = pv.getSimpleQuery('TCF', 'm1.tcf', False, False, False, r1)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0], r1)
+        self.assertIs(rows[0][2], True)
+        self.assertEqual(rows[0][3:5], ('TCF', 'm1.tcf'))
+        
+        cols, rows = pv.getSimpleQuery('TCF', '', True, False, False, r1, 'b.shp')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(len(rows[0]), len(cols))
+        self.assertEqual(rows[0][6], 'b.shp')
+        self.assertIs(rows[0][8], True)
+        
+        run = pv.getRunRow(r1)
+        self.assertEqual(run['dat'], 'a.dat')
+        self.assertEqual(run['timestamp'].strftime(pv.DATE_FORMAT), date)
+    
+    def test_queryPages(self):
+        """Check the paged queries return the same rows as the full ones."""
+        for i in range(7):
+            run = self.addRun(str(i))
+            pv.addAllModel([modelDict('m%s.tcf' % (i % 3), 'TCF', ['a.shp', 'a.shp', 'b%s.shp' % i])], run)
+        queries = [
+            ('All Modelfiles', '', True, False, False, 3),
+            ('All Modelfiles', '', True, False, False, -1),
+            ('TCF', '', False, False, False, -1),
+            ('RUN Options', '', False, False, False, -1),
+        ]
+        for q in queries:
+            cols, rows = pv.getSimpleQuery(*q)
+            pcols, pages = pv.getSimpleQueryPages(*q, page_size=2)
+            self.assertEqual(pcols, cols)
+            self.assertEqual(pages.count(), len(rows))
+            paged = []
+            while not pages.finished:
+                page = pages.fetchPage()
+                self.assertTrue(len(page) <= 2)
+                paged.extend(page)
+            self.assertEqual(sorted(paged), sorted(rows))
+            self.assertEqual(pages.fetched, len(rows))
+        
+        cols, pages, error = pv.complexQueryPages(
+            self.db_path, 'SELECT id, run_hash FROM run ORDER BY id DESC;', page_size=3)
+        self.assertEqual(error, '')
+        self.assertEqual(cols, ['id', 'run_hash'])
+        self.assertEqual(pages.fetchPage(), [(7, '6'), (6, '5'), (5, '4')])
+        self.assertEqual(pages.count(), 7)
+        self.assertEqual(pv.complexQueryPages(self.db_path, 'DELETE FROM run')[1], None)
+        self.assertIn('no such column', pv.complexQueryPages(self.db_path, 'SELECT x FROM run')[2])
+        
+ 
+if __name__ == '__main__':
+    unittest.main()
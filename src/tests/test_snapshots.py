@@ -0,0 +1,93 @@
+import unittest
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import jobs
+import peeweemodels as pm
+import peeweeviews as pv
+import snapshots
+
+
+class CancelledJob(object):
+    
+    def setProgress(self, value, maximum=None, message=None):
+        pass
+    
+    def checkCancelled(self):
+        raise jobs.JobCancelled('Snapshot database')
+
+
+class SnapshotManagerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.folder, 'models.logdb')
+        pm.createNewDb(self.db_path)
+        pm.createTableList(pm.getAllTables())
+        pm.openSession(self.db_path)
+        pm.Run.create(run_hash='one', run_options='', event_name='')
+        self.manager = snapshots.SnapshotManager(self.db_path, hourly=3, daily=2)
+    
+    def tearDown(self):
+        pm.closeSession()
+        shutil.rmtree(self.folder)
+    
+    def touchSnapshots(self, times):
+        os.makedirs(self.manager.folder)
+        for when in times:
+            open(self.manager.snapshotPath(when), 'w').close()
+    
+    def test_takeAndRestore(self):
+        snapshot = self.manager.takeSnapshot(pages=1, sleep=0)
+        self.assertEqual(self.manager.listSnapshots()[0][1], snapshot)
+        self.assertEqual(os.listdir(self.manager.folder), [os.path.basename(snapshot)])
+        
+        pm.Run.create(run_hash='two', run_options='', event_name='')
+        pm.closeSession()
+        os.remove(snapshot)
+        snapshot = self.manager.takeSnapshot(pages=-1)
+        pm.openSession(snapshot)
+        self.assertTrue(pv.runExists('two'))
+        pm.closeSession()
+        
+        # Restore an older copy
+        older = os.path.join(self.manager.folder, 'models_20260101_000000.logdb')
+        shutil.move(snapshot, older)
+        pm.openSession(older)
+        pm.Run.delete().where(pm.Run.run_hash == 'two').execute()
+        pm.closeSession()
+        before = self.manager.restoreSnapshot(older)
+        pm.openSession(self.db_path)
+        self.assertTrue(pv.runExists('one'))
+        self.assertFalse(pv.runExists('two'))
+        pm.openSession(before)
+        self.assertTrue(pv.runExists('two'))
+    
+    def test_cancelled(self):
+        with self.assertRaises(jobs.JobCancelled):
+            self.manager.takeSnapshot(CancelledJob(), pages=1, sleep=0)
+        self.assertEqual(os.listdir(self.manager.folder), [])
+    
+    def test_retention(self):
+        now = datetime(2026, 10, 18, 12, 30)
+        times = [now - timedelta(minutes=20 * i) for i in range(8)]
+        times += [now - timedelta(days=d) for d in range(1, 4)]
+        self.touchSnapshots(times)
+        self.assertFalse(self.manager.isDue(60, now))
+        self.assertTrue(self.manager.isDue(60, now + timedelta(hours=1)))
+        self.assertFalse(self.manager.isDue(0, now + timedelta(hours=1)))
+        
+        # 12:30, 11:50 and 10:50 are the latest in each of the last 3 hours,
+        # 17/10 12:30 is the latest from the day before
+        expected = [t for t in times if not t in [
+            times[0], times[2], times[5], times[8]]]
+        self.assertEqual([e[0] for e in self.manager.expiredSnapshots()], expected)
+        self.manager.prune()
+        self.assertEqual([s[0] for s in self.manager.listSnapshots()], 
+                         [times[0], times[2], times[5], times[8]])
+
+
+if __name__ == '__main__':
+    unittest.main()